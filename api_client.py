@@ -0,0 +1,117 @@
+"""
+Client for the e-invoice chatbot HTTP API.
+This module calls the endpoints of api_service.py, so the Streamlit app and
+other tools can use a shared chatbot service instead of running the pipeline
+in their own process.
+"""
+
+import json
+from typing import Dict, Iterator, List, Optional
+
+import plotly.graph_objects as go
+import requests
+
+
+class ChatAPIClient:
+    """
+    Calls the chatbot API over a pooled HTTP session.
+    """
+
+    def __init__(self, base_url: str, timeout: float = 120.0):
+        """
+        Initialize the client.
+
+        Args:
+            base_url: URL of the service, e.g. http://127.0.0.1:8000
+            timeout: Seconds to wait for the service to respond
+        """
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def _post(self, path: str, payload: Dict, stream: bool = False) -> requests.Response:
+        response = self.session.post(self.base_url + path, json=payload, timeout=self.timeout, stream=stream)
+        if response.status_code != 200:
+            try:
+                error = response.json()['error']['message']
+            except (ValueError, KeyError, TypeError):
+                error = response.text
+            raise RuntimeError(f"Chatbot API {path} failed with status {response.status_code}: {error}")
+        return response
+
+    def route(self, question: str, selected_table: str = 'All', selected_domain: str = 'All') -> Dict:
+        """Get the query context of a question."""
+        payload = {'question': question, 'selected_table': selected_table, 'selected_domain': selected_domain}
+        return self._post('/route', payload).json()['query_context']
+
+    def stream(self, question: str, selected_table: str = 'All', selected_domain: str = 'All',
+               history: Optional[List[Dict]] = None, **options) -> Iterator[Dict]:
+        """
+        Ask a question and iterate over the answer's events.
+
+        Args:
+            question: The user's question
+            selected_table: Table selected in the UI ('All' for automatic routing)
+            selected_domain: Domain selected in the UI ('All' for automatic routing)
+            history: Earlier conversation messages in OpenAI format
+            **options: Further request fields ('api_key', 'model', 'use_tools')
+
+        Returns:
+            Iterator over 'context', 'delta' and 'done' events
+        """
+        payload = {'question': question, 'selected_table': selected_table, 'selected_domain': selected_domain,
+                   'history': history, **options}
+        with self._post('/ask', payload, stream=True) as response:
+            for line in response.iter_lines():
+                if line:
+                    yield json.loads(line)
+
+    def ask(self, question: str, selected_table: str = 'All', selected_domain: str = 'All',
+            history: Optional[List[Dict]] = None, **options) -> Dict:
+        """
+        Ask a question and wait for the complete answer.
+
+        Returns:
+            The 'done' event: success, error, response_text, formatted_response,
+            visualization_type, plan, usage and timings
+        """
+        for event in self.stream(question, selected_table, selected_domain, history, **options):
+            if event['event'] == 'done':
+                return event
+        raise RuntimeError("Chatbot API /ask ended without an answer")
+
+    def chart(self, question: str, selected_table: str = 'All', selected_domain: str = 'All',
+              visualization_type: Optional[str] = None, plan: Optional[List[Dict]] = None) -> Optional[go.Figure]:
+        """
+        Get the chart of a question.
+
+        Args:
+            question: The user's question
+            selected_table: Table selected in the UI ('All' for automatic routing)
+            selected_domain: Domain selected in the UI ('All' for automatic routing)
+            visualization_type: The answer's visualization type (derived from the question if omitted)
+            plan: The answer's tool plan, charted instead of the data when given
+
+        Returns:
+            Plotly figure, or None if the question has no chart
+        """
+        payload = {'question': question, 'selected_table': selected_table, 'selected_domain': selected_domain,
+                   'visualization_type': visualization_type, 'plan': plan}
+        figure = self._post('/chart', payload).text
+        if figure == 'null':
+            return None
+        import plotly.io as pio
+        return pio.from_json(figure)
+
+
+# Example usage
+if __name__ == "__main__":
+    import sys
+
+    client = ChatAPIClient(sys.argv[1] if len(sys.argv) > 1 else 'http://127.0.0.1:8000')
+    question = "What is the total VAT collected in Dubai?"
+    print(client.route(question)['relevant_tables'])
+    for event in client.stream(question):
+        if event['event'] == 'delta':
+            print(event['text'], end='', flush=True)
+    print()
@@ -0,0 +1,385 @@
+"""
+Headless HTTP API for the e-invoice chatbot.
+This module serves the chat pipeline as an ASGI application, so other tools
+can route questions, stream answers and fetch charts without the Streamlit
+user interface, and several worker processes can serve them side by side.
+
+Each worker loads the data tables (or attaches to the copy shared by the
+node's workers, see CHATBOT_SHARED_DATA in data_loader.py) and builds the
+components once, at startup; requests run the blocking pipeline stages on a
+bounded thread pool so the event loop keeps serving other connections.
+
+Endpoints (JSON bodies, see ChatService for the fields):
+    POST /ask    Stream the answer as newline-delimited JSON events
+    POST /route  Get the query context of a question
+    POST /chart  Get the chart of a question as Plotly figure JSON (null without a chart)
+    GET  /health Get the loaded tables and their sizes
+    GET  /metrics Get this worker's stage timings in the Prometheus text format
+    GET  /memory Get this worker's memory footprint per table, column and derived cache
+
+Run it with several workers:
+    python api_service.py --port 8000 --workers 4
+    uvicorn api_service:app --port 8000 --workers 4
+"""
+
+import argparse
+import asyncio
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import pandas as pd
+
+from chat_pipeline import ChatPipeline
+import data_loader
+from data_router import DataRouter
+from memo import json_default, thaw
+from memory_report import component_structures, memory_report
+from response_handler import ResponseHandler
+from routing_classifier import get_default_classifier
+from telemetry import get_telemetry, start_exporters
+from visualization_generator import VisualizationGenerator
+
+# Threads per worker process running pipeline stages (default: the executor's own)
+API_THREADS = int(os.environ.get('CHATBOT_API_THREADS', '0')) or None
+
+# Largest accepted request body, in bytes
+MAX_BODY_BYTES = 1 << 20
+
+
+class APIError(Exception):
+    """
+    An error answered with an HTTP status and a JSON error body.
+    """
+
+    def __init__(self, status: int, code: str, message: str):
+        super().__init__(message)
+        self.status = status
+        self.code = code
+        self.message = message
+
+
+def _question(body: Dict) -> str:
+    question = body.get('question')
+    if not isinstance(question, str) or not question.strip():
+        raise APIError(400, 'invalid_request', "'question' must be a non-empty string")
+    return question
+
+
+def _selection(body: Dict) -> Tuple[str, str]:
+    return body.get('selected_table') or 'All', body.get('selected_domain') or 'All'
+
+
+class ChatService:
+    """
+    The chatbot components of one worker process, shared by all its requests.
+    """
+
+    def __init__(self, data: Optional[Dict[str, pd.DataFrame]] = None, pipeline: Optional[ChatPipeline] = None,
+                 viz_generator: Optional[VisualizationGenerator] = None, api_key: Optional[str] = None):
+        """
+        Initialize the service.
+
+        Args:
+            data: Data tables to serve (loaded with data_loader.load_data if omitted)
+            pipeline: Chat pipeline to use (a new one, with the shipped routing
+                classifier if available, is created if omitted)
+            viz_generator: Visualization generator to use
+            api_key: OpenAI API key used when a request does not send one
+                (defaults to the OPENAI_API_KEY environment variable)
+        """
+        start_exporters()
+        self.data = data if data is not None else data_loader.load_data()
+        if pipeline is None:
+            router = DataRouter(classifier=get_default_classifier())
+            pipeline = ChatPipeline(router, ResponseHandler(router.matcher))
+        self.pipeline = pipeline
+        self.router = pipeline.router
+        self.viz_generator = viz_generator or VisualizationGenerator()
+        self.api_key = api_key if api_key is not None else os.environ.get('OPENAI_API_KEY', '')
+
+    def health(self) -> Dict:
+        """Get the loaded tables with their row and column counts."""
+        return {
+            'status': 'ok',
+            'tables': {name: {'rows': len(table), 'columns': len(table.columns)} for name, table in self.data.items()}
+        }
+
+    def memory(self) -> Dict:
+        """Get the memory footprint of the tables (per column, with dtype suggestions) and derived caches."""
+        structures = component_structures(self.router, self.pipeline.response_handler)
+        return memory_report(self.data, structures)
+
+    def route(self, body: Dict) -> Dict:
+        """
+        Route a question.
+
+        Args:
+            body: {'question', optional 'selected_table' and 'selected_domain'}
+
+        Returns:
+            Dictionary with the 'query_context'
+        """
+        question = _question(body)
+        query_context = self.router.get_query_context(question, *_selection(body))
+        return {'query_context': thaw(query_context)}
+
+    def ask(self, body: Dict) -> Iterator[Dict]:
+        """
+        Answer a question, yielding events as the answer is generated.
+
+        Args:
+            body: {'question', optional 'selected_table', 'selected_domain',
+                'api_key', 'model', 'use_tools' and 'history' (earlier
+                messages in OpenAI format, kept by the caller)}
+
+        Returns:
+            Iterator over 'context', 'delta' and 'done' events (see
+            ChatPipeline.stream); the 'done' event carries the response text,
+            formatted response, visualization type, tool plan and timings
+        """
+        question = _question(body)
+        selected_table, selected_domain = _selection(body)
+        history = body.get('history')
+        if history is not None and not isinstance(history, list):
+            raise APIError(400, 'invalid_request', "'history' must be a list of messages")
+
+        events = self.pipeline.stream(
+            question,
+            self.data,
+            api_key=body.get('api_key') or self.api_key,
+            model=body.get('model') or 'gpt-3.5-turbo',
+            selected_table=selected_table,
+            selected_domain=selected_domain,
+            use_tools=bool(body.get('use_tools')),
+            history=history
+        )
+        for event in events:
+            if event['event'] == 'context':
+                yield {
+                    'event': 'context',
+                    'query_context': thaw(event['query_context']),
+                    'visualization_type': event['visualization_type']
+                }
+            elif event['event'] == 'done':
+                result = event['result']
+                response = result['response']
+                yield {
+                    'event': 'done',
+                    'success': response['success'],
+                    'error': response.get('error'),
+                    'response_text': response['response_text'],
+                    'formatted_response': result['formatted_response'],
+                    'visualization_type': response.get('visualization_type'),
+                    'plan': response.get('plan'),
+                    'usage': response.get('usage'),
+                    'timings': result['timings']
+                }
+            else:
+                yield event
+
+    def chart(self, body: Dict) -> Optional[str]:
+        """
+        Draw the chart of a question.
+
+        Args:
+            body: {'question', optional 'selected_table', 'selected_domain',
+                'visualization_type' (the answer's; derived from the question
+                if omitted) and 'plan' (the answer's tool plan, charted instead
+                of the data when given)}
+
+        Returns:
+            Plotly figure JSON, or None if the question has no chart
+        """
+        question = _question(body)
+        query_context = self.router.get_query_context(question, *_selection(body))
+        scoped_data = self.router.entity_extractor.apply_filters(self.data, query_context['filters'])
+
+        fig = None
+        if body.get('plan'):
+            fig = self.viz_generator.generate_visualization_from_plan(body['plan'], query_context)
+        if fig is None:
+            viz_type = body.get('visualization_type')
+            if viz_type is None:
+                response_context = self.pipeline.response_handler.prepare_response_context(query_context, scoped_data)
+                viz_type = response_context.get('visualization_type')
+            if viz_type:
+                fig = self.viz_generator.generate_visualization(viz_type, scoped_data, query_context)
+        return fig.to_json() if fig is not None else None
+
+
+class ChatAPI:
+    """
+    ASGI application serving a ChatService.
+
+    Runs under any ASGI server; the service is created on the lifespan
+    startup event (or on the first request if the server sends none), so
+    each worker process loads the data once.
+    """
+
+    def __init__(self, service_factory: Callable[[], ChatService] = ChatService, max_threads: Optional[int] = API_THREADS):
+        """
+        Initialize the application.
+
+        Args:
+            service_factory: Creates the service of this worker
+            max_threads: Threads running pipeline stages (the requests served at once)
+        """
+        self.service_factory = service_factory
+        self.service = None
+        self.executor = ThreadPoolExecutor(max_workers=max_threads, thread_name_prefix='chat-api')
+        self.startup_lock = None
+
+    async def __call__(self, scope: Dict, receive: Callable, send: Callable):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self._http(scope, receive, send)
+
+    async def _run(self, function: Callable, *args) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+
+    async def _get_service(self) -> ChatService:
+        if self.service is None:
+            if self.startup_lock is None:
+                self.startup_lock = asyncio.Lock()
+            async with self.startup_lock:
+                if self.service is None:
+                    self.service = await self._run(self.service_factory)
+        return self.service
+
+    async def _lifespan(self, receive: Callable, send: Callable):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                try:
+                    await self._get_service()
+                except Exception as e:
+                    await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                    return
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _http(self, scope: Dict, receive: Callable, send: Callable):
+        method, path = scope['method'], scope['path'].rstrip('/') or '/'
+        try:
+            if path == '/health':
+                if method != 'GET':
+                    raise APIError(405, 'method_not_allowed', f"{path} only accepts GET")
+                service = await self._get_service()
+                await self._send_json(send, 200, service.health())
+                return
+            if path == '/metrics':
+                if method != 'GET':
+                    raise APIError(405, 'method_not_allowed', f"{path} only accepts GET")
+                body = get_telemetry().render_prometheus().encode('utf-8')
+                await self._send(send, 200, 'text/plain; version=0.0.4', body)
+                return
+            if path == '/memory':
+                if method != 'GET':
+                    raise APIError(405, 'method_not_allowed', f"{path} only accepts GET")
+                service = await self._get_service()
+                # Scans every column: off the event loop
+                await self._send_json(send, 200, await self._run(service.memory))
+                return
+            if path not in ('/ask', '/route', '/chart'):
+                raise APIError(404, 'not_found', f"No endpoint {path}")
+            if method != 'POST':
+                raise APIError(405, 'method_not_allowed', f"{path} only accepts POST")
+
+            body = await self._read_json(receive)
+            service = await self._get_service()
+            if path == '/route':
+                await self._send_json(send, 200, await self._run(service.route, body))
+            elif path == '/chart':
+                figure = await self._run(service.chart, body)
+                await self._send(send, 200, 'application/json', (figure or 'null').encode('utf-8'))
+            else:
+                await self._stream_events(send, service.ask(body))
+        except APIError as e:
+            await self._send_json(send, e.status, {'error': {'code': e.code, 'message': e.message}})
+
+    async def _read_json(self, receive: Callable) -> Dict:
+        chunks, size = [], 0
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                raise APIError(400, 'invalid_request', "Client disconnected")
+            chunk = message.get('body', b'')
+            size += len(chunk)
+            if size > MAX_BODY_BYTES:
+                raise APIError(413, 'request_too_large', f"Request bodies are limited to {MAX_BODY_BYTES} bytes")
+            chunks.append(chunk)
+            if not message.get('more_body', False):
+                break
+        try:
+            body = json.loads(b''.join(chunks) or b'{}')
+        except ValueError:
+            raise APIError(400, 'invalid_json', "The request body is not valid JSON")
+        if not isinstance(body, dict):
+            raise APIError(400, 'invalid_request', "The request body must be a JSON object")
+        return body
+
+    async def _stream_events(self, send: Callable, events: Iterator[Dict]):
+        """Send events as newline-delimited JSON, pulling each from the pipeline on the thread pool."""
+        # Validation errors are raised by the first event, before the response starts
+        first = await self._run(next, events, None)
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [(b'content-type', b'application/x-ndjson; charset=utf-8'), (b'cache-control', b'no-cache')]
+        })
+        event = first
+        try:
+            while event is not None:
+                line = json.dumps(event, ensure_ascii=False, default=json_default) + '\n'
+                await send({'type': 'http.response.body', 'body': line.encode('utf-8'), 'more_body': True})
+                event = await self._run(next, events, None)
+        finally:
+            # Stop generating if the client went away mid-answer
+            if event is not None:
+                await self._run(events.close)
+        await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+
+    async def _send_json(self, send: Callable, status: int, payload: Dict):
+        body = json.dumps(payload, ensure_ascii=False, default=json_default).encode('utf-8')
+        await self._send(send, status, 'application/json', body)
+
+    async def _send(self, send: Callable, status: int, content_type: str, body: bytes):
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(b'content-type', f'{content_type}; charset=utf-8'.encode('latin-1')),
+                        (b'content-length', str(len(body)).encode('latin-1'))]
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+
+# The application served by each worker process
+app = ChatAPI()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Serve the e-invoice chatbot as an HTTP API")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help="Worker processes (each with its own copy of the data unless CHATBOT_SHARED_DATA is set)")
+    args = parser.parse_args(argv)
+
+    try:
+        import uvicorn
+    except ImportError:
+        print("The API service needs an ASGI server: pip install uvicorn")
+        return 1
+    uvicorn.run('api_service:app', host=args.host, port=args.port, workers=args.workers)
+    return 0
+
+
+if __name__ == "__main__":
+    import sys
+    sys.exit(main())
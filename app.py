@@ -4,18 +4,27 @@ This module integrates all components and provides the user interface.
 """
 
 import streamlit as st
+from streamlit.runtime.scriptrunner import StopException
 import pandas as pd
-import numpy as np
 import os
 import json
 import time
+import uuid
 from typing import Dict, List, Tuple, Optional, Any
 
 # Import custom modules
 from data_router import DataRouter
 from response_handler import ResponseHandler
-from response_generator import ResponseGenerator
 from visualization_generator import VisualizationGenerator
+from chat_pipeline import ChatPipeline
+from conversation_memory import ConversationMemory
+from routing_classifier import get_default_classifier
+from background_jobs import PoolBusyError, get_default_pool
+from chat_history import ChatHistory, get_default_store, session_memory_report
+from memory_report import component_structures, format_bytes, memory_report
+from slow_profiler import profile_slow
+from telemetry import get_telemetry, start_exporters
+import data_loader
 
 # Set page configuration
 st.set_page_config(
@@ -27,7 +36,11 @@ st.set_page_config(
 
 # Initialize session state
 if 'chat_history' not in st.session_state:
-    st.session_state.chat_history = []
+    # The newest messages stay in memory; older ones are spilled to disk and paged back on demand
+    st.session_state.chat_history = ChatHistory(uuid.uuid4().hex)
+
+if 'history_shown' not in st.session_state:
+    st.session_state.history_shown = 0
 
 if 'language' not in st.session_state:
     st.session_state.language = 'en'
@@ -38,125 +51,49 @@ if 'selected_table' not in st.session_state:
 if 'selected_domain' not in st.session_state:
     st.session_state.selected_domain = 'All'
 
-# Initialize components
-router = DataRouter()
-response_handler = ResponseHandler()
-viz_generator = VisualizationGenerator()
+if 'conversation_memory' not in st.session_state:
+    st.session_state.conversation_memory = ConversationMemory()
+
+if 'pending_job' not in st.session_state:
+    st.session_state.pending_job = None
+
+# Initialize components once per process (Streamlit reruns this script on every interaction)
+@st.cache_resource
+def get_components():
+    # Metrics endpoint and files configured with CHATBOT_METRICS_* (once per process)
+    start_exporters()
+    router = DataRouter(classifier=get_default_classifier())
+    response_handler = ResponseHandler(router.matcher)
+    return router, response_handler, VisualizationGenerator(), ChatPipeline(router, response_handler)
+
+@st.cache_resource
+def get_api_client(base_url):
+    from api_client import ChatAPIClient
+    return ChatAPIClient(base_url)
+
+router, response_handler, viz_generator, pipeline = get_components()
+
+# Answer through the chatbot API service instead of this process when configured
+CHATBOT_API_URL = os.environ.get('CHATBOT_API_URL', '')
+api_client = get_api_client(CHATBOT_API_URL) if CHATBOT_API_URL else None
 
-# Function to load data
-@st.cache_data
+# Show the operator panels in the sidebar
+ADMIN_MODE = os.environ.get('CHATBOT_ADMIN', '').lower() in ('1', 'true', 'yes')
+
+# Earlier messages read back from disk per click on "Show earlier messages"
+HISTORY_PAGE_SIZE = 10
+
+# Function to load data; one read-only copy is shared by all sessions (cache_data
+# would give every call its own unpickled copy, and detach shared tables)
+@st.cache_resource
 def load_data():
     """Load sample data for the chatbot"""
     try:
-        # Check if real data files exist
-        data_dir = "output"
-        if os.path.exists(data_dir):
-            data = {}
-            
-            # Try to load invoices data
-            invoices_path = os.path.join(data_dir, "invoices.csv")
-            if os.path.exists(invoices_path):
-                data['invoices'] = pd.read_csv(invoices_path, low_memory=False, on_bad_lines='skip')
-            
-            # Try to load items data
-            items_path = os.path.join(data_dir, "items.csv")
-            if os.path.exists(items_path):
-                data['items'] = pd.read_csv(items_path, low_memory=False, on_bad_lines='skip')
-            
-            # Try to load taxpayers data
-            taxpayers_path = os.path.join(data_dir, "taxpayers.csv")
-            if os.path.exists(taxpayers_path):
-                data['taxpayers'] = pd.read_csv(taxpayers_path, low_memory=False, on_bad_lines='skip')
-            
-            # Try to load audit logs data
-            audit_logs_path = os.path.join(data_dir, "invoice_audit_logs.csv")
-            if os.path.exists(audit_logs_path):
-                data['audit_logs'] = pd.read_csv(audit_logs_path, low_memory=False, on_bad_lines='skip')
-            
-            if data:
-                return data
-        
-        # If real data not available, generate synthetic data
-        return generate_synthetic_data()
+        return data_loader.load_data()
     
     except Exception as e:
         st.error(f"Error loading data: {str(e)}")
-        return generate_synthetic_data()
-
-def generate_synthetic_data():
-    """Generate synthetic data for demonstration"""
-    # Generate invoices data
-    invoices = pd.DataFrame({
-        'invoice_number': [f'INV{i:03d}' for i in range(1, 101)],
-        'invoice_datetime': pd.date_range(start='2025-01-01', periods=100),
-        'buyer_emirate': np.random.choice(['Dubai', 'Abu Dhabi', 'Sharjah', 'Ajman', 'Fujairah', 'Ras Al Khaimah', 'Umm Al Quwain'], 100),
-        'seller_emirate': np.random.choice(['Dubai', 'Abu Dhabi', 'Sharjah', 'Ajman', 'Fujairah', 'Ras Al Khaimah', 'Umm Al Quwain'], 100),
-        'invoice_tax_amount': np.random.uniform(50, 500, 100),
-        'invoice_without_tax': np.random.uniform(1000, 10000, 100),
-        'invoice_type': np.random.choice(['Standard', 'Credit Note', 'Debit Note'], 100),
-        'invoice_category': np.random.choice(['Goods', 'Services', 'Mixed'], 100),
-        'invoice_sales_type': np.random.choice(['B2B', 'B2C', 'B2G'], 100),
-        'document_status': np.random.choice(['Issued', 'Paid', 'Cancelled'], 100),
-        'buyer_name': [f'Company {i}' for i in range(1, 101)],
-        'buyer_trn': [f'TRN{i:06d}' for i in range(1, 101)],
-        'seller_name': [f'Vendor {i % 20 + 1}' for i in range(1, 101)],
-        'seller_trn': [f'TRN{i % 20 + 1:06d}' for i in range(1, 101)],
-        'vat_rate': np.random.choice([5.0, 0.0], 100, p=[0.95, 0.05]),
-        'vat_category': np.random.choice(['Standard', 'Zero Rated', 'Exempt'], 100, p=[0.95, 0.03, 0.02]),
-        'is_anomaly': np.random.choice([0, 1], 100, p=[0.9, 0.1]),
-        'anomaly_type': np.random.choice([None, 'Duplicate', 'Round Amount', 'Just Under Limit', 'Foreign Bank'], 100, p=[0.9, 0.025, 0.025, 0.025, 0.025]),
-        'anomaly_risk_score': np.random.uniform(0, 1, 100)
-    })
-    
-    # Generate items data
-    items = pd.DataFrame({
-        'item_id': [f'ITEM{i:04d}' for i in range(1, 301)],
-        'invoice_id': [f'INV{np.random.randint(1, 101):03d}' for _ in range(1, 301)],
-        'item_name': [f'Product {i % 50 + 1}' for i in range(1, 301)],
-        'item_description': [f'Description for Product {i % 50 + 1}' for i in range(1, 301)],
-        'quantity': np.random.randint(1, 10, 300),
-        'unit_price': np.random.uniform(100, 1000, 300),
-        'line_discount': np.random.uniform(0, 50, 300),
-        'line_total': np.random.uniform(100, 5000, 300),
-        'line_vat_amount': np.random.uniform(5, 250, 300),
-        'hs_code': [f'HS{np.random.randint(1000, 9999)}' for _ in range(1, 301)]
-    })
-    
-    # Generate taxpayers data
-    taxpayers = pd.DataFrame({
-        'tax_number': [f'TRN{i:06d}' for i in range(1, 51)],
-        'name': [f'Company {i}' for i in range(1, 51)],
-        'registration_date': pd.date_range(start='2020-01-01', periods=50),
-        'vat_registration_date': pd.date_range(start='2020-01-15', periods=50),
-        'legal_entity_type': np.random.choice(['LLC', 'FZE', 'Sole Proprietorship', 'Partnership'], 50),
-        'business_size': np.random.choice(['Small', 'Medium', 'Large'], 50),
-        'sector': np.random.choice(['Retail', 'Manufacturing', 'Services', 'Construction', 'Technology'], 50),
-        'number_of_employees': np.random.randint(5, 500, 50),
-        'ownership_type': np.random.choice(['Local', 'Foreign', 'Mixed'], 50),
-        'tax_compliance_score': np.random.uniform(60, 100, 50),
-        'bank_account': [f'AE{np.random.randint(100000000, 999999999)}' for _ in range(1, 51)],
-        'bank_country': np.random.choice(['UAE', 'UAE', 'UAE', 'UAE', 'Other'], 50)
-    })
-    
-    # Generate audit logs data
-    audit_logs = pd.DataFrame({
-        'log_id': [f'LOG{i:05d}' for i in range(1, 201)],
-        'invoice_id': [f'INV{np.random.randint(1, 101):03d}' for _ in range(1, 201)],
-        'timestamp': pd.date_range(start='2025-01-01', periods=200),
-        'user_id': [f'USER{np.random.randint(1, 11):02d}' for _ in range(1, 201)],
-        'action_type': np.random.choice(['Create', 'Update', 'Delete', 'View'], 200),
-        'field_changed': np.random.choice(['Amount', 'Status', 'Date', 'Description', None], 200),
-        'old_value': [f'Old Value {i}' for i in range(1, 201)],
-        'new_value': [f'New Value {i}' for i in range(1, 201)],
-        'system_notes': [f'System note {i}' for i in range(1, 201)]
-    })
-    
-    return {
-        'invoices': invoices,
-        'items': items,
-        'taxpayers': taxpayers,
-        'audit_logs': audit_logs
-    }
+        return data_loader.generate_synthetic_data()
 
 # Function to get example questions
 def get_example_questions(lang):
@@ -212,6 +149,14 @@ def get_ui_text(key, lang='en'):
             'en': "Select Model",
             'ar': "اختر النموذج"
         },
+        'use_tools': {
+            'en': "Compute answers from the full data",
+            'ar': "احسب الإجابات من البيانات الكاملة"
+        },
+        'use_tools_help': {
+            'en': "Let the model run aggregations locally on the loaded tables instead of reading data samples",
+            'ar': "دع النموذج يجري التجميعات محليًا على الجداول المحملة بدلاً من قراءة عينات البيانات"
+        },
         'temperature': {
             'en': "Response Creativity",
             'ar': "إبداع الاستجابة"
@@ -236,6 +181,76 @@ def get_ui_text(key, lang='en'):
             'en': "👋 Hello! I'm your e-invoice assistant. Ask me anything about the e-invoice data, tax compliance, or fraud detection.",
             'ar': "👋 مرحبًا! أنا مساعدك للفواتير الإلكترونية. اسألني أي شيء عن بيانات الفواتير الإلكترونية أو الامتثال الضريبي أو كشف الاحتيال."
         },
+        'progress_stages': {
+            'en': {
+                'queued': "Waiting for a free worker...",
+                'route': "Routing the question...",
+                'context': "Preparing the data...",
+                'fast_path': "Computing the answer...",
+                'memory': "Reading the conversation...",
+                'llm': "Writing the answer...",
+                'format': "Formatting the answer...",
+                'chart': "Drawing the chart...",
+                'done': "Done"
+            },
+            'ar': {
+                'queued': "في انتظار عامل متاح...",
+                'route': "توجيه السؤال...",
+                'context': "تجهيز البيانات...",
+                'fast_path': "حساب الإجابة...",
+                'memory': "قراءة المحادثة...",
+                'llm': "كتابة الإجابة...",
+                'format': "تنسيق الإجابة...",
+                'chart': "رسم المخطط...",
+                'done': "تم"
+            }
+        },
+        'request_cancelled': {
+            'en': "⏹️ Stopped answering the previous question.",
+            'ar': "⏹️ تم إيقاف الإجابة على السؤال السابق."
+        },
+        'request_failed': {
+            'en': "⚠️ Something went wrong while answering this question. Please try again or rephrase it.",
+            'ar': "⚠️ حدث خطأ أثناء الإجابة على هذا السؤال. يرجى المحاولة مرة أخرى أو إعادة صياغته."
+        },
+        'server_busy': {
+            'en': "⚠️ The assistant is busy answering other questions. Please try again in a moment.",
+            'ar': "⚠️ المساعد مشغول بالإجابة على أسئلة أخرى. يرجى المحاولة مرة أخرى بعد قليل."
+        },
+        'show_earlier': {
+            'en': "Show earlier messages ({count} more)",
+            'ar': "عرض الرسائل السابقة ({count} أخرى)"
+        },
+        'session_memory': {
+            'en': "Session memory",
+            'ar': "ذاكرة الجلسات"
+        },
+        'session_memory_help': {
+            'en': "Chat history held by each session of this process, and spilled to disk",
+            'ar': "سجل المحادثة الذي تحتفظ به كل جلسة في هذه العملية، والمنقول إلى القرص"
+        },
+        'request_timings': {
+            'en': "Request timings",
+            'ar': "توقيت الطلبات"
+        },
+        'request_timings_help': {
+            'en': "Milliseconds per stage of the latest questions, and per instrumented step",
+            'ar': "المدة بالمللي ثانية لكل مرحلة من الأسئلة الأخيرة، ولكل خطوة مقاسة"
+        },
+        'memory_footprint': {
+            'en': "Memory footprint",
+            'ar': "استهلاك الذاكرة"
+        },
+        'memory_footprint_help': {
+            'en': "Deep memory of the tables and their columns, the caches derived from them and each session, "
+                  "with dtype changes that would save memory",
+            'ar': "الذاكرة الفعلية للجداول وأعمدتها والذاكرات المؤقتة المشتقة منها وكل جلسة، "
+                  "مع تغييرات أنواع البيانات التي توفر الذاكرة"
+        },
+        'measure_memory': {
+            'en': "Measure",
+            'ar': "قياس"
+        },
         'api_key_missing': {
             'en': "⚠️ Please enter your OpenAI API key in the sidebar to enable AI responses.",
             'ar': "⚠️ الرجاء إدخال مفتاح API الخاص بك لـ OpenAI في الشريط الجانبي لتمكين ردود الذكاء الاصطناعي."
@@ -277,93 +292,248 @@ def get_ui_text(key, lang='en'):
     return ui_text.get(key, {}).get(lang, ui_text.get(key, {}).get('en', key))
 
 # Function to handle chat input
-def handle_chat_input(user_input):
+def handle_chat_input(user_input=None):
+    # chat_input callbacks receive no arguments; the text is in the widget state
+    if user_input is None:
+        user_input = st.session_state.get('user_input') or ''
+    
     if not user_input.strip():
         return
     
-    # Add user message to chat history
-    st.session_state.chat_history.append({"role": "user", "content": user_input})
-    
-    # Get API key from session state
-    api_key = st.session_state.get('api_key', '')
-    
-    # Initialize response generator with API key
-    response_generator = ResponseGenerator(api_key)
-    
-    # Get data
-    data = load_data()
-    
-    # Get query context
-    query_context = router.get_query_context(
-        user_input, 
-        st.session_state.selected_table if st.session_state.selected_table != 'All' else None
-    )
-    
-    # Override domain if selected in UI
-    if st.session_state.selected_domain != 'All':
-        query_context['relevant_domains'] = [st.session_state.selected_domain]
-        query_context['primary_domain'] = st.session_state.selected_domain
-    
-    # Prepare response context
-    response_context = response_handler.prepare_response_context(query_context, data)
-    
-    # Generate response
-    if response_generator.has_valid_api_key():
-        # Use real API
-        response = response_generator.generate_response(
-            user_input, 
-            response_context,
-            st.session_state.get('model', 'gpt-3.5-turbo')
-        )
-    else:
-        # Use mock response
-        response = response_generator.generate_mock_response(user_input, response_context)
+    # Profiled when slow (opt-in with CHATBOT_PROFILE_SLOW_MS); in-process answers
+    # are profiled on the worker pool, as 'answer_question'
+    with profile_slow('handle_chat_input', question=user_input, language=st.session_state.language,
+                      selected_table=st.session_state.selected_table,
+                      selected_domain=st.session_state.selected_domain,
+                      thin_client=api_client is not None) as profile_context:
+        # A newer question replaces one that is still being answered
+        cancel_pending_job()
+        
+        # Add user message to chat history
+        st.session_state.chat_history.append({"role": "user", "content": user_input})
+        
+        if api_client is not None:
+            # Send earlier turns with the question; the service keeps no sessions
+            memory = st.session_state.conversation_memory
+            result = api_client.ask(
+                user_input,
+                st.session_state.selected_table,
+                st.session_state.selected_domain,
+                history=memory.get_messages(),
+                api_key=st.session_state.get('api_key', ''),
+                model=st.session_state.get('model', 'gpt-3.5-turbo'),
+                use_tools=st.session_state.get('use_tools', False)
+            )
+            if result['success'] and result['response_text']:
+                memory.add_turn('user', user_input)
+                memory.add_turn('assistant', result['response_text'])
+            st.session_state.last_timings = result['timings']
+            profile_context['timings'] = result['timings']
+            profile_context['visualization_type'] = result.get('visualization_type')
+        
+            # Add response to chat history, with its chart fetched once
+            figure = None
+            if result.get('visualization_type'):
+                figure = api_client.chart(
+                    user_input,
+                    st.session_state.selected_table,
+                    st.session_state.selected_domain,
+                    visualization_type=result['visualization_type'],
+                    plan=result.get('plan')
+                )
+            st.session_state.chat_history.append({
+                "role": "assistant", 
+                "content": result['formatted_response'],
+                "question": user_input,
+                "visualization_type": result.get('visualization_type'),
+                "plan": result.get('plan'),
+                "figure": figure
+            })
+            return
+        
+        # Run routing, context building, response and chart generation on the shared
+        # worker pool; the script shows the progress until the answer is ready
+        try:
+            st.session_state.pending_job = get_default_pool().submit_question(
+                pipeline,
+                viz_generator,
+                user_input,
+                load_data(),
+                api_key=st.session_state.get('api_key', ''),
+                model=st.session_state.get('model', 'gpt-3.5-turbo'),
+                selected_table=st.session_state.selected_table,
+                selected_domain=st.session_state.selected_domain,
+                use_tools=st.session_state.get('use_tools', False),
+                memory=st.session_state.conversation_memory
+            )
+        except PoolBusyError:
+            st.session_state.chat_history.append({
+                "role": "assistant",
+                "content": get_ui_text('server_busy', st.session_state.language)
+            })
+
+# Function to cancel the question being answered
+def cancel_pending_job():
+    job = st.session_state.pending_job
+    if job is not None and not job.done():
+        job.cancel()
+        st.session_state.chat_history.append({
+            "role": "assistant",
+            "content": get_ui_text('request_cancelled', st.session_state.language)
+        })
+    st.session_state.pending_job = None
+
+# Function to move a finished background answer into the chat history
+def collect_pending_job(job):
+    st.session_state.pending_job = None
+    if job.cancelled:
+        return
     
-    # Format response for language
-    if response['success'] and response['response_text']:
-        formatted_response = response_handler.format_response_for_language(
-            response['response_text'], 
-            query_context['language']
-        )
-    else:
-        error_message = response.get('message', 'An error occurred')
-        formatted_response = response_handler.format_response_for_language(
-            error_message, 
-            query_context['language']
-        )
+    if job.error is not None:
+        message = get_ui_text('request_failed', st.session_state.language)
+        if ADMIN_MODE:
+            message += f" ({type(job.error).__name__}: {job.error})"
+        st.session_state.chat_history.append({
+            "role": "assistant",
+            "content": response_handler.format_response_for_language(message, st.session_state.language)
+        })
+        return
     
-    # Add response to chat history
+    result = job.result
+    response = result['response']
+    st.session_state.last_timings = result['timings']
     st.session_state.chat_history.append({
         "role": "assistant", 
-        "content": formatted_response,
-        "visualization_type": response.get('visualization_type')
+        "content": result['formatted_response'],
+        "question": job.question,
+        "visualization_type": response.get('visualization_type'),
+        "plan": response.get('plan'),
+        "figure": job.figure
     })
 
+# Function to show a background answer's progress until it is ready
+def show_job_progress(job, placeholder):
+    stages = get_ui_text('progress_stages', st.session_state.language)
+    try:
+        while True:
+            finished = job.wait(0.1)
+            # Redraw on every poll, even without progress: Streamlit only handles a rerun or
+            # stop request when the script sends something, so a long stage would block it
+            status = f"⏳ *{stages.get(job.stage, job.stage)}*"
+            placeholder.markdown(f"{job.text}\n\n{status}" if job.text else status)
+            if finished:
+                break
+    except StopException:
+        # The script was stopped or the session closed, so nobody will collect this answer.
+        # A rerun keeps the job: the next run finds it in the session and shows it again.
+        cancel_pending_job()
+        raise
+    collect_pending_job(job)
+    st.rerun()
+
 # Function to clear chat history
 def clear_chat_history():
-    st.session_state.chat_history = []
-    # Add welcome message
-    st.session_state.chat_history.append({
-        "role": "assistant", 
-        "content": get_ui_text('welcome_message', st.session_state.language)
-    })
+    cancel_pending_job()
+    st.session_state.chat_history.clear()
+    st.session_state.history_shown = 0
+    st.session_state.conversation_memory.clear()
 
 # Function to set language
 def set_language(lang):
     st.session_state.language = lang
-    # Update welcome message
-    if st.session_state.chat_history and st.session_state.chat_history[0]["role"] == "assistant":
-        st.session_state.chat_history[0]["content"] = get_ui_text('welcome_message', lang)
+
+# Function to page earlier messages back from disk
+def show_earlier_messages():
+    st.session_state.history_shown += HISTORY_PAGE_SIZE
 
 # Function to show example questions
 def show_example(example):
     # Set the example as the user input
     st.session_state.user_input = example
 
+# Function to show the memory accounting of all sessions (operator view)
+def show_session_memory_panel():
+    lang = st.session_state.language
+    with st.expander(get_ui_text('session_memory', lang)):
+        st.caption(get_ui_text('session_memory_help', lang))
+        report = session_memory_report()
+        disk_usage = get_default_store().usage()
+        in_memory = sum(entry['in_memory_bytes'] for entry in report)
+        on_disk = sum(usage['bytes'] for usage in disk_usage.values())
+        st.text(f"{len(report)} sessions: {in_memory / 1024:,.0f} KiB in memory, {on_disk / 1024:,.0f} KiB on disk")
+        if report:
+            st.dataframe(pd.DataFrame(report), hide_index=True, use_container_width=True)
+
+def show_request_timings_panel():
+    lang = st.session_state.language
+    telemetry = get_telemetry()
+    with st.expander(get_ui_text('request_timings', lang)):
+        st.caption(get_ui_text('request_timings_help', lang))
+        requests = telemetry.recent_requests(20)
+        if requests:
+            st.dataframe(pd.DataFrame([
+                {'question': request['question'][:40],
+                 **{stage: round(seconds * 1000, 1) for stage, seconds in request['timings'].items()}}
+                for request in requests
+            ]), hide_index=True, use_container_width=True)
+        summary = telemetry.summary()
+        if summary:
+            st.dataframe(pd.DataFrame(summary).round(1), hide_index=True, use_container_width=True)
+
+# Function to get the state of every session of this server (key to value)
+def live_session_states():
+    from streamlit import runtime
+    # The session manager is internal to Streamlit (and absent from test runtimes):
+    # without it, only this session is reported
+    session_manager = getattr(runtime.get_instance(), '_session_mgr', None) if runtime.exists() else None
+    if session_manager is None:
+        return {'current': st.session_state.to_dict()}
+    return {info.session.id: info.session.session_state.filtered_state for info in session_manager.list_sessions()}
+
+# Function to show the memory of the tables, derived caches and sessions (operator view)
+def show_memory_footprint_panel(data):
+    lang = st.session_state.language
+    with st.expander(get_ui_text('memory_footprint', lang)):
+        st.caption(get_ui_text('memory_footprint_help', lang))
+        # Measuring scans every column, so it runs on request rather than on every rerun
+        if st.button(get_ui_text('measure_memory', lang), key='measure_memory'):
+            st.session_state.memory_report = memory_report(
+                data or {},
+                component_structures(router, response_handler),
+                live_session_states(),
+                shared=[router, response_handler, viz_generator, pipeline, get_default_store(), get_default_pool()]
+            )
+        report = st.session_state.get('memory_report')
+        if report is None:
+            return
+        totals = report['totals']
+        st.text(f"RSS {report['rss_mb']:,.0f} MB: tables {format_bytes(totals['tables'])}, "
+                f"derived {format_bytes(totals['derived'])}, sessions {format_bytes(totals['sessions'])}; "
+                f"dtype changes would save {format_bytes(totals['savings'])}")
+        st.dataframe(pd.DataFrame([
+            {'table': table['table'], 'rows': table['rows'], 'MiB': table['bytes'] / 2 ** 20,
+             'shared MiB': table['shared_bytes'] / 2 ** 20, 'savings MiB': table['savings_bytes'] / 2 ** 20}
+            for table in report['tables']
+        ]).round(2), hide_index=True, use_container_width=True)
+        columns = pd.DataFrame([dict(column, table=table['table']) for table in report['tables']
+                                for column in table['columns']])
+        if not columns.empty:
+            columns = columns.sort_values('bytes', ascending=False)
+            st.dataframe(columns[['table', 'column', 'dtype', 'cardinality', 'nulls', 'bytes', 'suggested_dtype',
+                                  'savings_bytes']], hide_index=True, use_container_width=True)
+        st.dataframe(pd.DataFrame(report['derived']).astype({'entries': 'Int64', 'maxsize': 'Int64'}),
+                     hide_index=True, use_container_width=True)
+        if report['sessions']:
+            st.dataframe(pd.DataFrame([
+                dict(session, largest=', '.join(f"{key} {format_bytes(size)}"
+                                                for key, size in session['largest'].items()))
+                for session in report['sessions']
+            ]), hide_index=True, use_container_width=True)
+
 # Main function
 def main():
-    # Load data
-    data = load_data()
+    # Load data (the API service holds it in thin-client mode)
+    data = load_data() if api_client is None else None
     
     # Set up the sidebar
     with st.sidebar:
@@ -434,6 +604,13 @@ def main():
             label_visibility="collapsed"
         )
         
+        st.checkbox(
+            get_ui_text('use_tools', st.session_state.language),
+            value=False,
+            key="use_tools",
+            help=get_ui_text('use_tools_help', st.session_state.language)
+        )
+        
         st.subheader(get_ui_text('temperature', st.session_state.language))
         temperature = st.slider(
             label="",
@@ -444,22 +621,37 @@ def main():
             key="temperature",
             label_visibility="collapsed"
         )
+        
+        # Operator view of the memory held by the sessions of this process
+        if ADMIN_MODE:
+            st.divider()
+            show_session_memory_panel()
+            show_request_timings_panel()
+            show_memory_footprint_panel(data)
     
     # Main content area
     st.title(get_ui_text('title', st.session_state.language))
     st.caption(get_ui_text('subtitle', st.session_state.language))
     
-    # Initialize chat history with welcome message if empty
-    if not st.session_state.chat_history:
-        st.session_state.chat_history.append({
-            "role": "assistant", 
-            "content": get_ui_text('welcome_message', st.session_state.language)
-        })
-    
-    # Display chat messages
+    # Display chat messages: the welcome message, earlier messages paged back
+    # from disk on request, then the messages kept in memory
+    chat_history = st.session_state.chat_history
     chat_container = st.container()
     with chat_container:
-        for message in st.session_state.chat_history:
+        with st.chat_message("assistant"):
+            st.markdown(get_ui_text('welcome_message', st.session_state.language), unsafe_allow_html=True)
+        
+        messages = list(chat_history)
+        hidden = chat_history.spilled - st.session_state.history_shown
+        if hidden > 0:
+            st.button(
+                get_ui_text('show_earlier', st.session_state.language).format(count=hidden),
+                on_click=show_earlier_messages
+            )
+        if st.session_state.history_shown and chat_history.spilled:
+            messages = chat_history.page(st.session_state.history_shown) + messages
+        
+        for index, message in enumerate(messages):
             with st.chat_message(message["role"]):
                 st.markdown(message["content"], unsafe_allow_html=True)
                 
@@ -467,22 +659,53 @@ def main():
                 if message["role"] == "assistant" and "visualization_type" in message and message["visualization_type"]:
                     viz_type = message["visualization_type"]
                     
-                    # Get the last user message for context
-                    last_user_message = ""
-                    for msg in reversed(st.session_state.chat_history):
-                        if msg["role"] == "user":
-                            last_user_message = msg["content"]
-                            break
+                    # Get the user message this answer responds to
+                    last_user_message = message.get("question", "")
+                    if not last_user_message:
+                        for msg in reversed(messages[:index]):
+                            if msg["role"] == "user":
+                                last_user_message = msg["content"]
+                                break
                     
-                    if last_user_message:
-                        # Get query context
-                        query_context = router.get_query_context(last_user_message)
+                    fig = None
+                    if "figure" in message:
+                        # Drawn in the background together with the answer
+                        fig = message["figure"]
+                    elif last_user_message and api_client is not None:
+                        # Get the chart from the API service
+                        fig = api_client.chart(
+                            last_user_message,
+                            st.session_state.selected_table,
+                            st.session_state.selected_domain,
+                            visualization_type=viz_type,
+                            plan=message.get("plan")
+                        )
+                    elif last_user_message:
+                        # Get query context (memoized, so reruns do not route again)
+                        query_context = router.get_query_context(
+                            last_user_message,
+                            st.session_state.selected_table,
+                            st.session_state.selected_domain
+                        )
                         
-                        # Generate visualization
-                        fig = viz_generator.generate_visualization(viz_type, data, query_context)
+                        # Chart the computed plan results if the answer came from tools
+                        if message.get("plan"):
+                            fig = viz_generator.generate_visualization_from_plan(message["plan"], query_context)
                         
-                        if fig:
-                            st.plotly_chart(fig, use_container_width=True)
+                        # Generate visualization from the tables filtered by the question's entities
+                        if fig is None:
+                            scoped_data = router.entity_extractor.apply_filters(data, query_context['filters'])
+                            fig = viz_generator.generate_visualization(viz_type, scoped_data, query_context)
+                    
+                    if fig:
+                        st.plotly_chart(fig, use_container_width=True)
+        
+        # Placeholder bubble for the question being answered in the background
+        job = st.session_state.pending_job
+        progress_placeholder = None
+        if job is not None:
+            with st.chat_message("assistant"):
+                progress_placeholder = st.empty()
     
     # Chat input and buttons
     col1, col2, col3 = st.columns([3, 1, 1])
@@ -508,6 +731,11 @@ def main():
     # Warning if API key is not set
     if not st.session_state.get('api_key'):
         st.warning(get_ui_text('api_key_missing', st.session_state.language))
+    
+    # Update the placeholder last, so the rest of the page is usable meanwhile;
+    # a new submission reruns the script and cancels this question
+    if progress_placeholder is not None:
+        show_job_progress(job, progress_placeholder)
 
 # Run the app
 if __name__ == "__main__":
@@ -0,0 +1,78 @@
+"""
+Arabic text normalization for the e-invoice chatbot.
+This module folds common Arabic spelling variants (hamza forms of alef, taa
+marbuta, alef maqsura, tatweel and diacritics) so keywords match however a
+user types them.
+"""
+
+from functools import lru_cache
+
+# Character folding applied to Arabic text; None removes the character
+ARABIC_CHAR_MAP = {
+    'أ': 'ا',  # alef with hamza above
+    'إ': 'ا',  # alef with hamza below
+    'آ': 'ا',  # alef with madda
+    'ٱ': 'ا',  # alef wasla
+    'ة': 'ه',  # taa marbuta
+    'ى': 'ي',  # alef maqsura
+    '\u0640': None,  # tatweel
+}
+# Harakat, tanween, shadda, sukun and quranic marks
+ARABIC_CHAR_MAP.update({chr(code): None for code in range(0x064B, 0x0660)})
+ARABIC_CHAR_MAP.update({chr(code): None for code in range(0x0610, 0x061B)})
+ARABIC_CHAR_MAP['\u0670'] = None  # superscript alef
+
+_TRANSLATION = str.maketrans(ARABIC_CHAR_MAP)
+
+# Arabic-Indic and Persian digits with the Arabic thousands and decimal separators
+_DIGIT_TRANSLATION = str.maketrans('٠١٢٣٤٥٦٧٨٩۰۱۲۳۴۵۶۷۸۹٬٫', '01234567890123456789,.')
+
+
+def normalize_arabic(text: str) -> str:
+    """
+    Fold Arabic spelling variants to one form.
+
+    Args:
+        text: Text in any language (non-Arabic characters are unchanged)
+
+    Returns:
+        The text with alef forms folded to ا, ة to ه, ى to ي, and tatweel
+        and diacritics removed
+    """
+    return text.translate(_TRANSLATION)
+
+
+def normalize_digits(text: str) -> str:
+    """
+    Replace Arabic-Indic digits and separators with ASCII ones ('١٢٬٥٠٠' -> '12,500').
+
+    Args:
+        text: Text in any language
+
+    Returns:
+        The text with ASCII digits
+    """
+    return text.translate(_DIGIT_TRANSLATION)
+
+
+@lru_cache(maxsize=4096)
+def normalize_query(text: str) -> str:
+    """
+    Normalize a query or keyword for matching: lowercase plus Arabic folding.
+
+    Results are memoized, since the same query is normalized by several
+    components and users often repeat questions.
+
+    Args:
+        text: The query or keyword text
+
+    Returns:
+        Normalized text
+    """
+    return normalize_arabic(text.lower())
+
+
+# Example usage
+if __name__ == "__main__":
+    for text in ["الفاتورة", "الفـــاتورة", "الفَاتُورَة", "إمارة أبوظبي", "على", "Total VAT"]:
+        print(f"{text} -> {normalize_query(text)}")
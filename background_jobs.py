@@ -0,0 +1,264 @@
+"""
+Background processing of chat questions for the e-invoice chatbot.
+This module runs the chat pipeline on a bounded worker pool shared by all
+sessions of the process, so the Streamlit script thread only submits a
+question and renders its progress. The chart is drawn on the pool while the
+model writes the answer, and a session's newer question cancels its stale one.
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+import pandas as pd
+
+from chat_pipeline import ChatPipeline
+from slow_profiler import profile_slow
+from visualization_generator import VisualizationGenerator
+
+
+class PoolBusyError(Exception):
+    """Raised when the worker pool already holds its maximum number of jobs."""
+
+
+class ChatJob:
+    """
+    Progress and outcome of one question processed in the background.
+
+    The worker thread writes the fields; the UI reads them while polling.
+    """
+
+    def __init__(self, question: str):
+        """
+        Initialize the job.
+
+        Args:
+            question: The user's question
+        """
+        self.question = question
+        self.stage = 'queued'
+        self.text = ''
+        self.result = None
+        self.figure = None
+        self.error = None
+        self.chart_error = None
+        self.submitted = time.perf_counter()
+        self.future = None
+        self.cancel_event = threading.Event()
+        self.done_event = threading.Event()
+
+    def cancel(self):
+        """Stop the job: a queued job never starts, a running one stops at its next event."""
+        self.cancel_event.set()
+        if self.future is not None and self.future.cancel():
+            self.stage = 'cancelled'
+            self.done_event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self.cancel_event.is_set()
+
+    def done(self) -> bool:
+        return self.done_event.is_set()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Wait until the job is done; returns whether it is."""
+        return self.done_event.wait(timeout)
+
+    def set_stage(self, stage: str):
+        self.stage = stage
+
+
+class JobPool:
+    """
+    Bounded worker pool running chat questions and their charts.
+    """
+
+    def __init__(self, max_workers: int = 8, max_pending: int = 64):
+        """
+        Initialize the pool.
+
+        Args:
+            max_workers: Threads running pipeline stages and charts
+            max_pending: Jobs queued or running at most; further submissions
+                are rejected instead of queueing without bound
+        """
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='chat-job')
+        self.pending = 0
+        self.lock = threading.Lock()
+
+    def submit(self, function: Callable, *args) -> Future:
+        """
+        Run a function on the pool.
+
+        Raises:
+            PoolBusyError: If max_pending jobs are already queued or running
+        """
+        with self.lock:
+            if self.pending >= self.max_pending:
+                raise PoolBusyError(f"{self.pending} jobs are already queued or running")
+            self.pending += 1
+        try:
+            future = self.executor.submit(function, *args)
+        except BaseException:
+            self._release(None)
+            raise
+        future.add_done_callback(self._release)
+        return future
+
+    def _release(self, future: Optional[Future]):
+        with self.lock:
+            self.pending -= 1
+
+    def submit_question(self, pipeline: ChatPipeline, viz_generator: VisualizationGenerator, question: str,
+                        data: Dict[str, pd.DataFrame], **options: Any) -> ChatJob:
+        """
+        Answer a question in the background.
+
+        Args:
+            pipeline: Chat pipeline to run
+            viz_generator: Visualization generator for the answer's chart
+            question: The user's question
+            data: Dictionary of available data tables
+            **options: Further ChatPipeline.stream arguments (api_key, model,
+                selected_table, selected_domain, use_tools, memory)
+
+        Returns:
+            The job; its 'result' is what ChatPipeline.process returns and its
+            'figure' the answer's chart
+
+        Raises:
+            PoolBusyError: If the pool is full
+        """
+        job = ChatJob(question)
+        job.future = self.submit(self._run_question, job, pipeline, viz_generator, data, options)
+        return job
+
+    def _run_question(self, job: ChatJob, pipeline: ChatPipeline, viz_generator: VisualizationGenerator,
+                      data: Dict[str, pd.DataFrame], options: Dict):
+        # The answer to handle_chat_input's question, profiled when slow (without the API key and memory)
+        details = {key: value for key, value in options.items() if key not in ('api_key', 'memory')}
+        with profile_slow('answer_question', question=job.question,
+                          queued_seconds=time.perf_counter() - job.submitted, **details) as context:
+            self._answer(job, pipeline, viz_generator, data, options)
+            if job.result is not None:
+                context['query_context'] = job.result['query_context']
+                context['visualization_type'] = job.result['response'].get('visualization_type')
+                context['timings'] = job.result['timings']
+            context['stage'] = job.stage
+
+    def _answer(self, job: ChatJob, pipeline: ChatPipeline, viz_generator: VisualizationGenerator,
+                data: Dict[str, pd.DataFrame], options: Dict):
+        chart = None
+        try:
+            if job.cancelled:
+                return
+            events = pipeline.stream(job.question, data, on_stage=job.set_stage, **options)
+            try:
+                for event in events:
+                    if job.cancelled:
+                        return
+                    if event['event'] == 'context' and event['visualization_type']:
+                        # Draw the chart while the model writes the answer
+                        chart = self._submit_chart(viz_generator, event)
+                    elif event['event'] == 'delta':
+                        job.text += event['text']
+                    elif event['event'] == 'done':
+                        job.result = event['result']
+            finally:
+                events.close()
+            job.set_stage('chart')
+            job.figure = self._collect_chart(job, viz_generator, chart)
+        except Exception as e:
+            job.error = e
+        finally:
+            if job.cancelled:
+                job.stage = 'cancelled'
+                if chart is not None:
+                    chart.cancel()
+            elif job.error is None:
+                job.stage = 'done'
+            job.done_event.set()
+
+    def _submit_chart(self, viz_generator: VisualizationGenerator, context: Dict) -> Optional[Future]:
+        try:
+            return self.submit(
+                viz_generator.generate_visualization, context['visualization_type'], context['data'],
+                context['query_context']
+            )
+        except PoolBusyError:
+            # Drawn after the answer instead
+            return None
+
+    def _collect_chart(self, job: ChatJob, viz_generator: VisualizationGenerator,
+                       chart: Optional[Future]) -> Optional[Any]:
+        """Get the chart matching the final response, reusing the one drawn during generation."""
+        result = job.result
+        response = result['response']
+        viz_type = response.get('visualization_type')
+        try:
+            figure = None
+            if response.get('plan'):
+                figure = viz_generator.generate_visualization_from_plan(response['plan'], result['query_context'])
+            if figure is not None or not viz_type:
+                if chart is not None:
+                    chart.cancel()
+                return figure
+            if chart is not None and viz_type == result['response_context'].get('visualization_type'):
+                # A chart still waiting for a free worker is drawn here instead of waiting
+                if not chart.cancel():
+                    return chart.result()
+            return viz_generator.generate_visualization(viz_type, result['data'], result['query_context'])
+        except Exception as e:
+            # A failed chart does not discard the answer
+            job.chart_error = e
+            return None
+
+
+_default_pool = None
+_default_pool_lock = threading.Lock()
+
+
+def get_default_pool() -> JobPool:
+    """
+    Get the process-wide job pool, configured from environment variables.
+
+    Returns:
+        Shared JobPool instance
+    """
+    global _default_pool
+    with _default_pool_lock:
+        if _default_pool is None:
+            _default_pool = JobPool(
+                max_workers=int(os.environ.get('CHATBOT_WORKERS', 8)),
+                max_pending=int(os.environ.get('CHATBOT_MAX_PENDING', 64))
+            )
+        return _default_pool
+
+
+# Example usage
+if __name__ == "__main__":
+    from data_loader import generate_synthetic_data
+
+    pool = JobPool(max_workers=4)
+    pipeline = ChatPipeline()
+    viz_generator = VisualizationGenerator()
+    data = generate_synthetic_data()
+
+    stale = pool.submit_question(pipeline, viz_generator, "Show me the monthly revenue trend over the past year", data)
+    stale.cancel()
+    job = pool.submit_question(pipeline, viz_generator, "أظهر لي توزيع الفواتير حسب الإمارة", data)
+    stages = []
+    while not job.wait(0.001):
+        if not stages or stages[-1] != job.stage:
+            stages.append(job.stage)
+    stale.wait()
+    print(f"Stages seen: {stages}")
+    print(f"Stale job: {stale.stage}")
+    print(f"Answer: {job.result['formatted_response'][:80]}...")
+    print(f"Chart: {type(job.figure).__name__}, timings: "
+          f"{ {stage: round(seconds * 1000, 2) for stage, seconds in job.result['timings'].items()} }")
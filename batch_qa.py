@@ -0,0 +1,250 @@
+"""
+Headless batch question answering for the e-invoice chatbot.
+This module runs a file of questions through the chatbot pipeline with bounded
+concurrency and writes one JSON line per answer, resuming after a crash.
+
+Examples:
+    python batch_qa.py questions.txt --output results.jsonl --concurrency 8
+    python batch_qa.py questions.jsonl --output results.jsonl --charts-dir charts/
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List, Optional, Set
+
+from chat_pipeline import ChatPipeline
+import data_loader
+from prompt_builder import get_prompt_cache_metrics
+
+
+def read_questions(path: str) -> List[Dict]:
+    """
+    Read questions from a text file (one per line) or a JSONL file.
+
+    JSONL lines must have a 'question' field and may have an 'id'. Questions
+    without an id get one derived from their text, so ids stay stable when
+    the file is reordered.
+
+    Args:
+        path: Path of the questions file
+
+    Returns:
+        List of {'id', 'question'} dictionaries
+    """
+    questions = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            if path.endswith('.jsonl'):
+                entry = json.loads(line)
+                question = entry['question']
+                question_id = str(entry.get('id') or '')
+            else:
+                question, question_id = line, ''
+            if not question_id:
+                question_id = hashlib.sha1(question.encode('utf-8')).hexdigest()[:12]
+            questions.append({'id': question_id, 'question': question})
+    return questions
+
+
+def read_completed_ids(path: str, retry_failed: bool = False) -> Set[str]:
+    """
+    Collect the ids already answered in an existing results file.
+
+    A line cut short by a crash is ignored, so its question is asked again.
+
+    Args:
+        path: Path of the JSONL results file
+        retry_failed: Treat failed answers as not completed
+
+    Returns:
+        Set of completed question ids
+    """
+    completed = set()
+    if not os.path.exists(path):
+        return completed
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except ValueError:
+                continue
+            if retry_failed and not result.get('success'):
+                continue
+            completed.add(result['id'])
+    return completed
+
+
+class ResultWriter:
+    """
+    Thread-safe JSONL writer that flushes every result to disk.
+    """
+
+    def __init__(self, path: str):
+        # Drop a partial trailing line left by a crash before appending
+        if os.path.exists(path):
+            with open(path, 'rb+') as f:
+                content = f.read()
+                if content and not content.endswith(b'\n'):
+                    f.truncate(content.rfind(b'\n') + 1)
+        self.file = open(path, 'a', encoding='utf-8')
+        self.lock = threading.Lock()
+
+    def write(self, result: Dict):
+        line = json.dumps(result, ensure_ascii=False, default=str) + '\n'
+        with self.lock:
+            self.file.write(line)
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+    def close(self):
+        self.file.close()
+
+
+def answer_question(pipeline: ChatPipeline, entry: Dict, data: Dict, args: argparse.Namespace,
+                    viz_generator=None) -> Dict:
+    """
+    Answer one question and collect the result record.
+
+    Args:
+        pipeline: Shared chat pipeline
+        entry: Question dictionary with 'id' and 'question'
+        data: Dictionary of loaded data tables
+        args: Parsed command-line arguments
+        viz_generator: Visualization generator, if charts should be rendered
+
+    Returns:
+        Result dictionary written to the JSONL output
+    """
+    result = pipeline.process(
+        entry['question'],
+        data,
+        api_key=args.api_key,
+        model=args.model,
+        selected_table=args.table,
+        selected_domain=args.domain,
+        use_tools=args.use_tools
+    )
+    response = result['response']
+    query_context = result['query_context']
+    timings = dict(result['timings'])
+
+    record = {
+        'id': entry['id'],
+        'question': entry['question'],
+        'success': response['success'],
+        'answer': response.get('response_text'),
+        'error': response.get('error'),
+        'message': response.get('message'),
+        'language': query_context['language'],
+        'tables': list(query_context['relevant_tables']),
+        'domains': list(query_context['relevant_domains']),
+        'filters': [dict(item) for item in query_context['filters']],
+        'fast_path': response.get('fast_path'),
+        'visualization_type': response.get('visualization_type'),
+        'usage': response.get('usage'),
+        'chart': None
+    }
+
+    viz_type = response.get('visualization_type')
+    if viz_generator is not None and (viz_type or response.get('plan')):
+        stage_start = time.perf_counter()
+        fig = None
+        if response.get('plan'):
+            fig = viz_generator.generate_visualization_from_plan(response['plan'], query_context)
+        if fig is None and viz_type:
+            fig = viz_generator.generate_visualization(viz_type, result['data'], query_context)
+        if fig is not None:
+            chart_path = os.path.join(args.charts_dir, f"{entry['id']}.html")
+            fig.write_html(chart_path, include_plotlyjs='cdn')
+            record['chart'] = chart_path
+        timings['chart'] = time.perf_counter() - stage_start
+
+    record['timings_ms'] = {stage: round(seconds * 1000, 3) for stage, seconds in timings.items()}
+    return record
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Answer a file of questions with the e-invoice chatbot pipeline")
+    parser.add_argument('questions', help="Questions file: one question per line (.txt) or JSONL with 'id'/'question'")
+    parser.add_argument('--output', '-o', default='batch_results.jsonl', help="JSONL results file (appended to)")
+    parser.add_argument('--data-dir', default=data_loader.DATA_DIR, help="Directory with the exported CSV tables")
+    parser.add_argument('--concurrency', '-j', type=int, default=4, help="Questions processed concurrently")
+    parser.add_argument('--api-key', default=os.environ.get('OPENAI_API_KEY', ''),
+                        help="OpenAI API key (defaults to $OPENAI_API_KEY; mock answers without one)")
+    parser.add_argument('--model', default='gpt-3.5-turbo')
+    parser.add_argument('--use-tools', action='store_true', help="Compute answers with local aggregation tools")
+    parser.add_argument('--table', default='All', help="Restrict routing to one table")
+    parser.add_argument('--domain', default='All', help="Restrict routing to one domain")
+    parser.add_argument('--charts-dir', help="Render each answer's chart as HTML into this directory")
+    parser.add_argument('--retry-failed', action='store_true', help="Ask again questions that failed in a previous run")
+    args = parser.parse_args(argv)
+
+    questions = read_questions(args.questions)
+    completed = read_completed_ids(args.output, args.retry_failed)
+    pending = [entry for entry in questions if entry['id'] not in completed]
+    print(f"{len(questions)} questions, {len(questions) - len(pending)} already answered, {len(pending)} to go",
+          file=sys.stderr)
+    if not pending:
+        return 0
+
+    # Load the dataset once for all questions
+    started = time.perf_counter()
+    data = data_loader.load_data(args.data_dir)
+    print(f"Loaded {', '.join(f'{name} ({len(table)})' for name, table in data.items())} "
+          f"in {time.perf_counter() - started:.2f}s", file=sys.stderr)
+
+    viz_generator = None
+    if args.charts_dir:
+        from visualization_generator import VisualizationGenerator
+        os.makedirs(args.charts_dir, exist_ok=True)
+        viz_generator = VisualizationGenerator()
+
+    pipeline = ChatPipeline()
+    writer = ResultWriter(args.output)
+    failures = 0
+    started = time.perf_counter()
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, args.concurrency)) as executor:
+            futures = {
+                executor.submit(answer_question, pipeline, entry, data, args, viz_generator): entry
+                for entry in pending
+            }
+            for done, future in enumerate(as_completed(futures), start=1):
+                entry = futures[future]
+                try:
+                    record = future.result()
+                except Exception as e:
+                    # Record the failure so the run continues; --retry-failed asks again
+                    record = {'id': entry['id'], 'question': entry['question'], 'success': False,
+                              'error': 'pipeline_error', 'message': str(e)}
+                if not record['success']:
+                    failures += 1
+                writer.write(record)
+                if done % 25 == 0 or done == len(pending):
+                    print(f"{done}/{len(pending)} answered ({failures} failed)", file=sys.stderr)
+    finally:
+        writer.close()
+
+    elapsed = time.perf_counter() - started
+    print(f"Finished {len(pending)} questions in {elapsed:.1f}s ({len(pending) / elapsed:.1f}/s), "
+          f"{failures} failed", file=sys.stderr)
+    prompt_cache = get_prompt_cache_metrics().stats()['totals']
+    if prompt_cache['requests']:
+        print(f"Prompt cache: {prompt_cache['cached_tokens']:,} of {prompt_cache['prompt_tokens']:,} prompt tokens "
+              f"cached ({prompt_cache['cache_hit_ratio']:.1%}) over {prompt_cache['distinct_prefixes']} prefixes",
+              file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,3 @@
+"""
+Benchmarks and offline test tooling for the e-invoice chatbot.
+"""
@@ -0,0 +1,376 @@
+"""
+Concurrent-session load test for the e-invoice chatbot.
+This module starts the Streamlit app as a real headless server (against the
+stub OpenAI server as a mock LLM) and drives N sessions at once through
+scripted websocket clients speaking Streamlit's browser protocol. Each
+session sets its API key and language, then asks a stream of bilingual
+corpus questions with think time between them, changing the table and
+domain filters, the tools checkbox and the examples button along the way.
+
+For every number of sessions it reports the answer throughput, the latency
+percentiles of the page reruns per action (a rerun re-renders the whole
+chat, charts included), the time until the answer's progress placeholder
+appears and the server's RSS growth per session. It runs offline, on Linux
+(the server's RSS is read from /proc).
+
+Example:
+    python -m benchmarks.bench_load --sessions 1 5 10 20 --questions 5 --output load.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional, Tuple
+
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+from streamlit.proto.WidgetStates_pb2 import WidgetState
+from tornado.websocket import websocket_connect
+
+from benchmarks.bench_pipeline import STUB_API_KEY, summarize
+from benchmarks.eval_routing import DEFAULT_CORPUS, load_corpus
+from benchmarks.stub_server import StubConfig, start_stub_server
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Marker of the progress placeholder app.py shows while a question is answered
+PROGRESS_MARKER = '⏳'
+
+
+class Session:
+    """
+    One browser session of the app, driven over Streamlit's websocket protocol.
+
+    Widgets are found in the elements of the latest script run; the values set
+    on them are sent back with every rerun, as the browser does.
+    """
+
+    def __init__(self, url: str, timeout: float):
+        """
+        Initialize a session.
+
+        Args:
+            url: Base URL of the Streamlit server, e.g. http://127.0.0.1:8501
+            timeout: Seconds to wait for a script run to finish
+        """
+        self.url = url.replace('http://', 'ws://').replace('https://', 'wss://').rstrip('/') + '/_stcore/stream'
+        self.timeout = timeout
+        self.connection = None
+        # Widgets of the latest run in page order: (element type, widget id, label)
+        self.widgets = []
+        self.values = {}
+
+    async def connect(self):
+        self.connection = await websocket_connect(self.url, subprotocols=['streamlit'])
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+
+    def find(self, element_type: str, label: Optional[str] = None, key: Optional[str] = None,
+             index: int = 0, after: Optional[str] = None) -> str:
+        """
+        Get the id of a widget of the latest run.
+
+        Args:
+            element_type: Element type, e.g. 'button' or 'selectbox'
+            label: Label of the widget
+            key: Key of the widget
+            index: Position among the matching widgets
+            after: Only consider widgets after the first one of this type
+                (labels change with the language; positions do not)
+
+        Returns:
+            The widget id
+        """
+        widgets = self.widgets
+        if after is not None:
+            start = next((position for position, (kind, _, _) in enumerate(widgets) if kind == after), len(widgets))
+            widgets = widgets[start + 1:]
+        matches = [widget_id for kind, widget_id, widget_label in widgets if kind == element_type
+                   and (label is None or widget_label == label) and (key is None or widget_id.endswith(f'-{key}'))]
+        if len(matches) <= index:
+            raise LookupError(f"No {element_type} widget {label or key or index} on the page")
+        return matches[index]
+
+    async def rerun(self, trigger: Optional[WidgetState] = None) -> Dict:
+        """
+        Rerun the script with the current widget values and wait until it has finished.
+
+        Runs the app starts itself (st.rerun after an answer) are waited for too.
+
+        Args:
+            trigger: Button click or chat submission sent with this rerun only
+
+        Returns:
+            Dictionary with the seconds until the page was complete, the seconds
+            until the progress placeholder appeared (None if it did not), the
+            script runs and the exceptions the page showed
+        """
+        message = BackMsg()
+        message.rerun_script.query_string = ''
+        message.rerun_script.page_script_hash = ''
+        for state in self.values.values():
+            message.rerun_script.widget_states.widgets.append(state)
+        if trigger is not None:
+            message.rerun_script.widget_states.widgets.append(trigger)
+
+        started = time.perf_counter()
+        await self.connection.write_message(message.SerializeToString(), binary=True)
+        widgets, exceptions, runs, progress = [], [], 0, None
+        while True:
+            raw = await asyncio.wait_for(self.connection.read_message(), self.timeout)
+            if raw is None:
+                raise ConnectionError("The server closed the session")
+            forward = ForwardMsg()
+            forward.ParseFromString(raw)
+            kind = forward.WhichOneof('type')
+            if kind == 'new_session':
+                widgets = []
+            elif kind == 'delta' and forward.delta.WhichOneof('type') == 'new_element':
+                element = forward.delta.new_element
+                element_type = element.WhichOneof('type')
+                body = getattr(element, element_type)
+                if getattr(body, 'id', ''):
+                    widgets.append((element_type, body.id, getattr(body, 'label', '')))
+                elif element_type == 'exception':
+                    exceptions.append(f"{body.type}: {body.message}")
+                elif element_type == 'markdown' and progress is None and PROGRESS_MARKER in body.body:
+                    progress = time.perf_counter() - started
+            elif kind == 'script_finished':
+                runs += 1
+                if forward.script_finished != ForwardMsg.FINISHED_EARLY_FOR_RERUN:
+                    break
+        self.widgets = widgets
+        # Values of widgets no longer on the page (e.g. relabelled after a language switch) are dropped
+        current = {widget_id for _, widget_id, _ in widgets}
+        self.values = {widget_id: state for widget_id, state in self.values.items() if widget_id in current}
+        return {'seconds': time.perf_counter() - started, 'progress': progress, 'runs': runs, 'exceptions': exceptions}
+
+    async def set_text(self, widget_id: str, value: str) -> Dict:
+        self.values[widget_id] = WidgetState(id=widget_id, string_value=value)
+        return await self.rerun()
+
+    async def select(self, widget_id: str, index: int) -> Dict:
+        self.values[widget_id] = WidgetState(id=widget_id, int_value=index)
+        return await self.rerun()
+
+    async def check(self, widget_id: str, value: bool) -> Dict:
+        self.values[widget_id] = WidgetState(id=widget_id, bool_value=value)
+        return await self.rerun()
+
+    async def click(self, widget_id: str) -> Dict:
+        return await self.rerun(WidgetState(id=widget_id, trigger_value=True))
+
+    async def ask(self, widget_id: str, question: str) -> Dict:
+        trigger = WidgetState(id=widget_id)
+        trigger.string_trigger_value.data = question
+        return await self.rerun(trigger)
+
+
+async def run_session(index: int, url: str, questions: List[str], args, record) -> Session:
+    """
+    Play one analyst's session: open the page, set the API key and language, then ask the questions.
+
+    Args:
+        index: Session number (odd sessions use Arabic)
+        url: Base URL of the server
+        questions: The session's questions, in its language
+        args: Parsed command-line options
+        record: Callback record(action, result) collecting the timings
+
+    Returns:
+        The session, still connected (so the server's memory counts it)
+    """
+    rng = random.Random(index)
+    session = Session(url, args.timeout)
+    await session.connect()
+    try:
+        record('open', await session.rerun())
+        record('api_key', await session.set_text(session.find('text_input', key='api_key_input'), STUB_API_KEY))
+        if index % 2:
+            record('language', await session.click(session.find('button', label='العربية')))
+
+        for question in questions:
+            await asyncio.sleep(rng.expovariate(1 / args.think_time) if args.think_time > 0 else 0)
+            if rng.random() < args.control_rate:
+                action = rng.choice(['table_filter', 'domain_filter', 'tools', 'examples'])
+                if action == 'table_filter':
+                    result = await session.select(session.find('selectbox', index=0), rng.randrange(5))
+                elif action == 'domain_filter':
+                    result = await session.select(session.find('selectbox', index=1), rng.randrange(5))
+                elif action == 'tools':
+                    result = await session.check(session.find('checkbox', key='use_tools'), rng.random() < 0.5)
+                else:
+                    # The buttons next to the chat input are Clear and Examples
+                    result = await session.click(session.find('button', index=1, after='chat_input'))
+                record(action, result)
+            record('ask', await session.ask(session.find('chat_input', key='user_input'), question))
+    except Exception:
+        session.close()
+        raise
+    return session
+
+
+def rss_mb(pid: int) -> float:
+    """Read a process's resident set size in MB from /proc."""
+    with open(f'/proc/{pid}/status', encoding='utf-8') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_app(stub_url: str, scratch: str) -> Tuple[subprocess.Popen, str]:
+    """Start app.py under `streamlit run`, headless on a free port, and wait until it serves."""
+    port = free_port()
+    env = dict(os.environ, OPENAI_BASE_URL=stub_url, CHATBOT_HISTORY_DB=os.path.join(scratch, 'history.sqlite3'),
+               PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.environ.get('PYTHONPATH')])))
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'streamlit', 'run', os.path.join(ROOT, 'app.py'), '--server.headless', 'true',
+         '--server.port', str(port), '--server.address', '127.0.0.1', '--browser.gatherUsageStats', 'false'],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, env=env, cwd=ROOT
+    )
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return process, f'http://127.0.0.1:{port}'
+        except OSError:
+            if process.poll() is not None:
+                raise RuntimeError("The Streamlit server exited during startup")
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError("The Streamlit server did not start within 60 s")
+
+
+def question_streams(sessions: int, per_session: int, corpus_path: str) -> List[List[str]]:
+    """Draw each session's questions from the in-domain corpus queries of its language."""
+    corpus = [entry for entry in load_corpus(corpus_path) if not entry['out_of_domain']]
+    by_language = {language: [entry['query'] for entry in corpus if entry['language'] == language]
+                   for language in ('en', 'ar')}
+    return [random.Random(index).sample(by_language['ar' if index % 2 else 'en'], per_session)
+            for index in range(sessions)]
+
+
+async def run_level(sessions: int, url: str, pid: int, args) -> Dict:
+    """Run one load level: all sessions at once, then collect their timings and the server's memory."""
+    samples, progress, errors = {}, [], []
+
+    def record(action: str, result: Dict):
+        samples.setdefault(action, []).append(result['seconds'])
+        if action == 'ask' and result['progress'] is not None:
+            progress.append(result['progress'])
+        errors.extend(result['exceptions'])
+
+    # Warm up the server (data, components and imports) before the memory baseline
+    warm_up = question_streams(1, 1, args.corpus)[0]
+    quick = argparse.Namespace(**dict(vars(args), think_time=0, control_rate=0))
+    (await run_session(0, url, warm_up, quick, lambda action, result: None)).close()
+    await asyncio.sleep(1.0)
+    baseline = peak = rss_mb(pid)
+
+    streams = question_streams(sessions, args.questions, args.corpus)
+    started = time.perf_counter()
+    tasks = [asyncio.ensure_future(run_session(index, url, streams[index], args, record))
+             for index in range(sessions)]
+    # Sample the server's memory while the sessions run
+    while not all(task.done() for task in tasks):
+        peak = max(peak, rss_mb(pid))
+        await asyncio.sleep(0.5)
+    wall_time = time.perf_counter() - started
+    # Measured before the sessions disconnect, so it counts all of them
+    end = rss_mb(pid)
+    failures = []
+    for task in tasks:
+        if task.exception() is not None:
+            failures.append(f"{type(task.exception()).__name__}: {task.exception()}")
+        else:
+            task.result().close()
+
+    answered = len(samples.get('ask', []))
+    return {
+        'sessions': sessions,
+        'questions': answered,
+        'wall_seconds': wall_time,
+        'throughput': answered / wall_time,
+        'actions': summarize(samples),
+        'progress_shown': summarize({'progress': progress}).get('progress'),
+        'rss_baseline_mb': baseline,
+        'rss_end_mb': end,
+        'rss_peak_mb': max(peak, end),
+        'rss_per_session_mb': (end - baseline) / sessions,
+        'page_exceptions': len(errors),
+        'failed_sessions': failures
+    }
+
+
+def print_level(level: Dict):
+    print(f"\n{level['sessions']} sessions: {level['questions']} answers in {level['wall_seconds']:.1f} s "
+          f"({level['throughput']:.2f} answers/s), RSS {level['rss_baseline_mb']:.0f} -> {level['rss_end_mb']:.0f} MB "
+          f"(peak {level['rss_peak_mb']:.0f}), {level['rss_per_session_mb']:.1f} MB per session")
+    print(f"{'action':<14} {'count':>6} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10} {'max ms':>10}")
+    rows = dict(level['actions'])
+    if level['progress_shown']:
+        rows['progress_shown'] = level['progress_shown']
+    for action, stats in rows.items():
+        print(f"{action:<14} {stats['count']:>6} {stats['p50']:>10.1f} {stats['p95']:>10.1f} "
+              f"{stats['p99']:>10.1f} {stats['max']:>10.1f}")
+    if level['page_exceptions'] or level['failed_sessions']:
+        print(f"page exceptions: {level['page_exceptions']}, failed sessions: {level['failed_sessions'][:3]}")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Load-test the Streamlit app with concurrent scripted sessions")
+    parser.add_argument('--sessions', type=int, nargs='+', default=[1, 5, 10], help="Concurrent sessions per level")
+    parser.add_argument('--questions', type=int, default=5, help="Questions asked by each session")
+    parser.add_argument('--think-time', type=float, default=2.0, help="Mean seconds between a session's actions")
+    parser.add_argument('--control-rate', type=float, default=0.5,
+                        help="Chance of changing a filter or control before each question")
+    parser.add_argument('--corpus', default=DEFAULT_CORPUS, help="Labeled bilingual query corpus (JSON lines)")
+    parser.add_argument('--latency', type=float, default=0.5, help="Mock LLM seconds to the first token")
+    parser.add_argument('--tokens-per-second', type=float, default=100.0, help="Mock LLM generation speed")
+    parser.add_argument('--timeout', type=float, default=300.0, help="Seconds to wait for one rerun")
+    parser.add_argument('--output', help="Write the results as JSON to this file")
+    args = parser.parse_args(argv)
+
+    stub_config = StubConfig(latency=args.latency, tokens_per_second=args.tokens_per_second, seed=0)
+    stub = start_stub_server(stub_config)
+    stub_url = f"http://127.0.0.1:{stub.server_port}/v1"
+    levels = []
+    for sessions in args.sessions:
+        # A fresh server per level, so its memory starts from the same baseline
+        with tempfile.TemporaryDirectory(prefix='chatbot-load-') as scratch:
+            process, url = start_app(stub_url, scratch)
+            try:
+                level = asyncio.run(run_level(sessions, url, process.pid, args))
+            finally:
+                process.terminate()
+                process.wait(timeout=30)
+        levels.append(level)
+        print_level(level)
+    stub.shutdown()
+    print(f"\nMock LLM: {stub_config.stats}")
+
+    if args.output:
+        config = {key: value for key, value in vars(args).items() if key != 'output'}
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'config': config, 'llm': stub_config.stats, 'levels': levels}, f, indent=2)
+    return 1 if any(level['failed_sessions'] for level in levels) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
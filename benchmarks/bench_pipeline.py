@@ -0,0 +1,214 @@
+"""
+End-to-end latency benchmark for the e-invoice chatbot request pipeline.
+This module drives the real request/stream/retry code against the local stub
+server and reports p50/p95/p99 latency per pipeline stage.
+
+Examples:
+    # Drive app.py's handle_chat_input through Streamlit's AppTest (one session)
+    python -m benchmarks.bench_pipeline --mode app --repeat 3
+
+    # Drive ChatPipeline directly with 8 concurrent workers and 5% injected 429s
+    python -m benchmarks.bench_pipeline --mode pipeline --concurrency 8 --error-rate-429 0.05
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+import numpy as np
+
+from benchmarks.stub_server import StubConfig, start_stub_server
+from routing_classifier import get_default_classifier
+
+# Bilingual questions sent by the benchmark. They ask for explanations the fast path declines,
+# so every request reaches the LLM client (and its 429/retry handling); aggregate questions such
+# as "What is the total VAT collected in Dubai?" are answered locally and would skip it
+DEFAULT_QUESTIONS = [
+    "Why is VAT collected in Dubai lower than in Abu Dhabi?",
+    "Explain the trend in monthly revenue over the past year",
+    "Which sectors should we prioritise for compliance audits and why?",
+    "What could explain the anomalies detected in high-value invoices?",
+    "Summarize the risk profile of taxpayers with late filings",
+    "لماذا ضريبة القيمة المضافة المحصلة في دبي أقل من أبوظبي؟",
+    "اشرح اتجاه الإيرادات الشهرية خلال العام الماضي",
+    "ما القطاعات التي يجب أن نعطيها الأولوية في تدقيق الامتثال ولماذا؟",
+    "ما الذي قد يفسر الشذوذ في الفواتير عالية القيمة؟",
+    "لخص ملف المخاطر للمكلفين المتأخرين في تقديم الإقرارات"
+]
+
+STUB_API_KEY = "sk-stub-benchmark-key"
+
+
+def summarize(samples: Dict[str, List[float]]) -> Dict[str, Dict[str, float]]:
+    """
+    Compute latency percentiles per stage.
+
+    Args:
+        samples: Stage name to list of durations in seconds
+
+    Returns:
+        Stage name to {'count', 'p50', 'p95', 'p99', 'max'} in milliseconds
+    """
+    summary = {}
+    for stage, values in samples.items():
+        if not values:
+            continue
+        values_ms = np.asarray(values) * 1000.0
+        summary[stage] = {
+            'count': int(len(values_ms)),
+            'p50': float(np.percentile(values_ms, 50)),
+            'p95': float(np.percentile(values_ms, 95)),
+            'p99': float(np.percentile(values_ms, 99)),
+            'max': float(values_ms.max())
+        }
+    return summary
+
+
+def print_summary(summary: Dict[str, Dict[str, float]]):
+    print(f"{'stage':<10} {'count':>6} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10} {'max ms':>10}")
+    for stage, stats in summary.items():
+        print(f"{stage:<10} {stats['count']:>6} {stats['p50']:>10.2f} {stats['p95']:>10.2f} "
+              f"{stats['p99']:>10.2f} {stats['max']:>10.2f}")
+
+
+def run_app_mode(questions: List[str], timeout: float) -> Dict[str, List[float]]:
+    """Submit questions through app.py's chat input so handle_chat_input and the chart rerun run for real."""
+    from streamlit.testing.v1 import AppTest
+
+    app_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app.py')
+    app_test = AppTest.from_file(app_path, default_timeout=timeout)
+    app_test.run()
+    app_test.text_input(key='api_key_input').set_value(STUB_API_KEY).run()
+
+    samples = {}
+    for question in questions:
+        started = time.perf_counter()
+        app_test.chat_input[0].set_value(question).run()
+        elapsed = time.perf_counter() - started
+        if app_test.exception:
+            raise RuntimeError(app_test.exception[0].message)
+
+        timings = dict(app_test.session_state['last_timings'])
+        # Everything outside handle_chat_input: script rerun, chat rendering and charts
+        timings['render'] = max(0.0, elapsed - timings['total'])
+        timings['rerun'] = elapsed
+        for stage, seconds in timings.items():
+            samples.setdefault(stage, []).append(seconds)
+    return samples
+
+
+def run_pipeline_mode(questions: List[str], concurrency: int, stream: bool) -> Dict[str, List[float]]:
+    """Run questions through ChatPipeline concurrently, then chart each answer."""
+    from chat_pipeline import ChatPipeline
+    from data_loader import generate_synthetic_data
+    from response_generator import ResponseGenerator
+    from visualization_generator import VisualizationGenerator
+
+    pipeline = ChatPipeline()
+    viz_generator = VisualizationGenerator()
+    data = generate_synthetic_data()
+
+    def run_one(question: str) -> Dict[str, float]:
+        if stream:
+            timings = {}
+            started = time.perf_counter()
+            query_context = pipeline.router.get_query_context(question)
+            timings['route'] = time.perf_counter() - started
+            stage_start = time.perf_counter()
+            response_context = pipeline.response_handler.prepare_response_context(query_context, data)
+            timings['context'] = time.perf_counter() - stage_start
+            stage_start = time.perf_counter()
+            chunks = ResponseGenerator(STUB_API_KEY).generate_response_stream(question, response_context)
+            for index, _ in enumerate(chunks):
+                if index == 0:
+                    timings['ttft'] = time.perf_counter() - stage_start
+            timings['llm'] = time.perf_counter() - stage_start
+            viz_type = response_context.get('visualization_type')
+        else:
+            result = pipeline.process(question, data, api_key=STUB_API_KEY)
+            timings = dict(result['timings'])
+            query_context = result['query_context']
+            viz_type = result['response'].get('visualization_type')
+            started = time.perf_counter() - timings['total']
+
+        if viz_type:
+            stage_start = time.perf_counter()
+            viz_generator.generate_visualization(viz_type, data, query_context)
+            timings['chart'] = time.perf_counter() - stage_start
+        timings['total'] = time.perf_counter() - started
+        return timings
+
+    samples = {}
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for timings in executor.map(run_one, questions):
+            for stage, seconds in timings.items():
+                samples.setdefault(stage, []).append(seconds)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end chatbot latency benchmark against a stub OpenAI server")
+    parser.add_argument('--mode', choices=['app', 'pipeline'], default='app')
+    parser.add_argument('--questions', help="Text file with one question per line (defaults to built-in bilingual set)")
+    parser.add_argument('--repeat', type=int, default=2, help="Times to repeat the question set")
+    parser.add_argument('--concurrency', type=int, default=4, help="Concurrent requests in pipeline mode")
+    parser.add_argument('--stream', action='store_true', help="Use streaming responses in pipeline mode")
+    parser.add_argument('--latency', type=float, default=0.2)
+    parser.add_argument('--tokens-per-second', type=float, default=200.0)
+    parser.add_argument('--error-rate-429', type=float, default=0.0)
+    parser.add_argument('--error-rate-500', type=float, default=0.0)
+    parser.add_argument('--retry-after', type=float, default=0.2)
+    parser.add_argument('--timeout', type=float, default=60.0, help="Per-rerun timeout in app mode")
+    parser.add_argument('--output', help="Write the summary as JSON to this file")
+    args = parser.parse_args()
+
+    if args.questions:
+        with open(args.questions, encoding='utf-8') as f:
+            questions = [line.strip() for line in f if line.strip()]
+    else:
+        questions = DEFAULT_QUESTIONS
+    questions = questions * args.repeat
+
+    config = StubConfig(
+        latency=args.latency,
+        tokens_per_second=args.tokens_per_second,
+        error_rate_429=args.error_rate_429,
+        error_rate_500=args.error_rate_500,
+        retry_after=args.retry_after,
+        seed=0
+    )
+    server = start_stub_server(config)
+    # Must be set before the shared LLM client is created
+    os.environ['OPENAI_BASE_URL'] = f"http://127.0.0.1:{server.server_port}/v1"
+
+    # Load the routing model before timing, so the first requests' route stage does not include it
+    classifier = get_default_classifier()
+    if classifier is not None:
+        classifier.predict_many([''])
+
+    started = time.perf_counter()
+    if args.mode == 'app':
+        samples = run_app_mode(questions, args.timeout)
+    else:
+        samples = run_pipeline_mode(questions, args.concurrency, args.stream)
+    wall_time = time.perf_counter() - started
+    server.shutdown()
+
+    summary = summarize(samples)
+    print(f"Mode: {args.mode}, questions: {len(questions)}, wall time: {wall_time:.2f}s, "
+          f"throughput: {len(questions) / wall_time:.2f} q/s")
+    print(f"Stub server: {config.stats}")
+    print_summary(summary)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'mode': args.mode, 'questions': len(questions), 'wall_time': wall_time,
+                       'server': config.stats, 'stages': summary}, f, indent=2)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
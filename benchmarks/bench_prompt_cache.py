@@ -0,0 +1,181 @@
+"""
+Prompt cache benchmark for the e-invoice chatbot.
+This module replays conversations (from the labeled corpus, and drill-downs
+whose follow-ups filter the same data) through the simulated prompt cache of
+the stub server, once with the previous message order (all data samples right
+after the system prompt, tables in routing order) and once with the
+prefix-stable order, and reports the share of prompt tokens served from the
+cache. It runs offline.
+
+Example:
+    python -m benchmarks.bench_prompt_cache
+    python -m benchmarks.bench_prompt_cache --turns 4 --cache-min-tokens 256
+"""
+
+import argparse
+import json
+import sys
+import time
+from typing import Callable, Dict, List, Optional
+
+from benchmarks.eval_routing import DEFAULT_CORPUS, load_corpus
+from benchmarks.stub_server import DEFAULT_REPLY, StubConfig
+from data_loader import generate_synthetic_data
+from data_router import DataRouter
+from prompt_builder import render_data_samples
+from response_generator import ResponseGenerator
+from response_handler import ResponseHandler
+
+# Drill-down conversations: follow-up questions narrow the same data with different filters
+DRILL_DOWNS = [
+    ["What is the total VAT collected from invoices?", "What is the total VAT collected in Dubai?",
+     "What is the total VAT collected in Dubai last month?", "Show invoices in Dubai above 10,000 AED",
+     "Show invoices in Sharjah above 10,000 AED"],
+    ["Show me the revenue trend of invoices", "Show me the revenue trend of invoices since March",
+     "Show me the revenue trend of invoices in Abu Dhabi since March", "Revenue of invoices between 2k and 4k dirhams",
+     "Revenue of invoices over 3 million"],
+    ["ما هو إجمالي ضريبة القيمة المضافة المحصلة من الفواتير؟", "ما هو إجمالي ضريبة القيمة المضافة المحصلة في دبي؟",
+     "ما هو إجمالي ضريبة القيمة المضافة المحصلة في دبي الشهر الماضي؟",
+     "الفواتير التي تزيد قيمتها عن ٥٠٠٠ درهم في أبوظبي", "الفواتير التي تزيد قيمتها عن ٥٠٠٠ درهم في الشارقة"],
+    ["أظهر لي سجل التدقيق للفاتورة رقم 12", "أظهر لي سجل التدقيق للفاتورة رقم 15",
+     "سجلات التدقيق منذ فبراير", "سجلات التدقيق للفاتورة رقم 20 منذ فبراير"]
+]
+
+# Builds the messages of one request: (query, response_context, history) -> messages
+BuildMessages = Callable[[str, Dict, List[Dict]], List[Dict]]
+
+
+def legacy_system_prompt(handler: ResponseHandler, query_context: Dict) -> str:
+    """The system prompt as rendered before prompt assembly: tables and domains in routing order."""
+    lang = query_context['language']
+    system_prompt = handler.system_messages['general'][lang] + "\n\n"
+    for table in query_context['relevant_tables']:
+        system_prompt += handler.table_descriptions[table][lang] + "\n"
+    for domain in query_context['relevant_domains']:
+        for constraint in handler.domain_constraints[domain][lang]:
+            system_prompt += "- " + constraint + "\n"
+    return system_prompt
+
+
+def legacy_messages(handler: ResponseHandler) -> BuildMessages:
+    """The previous message order: system prompt, data samples, history, query."""
+    def build(query: str, response_context: Dict, history: List[Dict]) -> List[Dict]:
+        messages = [
+            {"role": "system", "content": legacy_system_prompt(handler, response_context['query_context'])},
+            *history,
+            {"role": "user", "content": query}
+        ]
+        data_samples = response_context['data_samples']
+        if data_samples:
+            tables = response_context['query_context']['relevant_tables']
+            data_samples = {table: data_samples[table] for table in tables if table in data_samples}
+            messages.insert(1, {"role": "system", "content": render_data_samples(data_samples)})
+        return messages
+    return build
+
+
+def replay(build: BuildMessages, conversations: List[List[Dict]], cache_min_tokens: int) -> Dict:
+    """
+    Send every conversation through a fresh simulated prompt cache.
+
+    Args:
+        build: Message builder to evaluate
+        conversations: Lists of (query, response_context) turns
+        cache_min_tokens: Shortest cacheable prefix
+
+    Returns:
+        Dictionary with request, prompt and cached token counts
+    """
+    cache = StubConfig(cache_min_tokens=cache_min_tokens)
+    for conversation in conversations:
+        history = []
+        for turn in conversation:
+            messages = build(turn['query'], turn['response_context'], history)
+            prompt_tokens = sum(max(1, len(str(message['content'])) // 4) for message in messages)
+            cache.record_usage(prompt_tokens, cache.cached_tokens(messages, prompt_tokens))
+            history += [{"role": "user", "content": turn['query']}, {"role": "assistant", "content": DEFAULT_REPLY}]
+    stats = cache.stats
+    return {
+        'requests': sum(len(conversation) for conversation in conversations),
+        'prompt_tokens': stats['prompt_tokens'],
+        'cached_tokens': stats['cached_tokens'],
+        'cache_hit_ratio': stats['cached_tokens'] / stats['prompt_tokens'] if stats['prompt_tokens'] else 0.0
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Compare prompt cache hits of the old and prefix-stable message order")
+    parser.add_argument('--corpus', default=DEFAULT_CORPUS, help="Labeled JSONL corpus")
+    parser.add_argument('--turns', type=int, default=3, help="Questions per simulated conversation")
+    parser.add_argument('--cache-min-tokens', type=int, default=1024, help="Shortest cacheable prefix (the API's is 1024)")
+    parser.add_argument('--output', help="Write the results as JSON to this file")
+    args = parser.parse_args(argv)
+
+    data = generate_synthetic_data()
+    router = DataRouter()
+    handler = ResponseHandler(router.matcher)
+
+    def turn(query: str) -> Dict:
+        query_context = router.get_query_context(query)
+        scoped_data = router.entity_extractor.apply_filters(data, query_context['filters'])
+        return {'query': query, 'response_context': handler.prepare_response_context(query_context, scoped_data)}
+
+    # Consecutive in-domain corpus questions of the same language form a conversation
+    turns = {'en': [], 'ar': []}
+    for entry in load_corpus(args.corpus):
+        if not entry['out_of_domain']:
+            turns[entry['language']].append(turn(entry['query']))
+    scenarios = {
+        'corpus': [
+            lang_turns[start:start + args.turns]
+            for lang_turns in turns.values()
+            for start in range(0, len(lang_turns), args.turns)
+        ],
+        'drill_down': [[turn(query) for query in conversation] for conversation in DRILL_DOWNS]
+    }
+
+    generator = ResponseGenerator()
+    builders = {
+        'legacy': legacy_messages(handler),
+        'prefix_stable': lambda query, response_context, history: generator.build_messages(
+            query, response_context, history)
+    }
+    report = {}
+    print(f"cache minimum {args.cache_min_tokens} tokens")
+    for scenario, conversations in scenarios.items():
+        report[scenario] = {name: replay(build, conversations, args.cache_min_tokens) for name, build in builders.items()}
+        print(f"\n== {scenario}: {len(conversations)} conversations ==")
+        for name, result in report[scenario].items():
+            print(f"{name:<14} prompt tokens {result['prompt_tokens']:>8,}  cached {result['cached_tokens']:>8,}  "
+                  f"hit ratio {result['cache_hit_ratio']:.1%}")
+
+    query_contexts = [item['response_context']['query_context'] for lang_turns in turns.values() for item in lang_turns]
+    rounds = 100
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for query_context in query_contexts:
+            legacy_system_prompt(handler, query_context)
+    legacy_seconds = time.perf_counter() - started
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for query_context in query_contexts:
+            handler.get_system_prompt(query_context)
+    builder_seconds = time.perf_counter() - started
+    report['system_prompt_us'] = {
+        'legacy': legacy_seconds / (rounds * len(query_contexts)) * 1e6,
+        'memoized': builder_seconds / (rounds * len(query_contexts)) * 1e6
+    }
+    print(f"\nsystem prompt: {report['system_prompt_us']['legacy']:.1f} us rendered, "
+          f"{report['system_prompt_us']['memoized']:.1f} us memoized")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+    # Fail if the prefix-stable order caches less of the follow-up questions than the previous one
+    drill_down = report['drill_down']
+    return 1 if drill_down['prefix_stable']['cached_tokens'] < drill_down['legacy']['cached_tokens'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,165 @@
+"""
+Micro-benchmark for query routing in the e-invoice chatbot.
+This module compares the single-pass KeywordMatcher against the original
+per-list substring scans on a batch of bilingual queries, and checks that
+both produce the same language, tables, domains and visualization type.
+Out-of-domain verdicts come from the domain gate now and are evaluated by
+benchmarks.eval_domain_gate instead.
+
+Example:
+    python -m benchmarks.bench_routing --queries 20000
+"""
+
+import argparse
+import json
+import re
+import sys
+import time
+from typing import Dict, List, Optional
+
+from benchmarks.bench_pipeline import DEFAULT_QUESTIONS
+from benchmarks.eval_domain_gate import LEGACY_TOPICS
+from data_router import DataRouter
+from keyword_matcher import KeywordMatcher
+from response_handler import ResponseHandler
+
+EXTRA_QUESTIONS = [
+    "Show me all invoices with VAT issues",
+    "What items have the highest price?",
+    "List taxpayers with compliance issues",
+    "Show me the audit log for invoice #12345",
+    "What's the revenue distribution across emirates?",
+    "How many fraudulent transactions were detected last month?",
+    "Which sellers have the largest invoice tax amount?",
+    "Break down the line total by hs code",
+    "What's the weather like in Dubai today?",
+    "Recommend a good restaurant near my hotel",
+    "أظهر لي جميع الفواتير التي بها مشاكل في ضريبة القيمة المضافة",
+    "ما هي العناصر ذات السعر الأعلى؟",
+    "قائمة دافعي الضرائب الذين لديهم مشاكل في الامتثال",
+    "أظهر لي سجل التدقيق للفاتورة رقم 12345",
+    "كم عدد المعاملات الاحتيالية التي تم اكتشافها الشهر الماضي؟",
+    "ما هي أفضل المطاعم في دبي؟",
+    "ما هو الطقس اليوم في أبو ظبي؟"
+]
+
+
+def legacy_analyze(router: DataRouter, handler: ResponseHandler, query: str) -> Dict:
+    """Route a query with the original scans: one substring check per keyword, regex rebuilt per call."""
+    def detect_language(text: str) -> str:
+        arabic_pattern = re.compile(r'[\u0600-\u06FF\u0750-\u077F\u08A0-\u08FF]+')
+        return 'ar' if arabic_pattern.search(text) else 'en'
+
+    def relevant_domains(text: str) -> List[str]:
+        lang = detect_language(text)
+        text_lower = text.lower()
+        domains = [domain for domain, keywords in router.domain_keywords.items()
+                   if any(keyword in text_lower for keyword in keywords[lang])]
+        return domains or list(router.domain_keywords.keys())
+
+    lang = detect_language(query)
+    query_lower = query.lower()
+    route_lang = detect_language(query)
+    tables = [table for table, keywords in router.table_keywords.items()
+              if any(keyword in query_lower for keyword in keywords[route_lang])]
+    if not tables:
+        for table, fields in router.table_fields.items():
+            field_pattern = '|'.join([re.escape(field.replace('_', ' ')) for field in fields])
+            if re.search(field_pattern, query_lower):
+                tables.append(table)
+    tables = tables or ['invoices']
+    domains = relevant_domains(query)
+
+    out_of_domain = any(topic in query_lower for topic in LEGACY_TOPICS)
+    viz_type = None
+    if not out_of_domain:
+        for candidate, keywords in handler.visualization_suggestions.items():
+            if any(keyword in query_lower for keyword in keywords[lang]):
+                viz_type = candidate
+                break
+    return {'language': lang, 'tables': tables, 'domains': domains,
+            'out_of_domain': out_of_domain, 'visualization_type': viz_type}
+
+
+def matcher_analyze(router: DataRouter, handler: ResponseHandler, query: str) -> Dict:
+    """Route a query with one KeywordMatcher scan shared by the router and the response handler."""
+    query_context = router.get_query_context(query)
+    out_of_domain = handler.is_out_of_domain(query, query_context)
+    viz_type = None
+    if not out_of_domain:
+        viz_types = query_context['keyword_matches']['visualizations']
+        viz_type = viz_types[0] if viz_types else None
+    return {'language': query_context['language'], 'tables': list(query_context['relevant_tables']),
+            'domains': list(query_context['relevant_domains']), 'out_of_domain': out_of_domain,
+            'visualization_type': viz_type}
+
+
+def time_batch(analyze, router: DataRouter, handler: ResponseHandler, queries: List[str], rounds: int) -> float:
+    """Best-of-rounds wall time in seconds for analyzing the whole batch."""
+    best = float('inf')
+    for _ in range(rounds):
+        started = time.perf_counter()
+        for query in queries:
+            analyze(router, handler, query)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark single-pass keyword routing against the original scans")
+    parser.add_argument('--queries', type=int, default=10000, help="Number of queries in the batch")
+    parser.add_argument('--rounds', type=int, default=5, help="Timing rounds (best is reported)")
+    parser.add_argument('--questions', help="Text file with one question per line (defaults to built-in bilingual set)")
+    parser.add_argument('--output', help="Write the results as JSON to this file")
+    args = parser.parse_args(argv)
+
+    if args.questions:
+        with open(args.questions, encoding='utf-8') as f:
+            base_questions = [line.strip() for line in f if line.strip()]
+    else:
+        base_questions = DEFAULT_QUESTIONS + EXTRA_QUESTIONS
+    queries = (base_questions * (args.queries // len(base_questions) + 1))[:args.queries]
+
+    # Lowercase-only matching has the same semantics as the original scans
+    router = DataRouter(KeywordMatcher(normalizer=str.lower))
+    handler = ResponseHandler(router.matcher)
+    normalized_router = DataRouter()
+    normalized_handler = ResponseHandler(normalized_router.matcher)
+
+    def routing(result: Dict) -> Dict:
+        return {key: value for key, value in result.items() if key != 'out_of_domain'}
+
+    mismatches = [query for query in base_questions
+                  if routing(legacy_analyze(router, handler, query)) != routing(matcher_analyze(router, handler, query))]
+    for query in mismatches:
+        print(f"MISMATCH: {query}\n  legacy:  {legacy_analyze(router, handler, query)}\n"
+              f"  matcher: {matcher_analyze(router, handler, query)}", file=sys.stderr)
+
+    # Build the matcher before timing
+    router.matcher.match('')
+    normalized_router.matcher.match('')
+    legacy_time = time_batch(legacy_analyze, router, handler, queries, args.rounds)
+    matcher_time = time_batch(matcher_analyze, router, handler, queries, args.rounds)
+    normalized_time = time_batch(matcher_analyze, normalized_router, normalized_handler, queries, args.rounds)
+
+    results = {
+        'queries': len(queries),
+        'legacy_us_per_query': legacy_time / len(queries) * 1e6,
+        'matcher_us_per_query': matcher_time / len(queries) * 1e6,
+        'normalized_matcher_us_per_query': normalized_time / len(queries) * 1e6,
+        'speedup': legacy_time / matcher_time,
+        'mismatches': len(mismatches)
+    }
+    print(f"{len(queries)} queries: legacy {results['legacy_us_per_query']:.1f} us/query, "
+          f"matcher {results['matcher_us_per_query']:.1f} us/query "
+          f"({results['normalized_matcher_us_per_query']:.1f} with Arabic normalization), "
+          f"speedup {results['speedup']:.2f}x, {len(mismatches)} mismatches")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,281 @@
+"""
+Scale micro-benchmarks for the e-invoice chatbot.
+This module times query routing on the labeled bilingual corpus
+(DataRouter.route_query, and get_query_context with and without its memo),
+ResponseHandler.prepare_response_context and every
+VisualizationGenerator.create_*_chart on a synthetic invoices table of
+1e3 to 1e7 rows, and stores the results as JSON. Given the JSON of an
+earlier run, it flags every benchmark that got slower than the tolerance.
+It runs offline, on a plain CPU (1e7 rows need about 2.5 GB of RAM).
+
+Example:
+    python -m benchmarks.bench_scale --output scale.json
+    python -m benchmarks.bench_scale --rows 1000 100000 --baseline scale.json --tolerance 0.25
+"""
+
+import argparse
+import json
+import platform
+import resource
+import sys
+import time
+from statistics import median
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.eval_routing import DEFAULT_CORPUS, load_corpus
+from data_loader import generate_synthetic_data, sort_by_time
+from data_router import DataRouter
+from response_handler import ResponseHandler
+from visualization_generator import VisualizationGenerator
+
+DEFAULT_ROWS = [1000, 100000, 1000000, 10000000]
+
+# Chart builders timed at every scale
+CHARTS = ['time_series', 'comparison', 'distribution', 'geographic']
+
+EMIRATES = ['Dubai', 'Abu Dhabi', 'Sharjah', 'Ajman', 'Fujairah', 'Ras Al Khaimah', 'Umm Al Quwain']
+
+
+def build_invoices(rows: int, seed: int = 0, text_dtype: str = 'object') -> pd.DataFrame:
+    """
+    Generate an invoices table with the synthetic table's columns at any size.
+
+    Categorical text columns draw from small pools (as in the real exports),
+    names from a pool of 5000 companies and 1000 vendors, and invoice numbers
+    are unique. The table is sorted by invoice date, like loaded tables.
+
+    Args:
+        rows: Number of invoices
+        seed: Random seed, so runs compare like with like
+        text_dtype: Dtype of the text columns ('object', or 'string[pyarrow]'
+            as for tables shared between workers)
+
+    Returns:
+        The invoices table
+    """
+    rng = np.random.default_rng(seed)
+
+    def pool(values: List, p: Optional[List[float]] = None) -> np.ndarray:
+        return np.array(values, dtype=object)[rng.choice(len(values), rows, p=p)]
+
+    companies = [f'Company {i}' for i in range(1, 5001)]
+    vendors = [f'Vendor {i}' for i in range(1, 1001)]
+    buyer = rng.integers(0, len(companies), rows)
+    seller = rng.integers(0, len(vendors), rows)
+    start = np.datetime64('2024-01-01T00:00:00', 's').astype('int64')
+    seconds = np.sort(rng.integers(start, start + 2 * 365 * 86400, rows))
+    invoices = pd.DataFrame({
+        'invoice_number': np.array([f'INV{i:08d}' for i in range(1, rows + 1)], dtype=object),
+        'invoice_datetime': seconds.astype('datetime64[s]').astype('datetime64[ns]'),
+        'buyer_emirate': pool(EMIRATES),
+        'seller_emirate': pool(EMIRATES),
+        'invoice_tax_amount': rng.uniform(50, 500, rows),
+        'invoice_without_tax': rng.uniform(1000, 10000, rows),
+        'invoice_type': pool(['Standard', 'Credit Note', 'Debit Note']),
+        'invoice_category': pool(['Goods', 'Services', 'Mixed']),
+        'invoice_sales_type': pool(['B2B', 'B2C', 'B2G']),
+        'document_status': pool(['Issued', 'Paid', 'Cancelled']),
+        'buyer_name': np.array(companies, dtype=object)[buyer],
+        'buyer_trn': np.array([f'TRN{i:06d}' for i in range(1, len(companies) + 1)], dtype=object)[buyer],
+        'seller_name': np.array(vendors, dtype=object)[seller],
+        'seller_trn': np.array([f'TRN{i:06d}' for i in range(1, len(vendors) + 1)], dtype=object)[seller],
+        'vat_rate': pool([5.0, 0.0], p=[0.95, 0.05]).astype(float),
+        'vat_category': pool(['Standard', 'Zero Rated', 'Exempt'], p=[0.95, 0.03, 0.02]),
+        'is_anomaly': rng.choice([0, 1], rows, p=[0.9, 0.1]),
+        'anomaly_type': pool([None, 'Duplicate', 'Round Amount', 'Just Under Limit', 'Foreign Bank'],
+                             p=[0.9, 0.025, 0.025, 0.025, 0.025]),
+        'anomaly_risk_score': rng.uniform(0, 1, rows)
+    }, copy=False)  # one block per column: consolidating the text columns would copy them at peak
+    if text_dtype != 'object':
+        invoices = invoices.astype({name: text_dtype for name, dtype in invoices.dtypes.items() if dtype == object})
+    invoices = sort_by_time({'invoices': invoices})['invoices']
+    invoices.attrs['data_version'] = f"bench_scale:{rows}:{seed}:{text_dtype}"
+    return invoices
+
+
+def time_call(function: Callable[[], object], min_time: float, max_runs: int) -> Dict[str, float]:
+    """
+    Time a call repeatedly until min_time seconds have passed or max_runs calls were made.
+
+    The first call is timed separately (it pays for imports and lazy
+    initialization) and not counted in the median.
+
+    Returns:
+        Dictionary with first, min and median seconds and the number of runs
+    """
+    started = time.perf_counter()
+    function()
+    first = time.perf_counter() - started
+    samples = []
+    spent = 0.0
+    while len(samples) < max_runs and (spent < min_time or not samples):
+        started = time.perf_counter()
+        function()
+        samples.append(time.perf_counter() - started)
+        spent += samples[-1]
+    return {'first': first, 'min': min(samples), 'median': median(samples), 'runs': len(samples)}
+
+
+def per_query(result: Dict[str, float], queries: int) -> Dict[str, float]:
+    """Divide the timings of a whole-corpus pass by the number of queries."""
+    return dict({key: value / queries for key, value in result.items() if key != 'runs'}, runs=result['runs'])
+
+
+def bench_routing(corpus: List[Dict], min_time: float, max_runs: int) -> Dict[str, Dict]:
+    """Time routing per query over the corpus: uncached, through a cold memo and through a warm memo."""
+    queries = [entry['query'] for entry in corpus]
+    router = DataRouter()
+    router.matcher.match('')
+
+    def route_all():
+        for query in queries:
+            router.route_query(query)
+
+    def context_cold():
+        router.context_memo.clear()
+        for query in queries:
+            router.get_query_context(query)
+
+    def context_warm():
+        for query in queries:
+            router.get_query_context(query)
+
+    return {
+        'route_query': per_query(time_call(route_all, min_time, max_runs), len(queries)),
+        'get_query_context.cold': per_query(time_call(context_cold, min_time, max_runs), len(queries)),
+        'get_query_context.warm': per_query(time_call(context_warm, min_time, max_runs), len(queries))
+    }
+
+
+def bench_scale(rows: int, corpus: List[Dict], min_time: float, max_runs: int, text_dtype: str) -> Dict[str, Dict]:
+    """Time response context building and every chart on an invoices table of the given size."""
+    data = generate_synthetic_data()
+    build_started = time.perf_counter()
+    data['invoices'] = build_invoices(rows, text_dtype=text_dtype)
+    build_seconds = time.perf_counter() - build_started
+
+    router = DataRouter()
+    handler = ResponseHandler(router.matcher)
+    # In-domain corpus queries routed to the invoices table, in both languages
+    contexts = [router.get_query_context(entry['query']) for entry in corpus
+                if not entry['out_of_domain'] and 'invoices' in entry['tables']]
+
+    def prepare_cold():
+        handler.context_memo.clear()
+        for query_context in contexts:
+            handler.prepare_response_context(query_context, data)
+
+    def prepare_warm():
+        for query_context in contexts:
+            handler.prepare_response_context(query_context, data)
+
+    results = {
+        'prepare_response_context.cold': per_query(time_call(prepare_cold, min_time, max_runs), len(contexts)),
+        'prepare_response_context.warm': per_query(time_call(prepare_warm, min_time, max_runs), len(contexts))
+    }
+
+    generator = VisualizationGenerator()
+    for language in ('en', 'ar'):
+        query_context = {'language': language}
+        for chart in CHARTS:
+            create_chart = getattr(generator, f'create_{chart}_chart')
+            try:
+                result = time_call(lambda: create_chart(data['invoices'], query_context), min_time, max_runs)
+            except Exception as e:
+                # Reported, not fatal: one broken chart should not hide the others' numbers
+                result = {'error': f"{type(e).__name__}: {e}"}
+            results[f'create_{chart}_chart.{language}'] = result
+
+    # Deep memory usage counts a pooled string once per row; peak RSS is what the box needs
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"{rows} rows: table built in {build_seconds:.1f} s, peak RSS so far {peak_mb:.0f} MB", file=sys.stderr)
+    return results
+
+
+def format_seconds(seconds: float) -> str:
+    """Format a duration with a readable unit."""
+    if seconds < 1e-3:
+        return f"{seconds * 1e6:.1f} us"
+    if seconds < 1:
+        return f"{seconds * 1e3:.2f} ms"
+    return f"{seconds:.2f} s"
+
+
+def compare(results: Dict[str, Dict], baseline: Dict[str, Dict], tolerance: float,
+            min_delta: float) -> List[str]:
+    """
+    List the benchmarks whose median got slower than the baseline's by more than the tolerance.
+
+    Args:
+        results: Benchmark name to timings of this run
+        baseline: Benchmark name to timings of the earlier run
+        tolerance: Allowed slowdown (0.2 = 20%)
+        min_delta: Slowdowns below this many seconds are ignored as noise
+
+    Returns:
+        One line per regression (benchmarks missing from either run are skipped)
+    """
+    regressions = []
+    for name, result in results.items():
+        previous = baseline.get(name)
+        if not previous or 'median' not in previous or 'median' not in result:
+            continue
+        delta = result['median'] - previous['median']
+        if result['median'] > previous['median'] * (1 + tolerance) and delta > min_delta:
+            regressions.append(f"{name}: {format_seconds(previous['median'])} -> "
+                               f"{format_seconds(result['median'])} ({result['median'] / previous['median']:.2f}x)")
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Time routing, context building and charts at several data scales")
+    parser.add_argument('--rows', type=int, nargs='+', default=DEFAULT_ROWS, help="Invoice table sizes to measure")
+    parser.add_argument('--corpus', default=DEFAULT_CORPUS, help="Labeled bilingual query corpus (JSON lines)")
+    parser.add_argument('--min-time', type=float, default=0.5, help="Seconds to spend timing each benchmark")
+    parser.add_argument('--max-runs', type=int, default=50, help="Most timed runs per benchmark")
+    parser.add_argument('--text-dtype', default='object', choices=['object', 'string[pyarrow]'],
+                        help="Dtype of the text columns (string[pyarrow] as with CHATBOT_SHARED_DATA)")
+    parser.add_argument('--output', help="Write the results as JSON to this file")
+    parser.add_argument('--baseline', help="Results JSON of an earlier run to compare with")
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help="Allowed slowdown against the baseline (0.2 = 20%%)")
+    parser.add_argument('--min-delta-ms', type=float, default=0.05,
+                        help="Ignore slowdowns smaller than this many milliseconds")
+    args = parser.parse_args(argv)
+
+    corpus = load_corpus(args.corpus)
+    results = bench_routing(corpus, args.min_time, args.max_runs)
+    for rows in args.rows:
+        for name, result in bench_scale(rows, corpus, args.min_time, args.max_runs, args.text_dtype).items():
+            results[f'{name}@{rows}'] = result
+
+    print(f"{'benchmark':<44} {'median':>10} {'min':>10} {'first':>10} {'runs':>5}")
+    for name, result in results.items():
+        if 'error' in result:
+            print(f"{name:<44} {result['error'][:60]}")
+            continue
+        print(f"{name:<44} {format_seconds(result['median']):>10} {format_seconds(result['min']):>10} "
+              f"{format_seconds(result['first']):>10} {result['runs']:>5}")
+
+    if args.output:
+        import plotly
+        environment = {'python': platform.python_version(), 'machine': platform.machine(),
+                       'processor': platform.processor(), 'pandas': pd.__version__, 'numpy': np.__version__,
+                       'plotly': plotly.__version__, 'text_dtype': args.text_dtype, 'rows': args.rows}
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'environment': environment, 'results': results}, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = compare(results, json.load(f)['results'], args.tolerance, args.min_delta_ms / 1000)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,156 @@
+"""
+Shared data benchmark for the e-invoice chatbot.
+This module exports a scaled copy of the synthetic tables as CSV files, starts
+N worker processes that each load them (once with a private copy per process,
+once attached to tables shared through CHATBOT_SHARED_DATA) and reports the
+memory of the workers: resident (RSS) and proportional (PSS, where pages
+shared by k processes count 1/k to each, so the sum is the node's RAM).
+It runs offline, on Linux.
+
+Example:
+    python -m benchmarks.bench_shared_data --rows 500000 --workers 1 2 4 8
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def export_tables(directory: str, rows: int):
+    """Write the synthetic tables, tiled to about `rows` invoices, as the loader's CSV files."""
+    import pandas as pd
+    from data_loader import TABLE_FILES, generate_synthetic_data
+
+    data = generate_synthetic_data()
+    repeat = max(1, rows // len(data['invoices']))
+    for table_name, table in data.items():
+        tiled = pd.concat([table] * repeat, ignore_index=True)
+        tiled.to_csv(os.path.join(directory, TABLE_FILES[table_name]), index=False)
+
+
+def memory_kb() -> Dict[str, int]:
+    """Read this process's RSS and PSS in kB from /proc/self/smaps_rollup."""
+    fields = {}
+    with open('/proc/self/smaps_rollup', encoding='utf-8') as f:
+        for line in f:
+            parts = line.split()
+            if parts[0] in ('Rss:', 'Pss:'):
+                fields[parts[0][:-1].lower()] = int(parts[1])
+    return fields
+
+
+def child(data_dir: str, shared_dir: str, hold: float):
+    """Load the tables, report memory once all workers are loaded and exit."""
+    import data_loader
+    # Imported before the baseline, so library pages are not counted as data
+    import pyarrow
+
+    baseline = memory_kb()
+    started = time.perf_counter()
+    data = data_loader.load_data(data_dir, shared_dir)
+    load_seconds = time.perf_counter() - started
+    # Touch every column, as answering questions would
+    rows = sum(len(table) for table in data.values())
+    for table in data.values():
+        for name in table.columns:
+            # Column by column: selecting several columns at once would copy them
+            if table[name].dtype.kind in 'iufbM':
+                table[name].min()
+    print(json.dumps({'ready': True}), flush=True)
+    # Wait until every worker has loaded, so PSS splits the shared pages between all of them
+    sys.stdin.readline()
+    print(json.dumps({'load_seconds': load_seconds, 'rows': rows, 'baseline': baseline, 'loaded': memory_kb()}),
+          flush=True)
+    time.sleep(hold)
+
+
+def run_workers(workers: int, data_dir: str, shared_dir: str) -> Dict:
+    """Start the workers, let them all load, then collect their memory."""
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.environ.get('PYTHONPATH')])))
+    processes = [
+        subprocess.Popen([sys.executable, '-m', 'benchmarks.bench_shared_data', '--child',
+                          '--data-dir', data_dir, '--shared-dir', shared_dir],
+                         stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True, env=env, cwd=ROOT)
+        for _ in range(workers)
+    ]
+    for process in processes:
+        if not json.loads(process.stdout.readline()).get('ready'):
+            raise RuntimeError("A worker failed to load the data")
+    results = []
+    for process in processes:
+        process.stdin.write('\n')
+        process.stdin.flush()
+        results.append(json.loads(process.stdout.readline()))
+    for process in processes:
+        process.kill()
+        process.wait()
+
+    # Data memory of a worker: what it holds beyond a bare interpreter with the libraries loaded
+    return {
+        'workers': workers,
+        'load_seconds': max(result['load_seconds'] for result in results),
+        'rss_mb': sum(result['loaded']['rss'] for result in results) / 1024,
+        'pss_mb': sum(result['loaded']['pss'] for result in results) / 1024,
+        'data_pss_mb': sum(result['loaded']['pss'] - result['baseline']['pss'] for result in results) / 1024
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Compare worker memory with private and shared data tables")
+    parser.add_argument('--rows', type=int, default=200000, help="Invoices in the exported tables")
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4], help="Worker counts to measure")
+    parser.add_argument('--output', help="Write the results as JSON to this file")
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--data-dir', help=argparse.SUPPRESS)
+    parser.add_argument('--shared-dir', default='', help=argparse.SUPPRESS)
+    parser.add_argument('--hold', type=float, default=60.0, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        child(args.data_dir, args.shared_dir, args.hold)
+        return 0
+
+    scratch = tempfile.mkdtemp(prefix='chatbot-bench-')
+    shm = '/dev/shm' if os.path.isdir('/dev/shm') else scratch
+    shared_dir = tempfile.mkdtemp(prefix='chatbot-shared-', dir=shm)
+    try:
+        data_dir = os.path.join(scratch, 'output')
+        os.makedirs(data_dir)
+        export_tables(data_dir, args.rows)
+        csv_mb = sum(os.path.getsize(os.path.join(data_dir, name)) for name in os.listdir(data_dir)) / 2 ** 20
+        print(f"{args.rows} invoices ({csv_mb:.0f} MB of CSV)")
+
+        results = []
+        # Publish once up front, so the shared runs measure attaching
+        run_workers(1, data_dir, shared_dir)
+        snapshot_mb = sum(os.path.getsize(os.path.join(path, name))
+                          for path, _, names in os.walk(shared_dir) for name in names) / 2 ** 20
+        print(f"shared snapshot {snapshot_mb:.0f} MB")
+        print(f"{'mode':<8} {'workers':>7} {'load s':>8} {'RSS MB':>9} {'PSS MB':>9} {'data PSS MB':>12}")
+        for mode, directory in (('private', ''), ('shared', shared_dir)):
+            for workers in args.workers:
+                result = dict(run_workers(workers, data_dir, directory), mode=mode)
+                results.append(result)
+                print(f"{mode:<8} {workers:>7} {result['load_seconds']:>8.2f} {result['rss_mb']:>9.0f} "
+                      f"{result['pss_mb']:>9.0f} {result['data_pss_mb']:>12.0f}")
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+        shutil.rmtree(shared_dir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'rows': args.rows, 'csv_mb': csv_mb, 'snapshot_mb': snapshot_mb, 'results': results},
+                      f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,167 @@
+"""
+Startup benchmark for the e-invoice chatbot.
+This module starts fresh Python processes that render app.py once through
+Streamlit's AppTest, with `-X importtime`, and reports the import time per
+top-level package, the time to the first rendered page and the time of a
+rerun. It runs offline.
+
+Example:
+    python -m benchmarks.bench_startup --runs 5 --output startup.json
+    python -m benchmarks.bench_startup --baseline startup.json --tolerance 0.2
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from statistics import median
+from typing import Dict, List, Optional
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app.py')
+
+# Packages reported individually; the chatbot's own modules are summed under
+# 'chatbot' and everything else under 'other'
+TRACKED_PACKAGES = ['streamlit', 'pandas', 'numpy', 'pyarrow', 'plotly', 'openai', 'requests', 'scipy', 'sklearn']
+CHATBOT_MODULES = {name[:-3] for name in os.listdir(os.path.dirname(APP_PATH)) if name.endswith('.py')}
+
+
+def parse_importtime(stderr: str) -> Dict[str, float]:
+    """
+    Sum `-X importtime` output per top-level package.
+
+    Each module's own (self) time is counted for its package, so a package
+    imported by another one is still reported under its own name.
+
+    Args:
+        stderr: Standard error of a process run with -X importtime
+
+    Returns:
+        Dictionary of package name to import seconds
+    """
+    packages = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or line.count('|') != 2:
+            continue
+        own, _, name = line[len('import time:'):].split('|')
+        if not own.strip().isdigit():
+            # Header line
+            continue
+        package = name.strip().split('.')[0]
+        packages[package] = packages.get(package, 0.0) + int(own) / 1e6
+    return packages
+
+
+def child(timeout: float):
+    """Render the app once and rerun it, printing the timings as JSON."""
+    started = time.perf_counter()
+    from streamlit.testing.v1 import AppTest
+
+    app_test = AppTest.from_file(APP_PATH, default_timeout=timeout)
+    render_started = time.perf_counter()
+    app_test.run()
+    first_render = time.perf_counter()
+    if app_test.exception:
+        raise RuntimeError(app_test.exception[0].message)
+    app_test.run()
+    rerun = time.perf_counter()
+    print(json.dumps({
+        'finished_at': time.time(),
+        'harness_import': render_started - started,
+        'first_render': first_render - render_started,
+        'rerun': rerun - first_render
+    }))
+
+
+def measure(timeout: float) -> Dict:
+    """
+    Start one process, render the app and collect its timings.
+
+    Returns:
+        Dictionary with time_to_first_render (from process start), first_render
+        (the first script run), rerun and import seconds per package
+    """
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [os.path.dirname(APP_PATH),
+                                                                      os.environ.get('PYTHONPATH')])))
+    spawned = time.time()
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-m', 'benchmarks.bench_startup', '--child', '--timeout', str(timeout)],
+        capture_output=True, text=True, env=env, cwd=os.path.dirname(APP_PATH)
+    )
+    if process.returncode != 0:
+        raise RuntimeError(process.stderr[-2000:])
+    result = json.loads(process.stdout.strip().splitlines()[-1])
+    packages = parse_importtime(process.stderr)
+    imports = {package: packages.get(package, 0.0) for package in TRACKED_PACKAGES}
+    imports['chatbot'] = sum(seconds for package, seconds in packages.items() if package in CHATBOT_MODULES)
+    imports['other'] = sum(seconds for package, seconds in packages.items()
+                           if package not in TRACKED_PACKAGES and package not in CHATBOT_MODULES)
+    return {
+        'time_to_first_render': result['finished_at'] - spawned - result['rerun'],
+        'first_render': result['first_render'],
+        'rerun': result['rerun'],
+        'import_total': sum(packages.values()),
+        'imports': imports
+    }
+
+
+def summarize(runs: List[Dict]) -> Dict:
+    """Take the median of every number over the runs."""
+    summary = {key: float(median([run[key] for run in runs]))
+               for key in ('time_to_first_render', 'first_render', 'rerun', 'import_total')}
+    summary['imports'] = {package: float(median([run['imports'][package] for run in runs]))
+                          for package in runs[0]['imports']}
+    summary['runs'] = len(runs)
+    return summary
+
+
+def compare(summary: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """List the tracked numbers that got slower than the baseline by more than the tolerance."""
+    regressions = []
+    for key in ('time_to_first_render', 'import_total'):
+        if summary[key] > baseline[key] * (1 + tolerance):
+            regressions.append(f"{key}: {baseline[key] * 1000:.0f} ms -> {summary[key] * 1000:.0f} ms")
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Measure import time and time to first render of the app")
+    parser.add_argument('--runs', type=int, default=3, help="Fresh processes to start")
+    parser.add_argument('--timeout', type=float, default=120.0, help="AppTest script timeout in seconds")
+    parser.add_argument('--output', help="Write the results as JSON to this file")
+    parser.add_argument('--baseline', help="Results JSON of an earlier run to compare with")
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help="Allowed slowdown against the baseline (0.2 = 20%%)")
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        child(args.timeout)
+        return 0
+
+    runs = [measure(args.timeout) for _ in range(args.runs)]
+    summary = summarize(runs)
+    print(f"{summary['runs']} runs (medians)")
+    print(f"time to first render {summary['time_to_first_render'] * 1000:8.0f} ms  (from process start)")
+    print(f"first script run     {summary['first_render'] * 1000:8.0f} ms")
+    print(f"rerun                {summary['rerun'] * 1000:8.0f} ms")
+    print(f"imports              {summary['import_total'] * 1000:8.0f} ms")
+    for package, seconds in sorted(summary['imports'].items(), key=lambda item: -item[1]):
+        print(f"  {package:<18} {seconds * 1000:8.0f} ms")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = compare(summary, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
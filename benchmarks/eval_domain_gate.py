@@ -0,0 +1,142 @@
+"""
+Out-of-domain gate evaluation for the e-invoice chatbot.
+This module runs the local domain gate and the previous substring topic
+check over labeled bilingual queries and reports the precision and recall
+of blocking out-of-domain questions, the share of uncertain verdicts (which
+still go to the API) and the gate's latency with and without its cache.
+
+Example:
+    python -m benchmarks.eval_domain_gate
+    python -m benchmarks.eval_domain_gate --corpus corpus/domain_gate_corpus.jsonl --output gate_eval.json
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from typing import Callable, Dict, List, Optional
+
+from benchmarks.eval_routing import DEFAULT_CORPUS, load_corpus
+from data_router import DataRouter
+from domain_gate import DomainGate
+
+GATE_CORPUS = os.path.join(os.path.dirname(DEFAULT_CORPUS), 'domain_gate_corpus.jsonl')
+
+# The topic list ResponseHandler substring-matched before the gate
+LEGACY_TOPICS = [
+    'weather', 'sports', 'entertainment', 'movies', 'music', 'recipes', 'cooking', 'travel', 'vacation',
+    'hotel', 'flight', 'restaurant', 'politics', 'election', 'news', 'celebrity', 'game', 'gaming',
+    'طقس', 'رياضة', 'ترفيه', 'أفلام', 'موسيقى', 'وصفات', 'طبخ', 'سفر', 'عطلة', 'فندق', 'رحلة', 'مطعم',
+    'سياسة', 'انتخابات', 'أخبار', 'مشاهير', 'لعبة', 'ألعاب'
+]
+
+
+def legacy_verdict(query: str) -> str:
+    """The previous check: any topic as a substring of the lowercased query."""
+    query_lower = query.lower()
+    return 'out_of_domain' if any(topic in query_lower for topic in LEGACY_TOPICS) else 'in_domain'
+
+
+def gate_verdict(router: DataRouter, gate: DomainGate) -> Callable[[str], str]:
+    """Wrap the domain gate, fed with the router's keyword matches and filters."""
+    def verdict(query: str) -> str:
+        query_context = router.get_query_context(query)
+        return gate.check(query, query_context['keyword_matches'], query_context['filters'])['verdict']
+    return verdict
+
+
+def score(verdict: Callable[[str], str], entries: List[Dict]) -> Dict:
+    """
+    Score blocking decisions: a query is blocked when its verdict is out of domain.
+
+    Args:
+        verdict: Function from query to verdict
+        entries: Labeled queries with 'out_of_domain'
+
+    Returns:
+        Dictionary with precision, recall and F1 of blocking, the uncertain
+        share and the misclassified queries
+    """
+    blocked_correct = blocked = expected = uncertain = 0
+    errors = []
+    for entry in entries:
+        result = verdict(entry['query'])
+        is_blocked = result == 'out_of_domain'
+        blocked += is_blocked
+        expected += entry['out_of_domain']
+        blocked_correct += is_blocked and entry['out_of_domain']
+        uncertain += result == 'uncertain'
+        if is_blocked != entry['out_of_domain']:
+            errors.append({'query': entry['query'], 'expected_out_of_domain': entry['out_of_domain'],
+                           'verdict': result})
+    precision = blocked_correct / blocked if blocked else 1.0
+    recall = blocked_correct / expected if expected else 1.0
+    return {
+        'queries': len(entries),
+        'precision': precision,
+        'recall': recall,
+        'f1': 2 * precision * recall / (precision + recall) if precision + recall else 0.0,
+        'uncertain_share': uncertain / len(entries) if entries else 0.0,
+        'errors': errors
+    }
+
+
+def measure_latency(router: DataRouter, queries: List[str], rounds: int = 5) -> Dict[str, float]:
+    """Best-of-rounds gate latency in microseconds per query, on fresh and on warm caches."""
+    contexts = [router.get_query_context(query) for query in queries]
+    cold = warm = float('inf')
+    for _ in range(rounds):
+        gate = DomainGate()
+        started = time.perf_counter()
+        for query, query_context in zip(queries, contexts):
+            gate.check(query, query_context['keyword_matches'], query_context['filters'])
+        cold = min(cold, time.perf_counter() - started)
+        started = time.perf_counter()
+        for query, query_context in zip(queries, contexts):
+            gate.check(query, query_context['keyword_matches'], query_context['filters'])
+        warm = min(warm, time.perf_counter() - started)
+    return {'cold_us': cold / len(queries) * 1e6, 'cached_us': warm / len(queries) * 1e6}
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Evaluate the local out-of-domain gate on labeled queries")
+    parser.add_argument('--corpus', action='append',
+                        help="Labeled JSONL corpus (repeatable; defaults to the routing and gate corpora)")
+    parser.add_argument('--output', help="Write the results as JSON to this file")
+    parser.add_argument('--show-errors', action='store_true', help="Print the misclassified queries")
+    args = parser.parse_args(argv)
+
+    corpus = [entry for path in (args.corpus or [DEFAULT_CORPUS, GATE_CORPUS]) for entry in load_corpus(path)]
+    router = DataRouter()
+    configurations = {'substring topics': legacy_verdict, 'domain gate': gate_verdict(router, DomainGate())}
+
+    report = {}
+    print(f"{'check':<17} {'lang':<5} {'queries':>7} {'precision':>9} {'recall':>7} {'f1':>6} {'uncertain':>9}")
+    for name, verdict in configurations.items():
+        report[name] = {}
+        for lang in ['en', 'ar', 'all']:
+            entries = [entry for entry in corpus if lang == 'all' or entry['language'] == lang]
+            result = score(verdict, entries)
+            report[name][lang] = result
+            print(f"{name:<17} {lang:<5} {result['queries']:>7} {result['precision']:>9.2f} {result['recall']:>7.2f} "
+                  f"{result['f1']:>6.2f} {result['uncertain_share']:>9.2f}")
+        if args.show_errors:
+            for error in report[name]['all']['errors']:
+                print(f"  {error['verdict']:<14} expected {'out' if error['expected_out_of_domain'] else 'in'}: "
+                      f"{error['query']}")
+
+    latency = measure_latency(router, [entry['query'] for entry in corpus])
+    report['latency'] = latency
+    print(f"gate latency: {latency['cold_us']:.1f} us/query, {latency['cached_us']:.1f} us/query cached")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+    # Fail if the gate blocks in-domain questions more often than the substring check
+    return 1 if report['domain gate']['all']['precision'] < report['substring topics']['all']['precision'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
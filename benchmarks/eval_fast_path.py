@@ -0,0 +1,97 @@
+"""
+Fast-path intent evaluation for the e-invoice chatbot.
+This module answers labeled bilingual queries through the deterministic fast
+path, as the pipeline does after routing, and reports the queries it answers
+with the wrong intent, answers although they need the LLM, or answers without
+the scope (entity, period or amount) they ask for.
+
+Example:
+    python -m benchmarks.eval_fast_path
+    python -m benchmarks.eval_fast_path --corpus corpus/fast_path_corpus.jsonl --output fast_path_eval.json
+"""
+
+import argparse
+import json
+import os
+import sys
+from typing import Dict, List, Optional
+
+from benchmarks.bench_scale import build_invoices
+from benchmarks.eval_routing import DEFAULT_CORPUS, load_corpus
+from data_loader import generate_synthetic_data
+from data_router import DataRouter
+from fast_path import FastPathEngine
+
+FAST_PATH_CORPUS = os.path.join(os.path.dirname(DEFAULT_CORPUS), 'fast_path_corpus.jsonl')
+
+
+def score(engine: FastPathEngine, router: DataRouter, entries: List[Dict], data_tables: Dict) -> Dict:
+    """
+    Score fast-path answers: each query must get its labeled intent (None to fall through).
+
+    Args:
+        engine: Fast-path engine
+        router: Router that builds each query's context
+        entries: Labeled queries with 'intent' and an optional 'scope' the answer must mention
+        data_tables: Dictionary of data tables to answer from
+
+    Returns:
+        Dictionary with the accuracy, the wrongly answered and wrongly declined
+        counts and the failing queries
+    """
+    false_answers = false_declines = 0
+    errors = []
+    for entry in entries:
+        response = engine.answer(entry['query'], router.get_query_context(entry['query']), data_tables)
+        intent = response['fast_path'] if response else None
+        unscoped = response is not None and entry.get('scope', '') not in response['response_text']
+        if intent != entry['intent'] or unscoped:
+            false_answers += intent is not None and entry['intent'] is None
+            false_declines += intent is None and entry['intent'] is not None
+            errors.append({'query': entry['query'], 'expected': entry['intent'], 'intent': intent,
+                           'response': response['response_text'] if response else None})
+    return {
+        'queries': len(entries),
+        'accuracy': 1 - len(errors) / len(entries) if entries else 1.0,
+        'false_answers': false_answers,
+        'false_declines': false_declines,
+        'errors': errors
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Evaluate fast-path intent matching on labeled queries")
+    parser.add_argument('--corpus', default=FAST_PATH_CORPUS, help="Labeled JSONL corpus")
+    parser.add_argument('--rows', type=int, default=10000,
+                        help="Invoices to answer from (seeded, so scoped answers are never empty by chance)")
+    parser.add_argument('--output', help="Write the results as JSON to this file")
+    args = parser.parse_args(argv)
+
+    corpus = load_corpus(args.corpus)
+    router = DataRouter()
+    engine = FastPathEngine(router)
+    data_tables = dict(generate_synthetic_data(), invoices=build_invoices(args.rows))
+
+    report = {}
+    print(f"{'lang':<5} {'queries':>7} {'accuracy':>8} {'false answers':>13} {'false declines':>14}")
+    for lang in ['en', 'ar', 'all']:
+        result = score(engine, router, [entry for entry in corpus if lang == 'all' or entry['language'] == lang],
+                       data_tables)
+        report[lang] = result
+        print(f"{lang:<5} {result['queries']:>7} {result['accuracy']:>8.2f} {result['false_answers']:>13} "
+              f"{result['false_declines']:>14}")
+    for error in report['all']['errors']:
+        print(f"  got {error['intent']}, expected {error['expected']}: {error['query']}")
+        if error['response']:
+            print(f"    {error['response'].splitlines()[0]}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+    # A wrong deterministic answer is worse than an LLM call, so every labeled query must pass
+    return 1 if report['all']['errors'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,75 @@
+"""
+Filter extraction evaluation for the e-invoice chatbot.
+This module extracts filters from labeled bilingual queries with the entity
+extractor and reports the queries whose identifiers, emirates, amount
+thresholds or periods differ from the labels, such as amounts read as years.
+
+Example:
+    python -m benchmarks.eval_filters
+    python -m benchmarks.eval_filters --corpus corpus/filter_corpus.jsonl --output filter_eval.json
+"""
+
+import argparse
+import json
+import os
+import sys
+from typing import Dict, List, Optional
+
+from benchmarks.eval_routing import DEFAULT_CORPUS, load_corpus
+from entity_extractor import EntityExtractor
+
+FILTER_CORPUS = os.path.join(os.path.dirname(DEFAULT_CORPUS), 'filter_corpus.jsonl')
+
+
+def score(extractor: EntityExtractor, entries: List[Dict]) -> Dict:
+    """
+    Score extracted filters against the labels.
+
+    Args:
+        extractor: Entity extractor
+        entries: Labeled queries with 'filters' as JSON (period edges as lists)
+
+    Returns:
+        Dictionary with the share of queries whose filters match exactly and
+        the failing queries
+    """
+    errors = []
+    for entry in entries:
+        # A JSON round trip turns the period edge tuples into lists, as in the labels
+        filters = json.loads(json.dumps(extractor.extract(entry['query'])))
+        if filters != entry['filters']:
+            errors.append({'query': entry['query'], 'expected': entry['filters'], 'filters': filters})
+    return {
+        'queries': len(entries),
+        'accuracy': 1 - len(errors) / len(entries) if entries else 1.0,
+        'errors': errors
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Evaluate filter extraction on labeled queries")
+    parser.add_argument('--corpus', default=FILTER_CORPUS, help="Labeled JSONL corpus")
+    parser.add_argument('--output', help="Write the results as JSON to this file")
+    args = parser.parse_args(argv)
+
+    corpus = load_corpus(args.corpus)
+    extractor = EntityExtractor()
+
+    report = {}
+    print(f"{'lang':<5} {'queries':>7} {'accuracy':>8}")
+    for lang in ['en', 'ar', 'all']:
+        result = score(extractor, [entry for entry in corpus if lang == 'all' or entry['language'] == lang])
+        report[lang] = result
+        print(f"{lang:<5} {result['queries']:>7} {result['accuracy']:>8.2f}")
+    for error in report['all']['errors']:
+        print(f"  {error['query']}\n    got      {error['filters']}\n    expected {error['expected']}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+    return 1 if report['all']['errors'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,255 @@
+"""
+Routing accuracy and throughput evaluation for the e-invoice chatbot.
+This module routes the labeled bilingual corpus with each router
+configuration and reports table/domain precision and recall, the
+out-of-domain accuracy, the system prompt size and queries per second, and
+the throughput of Arabic normalization by itself.
+
+Example:
+    python -m benchmarks.eval_routing
+    python -m benchmarks.eval_routing --corpus corpus/routing_corpus.jsonl --output routing_eval.json
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from arabic_normalizer import normalize_query
+from data_router import DataRouter
+from keyword_matcher import KeywordMatcher
+from llm_client import estimate_tokens
+from response_handler import ResponseHandler
+from routing_classifier import RoutingClassifier, precision_recall, train
+
+DEFAULT_CORPUS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                              'corpus', 'routing_corpus.jsonl')
+
+# A router configuration: query -> (tables, domains, is_out_of_domain)
+Route = Callable[[str], Tuple[List[str], List[str], bool]]
+
+
+def load_corpus(path: str = DEFAULT_CORPUS) -> List[Dict]:
+    """Read the labeled corpus: one {'query', 'language', 'tables', 'domains', 'out_of_domain'} per line."""
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def keyword_route(router: DataRouter, handler: ResponseHandler) -> Route:
+    """Wrap the keyword router and response handler as a router configuration."""
+    def route(query: str) -> Tuple[List[str], List[str], bool]:
+        query_context = router.get_query_context(query)
+        return (query_context['relevant_tables'], query_context['relevant_domains'],
+                handler.is_out_of_domain(query, query_context))
+    # Per-query memos a cold measurement must clear
+    route.memos = (router.context_memo, handler.domain_gate.memo)
+    return route
+
+
+def held_out_route(corpus: List[Dict], folds: int, directory: str) -> Route:
+    """
+    Route each corpus query with a classifier trained on the other folds.
+
+    Args:
+        corpus: Labeled entries
+        folds: Number of folds
+        directory: Where the per-fold models are written
+
+    Returns:
+        Router configuration for the corpus queries only
+    """
+    from sklearn.model_selection import KFold
+
+    routes = {}
+    for fold, (train_index, test_index) in enumerate(KFold(folds, shuffle=True, random_state=0).split(corpus)):
+        path = train([corpus[i] for i in train_index], os.path.join(directory, f'fold{fold}.npz'))
+        router = DataRouter(classifier=RoutingClassifier(path))
+        route = keyword_route(router, ResponseHandler(router.matcher))
+        routes.update((corpus[i]['query'], route) for i in test_index)
+
+    def held_out(query: str) -> Tuple[List[str], List[str], bool]:
+        return routes[query](query)
+    held_out.memos = tuple(memo for route in set(routes.values()) for memo in route.memos)
+    return held_out
+
+
+def evaluate(route: Route, corpus: List[Dict], handler: ResponseHandler) -> Dict[str, Dict]:
+    """
+    Score a router configuration on the corpus, per language and overall.
+
+    Args:
+        route: Router configuration to evaluate
+        corpus: Labeled queries
+        handler: Response handler used to measure the resulting system prompt size
+
+    Returns:
+        Language ('en', 'ar', 'all') to metrics dictionary
+    """
+    results = {}
+    for lang in ['en', 'ar', 'all']:
+        entries = [entry for entry in corpus if lang == 'all' or entry['language'] == lang]
+        tables, domains, prompt_tokens = [], [], []
+        ood_correct = 0
+        for entry in entries:
+            predicted_tables, predicted_domains, out_of_domain = route(entry['query'])
+            ood_correct += out_of_domain == entry['out_of_domain']
+            if entry['out_of_domain']:
+                continue
+            tables.append((predicted_tables, entry['tables']))
+            domains.append((predicted_domains, entry['domains']))
+            prompt = handler.get_system_prompt({
+                'language': entry['language'],
+                'relevant_tables': predicted_tables,
+                'relevant_domains': predicted_domains
+            })
+            prompt_tokens.append(estimate_tokens(prompt))
+
+        results[lang] = {
+            'queries': len(entries),
+            'tables': precision_recall(tables),
+            'domains': precision_recall(domains),
+            'table_exact_match': sum(set(p) == set(e) for p, e in tables) / len(tables) if tables else 0.0,
+            'out_of_domain_accuracy': ood_correct / len(entries) if entries else 0.0,
+            'avg_system_prompt_tokens': sum(prompt_tokens) / len(prompt_tokens) if prompt_tokens else 0.0
+        }
+    return results
+
+
+def clear_memos(route: Route):
+    """Drop everything a router configuration memoized per query, and the normalized-query cache."""
+    normalize_query.cache_clear()
+    for memo in getattr(route, 'memos', ()):
+        memo.clear()
+
+
+def measure_throughput(route: Route, queries: List[str], rounds: int = 3, cold: bool = False) -> float:
+    """
+    Best-of-rounds queries per second.
+
+    Args:
+        route: Router configuration
+        queries: Queries routed in each round
+        rounds: Number of rounds
+        cold: Clear every per-query memo (clear_memos) before each query, outside
+            the timed section, so each query is routed from scratch
+
+    Returns:
+        Queries per second of the fastest round
+    """
+    best = float('inf')
+    for _ in range(rounds):
+        if not cold:
+            started = time.perf_counter()
+            for query in queries:
+                route(query)
+            best = min(best, time.perf_counter() - started)
+            continue
+        elapsed = 0.0
+        for query in queries:
+            clear_memos(route)
+            started = time.perf_counter()
+            route(query)
+            elapsed += time.perf_counter() - started
+        best = min(best, elapsed)
+    return len(queries) / best
+
+
+def measure_normalization(queries: List[str], rounds: int = 3) -> Dict[str, float]:
+    """
+    Best-of-rounds queries per second of Arabic normalization alone.
+
+    The routing throughput includes keyword matching, the classifier and the
+    domain gate; this times normalize_query by itself, with its cache cleared
+    before each query (uncached) and kept (cached).
+
+    Args:
+        queries: Queries normalized in each round
+        rounds: Number of rounds
+
+    Returns:
+        Dictionary with 'uncached' and 'cached' queries per second
+    """
+    uncached = cached = float('inf')
+    for _ in range(rounds):
+        elapsed = 0.0
+        for query in queries:
+            normalize_query.cache_clear()
+            started = time.perf_counter()
+            normalize_query(query)
+            elapsed += time.perf_counter() - started
+        uncached = min(uncached, elapsed)
+        started = time.perf_counter()
+        for query in queries:
+            normalize_query(query)
+        cached = min(cached, time.perf_counter() - started)
+    return {'uncached': len(queries) / uncached, 'cached': len(queries) / cached}
+
+
+def print_report(name: str, results: Dict[str, Dict], throughput: Dict[str, float]):
+    print(f"\n== {name} ==")
+    print(f"{'lang':<5} {'tables P/R/F1':>20} {'domains P/R/F1':>20} {'exact':>7} {'ood acc':>8} {'prompt tok':>11}")
+    for lang, metrics in results.items():
+        table_scores = '/'.join(f"{metrics['tables'][key]:.2f}" for key in ['precision', 'recall', 'f1'])
+        domain_scores = '/'.join(f"{metrics['domains'][key]:.2f}" for key in ['precision', 'recall', 'f1'])
+        print(f"{lang:<5} {table_scores:>20} {domain_scores:>20} {metrics['table_exact_match']:>7.2f} "
+              f"{metrics['out_of_domain_accuracy']:>8.2f} {metrics['avg_system_prompt_tokens']:>11.0f}")
+    print(f"throughput: {throughput['warm']:,.0f} queries/s (memoized), {throughput['cold']:,.0f} queries/s (uncached)")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Evaluate routing accuracy and throughput on a labeled corpus")
+    parser.add_argument('--corpus', default=DEFAULT_CORPUS, help="Labeled JSONL corpus")
+    parser.add_argument('--repeat', type=int, default=50, help="Times the corpus is repeated for throughput")
+    parser.add_argument('--folds', type=int, default=5,
+                        help="Cross-validation folds for the classifier (its shipped model was trained on this corpus)")
+    parser.add_argument('--output', help="Write the results as JSON to this file")
+    args = parser.parse_args(argv)
+
+    corpus = load_corpus(args.corpus)
+    queries = [entry['query'] for entry in corpus] * args.repeat
+
+    configurations = {}
+    # Keyword matching without Arabic normalization (the previous behaviour)
+    plain_router = DataRouter(KeywordMatcher(normalizer=str.lower))
+    configurations['keywords'] = keyword_route(plain_router, ResponseHandler(plain_router.matcher))
+    router = DataRouter()
+    handler = ResponseHandler(router.matcher)
+    configurations['keywords+normalization'] = keyword_route(router, handler)
+    directory = tempfile.TemporaryDirectory()
+    # Every query is routed by a model that did not see it: scoring the shipped model on its own
+    # training corpus would only measure how well it memorized it
+    if RoutingClassifier().predict_many(['']) is not None:
+        try:
+            configurations[f'keywords+normalization+classifier ({args.folds}-fold)'] = held_out_route(
+                corpus, args.folds, directory.name)
+        except ImportError:
+            print("scikit-learn is not installed; skipping the classifier configuration")
+
+    report = {}
+    with directory:
+        for name, route in configurations.items():
+            results = evaluate(route, corpus, handler)
+            throughput = {'warm': measure_throughput(route, queries),
+                          'cold': measure_throughput(route, queries, cold=True)}
+            print_report(name, results, throughput)
+            report[name] = {'metrics': results, 'throughput': throughput}
+    normalization = measure_normalization(queries)
+    print(f"\nnormalize_query: {normalization['uncached']:,.0f} queries/s (uncached), "
+          f"{normalization['cached']:,.0f} queries/s (cached)")
+    report['normalize_query'] = {'throughput': normalization}
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+    # Fail if normalization made routing less accurate
+    baseline, normalized = report['keywords']['metrics']['all'], report['keywords+normalization']['metrics']['all']
+    regressed = any(normalized[kind]['f1'] < baseline[kind]['f1'] for kind in ['tables', 'domains'])
+    return 1 if regressed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
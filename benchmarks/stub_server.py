@@ -0,0 +1,285 @@
+"""
+OpenAI-compatible local stub server for offline testing of the e-invoice chatbot.
+This module mimics the chat-completions endpoint with configurable latency,
+token rate, streaming, prompt caching and injected rate-limit and server errors.
+
+Run it and point the chatbot at it:
+    python -m benchmarks.stub_server --port 8787 --latency 0.3 --error-rate-429 0.05
+    OPENAI_BASE_URL=http://127.0.0.1:8787/v1 streamlit run app.py
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+DEFAULT_REPLY = (
+    "Based on the e-invoice data, Dubai accounts for the largest share of invoices and VAT, "
+    "followed by Abu Dhabi and Sharjah. Anomalies are concentrated in duplicate and round-amount "
+    "invoices, which should be reviewed for compliance."
+)
+
+
+class StubConfig:
+    """
+    Behaviour of the stub server.
+    """
+
+    def __init__(self, latency: float = 0.2, latency_jitter: float = 0.05, tokens_per_second: float = 80.0,
+                 error_rate_429: float = 0.0, error_rate_500: float = 0.0, retry_after: float = 1.0,
+                 reply: str = DEFAULT_REPLY, seed: Optional[int] = None, cache_min_tokens: int = 1024,
+                 cache_block_tokens: int = 128, cache_size: int = 100000):
+        """
+        Initialize the configuration.
+
+        Args:
+            latency: Seconds before the first token (or the full response) is sent
+            latency_jitter: Uniform jitter added to the latency, in seconds
+            tokens_per_second: Generation speed used to pace completions
+            error_rate_429: Fraction of requests answered with 429 Too Many Requests
+            error_rate_500: Fraction of requests answered with 500 Internal Server Error
+            retry_after: Retry-After header value sent with injected 429 responses
+            reply: Text of every completion
+            seed: Optional random seed for reproducible error injection
+            cache_min_tokens: Shortest prompt prefix served from the simulated prompt
+                cache (0 disables it)
+            cache_block_tokens: Granularity of cached prompt tokens
+            cache_size: Number of prompt prefix blocks remembered
+        """
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.tokens_per_second = tokens_per_second
+        self.error_rate_429 = error_rate_429
+        self.error_rate_500 = error_rate_500
+        self.retry_after = retry_after
+        self.reply = reply
+        self.random = random.Random(seed)
+        self.cache_min_tokens = cache_min_tokens
+        self.cache_block_tokens = cache_block_tokens
+        self.cache_size = cache_size
+        self.prefixes = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {'requests': 0, 'streamed': 0, 'errors_429': 0, 'errors_500': 0,
+                      'prompt_tokens': 0, 'cached_tokens': 0}
+
+    def count(self, name: str):
+        with self.lock:
+            self.stats[name] += 1
+
+    def draw(self) -> float:
+        with self.lock:
+            return self.random.random()
+
+    def cached_tokens(self, messages: List[Dict], prompt_tokens: Optional[int] = None) -> int:
+        """
+        Count the prompt tokens served from the simulated prompt cache and remember this prompt.
+
+        Like the real API, the longest previously seen prefix of the serialized
+        prompt is cached in blocks of cache_block_tokens, once it reaches
+        cache_min_tokens.
+        """
+        if not self.cache_min_tokens:
+            return 0
+        prompt = json.dumps(messages, ensure_ascii=False, sort_keys=True)
+        block_chars = self.cache_block_tokens * 4
+        digest = hashlib.sha256()
+        keys = []
+        for start in range(0, len(prompt) - block_chars + 1, block_chars):
+            digest.update(prompt[start:start + block_chars].encode('utf-8'))
+            keys.append(digest.hexdigest())
+
+        cached = 0
+        with self.lock:
+            for blocks, key in enumerate(keys, 1):
+                if key in self.prefixes:
+                    self.prefixes.move_to_end(key)
+                    cached = blocks * self.cache_block_tokens
+                self.prefixes[key] = True
+            while len(self.prefixes) > self.cache_size:
+                self.prefixes.popitem(last=False)
+        if prompt_tokens is not None:
+            cached = min(cached, prompt_tokens - prompt_tokens % self.cache_block_tokens)
+        return cached if cached >= self.cache_min_tokens else 0
+
+    def record_usage(self, prompt_tokens: int, cached_tokens: int):
+        with self.lock:
+            self.stats['prompt_tokens'] += prompt_tokens
+            self.stats['cached_tokens'] += cached_tokens
+
+
+def _estimate_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+class StubRequestHandler(BaseHTTPRequestHandler):
+    """
+    HTTP handler implementing a minimal chat-completions API.
+    """
+
+    protocol_version = 'HTTP/1.1'
+    config = StubConfig()
+
+    def log_message(self, format, *args):
+        # Keep benchmark output clean
+        pass
+
+    def _send_json(self, status: int, payload: Dict, headers: Optional[Dict] = None):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip('/').endswith('/stats'):
+            self._send_json(200, dict(self.config.stats))
+        else:
+            self._send_json(404, {'error': {'message': 'Not found', 'type': 'invalid_request_error'}})
+
+    def do_POST(self):
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            self._send_json(404, {'error': {'message': 'Not found', 'type': 'invalid_request_error'}})
+            return
+
+        length = int(self.headers.get('Content-Length', 0))
+        request = json.loads(self.rfile.read(length) or b'{}')
+        config = self.config
+        config.count('requests')
+
+        # Inject errors before doing any work
+        draw = config.draw()
+        if draw < config.error_rate_429:
+            config.count('errors_429')
+            self._send_json(429, {
+                'error': {'message': 'Rate limit reached (stub)', 'type': 'requests', 'code': 'rate_limit_exceeded'}
+            }, headers={'Retry-After': str(config.retry_after)})
+            return
+        if draw < config.error_rate_429 + config.error_rate_500:
+            config.count('errors_500')
+            self._send_json(500, {'error': {'message': 'Internal server error (stub)', 'type': 'server_error'}})
+            return
+
+        time.sleep(max(0.0, config.latency + random.uniform(-1, 1) * config.latency_jitter))
+
+        model = request.get('model', 'gpt-3.5-turbo')
+        completion_id = f"chatcmpl-stub-{uuid.uuid4().hex[:12]}"
+        prompt_tokens = sum(_estimate_tokens(str(message.get('content') or '')) for message in request.get('messages', []))
+        words = config.reply.split(' ')
+        completion_tokens = _estimate_tokens(config.reply)
+        cached_tokens = config.cached_tokens(request.get('messages', []), prompt_tokens)
+        config.record_usage(prompt_tokens, cached_tokens)
+        usage = {
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'total_tokens': prompt_tokens + completion_tokens,
+            'prompt_tokens_details': {'cached_tokens': cached_tokens}
+        }
+        delay_per_word = (completion_tokens / max(config.tokens_per_second, 1e-6)) / max(len(words), 1)
+
+        if request.get('stream'):
+            config.count('streamed')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Cache-Control', 'no-cache')
+            self.send_header('Connection', 'close')
+            self.end_headers()
+            for index, word in enumerate(words):
+                chunk = {
+                    'id': completion_id, 'object': 'chat.completion.chunk', 'created': int(time.time()), 'model': model,
+                    'choices': [{'index': 0, 'delta': {'content': word if index == 0 else ' ' + word}, 'finish_reason': None}]
+                }
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode('utf-8'))
+                self.wfile.flush()
+                time.sleep(delay_per_word)
+            final = {
+                'id': completion_id, 'object': 'chat.completion.chunk', 'created': int(time.time()), 'model': model,
+                'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}]
+            }
+            self.wfile.write(f"data: {json.dumps(final)}\n\n".encode('utf-8'))
+            if (request.get('stream_options') or {}).get('include_usage'):
+                usage_chunk = {
+                    'id': completion_id, 'object': 'chat.completion.chunk', 'created': int(time.time()), 'model': model,
+                    'choices': [], 'usage': usage
+                }
+                self.wfile.write(f"data: {json.dumps(usage_chunk)}\n\n".encode('utf-8'))
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+            self.close_connection = True
+            return
+
+        time.sleep(delay_per_word * len(words))
+        self._send_json(200, {
+            'id': completion_id,
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': model,
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': config.reply}, 'finish_reason': 'stop'}],
+            'usage': usage
+        })
+
+
+def start_stub_server(config: Optional[StubConfig] = None, host: str = '127.0.0.1', port: int = 0) -> ThreadingHTTPServer:
+    """
+    Start the stub server on a background thread.
+
+    Args:
+        config: Server behaviour (defaults to StubConfig())
+        host: Interface to bind
+        port: Port to bind (0 picks a free port)
+
+    Returns:
+        The running server; its base URL is f"http://{host}:{server.server_port}/v1"
+    """
+    handler = type('ConfiguredStubRequestHandler', (StubRequestHandler,), {'config': config or StubConfig()})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OpenAI-compatible stub server for offline testing")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8787)
+    parser.add_argument('--latency', type=float, default=0.2, help="Seconds before the first token")
+    parser.add_argument('--latency-jitter', type=float, default=0.05)
+    parser.add_argument('--tokens-per-second', type=float, default=80.0)
+    parser.add_argument('--error-rate-429', type=float, default=0.0)
+    parser.add_argument('--error-rate-500', type=float, default=0.0)
+    parser.add_argument('--retry-after', type=float, default=1.0)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--cache-min-tokens', type=int, default=1024,
+                        help="Shortest cached prompt prefix (0 disables the simulated prompt cache)")
+    args = parser.parse_args()
+
+    config = StubConfig(
+        latency=args.latency,
+        latency_jitter=args.latency_jitter,
+        tokens_per_second=args.tokens_per_second,
+        error_rate_429=args.error_rate_429,
+        error_rate_500=args.error_rate_500,
+        retry_after=args.retry_after,
+        seed=args.seed,
+        cache_min_tokens=args.cache_min_tokens
+    )
+    handler = type('ConfiguredStubRequestHandler', (StubRequestHandler,), {'config': config})
+    server = ThreadingHTTPServer((args.host, args.port), handler)
+    server.daemon_threads = True
+    print(f"Stub OpenAI server listening on http://{args.host}:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
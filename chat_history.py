@@ -0,0 +1,291 @@
+"""
+Bounded chat history for the e-invoice chatbot.
+This module keeps the newest messages of each session in memory within a
+message and byte budget, spills older ones to a local SQLite store from
+which they are paged back on demand, and accounts for the memory every live
+session holds.
+"""
+
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import weakref
+from collections import deque
+from typing import Any, Dict, Iterator, List, Optional
+
+from memo import json_default
+
+# Default store location and per-session budgets (overridable with environment variables)
+HISTORY_DB = os.environ.get('CHATBOT_HISTORY_DB') or os.path.join(tempfile.gettempdir(), 'chatbot_history.sqlite3')
+MAX_MESSAGES = int(os.environ.get('CHATBOT_HISTORY_MAX_MESSAGES', 40))
+MAX_BYTES = int(os.environ.get('CHATBOT_HISTORY_MAX_BYTES', 4 * 1024 * 1024))
+# Spilled messages older than this many seconds are deleted when the store is opened
+MAX_AGE = float(os.environ.get('CHATBOT_HISTORY_MAX_AGE', 24 * 3600))
+
+
+def message_size(message: Dict) -> int:
+    """
+    Estimate the bytes a chat message holds.
+
+    Text counts its UTF-8 length, a chart the length of its Plotly JSON and a
+    tool plan the length of its JSON.
+
+    Args:
+        message: Chat message dictionary
+
+    Returns:
+        Approximate size in bytes
+    """
+    size = 0
+    for key, value in message.items():
+        if value is None:
+            continue
+        if isinstance(value, str):
+            size += len(value.encode('utf-8'))
+        elif key == 'figure':
+            size += len(value.to_json())
+        else:
+            size += len(json.dumps(value, ensure_ascii=False, default=json_default))
+    return size
+
+
+def _serialize(message: Dict) -> str:
+    payload = {key: value for key, value in message.items() if key != 'figure'}
+    if message.get('figure') is not None:
+        payload['figure'] = message['figure'].to_json()
+    return json.dumps(payload, ensure_ascii=False, default=json_default)
+
+
+def _deserialize(payload: str) -> Dict:
+    message = json.loads(payload)
+    if message.get('figure') is not None:
+        import plotly.io as pio
+        message['figure'] = pio.from_json(message['figure'])
+    return message
+
+
+class HistoryStore:
+    """
+    SQLite store of spilled chat messages, shared by all sessions of the process.
+    """
+
+    def __init__(self, path: str = HISTORY_DB):
+        """
+        Open (and create if needed) the store.
+
+        Args:
+            path: Database file (':memory:' keeps it in memory, for tests)
+        """
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        with self.lock:
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS messages ('
+                'session_id TEXT NOT NULL, seq INTEGER NOT NULL, bytes INTEGER NOT NULL, '
+                'created REAL NOT NULL, payload TEXT NOT NULL, PRIMARY KEY (session_id, seq))'
+            )
+
+    def write(self, session_id: str, seq: int, message: Dict, size: int):
+        """Store one message under its position in the session."""
+        payload = _serialize(message)
+        with self.lock:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO messages (session_id, seq, bytes, created, payload) VALUES (?, ?, ?, ?, ?)',
+                (session_id, seq, size, time.time(), payload)
+            )
+
+    def read(self, session_id: str, start: int, stop: int) -> List[Dict]:
+        """Read the messages of a session with start <= seq < stop, oldest first."""
+        with self.lock:
+            rows = self.connection.execute(
+                'SELECT payload FROM messages WHERE session_id = ? AND seq >= ? AND seq < ? ORDER BY seq',
+                (session_id, start, stop)
+            ).fetchall()
+        return [_deserialize(payload) for payload, in rows]
+
+    def delete(self, session_id: str):
+        """Forget all spilled messages of a session."""
+        with self.lock:
+            self.connection.execute('DELETE FROM messages WHERE session_id = ?', (session_id,))
+
+    def prune(self, max_age: float) -> int:
+        """
+        Delete messages older than max_age seconds (sessions that ended long ago).
+
+        Returns:
+            Number of deleted messages
+        """
+        with self.lock:
+            cursor = self.connection.execute('DELETE FROM messages WHERE created < ?', (time.time() - max_age,))
+        return cursor.rowcount
+
+    def usage(self) -> Dict[str, Dict[str, int]]:
+        """
+        Get the spilled messages and bytes per session.
+
+        Returns:
+            Dictionary of session id to {'messages', 'bytes'}
+        """
+        with self.lock:
+            rows = self.connection.execute(
+                'SELECT session_id, COUNT(*), SUM(bytes) FROM messages GROUP BY session_id'
+            ).fetchall()
+        return {session_id: {'messages': count, 'bytes': size or 0} for session_id, count, size in rows}
+
+
+class ChatHistory:
+    """
+    Chat messages of one session: the newest in memory, older ones in a HistoryStore.
+
+    Iterating yields the in-memory messages only; earlier ones are read
+    back a page at a time with page().
+    """
+
+    def __init__(self, session_id: str, store: Optional['HistoryStore'] = None,
+                 max_messages: int = MAX_MESSAGES, max_bytes: int = MAX_BYTES):
+        """
+        Initialize an empty history.
+
+        Args:
+            session_id: Identifier of the session in the store
+            store: Store for spilled messages (defaults to the process-wide store)
+            max_messages: Messages kept in memory at most
+            max_bytes: Bytes kept in memory at most (the newest message is
+                always kept, whatever its size)
+        """
+        self.session_id = session_id
+        self.store = store or get_default_store()
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.recent = deque()
+        self.recent_bytes = 0
+        self.spilled = 0
+        self.spilled_bytes = 0
+        self.created = time.time()
+        _live_histories.add(self)
+        # Spilled messages are deleted when the session (and its history) goes away
+        weakref.finalize(self, self.store.delete, session_id)
+
+    def append(self, message: Dict):
+        """
+        Add a message, spilling the oldest in-memory messages beyond the budget.
+
+        Args:
+            message: Chat message dictionary ('role', 'content' and optional
+                'question', 'visualization_type', 'plan' and 'figure')
+        """
+        size = message_size(message)
+        self.recent.append((message, size))
+        self.recent_bytes += size
+        while len(self.recent) > 1 and (len(self.recent) > self.max_messages or self.recent_bytes > self.max_bytes):
+            oldest, oldest_size = self.recent.popleft()
+            self.store.write(self.session_id, self.spilled, oldest, oldest_size)
+            self.spilled += 1
+            self.spilled_bytes += oldest_size
+            self.recent_bytes -= oldest_size
+
+    def __iter__(self) -> Iterator[Dict]:
+        return (message for message, _ in self.recent)
+
+    def __len__(self) -> int:
+        """Total number of messages, including spilled ones."""
+        return self.spilled + len(self.recent)
+
+    def __bool__(self) -> bool:
+        return len(self) > 0
+
+    def page(self, count: int) -> List[Dict]:
+        """
+        Read back the spilled messages just before the in-memory ones.
+
+        Args:
+            count: Number of messages to read (the latest spilled ones)
+
+        Returns:
+            Up to count messages, oldest first; they are not kept in memory
+        """
+        start = max(0, self.spilled - count)
+        return self.store.read(self.session_id, start, self.spilled)
+
+    def clear(self):
+        """Forget the whole history, in memory and in the store."""
+        self.recent.clear()
+        self.recent_bytes = 0
+        if self.spilled:
+            self.store.delete(self.session_id)
+        self.spilled = 0
+        self.spilled_bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get the memory accounting of this session.
+
+        Returns:
+            Dictionary with the session id, total messages, in-memory messages
+            and bytes, spilled messages and bytes, and the session's age in seconds
+        """
+        return {
+            'session_id': self.session_id,
+            'messages': len(self),
+            'in_memory_messages': len(self.recent),
+            'in_memory_bytes': self.recent_bytes,
+            'spilled_messages': self.spilled,
+            'spilled_bytes': self.spilled_bytes,
+            'age_seconds': time.time() - self.created
+        }
+
+
+# Histories of the sessions alive in this process (dropped with their session)
+_live_histories = weakref.WeakSet()
+
+_default_store = None
+_default_store_lock = threading.Lock()
+
+
+def get_default_store() -> HistoryStore:
+    """
+    Get the process-wide history store at CHATBOT_HISTORY_DB.
+
+    Messages left behind by processes that did not exit cleanly are pruned
+    after CHATBOT_HISTORY_MAX_AGE seconds.
+
+    Returns:
+        Shared HistoryStore instance
+    """
+    global _default_store
+    with _default_store_lock:
+        if _default_store is None:
+            _default_store = HistoryStore()
+            _default_store.prune(MAX_AGE)
+        return _default_store
+
+
+def session_memory_report() -> List[Dict[str, Any]]:
+    """
+    Get the memory accounting of every live session of the process, largest first.
+
+    Returns:
+        List of ChatHistory.stats() dictionaries
+    """
+    report = [history.stats() for history in list(_live_histories)]
+    return sorted(report, key=lambda entry: entry['in_memory_bytes'], reverse=True)
+
+
+# Example usage
+if __name__ == "__main__":
+    store = HistoryStore(':memory:')
+    history = ChatHistory('example-session', store, max_messages=4, max_bytes=2000)
+    for turn in range(6):
+        history.append({'role': 'user', 'content': f"Question {turn}: What is the total VAT collected in Dubai?"})
+        history.append({'role': 'assistant', 'content': "إجمالي ضريبة القيمة المضافة " * 10})
+
+    print(f"In memory: {[message['content'][:11] for message in history]}")
+    print(f"Paged back: {[message['content'][:11] for message in history.page(4)]}")
+    print(f"Stats: {history.stats()}")
+    print(f"Store usage: {store.usage()}")
+    print(f"Report: {session_memory_report()}")
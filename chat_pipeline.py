@@ -0,0 +1,277 @@
+"""
+Query processing pipeline for the e-invoice chatbot.
+This module runs one chat question through routing, context building and
+response generation, independently of the Streamlit user interface.
+"""
+
+import time
+from typing import Callable, Dict, Iterator, List, Optional
+import pandas as pd
+
+from conversation_memory import ConversationMemory
+from data_router import DataRouter
+from fast_path import FastPathEngine
+from llm_client import classify_error
+from response_handler import ResponseHandler
+from response_generator import API_ERROR_MESSAGES, ResponseGenerator
+from routing_classifier import get_default_classifier
+from telemetry import get_telemetry
+
+class ChatPipeline:
+    """
+    Runs a user question through the chatbot components and times each stage.
+    """
+
+    def __init__(self, router: Optional[DataRouter] = None, response_handler: Optional[ResponseHandler] = None):
+        """
+        Initialize the pipeline.
+
+        Args:
+            router: Data router to use (a new one, with the shipped routing
+                classifier if available, is created if omitted)
+            response_handler: Response handler to use (a new one is created if omitted)
+        """
+        self.router = router or DataRouter(classifier=get_default_classifier())
+        self.response_handler = response_handler or ResponseHandler(self.router.matcher)
+        self.fast_path = FastPathEngine(self.router)
+
+    def process(self, user_input: str, data: Dict[str, pd.DataFrame], api_key: str = '',
+                model: str = 'gpt-3.5-turbo', selected_table: str = 'All', selected_domain: str = 'All',
+                use_tools: bool = False, memory: Optional[ConversationMemory] = None,
+                history: Optional[List[Dict]] = None, on_stage: Optional[Callable[[str], None]] = None) -> Dict:
+        """
+        Process one user question.
+
+        Args:
+            user_input: The user's question
+            data: Dictionary of available data tables
+            api_key: OpenAI API key (mock responses are used without a valid key)
+            model: The OpenAI model to use
+            selected_table: Table selected in the UI ('All' for automatic routing)
+            selected_domain: Domain selected in the UI ('All' for automatic routing)
+            use_tools: Let the model compute answers with local aggregation tools
+            memory: Conversation memory of the session; earlier turns are sent
+                with the question and the new turn is recorded
+            history: Earlier conversation messages kept by the caller, used
+                when no memory is given
+            on_stage: Called with the name of each stage as it starts
+                ('route', 'context', 'fast_path', 'memory', 'llm', 'format')
+
+        Returns:
+            Dictionary with the query context, response context, response,
+            formatted response text, the filtered data tables the answer is
+            based on and per-stage timings in seconds
+        """
+        timings = {}
+        started = time.perf_counter()
+
+        # Initialize response generator with API key
+        response_generator = ResponseGenerator(api_key)
+        state = self._prepare(user_input, data, response_generator, model, selected_table, selected_domain,
+                              memory, history, timings, on_stage)
+        response = state['response']
+
+        # Generate response
+        _report(on_stage, 'llm')
+        stage_start = time.perf_counter()
+        if response is not None:
+            # Already answered by the fast path
+            pass
+        elif response_generator.has_valid_api_key() and use_tools:
+            # Let the model plan tool calls that aggregate the full data locally
+            response = response_generator.generate_response_with_tools(
+                user_input, state['response_context'], state['data'], model, state['history']
+            )
+        elif response_generator.has_valid_api_key():
+            # Use real API
+            response = response_generator.generate_response(
+                user_input, state['response_context'], model, state['history']
+            )
+        else:
+            # Use mock response
+            response = response_generator.generate_mock_response(user_input, state['response_context'])
+        timings['llm'] = time.perf_counter() - stage_start
+
+        return self._finish(user_input, state, response, memory, timings, started, on_stage)
+
+    def stream(self, user_input: str, data: Dict[str, pd.DataFrame], api_key: str = '',
+               model: str = 'gpt-3.5-turbo', selected_table: str = 'All', selected_domain: str = 'All',
+               use_tools: bool = False, memory: Optional[ConversationMemory] = None,
+               history: Optional[List[Dict]] = None, on_stage: Optional[Callable[[str], None]] = None) -> Iterator[Dict]:
+        """
+        Process one user question, yielding the answer as it is generated.
+
+        Model answers are streamed chunk by chunk; fast-path, tool-based and
+        mock answers arrive as a single chunk.
+
+        Args:
+            Same as process()
+
+        Returns:
+            Iterator over events: {'event': 'context', 'query_context',
+            'visualization_type', 'data' (the filtered tables)} once the
+            context is ready, {'event': 'delta',
+            'text'} per chunk of the answer, then {'event': 'done', 'result'}
+            with the dictionary process() returns
+        """
+        timings = {}
+        started = time.perf_counter()
+
+        response_generator = ResponseGenerator(api_key)
+        state = self._prepare(user_input, data, response_generator, model, selected_table, selected_domain,
+                              memory, history, timings, on_stage)
+        response_context = state['response_context']
+        yield {
+            'event': 'context',
+            'query_context': state['query_context'],
+            'visualization_type': response_context.get('visualization_type'),
+            'data': state['data']
+        }
+
+        _report(on_stage, 'llm')
+        stage_start = time.perf_counter()
+        response = state['response']
+        if response is None and response_generator.has_valid_api_key() and not use_tools:
+            chunks = []
+            try:
+                for chunk in response_generator.generate_response_stream(
+                        user_input, response_context, model, state['history']):
+                    if not chunks:
+                        timings['first_token'] = time.perf_counter() - stage_start
+                    chunks.append(chunk)
+                    yield {'event': 'delta', 'text': chunk}
+                response = {
+                    'success': True,
+                    'error': None,
+                    'message': None,
+                    'response_text': ''.join(chunks),
+                    'visualization_type': (None if response_context.get('is_out_of_domain', False)
+                                           else response_context.get('visualization_type'))
+                }
+            except Exception as e:
+                error = classify_error(e)
+                response = {
+                    'success': False,
+                    'error': error.code if error.code in API_ERROR_MESSAGES else 'api_error',
+                    'message': API_ERROR_MESSAGES.get(error.code, f'API error: {error.message}'),
+                    'response_text': None,
+                    'visualization_type': None
+                }
+        else:
+            if response is None and response_generator.has_valid_api_key():
+                response = response_generator.generate_response_with_tools(
+                    user_input, response_context, state['data'], model, state['history']
+                )
+            elif response is None:
+                response = response_generator.generate_mock_response(user_input, response_context)
+            if response['success'] and response['response_text']:
+                yield {'event': 'delta', 'text': response['response_text']}
+        timings['llm'] = time.perf_counter() - stage_start
+
+        yield {'event': 'done', 'result': self._finish(user_input, state, response, memory, timings, started, on_stage)}
+
+    def _prepare(self, user_input: str, data: Dict[str, pd.DataFrame], response_generator: ResponseGenerator,
+                 model: str, selected_table: str, selected_domain: str, memory: Optional[ConversationMemory],
+                 history: Optional[List[Dict]], timings: Dict, on_stage: Optional[Callable[[str], None]]) -> Dict:
+        """Run the stages before response generation: routing, context, fast path and memory."""
+        # Get query context (the selected domain overrides routing)
+        _report(on_stage, 'route')
+        stage_start = time.perf_counter()
+        query_context = self.router.get_query_context(user_input, selected_table, selected_domain)
+        timings['route'] = time.perf_counter() - stage_start
+
+        # Prepare response context from the tables filtered by the query's entities
+        _report(on_stage, 'context')
+        stage_start = time.perf_counter()
+        data = self.router.entity_extractor.apply_filters(data, query_context['filters'])
+        response_context = self.response_handler.prepare_response_context(query_context, data)
+        timings['context'] = time.perf_counter() - stage_start
+
+        # Answer simple aggregate questions directly from the data
+        _report(on_stage, 'fast_path')
+        stage_start = time.perf_counter()
+        response = None
+        if not response_context.get('is_out_of_domain', False):
+            response = self.fast_path.answer(
+                user_input, query_context, data, response_context.get('visualization_type')
+            )
+        timings['fast_path'] = time.perf_counter() - stage_start
+
+        # Get earlier turns (summarizing turns that left the verbatim window)
+        _report(on_stage, 'memory')
+        stage_start = time.perf_counter()
+        if response is not None or not response_generator.has_valid_api_key():
+            history = None
+        elif memory is not None:
+            history = memory.get_messages(
+                lambda summary, turns, max_tokens: response_generator.summarize_conversation(
+                    summary, turns, max_tokens, model
+                )
+            )
+        timings['memory'] = time.perf_counter() - stage_start
+
+        return {
+            'query_context': query_context,
+            'response_context': response_context,
+            'data': data,
+            'response': response,
+            'history': history
+        }
+
+    def _finish(self, user_input: str, state: Dict, response: Dict, memory: Optional[ConversationMemory],
+                timings: Dict, started: float, on_stage: Optional[Callable[[str], None]]) -> Dict:
+        """Format the response, record the exchange and assemble the result."""
+        query_context = state['query_context']
+
+        # Format response for language
+        _report(on_stage, 'format')
+        stage_start = time.perf_counter()
+        if response['success'] and response['response_text']:
+            formatted_response = self.response_handler.format_response_for_language(
+                response['response_text'],
+                query_context['language']
+            )
+        else:
+            error_message = response.get('message', 'An error occurred')
+            formatted_response = self.response_handler.format_response_for_language(
+                error_message,
+                query_context['language']
+            )
+        timings['format'] = time.perf_counter() - stage_start
+
+        # Remember the exchange for follow-up questions
+        if memory is not None and response['success'] and response['response_text']:
+            memory.add_turn('user', user_input)
+            memory.add_turn('assistant', response['response_text'])
+        timings['total'] = time.perf_counter() - started
+        get_telemetry().record_request(user_input, timings, success=response['success'],
+                                       tables=list(query_context['relevant_tables']))
+
+        return {
+            'query_context': query_context,
+            'response_context': state['response_context'],
+            'response': response,
+            'formatted_response': formatted_response,
+            'data': state['data'],
+            'timings': timings
+        }
+
+
+def _report(on_stage: Optional[Callable[[str], None]], stage: str):
+    if on_stage is not None:
+        on_stage(stage)
+
+
+# Example usage
+if __name__ == "__main__":
+    from data_loader import generate_synthetic_data
+
+    pipeline = ChatPipeline()
+    data = generate_synthetic_data()
+
+    for query in ["What is the total VAT collected in Dubai?", "أظهر لي توزيع الفواتير حسب الإمارة"]:
+        result = pipeline.process(query, data)
+        print(f"Query: {query}")
+        print(f"Response: {result['response']['response_text'][:80]}...")
+        print(f"Timings: { {stage: round(seconds * 1000, 2) for stage, seconds in result['timings'].items()} }")
+        print("---")
@@ -0,0 +1,189 @@
+"""
+Token-bounded multi-turn conversation memory for the e-invoice chatbot.
+This module keeps the latest turns verbatim and folds older turns into a
+cached rolling summary, so follow-up questions keep their context at a
+constant prompt cost per turn.
+"""
+
+import re
+import threading
+from typing import Callable, Dict, List, Optional
+
+from llm_client import estimate_tokens
+
+# Summarizer signature: (previous_summary, turns_to_fold, max_tokens) -> new summary
+Summarizer = Callable[[str, List[Dict], int], str]
+
+
+def _truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Cut a text down to roughly max_tokens, keeping its beginning."""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    # Binary search on character length, since token density depends on the script
+    low, high = 0, len(text)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if estimate_tokens(text[:middle]) <= max_tokens:
+            low = middle
+        else:
+            high = middle - 1
+    return text[:low].rstrip() + "…"
+
+
+def _strip_markup(text: str) -> str:
+    return re.sub(r'<[^>]+>', '', text or '').strip()
+
+
+def extractive_summarizer(previous_summary: str, turns: List[Dict], max_tokens: int) -> str:
+    """
+    Summarize turns locally by keeping the first sentence of each one.
+
+    Args:
+        previous_summary: Summary of the turns folded earlier
+        turns: Turns to fold into the summary
+        max_tokens: Token budget of the resulting summary
+
+    Returns:
+        The updated summary, trimmed from the oldest end to fit the budget
+    """
+    lines = [line for line in (previous_summary or '').split('\n') if line]
+    for turn in turns:
+        first_sentence = re.split(r'(?<=[.!?؟])\s', _strip_markup(turn['content']), maxsplit=1)[0]
+        lines.append(f"{turn['role']}: {_truncate_to_tokens(first_sentence, 60)}")
+
+    # Drop the oldest lines first when over budget
+    while len(lines) > 1 and estimate_tokens('\n'.join(lines)) > max_tokens:
+        lines.pop(0)
+    return _truncate_to_tokens('\n'.join(lines), max_tokens)
+
+
+class ConversationMemory:
+    """
+    Keeps the last turns verbatim and older turns as a rolling summary.
+    """
+
+    def __init__(self, max_recent_turns: int = 6, max_tokens: int = 1200, summary_tokens: int = 300):
+        """
+        Initialize the memory.
+
+        Args:
+            max_recent_turns: Maximum number of messages kept verbatim
+            max_tokens: Token budget for the summary plus the verbatim messages
+            summary_tokens: Token budget for the rolling summary
+        """
+        self.max_recent_turns = max_recent_turns
+        self.max_tokens = max_tokens
+        self.summary_tokens = summary_tokens
+        self.summary = ''
+        self.folded_turns = 0
+        self.recent_turns = []
+        self.pending_turns = []
+        # Bumped whenever the summary is replaced or cleared, so a summary computed
+        # from an older state is discarded instead of overwriting a newer one
+        self.version = 0
+        self.lock = threading.Lock()
+
+    def add_turn(self, role: str, content: str):
+        """
+        Record a turn of the conversation.
+
+        Args:
+            role: 'user' or 'assistant'
+            content: The message text (HTML wrappers are stripped)
+        """
+        with self.lock:
+            self.recent_turns.append({'role': role, 'content': _strip_markup(content)})
+
+            # Move turns that no longer fit into the queue for the next summary
+            while len(self.recent_turns) > self.max_recent_turns or (
+                    len(self.recent_turns) > 1 and self._recent_tokens() > self.max_tokens - self.summary_tokens):
+                self.pending_turns.append(self.recent_turns.pop(0))
+
+    def _recent_tokens(self) -> int:
+        return sum(estimate_tokens(turn['content']) + 4 for turn in self.recent_turns)
+
+    def get_messages(self, summarizer: Optional[Summarizer] = None) -> List[Dict]:
+        """
+        Get the conversation history as chat messages within the token budget.
+
+        Turns waiting to be folded are summarized first; the summary is cached,
+        so each turn is summarized only once. The summarizer runs without the
+        lock, so a slow LLM summarizer does not block add_turn() or clear().
+
+        Args:
+            summarizer: Function that folds turns into the summary
+                (defaults to the local extractive summarizer)
+
+        Returns:
+            List of chat messages in OpenAI format
+        """
+        summarize = summarizer or extractive_summarizer
+        while True:
+            with self.lock:
+                if not self.pending_turns:
+                    return self._build_messages()
+                version, previous_summary, turns = self.version, self.summary, list(self.pending_turns)
+
+            try:
+                summary = summarize(previous_summary, turns, self.summary_tokens)
+            except Exception:
+                summary = extractive_summarizer(previous_summary, turns, self.summary_tokens)
+
+            with self.lock:
+                # Otherwise the memory was cleared or another caller folded these turns first
+                if self.version == version:
+                    self.summary = _truncate_to_tokens(summary, self.summary_tokens)
+                    self.folded_turns += len(turns)
+                    # Turns added while summarizing stay pending for the next round
+                    del self.pending_turns[:len(turns)]
+                    self.version += 1
+
+    def _build_messages(self) -> List[Dict]:
+        """Chat messages from the summary and the verbatim turns; the caller holds the lock."""
+        messages = []
+        if self.summary:
+            messages.append({
+                "role": "system",
+                "content": "Summary of the earlier conversation:\n" + self.summary
+            })
+
+        budget = self.max_tokens - self.summary_tokens
+        for turn in self.recent_turns:
+            content = turn['content']
+            if estimate_tokens(content) > budget:
+                content = _truncate_to_tokens(content, budget)
+            messages.append({"role": turn['role'], "content": content})
+        return messages
+
+    def clear(self):
+        """Forget the whole conversation."""
+        with self.lock:
+            self.version += 1
+            self.summary = ''
+            self.folded_turns = 0
+            self.recent_turns = []
+            self.pending_turns = []
+
+
+# Example usage
+if __name__ == "__main__":
+    memory = ConversationMemory(max_recent_turns=4, max_tokens=400, summary_tokens=120)
+
+    conversation = [
+        ("user", "What is the total VAT collected in Dubai?"),
+        ("assistant", "The total VAT collected in Dubai is 1.2M AED. Most of it comes from B2B invoices."),
+        ("user", "And for Sharjah?"),
+        ("assistant", "Sharjah collected 410K AED in VAT. That is about a third of Dubai."),
+        ("user", "Which sector pays the most there?"),
+        ("assistant", "In Sharjah, manufacturing pays the most VAT, followed by retail."),
+        ("user", "Show me the monthly trend for that sector"),
+    ]
+
+    for role, content in conversation:
+        memory.add_turn(role, content)
+        messages = memory.get_messages()
+        tokens = sum(estimate_tokens(message['content']) for message in messages)
+        print(f"after {role:<9} -> {len(messages)} messages, ~{tokens} tokens, folded {memory.folded_turns}")
+
+    for message in memory.get_messages():
+        print(f"[{message['role']}] {message['content']}")
@@ -0,0 +1,220 @@
+"""
+Data loading for the e-invoice chatbot.
+This module loads the e-invoice tables from CSV files or generates synthetic data.
+
+With CHATBOT_SHARED_DATA set to a directory (e.g. /dev/shm/chatbot), the tables
+are published there once and every worker process of the node attaches to
+them read-only (see shared_tables.py) instead of holding its own copy.
+"""
+
+import os
+import uuid
+from typing import Dict
+import pandas as pd
+import numpy as np
+
+from telemetry import get_telemetry
+
+# Default directory containing the exported e-invoice tables
+DATA_DIR = "output"
+
+# Directory the tables are shared through between worker processes ('' loads them per process)
+SHARED_DATA_DIR = os.environ.get('CHATBOT_SHARED_DATA', '')
+
+# CSV file name for each table
+TABLE_FILES = {
+    'invoices': "invoices.csv",
+    'items': "items.csv",
+    'taxpayers': "taxpayers.csv",
+    'audit_logs': "invoice_audit_logs.csv"
+}
+
+# Time column of each time-series table; these tables are kept sorted by it
+TIME_COLUMNS = {
+    'invoices': 'invoice_datetime',
+    'audit_logs': 'timestamp'
+}
+
+def sort_by_time(data: Dict[str, pd.DataFrame]) -> Dict[str, pd.DataFrame]:
+    """
+    Parse the time column of each time-series table and sort the table by it.
+    
+    Sorted tables are marked with a 'sorted_by' attr, so time windows can be
+    sliced with binary search instead of scanning the table.
+    
+    Args:
+        data: Dictionary of data tables (modified in place)
+        
+    Returns:
+        The same dictionary
+    """
+    for table_name, column in TIME_COLUMNS.items():
+        table = data.get(table_name)
+        if table is None or column not in table.columns:
+            continue
+        if not pd.api.types.is_datetime64_any_dtype(table[column]):
+            table[column] = pd.to_datetime(table[column], errors='coerce')
+        if not table[column].is_monotonic_increasing:
+            # Stable, with unparseable dates last
+            table = table.sort_values(column, kind='stable', na_position='last', ignore_index=True)
+        table.attrs['sorted_by'] = column
+        data[table_name] = table
+    return data
+
+def source_version(data_dir: str = DATA_DIR) -> str:
+    """
+    Get a key of the source data that changes when any of its files changes.
+    
+    Args:
+        data_dir: Directory containing the exported CSV files
+        
+    Returns:
+        The path, size and modification time of every table file, or
+        'synthetic' if there are none
+    """
+    versions = []
+    for file_name in TABLE_FILES.values():
+        table_path = os.path.join(data_dir, file_name)
+        if os.path.exists(table_path):
+            stat = os.stat(table_path)
+            versions.append(f"{table_path}:{stat.st_size}:{stat.st_mtime_ns}")
+    return '|'.join(versions) or 'synthetic'
+
+def load_data(data_dir: str = DATA_DIR, shared_dir: str = SHARED_DATA_DIR) -> Dict[str, pd.DataFrame]:
+    """
+    Load the data tables for the chatbot.
+    
+    Args:
+        data_dir: Directory containing the exported CSV files
+        shared_dir: Directory to share the tables through between worker
+            processes ('' to load them in this process only)
+        
+    Returns:
+        Dictionary of data tables; synthetic data if no files are found
+    """
+    telemetry = get_telemetry()
+    with telemetry.span('load_data', mode='shared' if shared_dir else 'local') as span:
+        if shared_dir:
+            from shared_tables import load_shared
+            data = load_shared(shared_dir, source_version(data_dir), lambda: load_tables(data_dir))
+        else:
+            data = load_tables(data_dir)
+        span['rows'] = {table_name: len(table) for table_name, table in data.items()}
+    for table_name, table in data.items():
+        telemetry.set_gauge('table_rows', len(table), table=table_name)
+    return data
+
+def load_tables(data_dir: str = DATA_DIR) -> Dict[str, pd.DataFrame]:
+    """
+    Read the data tables into this process.
+    
+    Args:
+        data_dir: Directory containing the exported CSV files
+        
+    Returns:
+        Dictionary of data tables; synthetic data if no files are found
+    """
+    # Check if real data files exist
+    if os.path.exists(data_dir):
+        data = {}
+        
+        for table_name, file_name in TABLE_FILES.items():
+            table_path = os.path.join(data_dir, file_name)
+            if os.path.exists(table_path):
+                data[table_name] = pd.read_csv(table_path, low_memory=False, on_bad_lines='skip')
+                # Version key for memoized contexts: changes when the file changes
+                stat = os.stat(table_path)
+                data[table_name].attrs['data_version'] = f"{table_path}:{stat.st_size}:{stat.st_mtime_ns}"
+        
+        if data:
+            return sort_by_time(data)
+    
+    # If real data not available, generate synthetic data
+    data = generate_synthetic_data()
+    version = f"synthetic:{uuid.uuid4().hex}"
+    for table in data.values():
+        table.attrs['data_version'] = version
+    return data
+
+def generate_synthetic_data():
+    """Generate synthetic data for demonstration"""
+    # Generate invoices data
+    invoices = pd.DataFrame({
+        'invoice_number': [f'INV{i:03d}' for i in range(1, 101)],
+        'invoice_datetime': pd.date_range(start='2025-01-01', periods=100),
+        'buyer_emirate': np.random.choice(['Dubai', 'Abu Dhabi', 'Sharjah', 'Ajman', 'Fujairah', 'Ras Al Khaimah', 'Umm Al Quwain'], 100),
+        'seller_emirate': np.random.choice(['Dubai', 'Abu Dhabi', 'Sharjah', 'Ajman', 'Fujairah', 'Ras Al Khaimah', 'Umm Al Quwain'], 100),
+        'invoice_tax_amount': np.random.uniform(50, 500, 100),
+        'invoice_without_tax': np.random.uniform(1000, 10000, 100),
+        'invoice_type': np.random.choice(['Standard', 'Credit Note', 'Debit Note'], 100),
+        'invoice_category': np.random.choice(['Goods', 'Services', 'Mixed'], 100),
+        'invoice_sales_type': np.random.choice(['B2B', 'B2C', 'B2G'], 100),
+        'document_status': np.random.choice(['Issued', 'Paid', 'Cancelled'], 100),
+        'buyer_name': [f'Company {i}' for i in range(1, 101)],
+        'buyer_trn': [f'TRN{i:06d}' for i in range(1, 101)],
+        'seller_name': [f'Vendor {i % 20 + 1}' for i in range(1, 101)],
+        'seller_trn': [f'TRN{i % 20 + 1:06d}' for i in range(1, 101)],
+        'vat_rate': np.random.choice([5.0, 0.0], 100, p=[0.95, 0.05]),
+        'vat_category': np.random.choice(['Standard', 'Zero Rated', 'Exempt'], 100, p=[0.95, 0.03, 0.02]),
+        'is_anomaly': np.random.choice([0, 1], 100, p=[0.9, 0.1]),
+        'anomaly_type': np.random.choice([None, 'Duplicate', 'Round Amount', 'Just Under Limit', 'Foreign Bank'], 100, p=[0.9, 0.025, 0.025, 0.025, 0.025]),
+        'anomaly_risk_score': np.random.uniform(0, 1, 100)
+    })
+    
+    # Generate items data
+    items = pd.DataFrame({
+        'item_id': [f'ITEM{i:04d}' for i in range(1, 301)],
+        'invoice_id': [f'INV{np.random.randint(1, 101):03d}' for _ in range(1, 301)],
+        'item_name': [f'Product {i % 50 + 1}' for i in range(1, 301)],
+        'item_description': [f'Description for Product {i % 50 + 1}' for i in range(1, 301)],
+        'quantity': np.random.randint(1, 10, 300),
+        'unit_price': np.random.uniform(100, 1000, 300),
+        'line_discount': np.random.uniform(0, 50, 300),
+        'line_total': np.random.uniform(100, 5000, 300),
+        'line_vat_amount': np.random.uniform(5, 250, 300),
+        'hs_code': [f'HS{np.random.randint(1000, 9999)}' for _ in range(1, 301)]
+    })
+    
+    # Generate taxpayers data
+    taxpayers = pd.DataFrame({
+        'tax_number': [f'TRN{i:06d}' for i in range(1, 51)],
+        'name': [f'Company {i}' for i in range(1, 51)],
+        'registration_date': pd.date_range(start='2020-01-01', periods=50),
+        'vat_registration_date': pd.date_range(start='2020-01-15', periods=50),
+        'legal_entity_type': np.random.choice(['LLC', 'FZE', 'Sole Proprietorship', 'Partnership'], 50),
+        'business_size': np.random.choice(['Small', 'Medium', 'Large'], 50),
+        'sector': np.random.choice(['Retail', 'Manufacturing', 'Services', 'Construction', 'Technology'], 50),
+        'number_of_employees': np.random.randint(5, 500, 50),
+        'ownership_type': np.random.choice(['Local', 'Foreign', 'Mixed'], 50),
+        'tax_compliance_score': np.random.uniform(60, 100, 50),
+        'bank_account': [f'AE{np.random.randint(100000000, 999999999)}' for _ in range(1, 51)],
+        'bank_country': np.random.choice(['UAE', 'UAE', 'UAE', 'UAE', 'Other'], 50)
+    })
+    
+    # Generate audit logs data
+    audit_logs = pd.DataFrame({
+        'log_id': [f'LOG{i:05d}' for i in range(1, 201)],
+        'invoice_id': [f'INV{np.random.randint(1, 101):03d}' for _ in range(1, 201)],
+        'timestamp': pd.date_range(start='2025-01-01', periods=200),
+        'user_id': [f'USER{np.random.randint(1, 11):02d}' for _ in range(1, 201)],
+        'action_type': np.random.choice(['Create', 'Update', 'Delete', 'View'], 200),
+        'field_changed': np.random.choice(['Amount', 'Status', 'Date', 'Description', None], 200),
+        'old_value': [f'Old Value {i}' for i in range(1, 201)],
+        'new_value': [f'New Value {i}' for i in range(1, 201)],
+        'system_notes': [f'System note {i}' for i in range(1, 201)]
+    })
+    
+    return sort_by_time({
+        'invoices': invoices,
+        'items': items,
+        'taxpayers': taxpayers,
+        'audit_logs': audit_logs
+    })
+
+
+# Example usage
+if __name__ == "__main__":
+    data = load_data()
+    print(f"Source: {source_version()}")
+    for table_name, table in data.items():
+        print(f"{table_name}: {len(table)} rows, {len(table.columns)} columns")
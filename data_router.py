@@ -7,12 +7,35 @@ import re
 import pandas as pd
 from typing import Dict, List, Tuple, Set, Optional
 
+from entity_extractor import EntityExtractor
+from keyword_matcher import KeywordMatcher, detect_language
+from memo import BoundedMemo, freeze
+from routing_classifier import RoutingClassifier
+from telemetry import get_telemetry
+
 class DataRouter:
     """
     Routes user queries to the appropriate data tables based on content analysis.
     """
     
-    def __init__(self):
+    def __init__(self, matcher: Optional[KeywordMatcher] = None, classifier: Optional[RoutingClassifier] = None,
+                 cache_size: int = 1024, entity_extractor: Optional[EntityExtractor] = None):
+        """
+        Initialize the router.
+        
+        Args:
+            matcher: Keyword matcher to compile the keyword lists into
+                (a new one with Arabic normalization is created if omitted)
+            classifier: Trained classifier used instead of the default tables and
+                domains when no keyword matches (keyword routing only if omitted)
+            cache_size: Number of query contexts memoized (0 disables the memo)
+            entity_extractor: Extractor of the invoice numbers, TRNs, emirates and
+                amount thresholds that filter the data (a new one is created if omitted)
+        """
+        self.classifier = classifier
+        self.entity_extractor = entity_extractor or EntityExtractor()
+        self.context_memo = BoundedMemo(cache_size)
+        
         # Define table-specific keywords for routing
         self.table_keywords = {
             'invoices': {
@@ -95,6 +118,15 @@ class DataRouter:
                 'field_changed', 'old_value', 'new_value', 'system_notes'
             ]
         }
+
+        # Compile all keyword lists into one matcher; the response handler adds its own lists to it
+        self.matcher = matcher or KeywordMatcher()
+        self.matcher.add_keywords('tables', self.table_keywords)
+        self.matcher.add_keywords('domains', self.domain_keywords)
+        self.matcher.add_keywords('fields', {
+            table: [field.replace('_', ' ') for field in fields]
+            for table, fields in self.table_fields.items()
+        })
     
     def detect_language(self, query: str) -> str:
         """
@@ -107,72 +139,117 @@ class DataRouter:
             'ar' for Arabic, 'en' for English (default)
         """
         # Simple detection based on Arabic character presence
-        arabic_pattern = re.compile(r'[\u0600-\u06FF\u0750-\u077F\u08A0-\u08FF]+')
-        if arabic_pattern.search(query):
-            return 'ar'
-        return 'en'
+        return detect_language(query)
     
-    def route_query(self, query: str, selected_table: Optional[str] = None) -> Tuple[List[str], List[str]]:
+    def route_query(self, query: str, selected_table: Optional[str] = None,
+                    keyword_matches: Optional[Dict] = None) -> Tuple[List[str], List[str]]:
         """
         Route a user query to the appropriate data tables and domains.
         
         Args:
             query: The user's query text
             selected_table: User-selected table from UI (if any)
+            keyword_matches: Result of self.matcher.match(query), if already computed
             
         Returns:
             Tuple of (relevant_tables, relevant_domains)
         """
+        if keyword_matches is None:
+            keyword_matches = self.matcher.match(query)
+        
+        prediction = None
+        if self.classifier is not None and self._needs_classifier(keyword_matches, selected_table):
+            predictions = self.classifier.predict_many([query])
+            prediction = predictions[0] if predictions else None
+        
+        return self._route_with_matches(keyword_matches, selected_table, prediction)
+    
+    def route_many(self, queries: List[str], selected_table: Optional[str] = None) -> List[Tuple[List[str], List[str]]]:
+        """
+        Route a batch of queries, classifying all vague ones in one vectorized call.
+        
+        Args:
+            queries: The query texts
+            selected_table: User-selected table from UI (if any)
+            
+        Returns:
+            List of (relevant_tables, relevant_domains), one per query
+        """
+        all_matches = [self.matcher.match(query) for query in queries]
+        
+        predictions = [None] * len(queries)
+        if self.classifier is not None:
+            vague = [index for index, keyword_matches in enumerate(all_matches)
+                     if self._needs_classifier(keyword_matches, selected_table)]
+            if vague:
+                for index, prediction in zip(vague, self.classifier.predict_many([queries[i] for i in vague]) or []):
+                    predictions[index] = prediction
+        
+        return [self._route_with_matches(keyword_matches, selected_table, prediction)
+                for keyword_matches, prediction in zip(all_matches, predictions)]
+    
+    def _needs_classifier(self, keyword_matches: Dict, selected_table: Optional[str]) -> bool:
+        """Check whether keyword routing would fall back to its defaults."""
+        table_selected = bool(selected_table and selected_table.lower() != 'all')
+        no_tables = not (keyword_matches['tables'] or keyword_matches['fields'])
+        return (no_tables and not table_selected) or not keyword_matches['domains']
+    
+    def _route_with_matches(self, keyword_matches: Dict, selected_table: Optional[str],
+                            prediction: Optional[Dict[str, List[str]]] = None) -> Tuple[List[str], List[str]]:
+        """
+        Pick tables and domains from keyword matches, using the classifier's
+        prediction (if any) instead of the defaults.
+        """
+        prediction = prediction or {}
+        
+        # Get relevant domains
+        relevant_domains = self._domains_from_matches(keyword_matches, prediction.get('domains'))
+        
         # If user explicitly selected a table, prioritize it
         if selected_table and selected_table.lower() != 'all':
-            return [selected_table.lower()], self._get_relevant_domains(query)
-        
-        # Detect language
-        lang = self.detect_language(query)
-        query_lower = query.lower()
+            return [selected_table.lower()], relevant_domains
         
         # Check for explicit table mentions
-        relevant_tables = []
-        for table, keywords in self.table_keywords.items():
-            # Check if any keyword for this table is in the query
-            if any(keyword in query_lower for keyword in keywords[lang]):
-                relevant_tables.append(table)
+        relevant_tables = list(keyword_matches['tables'])
         
         # Check for field mentions if no tables found yet
         if not relevant_tables:
-            for table, fields in self.table_fields.items():
-                # Check if any field for this table is mentioned in the query
-                field_pattern = '|'.join([re.escape(field.replace('_', ' ')) for field in fields])
-                if re.search(field_pattern, query_lower):
-                    relevant_tables.append(table)
+            relevant_tables = list(keyword_matches['fields'])
+        
+        # Ask the classifier for vague questions
+        if not relevant_tables:
+            relevant_tables = list(prediction.get('tables') or [])
         
         # Default to invoices table if nothing specific was found
         if not relevant_tables:
             relevant_tables = ['invoices']
         
-        # Get relevant domains
-        relevant_domains = self._get_relevant_domains(query)
-        
         return relevant_tables, relevant_domains
     
-    def _get_relevant_domains(self, query: str) -> List[str]:
+    def _get_relevant_domains(self, query: str, keyword_matches: Optional[Dict] = None,
+                              predicted_domains: Optional[List[str]] = None) -> List[str]:
         """
         Identify relevant domains based on the query.
         
         Args:
             query: The user's query text
+            keyword_matches: Result of self.matcher.match(query), if already computed
+            predicted_domains: Classifier prediction used when no domain keyword matches
             
         Returns:
             List of relevant domain names
         """
-        lang = self.detect_language(query)
-        query_lower = query.lower()
+        if keyword_matches is None:
+            keyword_matches = self.matcher.match(query)
+        return self._domains_from_matches(keyword_matches, predicted_domains)
+    
+    def _domains_from_matches(self, keyword_matches: Dict, predicted_domains: Optional[List[str]] = None) -> List[str]:
+        """Merge matched domain keywords with the classifier's prediction, falling back to all domains."""
+        relevant_domains = list(keyword_matches['domains'])
         
-        relevant_domains = []
-        for domain, keywords in self.domain_keywords.items():
-            # Check if any keyword for this domain is in the query
-            if any(keyword in query_lower for keyword in keywords[lang]):
-                relevant_domains.append(domain)
+        # Ask the classifier for vague questions
+        if not relevant_domains and predicted_domains:
+            relevant_domains = list(predicted_domains)
         
         # Default to all domains if nothing specific was found
         if not relevant_domains:
@@ -180,27 +257,53 @@ class DataRouter:
         
         return relevant_domains
     
-    def get_query_context(self, query: str, selected_table: Optional[str] = None) -> Dict:
+    def get_query_context(self, query: str, selected_table: Optional[str] = None,
+                          selected_domain: Optional[str] = None) -> Dict:
         """
         Get comprehensive context about a query for the response generator.
         
+        Contexts are memoized per (query, selected table, selected domain) and
+        returned read-only; the language is derived from the query itself.
+        
         Args:
             query: The user's query text
             selected_table: User-selected table from UI (if any)
+            selected_domain: User-selected domain from UI (if any); overrides routing
             
         Returns:
-            Dictionary with query context information
+            Read-only mapping with query context information
         """
-        lang = self.detect_language(query)
-        tables, domains = self.route_query(query, selected_table)
+        selected_table = selected_table if selected_table and selected_table.lower() != 'all' else None
+        selected_domain = selected_domain if selected_domain and selected_domain.lower() != 'all' else None
+        with get_telemetry().span('route_query') as span:
+            query_context, hit = self.context_memo.lookup(
+                (query, selected_table, selected_domain),
+                lambda: freeze(self._build_query_context(query, selected_table, selected_domain))
+            )
+            span['cache'] = 'hit' if hit else 'miss'
+            span['tables'] = list(query_context['relevant_tables'])
+        return query_context
+    
+    def _build_query_context(self, query: str, selected_table: Optional[str],
+                             selected_domain: Optional[str]) -> Dict:
+        # Scan the query once; the matches are reused by the response handler
+        keyword_matches = self.matcher.match(query)
+        tables, domains = self.route_query(query, selected_table, keyword_matches)
+        
+        # Override domain if selected in UI
+        if selected_domain:
+            domains = [selected_domain]
         
         return {
             'query': query,
-            'language': lang,
+            'language': keyword_matches['language'],
             'relevant_tables': tables,
             'relevant_domains': domains,
             'primary_table': tables[0] if tables else 'invoices',
-            'primary_domain': domains[0] if domains else 'tax_compliance'
+            'primary_domain': domains[0] if domains else 'tax_compliance',
+            'keyword_matches': keyword_matches,
+            # Applied to the data tables before sampling, aggregation and charting
+            'filters': self.entity_extractor.extract(query)
         }
 
 
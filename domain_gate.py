@@ -0,0 +1,194 @@
+"""
+Local out-of-domain gate for the e-invoice chatbot.
+This module scores how likely a query is to be unrelated to e-invoice data
+from weighted word-boundary cues (off-topic subjects in English and Arabic)
+against the in-domain evidence the router and entity extractor already
+found, so clearly off-topic questions are answered locally instead of
+spending an API call.
+"""
+
+import math
+import re
+from typing import Dict, Iterable, List, Optional, Sequence
+
+from arabic_normalizer import normalize_query
+from memo import BoundedMemo, freeze
+
+# Off-topic cues per class: (weight, {'en': [...], 'ar': [...]}).
+# English cues are singular stems (a plural s/es is allowed); Arabic cues may
+# take the usual clitic prefixes (و ف ب ل ك, ال, لل) and a short suffix.
+OFF_TOPIC_CUES = {
+    # Subjects that are never about invoice data
+    'off_topic': (3.5, {
+        'en': ['weather', 'temperature', 'rain', 'recipe', 'cook', 'cooking', 'bake', 'joke', 'poem',
+               'capital of', 'celebrity', 'celebrities', 'singer', 'actor', 'actress', 'song', 'lyrics',
+               'horoscope', 'election', 'politics', 'political', 'news', 'who won', 'score of the',
+               'vacation', 'holiday destination', 'video game', 'tv show', 'girlfriend', 'boyfriend'],
+        'ar': ['طقس', 'درجة الحرارة', 'امطار', 'وصفة', 'طبخ', 'اطبخ', 'نكتة', 'قصيدة', 'عاصمة',
+               'مشاهير', 'مغني', 'ممثل', 'اغنية', 'اغاني', 'ابراج', 'انتخابات', 'سياسة', 'سياسية',
+               'اخبار', 'فاز', 'مباراة', 'عطلة', 'اجازة', 'لعبة فيديو', 'مسلسل']
+    }),
+    # Subjects that are off-topic on their own but also business sectors
+    # ("VAT on hotel invoices", "gaming companies"), so in-domain evidence outweighs them
+    'sector': (2.0, {
+        'en': ['restaurant', 'hotel', 'travel', 'tourism', 'flight', 'airline', 'game', 'gaming', 'music',
+               'sport', 'football', 'movie', 'film', 'cinema', 'entertainment', 'food'],
+        'ar': ['مطعم', 'مطاعم', 'فندق', 'فنادق', 'سفر', 'سياحة', 'طيران', 'رحلة', 'لعبة', 'العاب',
+               'موسيقى', 'رياضة', 'كرة القدم', 'افلام', 'فيلم', 'سينما', 'ترفيه', 'طعام']
+    }),
+    # Requests typical of chit-chat and personal assistants
+    'request': (1.0, {
+        'en': ['recommend', 'suggest', 'book', 'plan', 'tell me', 'watch', 'play', 'listen'],
+        'ar': ['اقترح', 'احجز', 'خطط', 'اخبرني', 'مشاهدة', 'لمشاهدتها', 'العب']
+    })
+}
+
+# Business vocabulary the routing keywords do not cover
+DOMAIN_CUES = (1.5, {
+    'en': ['company', 'companies', 'business', 'sector', 'industry', 'supplier', 'vendor', 'customer',
+           'merchant', 'purchase', 'sale', 'pay', 'paid', 'payment', 'transaction', 'dirham', 'aed',
+           'refund', 'credit note'],
+    'ar': ['شركة', 'شركات', 'قطاع', 'مورد', 'موردين', 'عميل', 'عملاء', 'تاجر', 'مشتريات', 'مبيعات',
+           'مدفوعات', 'دفع', 'معاملات', 'درهم', 'دراهم', 'استرداد']
+})
+
+# Weight of each matched routing keyword label, per keyword category; domain
+# keywords include place names and generic words ("trend"), so they count less
+ROUTING_WEIGHTS = {'tables': 1.5, 'fields': 1.5, 'domains': 0.5}
+
+# Filters that only make sense for invoice data (emirates and dates do not:
+# "weather in Dubai yesterday")
+FILTER_WEIGHT = 3.0
+DOMAIN_FILTER_FIELDS = {'invoice_number', 'trn', 'total_amount', 'tax_amount', 'line_amount', 'line_tax_amount'}
+
+ARABIC_PREFIX = r'(?:[وفبلك]?(?:ال|لل)?)'
+ARABIC_SUFFIX = r'[ء-ي]{0,3}'
+
+
+def _cue_pattern(cues: Dict[str, List[str]]) -> re.Pattern:
+    """Compile the English and Arabic cues of one class into one word-boundary regex."""
+    english = sorted((normalize_query(cue) for cue in cues.get('en', [])), key=len, reverse=True)
+    arabic = sorted((normalize_query(cue) for cue in cues.get('ar', [])), key=len, reverse=True)
+    branches = []
+    if english:
+        words = '|'.join(re.escape(cue).replace(r'\ ', r'\s+') for cue in english)
+        branches.append(rf'\b(?:{words})(?:e?s)?\b')
+    if arabic:
+        words = '|'.join(re.escape(cue).replace(r'\ ', r'\s+') for cue in arabic)
+        branches.append(rf'(?<!\w){ARABIC_PREFIX}(?:{words}){ARABIC_SUFFIX}(?!\w)')
+    return re.compile('(' + '|'.join(branches) + ')')
+
+
+class DomainGate:
+    """
+    Scores queries as in domain, out of domain or uncertain, with cached verdicts.
+
+    The score is a logistic function of the off-topic cue weights minus the
+    in-domain evidence: routing keyword hits, business vocabulary and
+    invoice-specific filters. Without any cue the score is 0.5 (uncertain),
+    so only queries with clear off-topic evidence are answered locally.
+    """
+
+    def __init__(self, out_threshold: float = 0.8, in_threshold: float = 0.3, cache_size: int = 4096):
+        """
+        Initialize the gate.
+
+        Args:
+            out_threshold: Score from which a query is out of domain
+            in_threshold: Score up to which a query is in domain
+            cache_size: Number of verdicts memoized
+        """
+        self.out_threshold = out_threshold
+        self.in_threshold = in_threshold
+        self.off_topic_patterns = [(weight, _cue_pattern(cues)) for weight, cues in OFF_TOPIC_CUES.values()]
+        self.domain_pattern = _cue_pattern(DOMAIN_CUES[1])
+        self.memo = BoundedMemo(cache_size)
+
+    def check(self, query: str, keyword_matches: Optional[Dict] = None,
+              filters: Optional[Sequence[Dict]] = None) -> Dict:
+        """
+        Get the verdict for a query.
+
+        Verdicts are memoized per query; keyword matches and filters are
+        derived from the query alone, so they are not part of the key.
+
+        Args:
+            query: The user's query text
+            keyword_matches: The router's KeywordMatcher result for the query
+            filters: Filters extracted from the query
+
+        Returns:
+            Read-only mapping with 'verdict' ('in_domain', 'out_of_domain' or
+            'uncertain'), 'score' (probability of being out of domain),
+            'confidence' (probability of the verdict's side) and the matched
+            'off_topic_cues' and 'domain_cues'
+        """
+        return self.memo.get_or_compute(query, lambda: freeze(self._score(query, keyword_matches, filters)))
+
+    def _score(self, query: str, keyword_matches: Optional[Dict], filters: Optional[Sequence[Dict]]) -> Dict:
+        text = normalize_query(query)
+        logit = 0.0
+        off_topic_cues = []
+        for weight, pattern in self.off_topic_patterns:
+            for cue in _distinct(pattern.findall(text)):
+                logit += weight
+                off_topic_cues.append(cue)
+
+        domain_cues = _distinct(self.domain_pattern.findall(text))
+        logit -= DOMAIN_CUES[0] * len(domain_cues)
+        for category, weight in ROUTING_WEIGHTS.items():
+            for label in (keyword_matches or {}).get(category, ()):
+                logit -= weight
+                domain_cues.append(label)
+        for item in filters or ():
+            if item['field'] in DOMAIN_FILTER_FIELDS:
+                logit -= FILTER_WEIGHT
+                domain_cues.append(item['field'])
+
+        score = 1.0 / (1.0 + math.exp(-logit))
+        if score >= self.out_threshold:
+            verdict = 'out_of_domain'
+        elif score <= self.in_threshold:
+            verdict = 'in_domain'
+        else:
+            verdict = 'uncertain'
+        return {
+            'verdict': verdict,
+            'score': score,
+            'confidence': max(score, 1.0 - score),
+            'off_topic_cues': off_topic_cues,
+            'domain_cues': domain_cues
+        }
+
+
+def _distinct(items: Iterable[str]) -> List[str]:
+    """Deduplicate while keeping the first-seen order."""
+    return list(dict.fromkeys(items))
+
+
+# Example usage
+if __name__ == "__main__":
+    import time
+    from data_router import DataRouter
+
+    router = DataRouter()
+    gate = DomainGate()
+    test_queries = [
+        "What's the weather like in Dubai today?",
+        "Total VAT on invoices from gaming companies",
+        "Recommend a good restaurant near my hotel",
+        "Which hotels paid the most VAT last quarter?",
+        "Tell me a joke",
+        "What is the growth in invoice volume?",
+        "ما هو الطقس اليوم في دبي؟",
+        "إجمالي ضريبة القيمة المضافة لشركات الألعاب",
+        "هل يمكنك مساعدتي؟"
+    ]
+
+    for query in test_queries:
+        query_context = router.get_query_context(query)
+        started = time.perf_counter()
+        verdict = gate.check(query, query_context['keyword_matches'], query_context['filters'])
+        elapsed = (time.perf_counter() - started) * 1e6
+        print(f"{query} -> {verdict['verdict']} ({verdict['score']:.2f}, {elapsed:.0f} us) "
+              f"off-topic {list(verdict['off_topic_cues'])}, domain {list(verdict['domain_cues'])}")
@@ -0,0 +1,551 @@
+"""
+Entity extraction and filter pushdown for the e-invoice chatbot.
+This module extracts invoice numbers, TRNs, emirates and amount thresholds
+from English and Arabic queries, turns them into structured filters, and
+applies the filters to the data tables before sampling, aggregation and
+charting, so a question about one invoice only touches that invoice's rows.
+"""
+
+import re
+from typing import Dict, Hashable, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from arabic_normalizer import normalize_digits, normalize_query
+from data_loader import TIME_COLUMNS
+from memo import BoundedMemo, data_version
+from temporal_parser import MONTHS, parse_period, resolve_period, time_slice
+
+# Canonical emirate names as stored in the data, with English and Arabic aliases
+EMIRATE_ALIASES = {
+    'Abu Dhabi': ['abu dhabi', 'abudhabi', 'أبو ظبي', 'أبوظبي', 'ابو ظبي', 'ابوظبي'],
+    'Dubai': ['dubai', 'دبي'],
+    'Sharjah': ['sharjah', 'الشارقة', 'الشارقه'],
+    'Ajman': ['ajman', 'عجمان'],
+    'Umm Al Quwain': ['umm al quwain', 'أم القيوين', 'ام القيوين'],
+    'Ras Al Khaimah': ['ras al khaimah', 'رأس الخيمة', 'راس الخيمة', 'رأس الخيمه'],
+    'Fujairah': ['fujairah', 'الفجيرة', 'الفجيره']
+}
+
+# Arabic display names of the emirates
+EMIRATE_NAMES_AR = {
+    'Abu Dhabi': 'أبو ظبي', 'Dubai': 'دبي', 'Sharjah': 'الشارقة', 'Ajman': 'عجمان',
+    'Umm Al Quwain': 'أم القيوين', 'Ras Al Khaimah': 'رأس الخيمة', 'Fujairah': 'الفجيرة'
+}
+
+# Columns each filter field applies to, per table; a row matches if any listed column matches.
+# Tables without an entry are left unfiltered.
+FILTER_COLUMNS = {
+    'invoice_number': {'invoices': ['invoice_number'], 'items': ['invoice_id'], 'audit_logs': ['invoice_id']},
+    'trn': {'invoices': ['buyer_trn', 'seller_trn'], 'taxpayers': ['tax_number']},
+    'buyer_emirate': {'invoices': ['buyer_emirate']},
+    'seller_emirate': {'invoices': ['seller_emirate']},
+    'total_amount': {'invoices': ['invoice_without_tax']},
+    'tax_amount': {'invoices': ['invoice_tax_amount']},
+    'line_amount': {'items': ['line_total']},
+    'line_tax_amount': {'items': ['line_vat_amount']},
+    'date': {table_name: [column] for table_name, column in TIME_COLUMNS.items()}
+}
+
+# Identifier fields, looked up through a hash index instead of a full scan
+ID_FIELDS = {'invoice_number', 'trn'}
+
+# Patterns run on the normalized query (lowercase, Arabic folded, ASCII digits)
+INVOICE_PATTERNS = [
+    re.compile(r'\b(inv[-_/]?\d[\w/-]*)'),
+    re.compile(r'(?:invoice|فاتوره)s?\s*(?:number|no\.?|num|id|رقم)\s*[:#]?\s*(\d+)'),
+    re.compile(r'(?:invoice|فاتوره)s?\s*#?\s*(\d+)\b'),
+    re.compile(r'#\s?(\d+)\b')
+]
+TRN_PATTERNS = [
+    re.compile(r'\b(trn\d+)\b'),
+    re.compile(r'\btrn\s*(?:number|no\.?|#|:)?\s*(\d+)'),
+    re.compile(r'رقم التسجيل الضريبي\s*:?\s*(\d+)'),
+    re.compile(r'\b(\d{15})\b')
+]
+
+_NUMBER = r'(?P<number>\d[\d,]*(?:\.\d+)?)\s*(?P<unit>k|m|thousand|million|الف|مليون)?\b'
+_CURRENCY = r'(?:aed|dhs?|dirhams?|درهم|دراهم)'
+# Comparison phrases (regular expressions on normalized text); Arabic verbs may be
+# followed by the noun they compare ("تزيد قيمتها عن")
+_ARABIC_MORE = r'(?:يزيد|تزيد|يتجاوز|تتجاوز)(?:\s+\S+)?\s*(?:عن|علي)?'
+THRESHOLD_OPERATORS = {
+    '>=': [r'at least', r'minimum(?: of)?', r'>=', r'لا (?:يقل|تقل)(?:\s+\S+)?\s+عن'],
+    '<=': [r'at most', r'maximum(?: of)?', r'up to', r'<=', r'لا (?:يزيد|تزيد)(?:\s+\S+)?\s+عن'],
+    '>': [r'above', r'over', r'more than', r'greater than', r'higher than', r'larger than', r'exceed(?:s|ing)?',
+          r'>', r'(?:اكثر|اعلي|اكبر) من', r'فوق', _ARABIC_MORE],
+    '<': [r'below', r'under', r'less than', r'lower than', r'smaller than', r'<', r'(?:اقل|ادني) من',
+          r'تحت', r'دون']
+}
+_OPERATOR_GROUPS = {'ge': '>=', 'le': '<=', 'gt': '>', 'lt': '<'}
+THRESHOLD_PATTERN = re.compile(
+    r'(?<![\w<>])(?:' + '|'.join(
+        f"(?P<{name}>{'|'.join(THRESHOLD_OPERATORS[op])})" for name, op in _OPERATOR_GROUPS.items()
+    ) + rf')\s*(?P<pre>{_CURRENCY})?\s*{_NUMBER}\s*(?P<post>{_CURRENCY}|%|percent|بالمئه)?'
+)
+# Comparisons written after the amount ("2000 aed or more", "٥٠٠ درهم فأكثر")
+SUFFIX_OPERATORS = {
+    '>=': [r'or (?:more|above|over|higher|greater)', r'and (?:above|over|more)', r'(?:او\s*|ف)(?:اكثر|اعلي|فوق)'],
+    '<=': [r'or (?:less|below|under|lower)', r'and (?:below|under|less)', r'(?:او\s*|ف)(?:اقل|ادني)']
+}
+SUFFIX_THRESHOLD_PATTERN = re.compile(
+    rf'(?<![\w.,])(?P<pre>{_CURRENCY})?\s*{_NUMBER}\s*(?P<post>{_CURRENCY}|%|percent|بالمئه)?\s*(?:'
+    + '|'.join(f"(?P<{name}>{'|'.join(SUFFIX_OPERATORS[op])})" for name, op in _OPERATOR_GROUPS.items()
+               if op in SUFFIX_OPERATORS) + r')(?!\w)'
+)
+# Ranges: "between 1000 and 2000 AED", "from 5000 to 10000 aed", "من ٥٠٠٠ الى ١٠٠٠٠ درهم"
+BETWEEN_PATTERN = re.compile(
+    rf'(?:(?:between|بين)\s*(?P<pre>{_CURRENCY})?\s*{_NUMBER}\s*{_CURRENCY}?\s*(?:and|to|-|و)'
+    rf'|(?:\bfrom|(?<!\S)من)\s*(?P<from_pre>{_CURRENCY})?\s*(?P<from_number>\d[\d,]*(?:\.\d+)?)\s*'
+    rf'(?P<from_unit>k|m|thousand|million|الف|مليون)?\b\s*{_CURRENCY}?\s*(?:to|till|until|-|الي|حتي))\s*'
+    rf'{_CURRENCY}?\s*(?P<upper>\d[\d,]*(?:\.\d+)?)\s*(?P<upper_unit>k|m|thousand|million|الف|مليون)?\b\s*'
+    rf'(?P<post>{_CURRENCY}|%)?'
+)
+# A bare range of years or days ("from 2023 to 2024", "between 1 and 3 march") is a period
+_YEAR_NUMBER = re.compile(r'(?:19|20)\d\d')
+DATE_AFTER = re.compile(r'\s*(?:of\s+)?(?:' + '|'.join(
+    re.escape(normalize_query(word)) for words in MONTHS.values() for word in sorted(words, key=len, reverse=True)
+) + r')(?!\w)')
+_MULTIPLIERS = {'k': 1e3, 'thousand': 1e3, 'الف': 1e3, 'm': 1e6, 'million': 1e6, 'مليون': 1e6}
+
+# Without a currency or magnitude, a number is only a threshold if the query talks about money
+AMOUNT_WORDS = re.compile(r'amount|value|worth|total|vat|tax|price|revenue|sales|مبلغ|قيمه|ضريب|سعر|اجمالي|ايراد')
+# A threshold is on the tax amount only if a tax word names what it compares: right before
+# the comparison ("vat over 500", "tax amount between", "ضريبه القيمه المضافه اكثر من")
+# or right after the amount ("500 aed of vat", "500 درهم ضريبه")
+_TAX_WORD = r'(?:\b(?:vat|tax(?:es)?)\b|\S*ضريب\S*(?:\s+القيمه\s+المضافه)?)'
+_TAX_FILLER = r'(?:amounts?|values?|totals?|of|is|was|were|paid|charged|collected|مبلغ|المبلغ|قيمه|قيمتها|اجمالي|فيها)'
+TAX_BEFORE = re.compile(rf'{_TAX_WORD}(?:\s+{_TAX_FILLER})*\s*$')
+TAX_AFTER = re.compile(rf'\s*(?:(?:of|in)\s+)?{_TAX_WORD}')
+# Thresholds apply to line items rather than invoices when the query is about items
+ITEM_WORDS = re.compile(r'\b(?:items?|line|lines|products?|goods)\b|بند|بنود|منتج|عنصر|عناصر')
+# ...and if it does not count something ("more than 10 invoices")
+COUNT_NOUN = re.compile(r'\s*(?:invoices?|items?|transactions?|times|days?|weeks?|months?|years?|taxpayers?|'
+                        r'companies|vendors?|sellers?|buyers?|فاتوره|فواتير|مرات|مره|ايام|يوم|اشهر|شهر|سنوات|سنه)\b')
+# Words that exclude the entity after them ("not from Dubai", "excluding INV-001", "باستثناء دبي")
+NEGATION_BEFORE = re.compile(
+    r"(?:\b(?:not|non|outside|excluding|exclude|except|other than|apart from|besides|without)|n't|"
+    r'غير|باستثناء|استثناء|عدا|خارج|سوي|ليس|ليست)'
+    r'(?:\s+(?:from|in|of|for|by|to|the|including|any|من|في))*[\s-]*$'
+)
+# ...and the entities listed after an excluded one ("excluding Dubai and Sharjah")
+LIST_JOINER = re.compile(r'\s*,?\s*(?:(?:and|or|nor|&|او)\s+|و\s*)?')
+SELLER_WORDS = re.compile(r'\b(?:seller|sellers|vendor|vendors|supplier|suppliers|sold)\b|بائع|مورد|البائع')
+
+
+def _parse_number(number: str, multiplier: Optional[str]) -> float:
+    return float(number.replace(',', '')) * _MULTIPLIERS.get(multiplier or '', 1.0)
+
+
+def _excluded(text: str, start: int, excluded_ends: Sequence[int]) -> bool:
+    """Whether the entity at start follows a negation or is listed right after an excluded entity."""
+    return bool(NEGATION_BEFORE.search(text, 0, start)) or any(
+        end <= start and LIST_JOINER.fullmatch(text, end, start) for end in excluded_ends)
+
+
+def canonical_id(value: str) -> str:
+    """Canonical form of an identifier: uppercase letters and digits only ('inv-001' -> 'INV001')."""
+    return re.sub(r'[^0-9A-Z]', '', str(value).upper())
+
+
+def _trailing_number(value: str) -> Optional[int]:
+    match = re.search(r'(\d+)$', value)
+    return int(match.group(1)) if match else None
+
+
+def filter_key(filters: Sequence) -> Hashable:
+    """Hashable key for a list of (possibly frozen) filter mappings."""
+    return tuple(tuple(sorted((name, tuple(value) if isinstance(value, (list, tuple)) else value)
+                              for name, value in item.items()))
+                 for item in filters)
+
+
+class EntityExtractor:
+    """
+    Extracts filterable entities from queries and applies them to data tables.
+    """
+
+    def __init__(self, cache_size: int = 16):
+        """
+        Initialize the extractor.
+
+        Args:
+            cache_size: Number of identifier indexes and filtered tables kept
+                (per data version and filter set; 0 disables the caches)
+        """
+        self.emirate_names = list(EMIRATE_ALIASES.keys())
+        self.emirate_pattern = re.compile('|'.join(
+            '(?P<e{}>{})'.format(index, '|'.join(
+                re.escape(alias) for alias in sorted({normalize_query(alias) for alias in aliases},
+                                                     key=len, reverse=True)))
+            for index, aliases in enumerate(EMIRATE_ALIASES.values())
+        ))
+        self.index_memo = BoundedMemo(cache_size)
+        self.filter_memo = BoundedMemo(cache_size)
+
+    def find_emirates(self, query: str, excluded: bool = False) -> List[str]:
+        """
+        Find the emirates mentioned in a query.
+
+        Args:
+            query: The user's query text
+            excluded: Return the emirates the query excludes ("not from Dubai",
+                "excluding Dubai and Sharjah", "باستثناء دبي") instead of the
+                ones it asks about
+
+        Returns:
+            Canonical emirate names in order of first mention
+        """
+        text = normalize_query(query)
+        emirates, excluded_ends = [], []
+        for match in self.emirate_pattern.finditer(text):
+            negated = _excluded(text, match.start(), excluded_ends)
+            if negated:
+                excluded_ends.append(match.end())
+            emirate = self.emirate_names[int(match.lastgroup[1:])]
+            if negated == excluded and emirate not in emirates:
+                emirates.append(emirate)
+        return emirates
+
+    def extract(self, query: str) -> List[Dict]:
+        """
+        Extract structured filters from a query.
+
+        Filters are dictionaries with a 'field' (a key of FILTER_COLUMNS) and
+        an 'op': 'in' with 'values' for identifiers and emirates ('not in'
+        for emirates after a negation such as "not from" or "excluding";
+        excluded identifiers are left out rather than filtered), or a
+        comparison ('>', '>=', '<', '<=', 'between') with 'value' (and
+        'upper' for 'between') for amounts, or 'period' with 'start' and
+        'end' edges from temporal_parser for dates (resolved against the
+        data by resolve_filters).
+
+        Args:
+            query: The user's query text
+
+        Returns:
+            List of filters (empty if the query names no entity)
+        """
+        text = normalize_digits(normalize_query(query))
+        filters = []
+
+        invoices = self._find_ids(text, INVOICE_PATTERNS)
+        if invoices:
+            filters.append({'field': 'invoice_number', 'op': 'in', 'values': invoices})
+        trns = self._find_ids(text, TRN_PATTERNS)
+        if trns:
+            filters.append({'field': 'trn', 'op': 'in', 'values': trns})
+
+        role = 'seller' if SELLER_WORDS.search(text) else 'buyer'
+        emirates = self.find_emirates(query)
+        if emirates:
+            filters.append({'field': f'{role}_emirate', 'op': 'in', 'values': emirates})
+        emirates = self.find_emirates(query, excluded=True)
+        if emirates:
+            filters.append({'field': f'{role}_emirate', 'op': 'not in', 'values': emirates})
+
+        amount_spans = []
+        filters.extend(self._find_thresholds(text, amount_spans))
+
+        period = parse_period(query, amount_spans)
+        if period:
+            filters.append({'field': 'date', 'op': 'period', 'start': period[0], 'end': period[1]})
+        return filters
+
+    def _find_ids(self, text: str, patterns: List[re.Pattern]) -> List[str]:
+        ids, excluded, excluded_ends = [], [], []
+        for pattern in patterns:
+            for match in pattern.finditer(text):
+                value = match.group(1)
+                # A bare four-digit number after "invoice" is more likely a year
+                if pattern is INVOICE_PATTERNS[2] and re.fullmatch(r'(?:19|20)\d\d', value):
+                    continue
+                value = canonical_id(value)
+                # "All invoices except INV-001" must not narrow the data to INV-001
+                if _excluded(text, match.start(), excluded_ends) or any(found.endswith(value) for found in excluded):
+                    excluded_ends.append(match.end())
+                    excluded.append(value)
+                    continue
+                # Skip repeats and bare numbers already found with their prefix ('TRN000007', '000007')
+                if not any(found.endswith(value) for found in ids):
+                    ids.append(value)
+        return ids
+
+    def _find_thresholds(self, text: str, spans: List[Tuple[int, int]]) -> List[Dict]:
+        """Find amount thresholds and ranges, appending the span of each to spans."""
+        items = bool(ITEM_WORDS.search(text))
+
+        def field(match: re.Match) -> str:
+            # "Total VAT for invoices above 5000 AED" compares the invoice amount, not the VAT
+            taxed = bool(TAX_BEFORE.search(text, 0, match.start()) or TAX_AFTER.match(text, match.end()))
+            if items:
+                return 'line_tax_amount' if taxed else 'line_amount'
+            return 'tax_amount' if taxed else 'total_amount'
+
+        # A currency or magnitude on one side of a range ("above 100 and below 500 AED") makes
+        # the bare numbers compared alongside it amounts too
+        ranges = [match for match in BETWEEN_PATTERN.finditer(text)
+                  if match.group('post') != '%' and not self._is_date_range(text, match)]
+        comparisons = [match for match in [*THRESHOLD_PATTERN.finditer(text), *SUFFIX_THRESHOLD_PATTERN.finditer(text)]
+                       if match.group('post') not in ('%', 'percent', 'بالمئه')]
+        mentions_amount = bool(AMOUNT_WORDS.search(text)) or any(
+            match.group('pre') or match.group('post') or match.group('unit')
+            or (match.re is BETWEEN_PATTERN and (match.group('from_pre') or match.group('from_unit')))
+            for match in [*ranges, *comparisons])
+        filters = []
+
+        for match in ranges:
+            if COUNT_NOUN.match(text, match.end()):
+                continue
+            if match.group('from_number'):
+                number, unit = match.group('from_number'), match.group('from_unit')
+            else:
+                number, unit = match.group('number'), match.group('unit')
+            if not (unit or match.group('upper_unit') or mentions_amount):
+                continue
+            low = _parse_number(number, unit)
+            high = _parse_number(match.group('upper'), match.group('upper_unit'))
+            if not unit and match.group('upper_unit') and low < float(match.group('upper').replace(',', '')):
+                # "between 5 and 10 million": the magnitude covers both sides
+                low = _parse_number(number, match.group('upper_unit'))
+            spans.append(match.span())
+            filters.append({'field': field(match), 'op': 'between', 'value': min(low, high), 'upper': max(low, high)})
+
+        for match in comparisons:
+            if any(match.start() < end and match.end() > start for start, end in spans):
+                continue
+            if not mentions_amount or COUNT_NOUN.match(text, match.end()):
+                continue
+            op = next(op for name, op in _OPERATOR_GROUPS.items() if match.groupdict().get(name))
+            spans.append(match.span())
+            filters.append({'field': field(match), 'op': op, 'value': _parse_number(match.group('number'), match.group('unit'))})
+        return filters
+
+    @staticmethod
+    def _is_date_range(text: str, match: re.Match) -> bool:
+        """Whether a range without a currency is a span of years or days rather than amounts."""
+        if match.group('pre') or match.group('from_pre') or match.group('post'):
+            return False
+        low = match.group('number') or match.group('from_number')
+        return bool(DATE_AFTER.match(text, match.end())
+                    or (_YEAR_NUMBER.fullmatch(low) and _YEAR_NUMBER.fullmatch(match.group('upper'))))
+
+    def _id_index(self, table: pd.DataFrame, version: Hashable, column: str) -> Tuple[pd.Index, pd.Index]:
+        """Hash indexes of a column's canonical identifiers and their trailing numbers."""
+        def build():
+            canonical = table[column].astype(str).str.upper().str.replace(r'[^0-9A-Z]', '', regex=True)
+            numbers = pd.to_numeric(canonical.str.extract(r'(\d+)$')[0], errors='coerce')
+            return pd.Index(canonical.to_numpy()), pd.Index(numbers.to_numpy())
+        return self.index_memo.get_or_compute((version, column), build)
+
+    def _lookup(self, table: pd.DataFrame, version: Hashable, columns: List[str], values: Sequence) -> np.ndarray:
+        """Positions of the rows whose identifier columns match any of the values."""
+        positions = []
+        for column in columns:
+            canonical_index, number_index = self._id_index(table, version, column)
+            for value in values:
+                found = canonical_index.get_indexer_for([value])
+                found = found[found >= 0]
+                if not len(found):
+                    # 'INV1', '#1' or 'TRN 1' still find 'INV001' and 'TRN000001'
+                    number = _trailing_number(value)
+                    if number is not None:
+                        found = number_index.get_indexer_for([number])
+                        found = found[found >= 0]
+                positions.append(found)
+        return np.unique(np.concatenate(positions)) if positions else np.array([], dtype=int)
+
+    def _mask(self, table: pd.DataFrame, columns: List[str], item) -> np.ndarray:
+        """Boolean mask of the rows matching a value or range filter on any of the columns."""
+        if item['op'] == 'not in':
+            # Excluded values: a row is kept only if none of its columns holds one
+            return ~self._mask(table, columns, {'op': 'in', 'values': item['values']})
+        mask = np.zeros(len(table), dtype=bool)
+        for column in columns:
+            values = table[column]
+            op = item['op']
+            if op == 'in':
+                mask |= values.isin(list(item['values'])).to_numpy()
+                continue
+            values = pd.to_numeric(values, errors='coerce').to_numpy()
+            if op == '>':
+                mask |= values > item['value']
+            elif op == '>=':
+                mask |= values >= item['value']
+            elif op == '<':
+                mask |= values < item['value']
+            elif op == '<=':
+                mask |= values <= item['value']
+            elif op == 'between':
+                mask |= (values >= item['value']) & (values <= item['upper'])
+        return mask
+
+    def reference_date(self, data_tables: Dict[str, pd.DataFrame]) -> pd.Timestamp:
+        """
+        Get the "today" that relative periods such as "last month" count from.
+
+        This is the latest date in the data (invoices first), so an exported
+        snapshot answers relative questions about its own last months; tables
+        filtered by a period keep the reference they were filtered with.
+
+        Args:
+            data_tables: Dictionary of data tables
+
+        Returns:
+            The reference date (the current date if the data has no dates)
+        """
+        for table_name, (column,) in FILTER_COLUMNS['date'].items():
+            table = data_tables.get(table_name)
+            if table is None or column not in table.columns:
+                continue
+            if 'reference_date' in table.attrs:
+                return pd.Timestamp(table.attrs['reference_date'])
+
+            def latest():
+                dates = table[column]
+                if table.attrs.get('sorted_by') == column:
+                    dates = dates.iloc[-int(dates.isna().sum()) - 1:]
+                elif not pd.api.types.is_datetime64_any_dtype(dates):
+                    dates = pd.to_datetime(dates, errors='coerce')
+                return dates.max()
+
+            reference = self.index_memo.get_or_compute((data_version({table_name: table}), 'latest', column), latest)
+            if pd.notna(reference):
+                return pd.Timestamp(reference).tz_localize(None)
+        return pd.Timestamp.now().normalize()
+
+    def resolve_filters(self, filters: Sequence, data_tables: Dict[str, pd.DataFrame]) -> List:
+        """
+        Resolve period filters to date windows against the data's reference date.
+
+        Args:
+            filters: Filters from extract()
+            data_tables: Dictionary of data tables the filters will be applied to
+
+        Returns:
+            The filters, with each 'period' replaced by a 'window' filter whose
+            'start' and (exclusive) 'end' are ISO timestamps or None, and whose
+            'reference' is the reference date used
+        """
+        if not any(item['op'] == 'period' for item in filters):
+            return list(filters)
+        reference = self.reference_date(data_tables)
+        resolved = []
+        for item in filters:
+            if item['op'] == 'period':
+                start, end = resolve_period(item['start'], item['end'], reference)
+                item = {'field': item['field'], 'op': 'window',
+                        'start': start.isoformat() if start is not None else None,
+                        'end': end.isoformat() if end is not None else None,
+                        'reference': reference.isoformat()}
+            resolved.append(item)
+        return resolved
+
+    def filter_table(self, table_name: str, table: pd.DataFrame, filters: Sequence) -> pd.DataFrame:
+        """
+        Apply the filters that concern one table.
+
+        Identifier filters are resolved first through a cached hash index, so
+        only the matching rows are touched; date windows are then sliced with
+        binary search on time-sorted tables, and value and range filters are
+        applied as vectorized masks. Filters whose columns the table lacks are
+        ignored.
+
+        Args:
+            table_name: Name of the table (selects the columns of each filter)
+            table: The table
+            filters: Filters from extract(); periods are resolved against this
+                table alone unless resolve_filters was applied first
+
+        Returns:
+            The filtered table (the table itself if no filter applies or the
+            filters keep every row), with a 'data_version' attr derived from
+            the table's and the filters and the 'filtered' attr set
+        """
+        applicable = [(item, columns) for item in filters
+                      for columns in [[column for column in FILTER_COLUMNS.get(item['field'], {}).get(table_name, [])
+                                       if column in table.columns]]
+                      if columns]
+        if not applicable:
+            return table
+        if any(item['op'] == 'period' for item, _ in applicable):
+            return self.filter_table(table_name, table, self.resolve_filters(filters, {table_name: table}))
+
+        version = data_version({table_name: table})
+        key = (version, filter_key([item for item, _ in applicable]))
+
+        def compute():
+            result = table
+            id_filters = [(item, columns) for item, columns in applicable if item['field'] in ID_FIELDS]
+            if id_filters:
+                positions = None
+                for item, columns in id_filters:
+                    found = self._lookup(table, version, columns, item['values'])
+                    positions = found if positions is None else np.intersect1d(positions, found)
+                result = table.iloc[positions]
+            for item, columns in applicable:
+                if item['op'] == 'window':
+                    start, end = (pd.Timestamp(item[edge]) if item[edge] else None for edge in ('start', 'end'))
+                    result = time_slice(result, columns[0], start, end)
+                    result.attrs['reference_date'] = item['reference']
+            for item, columns in applicable:
+                if item['field'] not in ID_FIELDS and item['op'] != 'window':
+                    result = result[self._mask(result, columns, item)]
+            if len(result) == len(table):
+                # The filters keep every row: share the table, its version and its memoized results
+                return table
+            result.attrs['data_version'] = f"{table.attrs.get('data_version') or version}|{hash(key[1]):x}"
+            result.attrs['filtered'] = True
+            return result
+
+        return self.filter_memo.get_or_compute(key, compute)
+
+    def apply_filters(self, data_tables: Dict[str, pd.DataFrame], filters: Sequence) -> Dict[str, pd.DataFrame]:
+        """
+        Apply query filters to all data tables.
+
+        Args:
+            data_tables: Dictionary of data tables
+            filters: Filters from extract() (e.g. a query context's 'filters');
+                periods are resolved against the reference date of all tables
+
+        Returns:
+            Dictionary of filtered tables (the input itself when there are no filters)
+        """
+        if not filters:
+            return data_tables
+        filters = self.resolve_filters(filters, data_tables)
+        return {name: self.filter_table(name, table, filters) for name, table in data_tables.items()}
+
+
+# Example usage
+if __name__ == "__main__":
+    import time
+    from data_loader import generate_synthetic_data
+
+    extractor = EntityExtractor()
+    data = generate_synthetic_data()
+
+    test_queries = [
+        "Show me the audit log for invoice #12",
+        "What is the VAT on invoice INV042?",
+        "List invoices above 5,000 AED in Dubai",
+        "Invoices from sellers in Sharjah between 2k and 4k dirhams",
+        "Which taxpayers have more than 10 invoices?",
+        "Show invoices for TRN000007",
+        "أظهر لي سجل التدقيق للفاتورة رقم 12",
+        "الفواتير التي تزيد قيمتها عن ٥٠٠٠ درهم في أبوظبي",
+        "Total VAT in Dubai last month",
+        "سجلات التدقيق منذ فبراير"
+    ]
+
+    for query in test_queries:
+        started = time.perf_counter()
+        filters = extractor.extract(query)
+        scoped = extractor.apply_filters(data, filters)
+        elapsed = (time.perf_counter() - started) * 1000
+        print(f"Query: {query}")
+        print(f"Filters: {filters}")
+        print(f"Rows: { {name: len(table) for name, table in scoped.items()} } ({elapsed:.2f} ms)")
+        print("---")
@@ -0,0 +1,421 @@
+"""
+Deterministic fast-path answers for simple aggregate questions in the e-invoice chatbot.
+This module matches common aggregate intents in English and Arabic and computes
+the answer directly from the data, skipping the LLM call.
+"""
+
+import re
+from typing import Dict, Optional
+import pandas as pd
+
+from arabic_normalizer import normalize_query
+from data_router import DataRouter
+from entity_extractor import EMIRATE_NAMES_AR
+
+# Words that make a question open-ended or multi-step, so it needs the LLM
+OPEN_ENDED_MARKERS = {
+    'en': ['why', 'explain', 'recommend', 'should', 'trend', 'over time', 'predict', 'forecast',
+           'what if', 'how can', 'how do', 'suggest', 'summarize', 'summarise', 'what does', 'meaning'],
+    'ar': ['لماذا', 'اشرح', 'وضح', 'توصي', 'اتجاه', 'توقع', 'كيف', 'اقترح', 'لخص', 'ماذا يعني', 'معنى']
+}
+
+# Period and range words; open-ended unless the query context has a parsed date or range filter
+PERIOD_MARKERS = {
+    'en': ['last', 'since', 'between'],
+    'ar': ['الماضي', 'الماضية', 'منذ', 'بين']
+}
+
+# Comparison words; fine for per-group breakdowns, but not for single-value intents
+COMPARISON_MARKERS = {
+    'en': ['compare', 'comparison', 'versus', 'vs'],
+    'ar': ['قارن', 'مقارنة', 'مقابل']
+}
+
+# Negations; no filter here can exclude rows, so "not in Dubai" must not answer about Dubai
+NEGATION_MARKERS = {
+    'en': ['not', 'with no', 'has no', 'have no', 'no vat', 'no tax', "isn't", "aren't", "wasn't", "weren't", "don't", "doesn't", "didn't", 'excluding',
+           'exclude', 'except', 'outside', 'other than', 'apart from', 'besides', 'without', 'non'],
+    'ar': ['غير', 'باستثناء', 'استثناء', 'ما عدا', 'عدا', 'خارج', 'بدون', 'ليس', 'ليست', 'لا', 'لم', 'سوي']
+}
+
+# Intents that answer with a per-group breakdown
+GROUPED_INTENTS = {'top_anomaly_types', 'compliance_by_sector', 'invoices_by_emirate'}
+
+# Qualifiers that narrow a question to a subset no query filter can select;
+# an intent only answers when the qualifier is its own subject
+QUALIFIER_WORDS = {
+    'anomaly': {'en': ['anomaly', 'anomalous', 'fraud', 'fraudulent', 'suspicious', 'flagged', 'outlier',
+                       'irregular', 'duplicate', 'fake', 'manipulated'],
+                'ar': ['شذوذ', 'شاذ', 'شاذه', 'احتيال', 'احتيالي', 'احتياليه', 'مشبوه', 'مشبوهه', 'متطرفه',
+                       'مكرر', 'مكرره', 'مزيف', 'مزيفه', 'تلاعب']},
+    'compliance': {'en': ['compliance', 'compliant'], 'ar': ['امتثال', 'ممتثل', 'ممتثله']},
+    'risk': {'en': ['risk', 'risky'], 'ar': ['خطر', 'مخاطر', 'خطوره']},
+    'status': {'en': ['cancelled', 'canceled', 'cancellation', 'paid', 'unpaid', 'pending', 'draft', 'rejected',
+                      'void', 'voided', 'outstanding', 'overdue'],
+               'ar': ['ملغاه', 'ملغي', 'ملغيه', 'الغاء', 'مدفوعه', 'مدفوع', 'معلقه', 'مسوده', 'مرفوضه', 'مستحقه']},
+    'document_type': {'en': ['credit note', 'debit note', 'standard invoice', 'standard rated', 'goods', 'services',
+                             'mixed', 'b2b', 'b2c', 'b2g', 'zero rated', 'zero-rated', 'exempt', 'reverse charge',
+                             'export', 'category', 'sales type', 'vat rate'],
+                      'ar': ['اشعار دائن', 'اشعار مدين', 'دائن', 'مدين', 'سلع', 'خدمات', 'مختلطه', 'معفاه', 'معفي', 'صفريه',
+                             'تصدير', 'فئه', 'نسبه الضريبه']},
+    # Parties: sellers and buyers are selectable through an emirate filter, named parties are not
+    'seller': {'en': ['seller', 'vendor', 'supplier', 'sold'], 'ar': ['بائع', 'بائعين', 'مورد', 'موردين']},
+    'buyer': {'en': ['buyer', 'customer', 'client', 'purchaser'], 'ar': ['مشتري', 'مشترين', 'عميل', 'عملاء']},
+    'party': {'en': ['company', 'companies', 'issued by', 'named', 'business'],
+              'ar': ['شركه', 'شركات', 'صادره عن', 'صادره من']},
+    # Subjects other than invoices, which the intents here do not count or sum
+    'items': {'en': ['item', 'line', 'line item', 'product'],
+              'ar': ['بند', 'بنود', 'منتج', 'منتجات', 'عنصر', 'عناصر', 'سلعه']},
+    'taxpayers': {'en': ['taxpayer', 'registrant'], 'ar': ['دافع', 'دافعي', 'مكلف', 'مكلفين']},
+    'audit_logs': {'en': ['audit', 'log'], 'ar': ['تدقيق', 'سجل', 'سجلات']}
+}
+INTENT_SUBJECTS = {'top_anomaly_types': {'anomaly'}, 'compliance_by_sector': {'compliance', 'taxpayers'}}
+# Qualifiers a pushed-down filter takes care of ("from sellers in Dubai")
+FILTER_QUALIFIERS = {'seller_emirate': 'seller', 'buyer_emirate': 'buyer'}
+
+# Arabic clitics that may precede a word: a conjunction or preposition, then the article
+ARABIC_PREFIXES = '(?:[وفبلك]?ال|لل|[وفبلك])?'
+# Arabic endings that keep a word's meaning here: tanween alef, plural and possessive
+ARABIC_SUFFIXES = '(?:ات|ها|ا)?'
+# Arabic words this short are matched exactly, since clitics turn them into other words (كم, لكم, كمية)
+ARABIC_MIN_CLITIC_LENGTH = 3
+
+# Intent trigger words in both languages
+INTENT_WORDS = {
+    'total': {'en': ['total', 'sum', 'how much'], 'ar': ['إجمالي', 'اجمالي', 'مجموع', 'كم']},
+    'count': {'en': ['how many', 'number of', 'count'], 'ar': ['كم عدد', 'عدد']},
+    'average': {'en': ['average', 'mean'], 'ar': ['متوسط', 'معدل']},
+    'distribution': {'en': ['distribution', 'breakdown', 'by', 'per', 'split'],
+                     'ar': ['توزيع', 'حسب', 'لكل', 'تقسيم']},
+    'common': {'en': ['common', 'frequent', 'top', 'most'], 'ar': ['شيوع', 'الأكثر', 'الاكثر', 'أكثر']},
+    'emirate': {'en': ['emirate'], 'ar': ['إمارة', 'الإمارة', 'الإمارات', 'امارة']},
+    'sector': {'en': ['sector'], 'ar': ['قطاع', 'القطاع', 'القطاعات']},
+    'compliance': {'en': ['compliance', 'compliant'], 'ar': ['امتثال']},
+    'amount': {'en': ['amount', 'value', 'size'], 'ar': ['مبلغ', 'قيمة']}
+}
+
+# Answer templates in both languages
+TEMPLATES = {
+    'total_vat': {
+        'en': "The total VAT collected{scope} is {value} AED across {count:,} invoices.",
+        'ar': "إجمالي ضريبة القيمة المضافة المحصلة{scope} هو {value} درهم إماراتي عبر {count:,} فاتورة."
+    },
+    'invoice_count': {
+        'en': "There are {count:,} invoices{scope}.",
+        'ar': "يوجد {count:,} فاتورة{scope}."
+    },
+    'average_invoice_amount': {
+        'en': "The average invoice amount before tax{scope} is {value} AED ({count:,} invoices).",
+        'ar': "متوسط مبلغ الفاتورة قبل الضريبة{scope} هو {value} درهم إماراتي ({count:,} فاتورة)."
+    },
+    'invoices_by_emirate': {
+        'en': "Distribution of {count:,} invoices{scope} by emirate:\n{rows}",
+        'ar': "توزيع {count:,} فاتورة{scope} حسب الإمارة:\n{rows}"
+    },
+    'top_anomaly_types': {
+        'en': "{count:,} invoices{scope} are flagged with an anomaly type. The most common types are:\n{rows}",
+        'ar': "تم تحديد نوع شذوذ لـ {count:,} فاتورة{scope}. أنواع الشذوذ الأكثر شيوعًا هي:\n{rows}"
+    },
+    'compliance_by_sector': {
+        'en': "Average tax compliance score by sector ({count:,} taxpayers):\n{rows}",
+        'ar': "متوسط درجة الامتثال الضريبي حسب القطاع ({count:,} دافع ضرائب):\n{rows}"
+    }
+}
+
+# Descriptions of the query filters that scope an answer
+SCOPE_TEMPLATES = {
+    'buyer_emirate': {'en': " in {values}", 'ar': " في {values}"},
+    'seller_emirate': {'en': " from sellers in {values}", 'ar': " من بائعين في {values}"},
+    'invoice_number': {'en': " for invoice {values}", 'ar': " للفاتورة {values}"},
+    'trn': {'en': " for TRN {values}", 'ar': " لرقم التسجيل الضريبي {values}"},
+    'total_amount': {'en': " with an amount before tax {condition}", 'ar': " بمبلغ قبل الضريبة {condition}"},
+    'tax_amount': {'en': " with VAT {condition}", 'ar': " بضريبة {condition}"},
+    'date': {'en': " {condition}", 'ar': " {condition}"}
+}
+# Filter operators the handlers apply and describe
+SUPPORTED_OPS = {'in', 'period', '>', '>=', '<', '<=', 'between'}
+CONDITION_TEMPLATES = {
+    '>': {'en': "above {value} AED", 'ar': "أكثر من {value} درهم"},
+    '>=': {'en': "of at least {value} AED", 'ar': "لا تقل عن {value} درهم"},
+    '<': {'en': "below {value} AED", 'ar': "أقل من {value} درهم"},
+    '<=': {'en': "of at most {value} AED", 'ar': "لا تزيد عن {value} درهم"},
+    'between': {'en': "between {value} and {upper} AED", 'ar': "بين {value} و{upper} درهم"},
+    'window': {'en': "from {start} to {end}", 'ar': "من {start} إلى {end}"},
+    'window_start': {'en': "since {start}", 'ar': "منذ {start}"},
+    'window_end': {'en': "until {end}", 'ar': "حتى {end}"}
+}
+
+
+class FastPathEngine:
+    """
+    Answers simple aggregate questions directly from the data.
+    """
+
+    def __init__(self, router: Optional[DataRouter] = None):
+        """
+        Initialize the engine.
+
+        Args:
+            router: Data router whose keyword tables supply the tax, invoice
+                and fraud vocabulary (a new one is created if omitted)
+        """
+        self.router = router or DataRouter()
+
+        # Vocabulary taken from the router's keyword tables
+        self.vocabulary = {
+            'tax': {lang: [word for word in words if 'vat' in word or 'tax' in word or 'ضريبة' in word]
+                    for lang, words in self.router.table_keywords['invoices'].items()},
+            'invoice': {lang: [word for word in words if 'invoice' in word or 'فاتور' in word or 'فواتير' in word]
+                        for lang, words in self.router.table_keywords['invoices'].items()},
+            'anomaly': {lang: words for lang, words in self.router.domain_keywords['fraud_detection'].items()}
+        }
+        self.vocabulary.update(INTENT_WORDS)
+
+        # Compile one alternation regex per vocabulary entry and language (on normalized words)
+        self.patterns = {
+            name: {lang: self._compile_words(words, lang) for lang, words in by_lang.items()}
+            for name, by_lang in self.vocabulary.items()
+        }
+        self.qualifiers = {
+            name: {lang: self._compile_words(words, lang) for lang, words in by_lang.items()}
+            for name, by_lang in QUALIFIER_WORDS.items()
+        }
+        self.open_ended = {lang: self._compile_words(words, lang) for lang, words in OPEN_ENDED_MARKERS.items()}
+        self.negation = {lang: self._compile_words(words, lang) for lang, words in NEGATION_MARKERS.items()}
+        self.comparison = {lang: self._compile_words(words, lang) for lang, words in COMPARISON_MARKERS.items()}
+        self.period = {lang: self._compile_words(words, lang) for lang, words in PERIOD_MARKERS.items()}
+        self.entity_extractor = self.router.entity_extractor
+
+        # Intents are tried in order; the first whose matcher accepts the query wins
+        self.intents = [
+            ('top_anomaly_types', lambda has: has('anomaly') and (has('common') or has('distribution') or has('count')),
+             self._top_anomaly_types),
+            ('compliance_by_sector', lambda has: has('compliance') and has('sector'), self._compliance_by_sector),
+            ('invoices_by_emirate', lambda has: has('emirate') and has('distribution') and has('invoice'),
+             self._invoices_by_emirate),
+            ('total_vat', lambda has: has('total') and has('tax'), self._total_vat),
+            ('average_invoice_amount', lambda has: has('average') and has('invoice') and has('amount'),
+             self._average_invoice_amount),
+            ('invoice_count', lambda has: has('count') and has('invoice'), self._invoice_count)
+        ]
+
+    @staticmethod
+    def _compile_words(words, lang: str) -> re.Pattern:
+        """
+        Compile normalized words into one alternation, longest first, matching whole words only.
+
+        English words may take a plural ending ('invoices', 'anomalies'). Arabic
+        words of ARABIC_MIN_CLITIC_LENGTH letters or more may take the attached
+        conjunctions, prepositions and article in front and a few endings behind
+        ('والفواتير', 'شيوعا'); shorter ones must stand alone.
+        """
+        normalized = sorted({normalize_query(word).strip() for word in words}, key=len, reverse=True)
+        if lang == 'ar':
+            alternatives = [
+                f"{ARABIC_PREFIXES}{re.escape(word)}{ARABIC_SUFFIXES}" if len(word) >= ARABIC_MIN_CLITIC_LENGTH
+                else re.escape(word)
+                for word in normalized
+            ]
+        else:
+            alternatives = [
+                f"{re.escape(word[:-1])}(?:y|ies)" if re.search('[^aeiou]y$', word) else f"{re.escape(word)}(?:e?s)?"
+                for word in normalized
+            ]
+        return re.compile(r"(?<!\w)(?:" + '|'.join(alternatives) + r")(?!\w)")
+
+    def match_intent(self, query: str, lang: str, has_window: bool = False,
+                     consumed: frozenset = frozenset()) -> Optional[str]:
+        """
+        Find the aggregate intent of a query.
+
+        Questions with a negation, or with a qualifier (status, document type,
+        party, anomaly, a subject other than invoices) that no applied filter
+        selects, fall through: answering them from the whole table would be
+        confidently wrong.
+
+        Args:
+            query: The user's query text
+            lang: Language code ('en' or 'ar')
+            has_window: Whether the query's period or range was parsed into a
+                filter, so words like "last" and "since" can be answered
+            consumed: Qualifiers selected by the query's filters (see FILTER_QUALIFIERS)
+
+        Returns:
+            Intent name, or None for unmatched or open-ended questions
+        """
+        query_lower = f" {normalize_query(query)} "
+        if self.open_ended[lang].search(query_lower) or self.negation[lang].search(query_lower):
+            return None
+        if not has_window and self.period[lang].search(query_lower):
+            return None
+
+        def has(name: str) -> bool:
+            return bool(self.patterns[name][lang].search(query_lower))
+
+        compares = bool(self.comparison[lang].search(query_lower))
+        qualifiers = {name for name, patterns in self.qualifiers.items() if patterns[lang].search(query_lower)}
+        for intent, matcher, _ in self.intents:
+            if matcher(has):
+                if compares and intent not in GROUPED_INTENTS:
+                    return None
+                if qualifiers - consumed - INTENT_SUBJECTS.get(intent, set()):
+                    # "How many invoices are anomalous?" must not answer with all invoices
+                    return None
+                return intent
+        return None
+
+    def answer(self, query: str, query_context: Dict, data_tables: Dict[str, pd.DataFrame],
+               visualization_type: Optional[str] = None) -> Optional[Dict]:
+        """
+        Answer a query directly from the data if it matches a known intent.
+
+        Args:
+            query: The user's query text
+            query_context: Dictionary with query context information
+            data_tables: Dictionary of available data tables
+            visualization_type: Visualization type to attach to the response
+
+        Returns:
+            Response dictionary in the ResponseGenerator format (with a
+            'fast_path' entry naming the intent), or None to fall through
+        """
+        lang = query_context['language']
+        filters = self.entity_extractor.extract(query)
+        if any(item['field'] not in SCOPE_TEMPLATES or item['op'] not in SUPPORTED_OPS for item in filters):
+            # Line-item thresholds or exclusions: the handlers below only scope invoices by inclusion
+            return None
+        has_window = any(item['field'] == 'date' or item['op'] == 'between' for item in filters)
+        consumed = frozenset(FILTER_QUALIFIERS[item['field']] for item in filters if item['field'] in FILTER_QUALIFIERS)
+        intent = self.match_intent(query, lang, has_window, consumed)
+        if intent is None:
+            return None
+
+        handler = next(handler for name, _, handler in self.intents if name == intent)
+        try:
+            response_text = handler(query, lang, data_tables)
+        except (KeyError, ValueError, TypeError):
+            # Missing columns or unexpected data: let the LLM handle it
+            return None
+        if response_text is None:
+            return None
+
+        return {
+            'success': True,
+            'error': None,
+            'message': None,
+            'response_text': response_text,
+            'visualization_type': visualization_type,
+            'fast_path': intent
+        }
+
+    def _display_name(self, value, lang: str) -> str:
+        if lang == 'ar':
+            return EMIRATE_NAMES_AR.get(value, value)
+        return value
+
+    def _describe_filter(self, item, lang: str) -> str:
+        separator = '، ' if lang == 'ar' else ', '
+        if item['op'] == 'in':
+            values = separator.join(self._display_name(value, lang) for value in item['values'])
+            return SCOPE_TEMPLATES[item['field']][lang].format(values=values)
+        if item['op'] == 'window':
+            # Windows end exclusively; show the last day they include
+            start = item['start'][:10] if item['start'] else None
+            end = (pd.Timestamp(item['end']) - pd.Timedelta(days=1)).strftime('%Y-%m-%d') if item['end'] else None
+            template = 'window' if start and end else ('window_start' if start else 'window_end')
+            condition = CONDITION_TEMPLATES[template][lang].format(start=start, end=end)
+        else:
+            condition = CONDITION_TEMPLATES[item['op']][lang].format(
+                value=f"{item['value']:,.0f}", upper=f"{item.get('upper', 0):,.0f}")
+        return SCOPE_TEMPLATES[item['field']][lang].format(condition=condition)
+
+    def _query_filters(self, query: str, data_tables: Dict[str, pd.DataFrame]):
+        filters = [item for item in self.entity_extractor.extract(query) if item['field'] in SCOPE_TEMPLATES]
+        return self.entity_extractor.resolve_filters(filters, data_tables)
+
+    def _scoped_invoices(self, query: str, lang: str, data_tables: Dict[str, pd.DataFrame]):
+        # Filters are usually pushed down already; applying them again is cheap and keeps direct calls correct
+        filters = self._query_filters(query, data_tables)
+        invoices = self.entity_extractor.filter_table('invoices', data_tables['invoices'], filters)
+        scope = ''.join(self._describe_filter(item, lang) for item in filters)
+        return invoices, scope
+
+    def _format_rows(self, series: pd.Series, value_format: str = '{:,}', limit: int = 10) -> str:
+        return '\n'.join(f"- {label}: {value_format.format(value)}" for label, value in series.head(limit).items())
+
+    def _total_vat(self, query: str, lang: str, data_tables: Dict[str, pd.DataFrame]) -> str:
+        invoices, scope = self._scoped_invoices(query, lang, data_tables)
+        total = float(invoices['invoice_tax_amount'].sum())
+        return TEMPLATES['total_vat'][lang].format(scope=scope, value=f"{total:,.2f}", count=len(invoices))
+
+    def _invoice_count(self, query: str, lang: str, data_tables: Dict[str, pd.DataFrame]) -> str:
+        invoices, scope = self._scoped_invoices(query, lang, data_tables)
+        return TEMPLATES['invoice_count'][lang].format(scope=scope, count=len(invoices))
+
+    def _average_invoice_amount(self, query: str, lang: str, data_tables: Dict[str, pd.DataFrame]) -> str:
+        invoices, scope = self._scoped_invoices(query, lang, data_tables)
+        average = float(invoices['invoice_without_tax'].mean())
+        return TEMPLATES['average_invoice_amount'][lang].format(scope=scope, value=f"{average:,.2f}", count=len(invoices))
+
+    def _invoices_by_emirate(self, query: str, lang: str, data_tables: Dict[str, pd.DataFrame]) -> str:
+        invoices, scope = self._scoped_invoices(query, lang, data_tables)
+        counts = invoices['buyer_emirate'].value_counts()
+        if counts.empty:
+            return None
+        shares = counts / counts.sum() * 100
+        rows = '\n'.join(
+            f"- {self._display_name(emirate, lang)}: {count:,} ({share:.1f}%)"
+            for (emirate, count), share in zip(counts.items(), shares)
+        )
+        return TEMPLATES['invoices_by_emirate'][lang].format(scope=scope, count=len(invoices), rows=rows)
+
+    def _top_anomaly_types(self, query: str, lang: str, data_tables: Dict[str, pd.DataFrame]) -> str:
+        invoices, scope = self._scoped_invoices(query, lang, data_tables)
+        counts = invoices['anomaly_type'].value_counts()
+        if counts.empty:
+            return None
+        return TEMPLATES['top_anomaly_types'][lang].format(scope=scope, count=int(counts.sum()),
+                                                           rows=self._format_rows(counts, limit=5))
+
+    def _compliance_by_sector(self, query: str, lang: str, data_tables: Dict[str, pd.DataFrame]) -> str:
+        # Compliance scores are per taxpayer; invoice filters (emirate, period, amount) do not select taxpayers
+        if self._query_filters(query, data_tables):
+            return None
+        taxpayers = data_tables['taxpayers']
+        scores = taxpayers.groupby('sector')['tax_compliance_score'].mean().sort_values(ascending=False)
+        return TEMPLATES['compliance_by_sector'][lang].format(count=len(taxpayers), rows=self._format_rows(scores, '{:.1f}'))
+
+
+# Example usage
+if __name__ == "__main__":
+    import time
+    from data_loader import generate_synthetic_data
+
+    engine = FastPathEngine()
+    data = generate_synthetic_data()
+
+    test_queries = [
+        ("What is the total VAT collected in Dubai?", 'en'),
+        ("Show me the distribution of invoices by emirate", 'en'),
+        ("What are the most common anomaly types in invoices?", 'en'),
+        ("Compare tax compliance rates across different sectors", 'en'),
+        ("What is the tax compliance score by sector?", 'en'),
+        ("How many invoices are there in Sharjah?", 'en'),
+        ("Why is VAT in Dubai so high?", 'en'),
+        ("What is the total VAT collected last month?", 'en'),
+        ("ما هو إجمالي ضريبة القيمة المضافة المحصلة في دبي؟", 'ar'),
+        ("أظهر لي توزيع الفواتير حسب الإمارة", 'ar'),
+        ("ما هي أنواع الشذوذ الأكثر شيوعًا في الفواتير؟", 'ar')
+    ]
+
+    for query, lang in test_queries:
+        started = time.perf_counter()
+        response = engine.answer(query, {'language': lang}, data)
+        elapsed = (time.perf_counter() - started) * 1000
+        print(f"Query: {query}")
+        if response:
+            print(f"Intent: {response['fast_path']} ({elapsed:.2f} ms)")
+            print(response['response_text'])
+        else:
+            print("No fast-path match; falls through to the LLM")
+        print("---")
@@ -0,0 +1,154 @@
+"""
+Single-pass keyword matching for the e-invoice chatbot.
+This module compiles every routing keyword list (tables, domains, fields,
+out-of-domain topics, visualization hints) into one regular expression, so a
+query is scanned once to get its language and all keyword hits.
+"""
+
+import re
+import threading
+from typing import Callable, Dict, List, Union
+
+from arabic_normalizer import normalize_query
+
+# Arabic script ranges used for language detection
+ARABIC_PATTERN = re.compile(r'[\u0600-\u06FF\u0750-\u077F\u08A0-\u08FF]')
+
+# Keywords of one label: either per language ({'en': [...], 'ar': [...]})
+# or a plain list that matches queries in any language
+LabelKeywords = Union[Dict[str, List[str]], List[str]]
+
+
+def detect_language(query: str) -> str:
+    """
+    Detect if the query is in Arabic or English.
+
+    Args:
+        query: The user's query text
+
+    Returns:
+        'ar' for Arabic, 'en' for English (default)
+    """
+    return 'ar' if ARABIC_PATTERN.search(query) else 'en'
+
+
+def _trie_pattern(node: Dict) -> str:
+    """Turn a character trie into a regex that matches the longest keyword first."""
+    is_end = '' in node
+    branches = [re.escape(char) + _trie_pattern(child) for char, child in sorted(node.items()) if char]
+    if not branches:
+        return ''
+    body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+    if is_end:
+        # Greedy optional: try the longer keyword before stopping here
+        return ('(?:' + body + ')?') if len(branches) == 1 else body + '?'
+    return body
+
+
+class KeywordMatcher:
+    """
+    Matches a query against all registered keyword lists in a single pass.
+
+    Keywords keep the substring semantics of the original per-list scans
+    (`keyword in query.lower()`): the compiled regex finds the longest keyword
+    starting at each position, and every shorter keyword contained in it is
+    credited through a precomputed containment table. Keywords and queries
+    go through the same normalizer, so Arabic spelling variants match.
+    """
+
+    def __init__(self, normalizer: Callable[[str], str] = normalize_query):
+        """
+        Initialize the matcher.
+
+        Args:
+            normalizer: Function applied to keywords when registered and to
+                each query before scanning (lowercase plus Arabic folding by default)
+        """
+        self.normalizer = normalizer
+        # category -> label -> keywords
+        self.categories = {}
+        # keyword -> list of (category, label, language or None)
+        self._entries = {}
+        # keyword -> all keywords that are substrings of it (itself included)
+        self._contained = {}
+        self._pattern = None
+        self._lock = threading.Lock()
+
+    def add_keywords(self, category: str, keywords: Dict[str, LabelKeywords]):
+        """
+        Register the keyword lists of one category.
+
+        Args:
+            category: Category name returned in match results (e.g. 'tables')
+            keywords: Label to keywords, either per language or language-independent
+        """
+        with self._lock:
+            self.categories[category] = keywords
+            for label, words in keywords.items():
+                per_language = words.items() if isinstance(words, dict) else [(None, words)]
+                for lang, lang_words in per_language:
+                    for word in lang_words:
+                        word = self.normalizer(word)
+                        self._entries.setdefault(word, []).append((category, label, lang))
+            self._pattern = None
+
+    def _compile(self) -> re.Pattern:
+        with self._lock:
+            if self._pattern is None:
+                trie = {}
+                for word in self._entries:
+                    node = trie
+                    for char in word:
+                        node = node.setdefault(char, {})
+                    node[''] = True
+                words = list(self._entries)
+                self._contained = {word: [other for other in words if other in word] for word in words}
+                # Zero-width lookahead so matches may overlap: one hit per start position
+                self._pattern = re.compile('(?=(' + _trie_pattern(trie) + '))')
+            return self._pattern
+
+    def match(self, query: str) -> Dict:
+        """
+        Scan a query once and collect its language and keyword hits.
+
+        Per-language keywords only count for the detected language;
+        language-independent keywords always count.
+
+        Args:
+            query: The user's query text
+
+        Returns:
+            Dictionary with 'language' and, per registered category, the list
+            of matched labels in registration order
+        """
+        pattern = self._pattern or self._compile()
+        lang = detect_language(query)
+
+        found = set()
+        for word in pattern.findall(self.normalizer(query)):
+            if word not in found:
+                found.update(self._contained[word])
+
+        hits = {category: set() for category in self.categories}
+        for word in found:
+            for category, label, word_lang in self._entries[word]:
+                if word_lang is None or word_lang == lang:
+                    hits[category].add(label)
+
+        result = {'language': lang}
+        for category, keywords in self.categories.items():
+            result[category] = [label for label in keywords if label in hits[category]]
+        return result
+
+
+# Example usage
+if __name__ == "__main__":
+    matcher = KeywordMatcher()
+    matcher.add_keywords('tables', {
+        'invoices': {'en': ['invoice', 'invoices', 'vat'], 'ar': ['فاتورة', 'فواتير']},
+        'items': {'en': ['item', 'items', 'line item'], 'ar': ['عنصر', 'بند']}
+    })
+    matcher.add_keywords('out_of_domain', {'weather': ['weather', 'طقس']})
+
+    for query in ["Show me the invoices with line items", "ما هي الفواتير؟", "What's the weather today?"]:
+        print(f"{query} -> {matcher.match(query)}")
@@ -0,0 +1,647 @@
+"""
+OpenAI request execution for the e-invoice chatbot.
+This module wraps chat-completion calls with structured error handling,
+retries with exponential backoff, a process-wide client-side rate limiter
+and coalescing of identical in-flight requests.
+"""
+
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+# Error codes that are worth retrying after a delay
+RETRYABLE_ERRORS = {'rate_limit', 'timeout', 'connection', 'server_error'}
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Roughly estimate the number of tokens in a text without a tokenizer.
+
+    Args:
+        text: The text to measure
+
+    Returns:
+        Estimated token count (about 4 characters per token for Latin text,
+        about 2 per token for Arabic and other non-ASCII text)
+    """
+    if not text:
+        return 0
+    non_ascii = sum(1 for char in text if ord(char) > 127)
+    ascii_chars = len(text) - non_ascii
+    return ascii_chars // 4 + non_ascii // 2 + 1
+
+
+def estimate_message_tokens(messages: List[Dict]) -> int:
+    """
+    Estimate the prompt tokens of a list of chat messages.
+
+    Args:
+        messages: Chat messages in OpenAI format
+
+    Returns:
+        Estimated token count including per-message overhead
+    """
+    return sum(estimate_tokens(message.get('content') or '') + 4 for message in messages) + 2
+
+
+class LLMError(Exception):
+    """
+    Structured error raised for failed chat-completion calls.
+    """
+
+    def __init__(self, code: str, message: str, status: Optional[int] = None,
+                 retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+        self.status = status
+        self.retry_after = retry_after
+
+    @property
+    def retryable(self) -> bool:
+        return self.code in RETRYABLE_ERRORS
+
+
+def _get_error_headers(exc: Exception) -> Dict[str, str]:
+    """Extract HTTP response headers from an OpenAI exception, if any."""
+    response = getattr(exc, 'response', None)
+    headers = getattr(response, 'headers', None) or getattr(exc, 'headers', None) or {}
+    try:
+        return {str(key).lower(): str(value) for key, value in dict(headers).items()}
+    except (TypeError, ValueError):
+        return {}
+
+
+def parse_retry_after(headers: Dict[str, str]) -> Optional[float]:
+    """
+    Parse the server-requested delay from Retry-After style headers.
+
+    Args:
+        headers: Lower-cased response headers
+
+    Returns:
+        Delay in seconds, or None if the server did not request one
+    """
+    if 'retry-after-ms' in headers:
+        try:
+            return max(0.0, float(headers['retry-after-ms']) / 1000.0)
+        except ValueError:
+            pass
+
+    value = headers.get('retry-after')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    # Retry-After may also be an HTTP date
+    try:
+        retry_at = parsedate_to_datetime(value)
+        return max(0.0, retry_at.timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def classify_error(exc: Exception) -> LLMError:
+    """
+    Convert an exception raised by the OpenAI SDK into a structured LLMError.
+
+    Works on status codes and exception types rather than message text, and
+    understands both the current and the legacy SDK exception attributes.
+
+    Args:
+        exc: The exception raised by the API call
+
+    Returns:
+        LLMError describing the failure
+    """
+    if isinstance(exc, LLMError):
+        return exc
+
+    status = getattr(exc, 'status_code', None) or getattr(exc, 'http_status', None)
+    error_code = str(getattr(exc, 'code', '') or '')
+    type_name = type(exc).__name__
+    message = str(exc) or type_name
+    retry_after = parse_retry_after(_get_error_headers(exc))
+
+    if status == 401 or type_name == 'AuthenticationError':
+        return LLMError('invalid_api_key', message, status)
+    if status == 429 or type_name == 'RateLimitError':
+        # A 429 for an exhausted quota will not succeed on retry
+        if error_code == 'insufficient_quota':
+            return LLMError('quota_exceeded', message, status)
+        return LLMError('rate_limit', message, status, retry_after)
+    if 'Timeout' in type_name:
+        return LLMError('timeout', message, status, retry_after)
+    if 'Connection' in type_name:
+        return LLMError('connection', message, status, retry_after)
+    if status is not None and (status >= 500 or status in (408, 409)):
+        return LLMError('server_error', message, status, retry_after)
+    if status is not None and 400 <= status < 500:
+        return LLMError('bad_request', message, status)
+    return LLMError('api_error', message, status)
+
+
+class RetryPolicy:
+    """
+    Exponential backoff with full jitter that honors server Retry-After hints.
+    """
+
+    def __init__(self, max_retries: int = 4, base_delay: float = 0.5, max_delay: float = 20.0):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def get_delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """
+        Compute how long to wait before the next attempt.
+
+        Args:
+            attempt: Zero-based index of the attempt that just failed
+            retry_after: Delay requested by the server, if any
+
+        Returns:
+            Delay in seconds
+        """
+        backoff = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+        if retry_after is not None:
+            # Never retry earlier than the server asked; jitter spreads the herd
+            return min(retry_after, self.max_delay * 3) + backoff * 0.25
+        return backoff
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket refilled continuously at a per-minute rate.
+
+    Reservations may drive the balance negative, so callers queue up behind
+    each other instead of racing for the next refill.
+    """
+
+    def __init__(self, capacity_per_minute: float):
+        self.capacity = float(capacity_per_minute)
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount: float) -> float:
+        """
+        Take tokens from the bucket.
+
+        Args:
+            amount: Number of tokens to take
+
+        Returns:
+            Seconds the caller must wait before the reservation is covered
+        """
+        amount = min(float(amount), self.capacity)
+        with self.lock:
+            self._refill(time.monotonic())
+            self.tokens -= amount
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+    def adjust(self, amount: float):
+        """Return (positive) or take (negative) tokens after the fact."""
+        with self.lock:
+            self._refill(time.monotonic())
+            self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class RateLimiter:
+    """
+    Process-wide limiter on requests per minute, tokens per minute and
+    concurrent in-flight requests for one API key pool.
+    """
+
+    def __init__(self, requests_per_minute: int = 500, tokens_per_minute: int = 90000,
+                 max_concurrency: int = 8):
+        self.request_bucket = TokenBucket(requests_per_minute)
+        self.token_bucket = TokenBucket(tokens_per_minute)
+        self.semaphore = threading.BoundedSemaphore(max_concurrency)
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def pause(self, seconds: float):
+        """
+        Hold back every caller for a while, e.g. after the server returned 429.
+
+        Args:
+            seconds: Minimum delay before the next request may start
+        """
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    @contextmanager
+    def acquire(self, estimated_tokens: int):
+        """
+        Block until a request with the given token estimate may be sent.
+
+        Args:
+            estimated_tokens: Estimated prompt plus completion tokens
+        """
+        wait = max(self.request_bucket.reserve(1), self.token_bucket.reserve(estimated_tokens))
+        wait = max(wait, self.paused_until - time.monotonic())
+        if wait > 0:
+            time.sleep(wait)
+
+        with self.semaphore:
+            yield
+
+    def settle(self, estimated_tokens: int, actual_tokens: Optional[int]):
+        """
+        Correct the token bucket once the real usage of a request is known.
+
+        Args:
+            estimated_tokens: Tokens reserved before the request
+            actual_tokens: Tokens reported by the API (None if unknown)
+        """
+        if actual_tokens is not None:
+            self.token_bucket.adjust(estimated_tokens - actual_tokens)
+
+
+def request_fingerprint(api_key: str, **request: Any) -> str:
+    """
+    Compute a stable fingerprint of a full chat-completion request.
+
+    Args:
+        api_key: OpenAI API key (hashed, so different keys never share results)
+        **request: Model, messages and sampling parameters of the request
+
+    Returns:
+        Hex digest identifying the request
+    """
+    payload = json.dumps(request, sort_keys=True, ensure_ascii=False, default=str)
+    digest = hashlib.sha256()
+    digest.update(hashlib.sha256(api_key.encode('utf-8')).digest())
+    digest.update(payload.encode('utf-8'))
+    return digest.hexdigest()
+
+
+class SharedStream:
+    """
+    Buffered text stream that several consumers can read concurrently.
+
+    Every subscriber replays the chunks published so far and then follows
+    the producer until it finishes.
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.condition = threading.Condition()
+
+    def publish(self, chunk: str):
+        with self.condition:
+            self.chunks.append(chunk)
+            self.condition.notify_all()
+
+    def finish(self, error: Optional[Exception] = None):
+        with self.condition:
+            self.done = True
+            self.error = error
+            self.condition.notify_all()
+
+    def subscribe(self) -> Iterator[str]:
+        """
+        Iterate over the stream from its first chunk.
+
+        Yields:
+            Text chunks in order
+
+        Raises:
+            LLMError: If the producer failed
+        """
+        index = 0
+        while True:
+            with self.condition:
+                while index >= len(self.chunks) and not self.done:
+                    self.condition.wait()
+                if index < len(self.chunks):
+                    chunk = self.chunks[index]
+                    index += 1
+                elif self.error is not None:
+                    raise self.error
+                else:
+                    return
+            yield chunk
+
+
+class InflightRegistry:
+    """
+    Registry of in-flight requests keyed by request fingerprint.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def join(self, key: str, factory) -> Any:
+        """
+        Join the in-flight entry for a key, creating it if there is none.
+
+        Args:
+            key: Request fingerprint
+            factory: Callable creating a new entry (e.g. Future or SharedStream)
+
+        Returns:
+            Tuple of (entry, is_leader); the leader must perform the request
+        """
+        with self._lock:
+            if key in self._entries:
+                return self._entries[key], False
+            entry = factory()
+            self._entries[key] = entry
+            return entry, True
+
+    def release(self, key: str, entry: Any):
+        """Remove a finished entry so later requests are sent again."""
+        with self._lock:
+            if self._entries.get(key) is entry:
+                del self._entries[key]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+
+class LLMClient:
+    """
+    Executes chat-completion requests with rate limiting and retries.
+    """
+
+    def __init__(self, limiter: Optional[RateLimiter] = None, retry_policy: Optional[RetryPolicy] = None,
+                 base_url: Optional[str] = None, timeout: float = 60.0):
+        """
+        Initialize the client.
+
+        Args:
+            limiter: Rate limiter shared by all requests made through this client
+            retry_policy: Backoff policy for retryable errors
+            base_url: Optional override of the OpenAI API base URL
+            timeout: Per-request timeout in seconds
+        """
+        self.limiter = limiter or RateLimiter()
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.base_url = base_url
+        self.timeout = timeout
+        self.inflight = InflightRegistry()
+        self.stats = {'requests': 0, 'coalesced': 0}
+        self._clients = {}
+        self._clients_lock = threading.Lock()
+
+    def _get_openai_client(self, api_key: str):
+        """Return a cached SDK client for the API key, with SDK retries disabled."""
+        with self._clients_lock:
+            if api_key not in self._clients:
+                import openai
+                self._clients[api_key] = openai.OpenAI(
+                    api_key=api_key,
+                    base_url=self.base_url,
+                    timeout=self.timeout,
+                    max_retries=0
+                )
+            return self._clients[api_key]
+
+    def create_chat_completion(self, api_key: str, model: str, messages: List[Dict],
+                               temperature: float = 0.7, max_tokens: int = 1000,
+                               coalesce: bool = True, **kwargs) -> Any:
+        """
+        Send a chat-completion request, retrying transient failures.
+        
+        Concurrent identical requests are coalesced: the first caller sends
+        the request and the others wait for and share its result.
+
+        Args:
+            api_key: OpenAI API key
+            model: The OpenAI model to use
+            messages: Chat messages in OpenAI format
+            temperature: Sampling temperature
+            max_tokens: Maximum completion tokens
+            coalesce: Share the result of an identical in-flight request
+            **kwargs: Extra arguments passed to the SDK
+
+        Returns:
+            The SDK chat-completion response
+
+        Raises:
+            LLMError: If the request failed and cannot (or can no longer) be retried
+        """
+        request = dict(model=model, messages=messages, temperature=temperature, max_tokens=max_tokens, **kwargs)
+        if not coalesce:
+            return self._send_with_retries(api_key, request)
+
+        key = request_fingerprint(api_key, **request)
+        future, is_leader = self.inflight.join(key, Future)
+        if not is_leader:
+            self._count('coalesced')
+            return future.result()
+
+        error = None
+        try:
+            response = self._send_with_retries(api_key, request)
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            # Settle on any exit, including KeyboardInterrupt and cancellation, so followers never block
+            if error is None:
+                future.set_result(response)
+            else:
+                future.set_exception(classify_error(error))
+            self.inflight.release(key, future)
+        return response
+
+    def stream_chat_completion(self, api_key: str, model: str, messages: List[Dict],
+                               temperature: float = 0.7, max_tokens: int = 1000,
+                               coalesce: bool = True, on_usage: Optional[Callable[[Any], None]] = None,
+                               **kwargs) -> Iterator[str]:
+        """
+        Stream the text of a chat completion.
+        
+        The stream is produced by a background thread, so concurrent identical
+        requests subscribe to the same stream and a slow or abandoned reader
+        does not hold up the others.
+
+        Args:
+            api_key: OpenAI API key
+            model: The OpenAI model to use
+            messages: Chat messages in OpenAI format
+            temperature: Sampling temperature
+            max_tokens: Maximum completion tokens
+            coalesce: Subscribe to an identical in-flight stream if there is one
+            on_usage: Called with the usage of the upstream request when the API
+                reports it (pass stream_options={'include_usage': True}); a
+                subscriber to an in-flight stream sent no request of its own and
+                is not called
+            **kwargs: Extra arguments passed to the SDK
+
+        Returns:
+            Iterator over response text chunks (raises LLMError on failure)
+        """
+        request = dict(model=model, messages=messages, temperature=temperature, max_tokens=max_tokens, **kwargs)
+        key = request_fingerprint(api_key, stream=True, **request)
+
+        if coalesce:
+            stream, is_leader = self.inflight.join(key, SharedStream)
+        else:
+            stream, is_leader = SharedStream(), True
+
+        if is_leader:
+            producer = threading.Thread(
+                target=self._produce_stream,
+                args=(api_key, request, stream, key if coalesce else None, on_usage),
+                daemon=True
+            )
+            producer.start()
+        else:
+            self._count('coalesced')
+
+        return stream.subscribe()
+
+    def _count(self, name: str):
+        with self._clients_lock:
+            self.stats[name] += 1
+
+    def _send_with_retries(self, api_key: str, request: Dict) -> Any:
+        """Send one request through the rate limiter, retrying retryable errors."""
+        client = self._get_openai_client(api_key)
+        estimated_tokens = estimate_message_tokens(request['messages']) + request['max_tokens']
+        attempt = 0
+
+        while True:
+            self._count('requests')
+            with self.limiter.acquire(estimated_tokens):
+                try:
+                    response = client.chat.completions.create(**request)
+                except Exception as e:
+                    error = classify_error(e)
+                else:
+                    usage = getattr(response, 'usage', None)
+                    self.limiter.settle(estimated_tokens, getattr(usage, 'total_tokens', None))
+                    return response
+
+            self._wait_before_retry(error, attempt)
+            attempt += 1
+
+    def _wait_before_retry(self, error: LLMError, attempt: int):
+        """Sleep before the next attempt, or raise if the error is final."""
+        if not error.retryable or attempt >= self.retry_policy.max_retries:
+            raise error
+
+        delay = self.retry_policy.get_delay(attempt, error.retry_after)
+        if error.code == 'rate_limit':
+            # Everyone sharing the key backs off, not just this caller
+            self.limiter.pause(delay)
+        time.sleep(delay)
+
+    def _produce_stream(self, api_key: str, request: Dict, stream: SharedStream, key: Optional[str],
+                        on_usage: Optional[Callable[[Any], None]] = None):
+        """Consume an SDK stream into a shared stream; retries only before the first chunk."""
+        client = self._get_openai_client(api_key)
+        estimated_tokens = estimate_message_tokens(request['messages']) + request['max_tokens']
+        attempt = 0
+        error = None
+
+        try:
+            while True:
+                self._count('requests')
+                text = ''
+                usage = None
+                with self.limiter.acquire(estimated_tokens):
+                    try:
+                        for chunk in client.chat.completions.create(stream=True, **request):
+                            delta = chunk.choices[0].delta.content if chunk.choices else None
+                            if delta:
+                                text += delta
+                                stream.publish(delta)
+                            # With include_usage the last chunk carries the usage and no choices
+                            usage = getattr(chunk, 'usage', None) or usage
+                    except Exception as e:
+                        error = classify_error(e)
+                    else:
+                        error = None
+                        self.limiter.settle(
+                            estimated_tokens,
+                            getattr(usage, 'total_tokens', None) or
+                            estimate_message_tokens(request['messages']) + estimate_tokens(text)
+                        )
+                        if usage is not None and on_usage is not None:
+                            on_usage(usage)
+
+                if error is None:
+                    break
+                if stream.chunks:
+                    # Part of the answer was already delivered; do not replay it
+                    raise error
+                self._wait_before_retry(error, attempt)
+                attempt += 1
+        except BaseException as e:
+            # Subscribers always get an LLMError, also when on_usage or the SDK raised something else
+            error = classify_error(e)
+            if not isinstance(e, Exception):
+                raise
+        finally:
+            if key is not None:
+                self.inflight.release(key, stream)
+            stream.finish(error)
+
+
+_default_client = None
+_default_client_lock = threading.Lock()
+
+
+def get_default_client() -> LLMClient:
+    """
+    Get the process-wide LLM client, configured from environment variables.
+
+    Returns:
+        Shared LLMClient instance
+    """
+    global _default_client
+    with _default_client_lock:
+        if _default_client is None:
+            limiter = RateLimiter(
+                requests_per_minute=int(os.environ.get('OPENAI_MAX_RPM', 500)),
+                tokens_per_minute=int(os.environ.get('OPENAI_MAX_TPM', 90000)),
+                max_concurrency=int(os.environ.get('OPENAI_MAX_CONCURRENCY', 8))
+            )
+            retry_policy = RetryPolicy(max_retries=int(os.environ.get('OPENAI_MAX_RETRIES', 4)))
+            _default_client = LLMClient(
+                limiter=limiter,
+                retry_policy=retry_policy,
+                base_url=os.environ.get('OPENAI_BASE_URL') or None
+            )
+        return _default_client
+
+
+# Example usage
+if __name__ == "__main__":
+    bucket = TokenBucket(capacity_per_minute=60)
+    print("Waits for 65 one-token reservations against a 60/min bucket:")
+    waits = [bucket.reserve(1) for _ in range(65)]
+    print([round(wait, 2) for wait in waits[-6:]])
+
+    policy = RetryPolicy()
+    print("Backoff delays:", [round(policy.get_delay(attempt), 2) for attempt in range(5)])
+    print("Delay honoring Retry-After=3:", round(policy.get_delay(0, retry_after=3), 2))
+
+    print("Parsed Retry-After:", parse_retry_after({'retry-after': '7'}), parse_retry_after({'retry-after-ms': '250'}))
+    print("Estimated tokens:", estimate_tokens("What is the total VAT collected in Dubai?"),
+          estimate_tokens("ما هو إجمالي ضريبة القيمة المضافة المحصلة في دبي؟"))
@@ -0,0 +1,167 @@
+"""
+Bounded memoization of query and response contexts for the e-invoice chatbot.
+This module provides a thread-safe LRU memo, deep freezing of cached results
+so callers cannot mutate them, and a cheap version key for the data tables.
+"""
+
+import threading
+from collections import OrderedDict
+from collections.abc import Mapping
+from types import MappingProxyType
+from typing import Any, Callable, Dict, Hashable, List, Tuple
+
+import pandas as pd
+
+# Immutable leaf types that freeze() returns as they are
+_SCALARS = frozenset({str, int, float, bool, type(None), bytes})
+
+
+def freeze(value: Any) -> Any:
+    """
+    Make a nested structure read-only.
+
+    Dictionaries become read-only mappings, lists and tuples become tuples and
+    sets become frozensets; other values are returned as they are.
+
+    Args:
+        value: The structure to freeze
+
+    Returns:
+        A frozen copy of the structure
+    """
+    # Exact type checks first: an isinstance check against the Mapping ABC costs several
+    # times more, and contexts are mostly plain dicts, lists and strings
+    kind = type(value)
+    if kind in _SCALARS or kind is MappingProxyType:
+        return value
+    if kind is dict:
+        return MappingProxyType({key: freeze(item) for key, item in value.items()})
+    if kind is list or kind is tuple:
+        return tuple([freeze(item) for item in value])
+    if isinstance(value, Mapping):
+        return MappingProxyType({key: freeze(item) for key, item in value.items()})
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    if isinstance(value, (set, frozenset)):
+        return frozenset(freeze(item) for item in value)
+    return value
+
+
+def thaw(value: Any) -> Any:
+    """
+    Get a mutable copy of a frozen structure (read-only mappings to dicts, tuples to lists).
+
+    Args:
+        value: The structure to copy
+
+    Returns:
+        A mutable deep copy
+    """
+    if isinstance(value, Mapping):
+        return {key: thaw(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [thaw(item) for item in value]
+    return value
+
+
+def json_default(value: Any) -> Any:
+    """`default` for json.dumps that serializes frozen mappings and missing values; anything else becomes a string."""
+    if isinstance(value, Mapping):
+        return dict(value)
+    if value is pd.NA:
+        # Missing text in Arrow-backed string columns
+        return None
+    return str(value)
+
+
+def data_version(data_tables: Dict[str, pd.DataFrame]) -> Hashable:
+    """
+    Get a version key for a set of data tables.
+
+    Uses the 'data_version' the loader stores in each table's attrs, which
+    survives copies and Streamlit's cache; falls back to the table's identity
+    and shape.
+
+    Args:
+        data_tables: Dictionary of data tables
+
+    Returns:
+        A hashable key that changes when the data is reloaded
+    """
+    return tuple(
+        (name, table.attrs.get('data_version') or (id(table), table.shape))
+        for name, table in sorted(data_tables.items())
+    )
+
+
+class BoundedMemo:
+    """
+    Thread-safe least-recently-used memo with a fixed number of entries.
+    """
+
+    def __init__(self, maxsize: int = 1024):
+        """
+        Initialize the memo.
+
+        Args:
+            maxsize: Maximum number of cached entries (0 disables caching)
+        """
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        """
+        Return the cached value for a key, computing and caching it on a miss.
+
+        The value is computed outside the lock, so two threads missing the same
+        key may both compute it; results must therefore be deterministic.
+
+        Args:
+            key: Hashable cache key
+            compute: Function producing the value
+
+        Returns:
+            The cached or freshly computed value
+        """
+        return self.lookup(key, compute)[0]
+
+    def lookup(self, key: Hashable, compute: Callable[[], Any]) -> Tuple[Any, bool]:
+        """
+        Like get_or_compute, also telling whether the value came from the cache.
+
+        Returns:
+            Tuple of (value, hit)
+        """
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key], True
+            self.misses += 1
+
+        value = compute()
+        if self.maxsize > 0:
+            with self.lock:
+                self.entries[key] = value
+                self.entries.move_to_end(key)
+                while len(self.entries) > self.maxsize:
+                    self.entries.popitem(last=False)
+        return value, False
+
+    def stats(self) -> Dict[str, int]:
+        """Get hit, miss and size counters."""
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self.entries), 'maxsize': self.maxsize}
+
+    def items(self) -> List[Tuple[Hashable, Any]]:
+        """Get a snapshot of the cached (key, value) pairs, least recently used first."""
+        with self.lock:
+            return list(self.entries.items())
+
+    def clear(self):
+        """Drop all cached entries."""
+        with self.lock:
+            self.entries.clear()
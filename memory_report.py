@@ -0,0 +1,526 @@
+"""
+Memory footprint report for the e-invoice chatbot.
+This module measures the deep memory of the loaded data tables (per column,
+with its dtype and cardinality, and the dtype conversions that would shrink
+it), of the structures derived from them (memoized query and response
+contexts, identifier indexes, filtered tables, prompts, the routing models)
+and of each session's state, so nodes can be sized from measured numbers.
+
+Memory reachable from several places is counted once, where it is first met:
+tables first, then derived structures, then sessions. A filtered table that
+is a slice of a loaded table, or a session holding the tables, is therefore
+not charged for their buffers again. Text columns count each distinct string
+object once: read_csv keeps one object per distinct value, which pandas' own
+deep memory usage counts once per row.
+
+Run it on the exported data to size a node:
+    python memory_report.py --data-dir output --output memory.json
+"""
+
+import argparse
+import json
+import os
+import sys
+import types
+import weakref
+from collections import deque
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from plotly.basedatatypes import BaseFigure
+
+from chat_history import ChatHistory
+from memo import BoundedMemo
+
+# Values seen while suggesting conversions to datetime64 (ISO dates of the CSV exports)
+DATE_SAMPLE = 1000
+DATE_PATTERN = r'^\d{4}-\d{2}-\d{2}'
+
+# Objects whose size is not the footprint of the value holding them (code and shared machinery)
+_OPAQUE_TYPES = (type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType, types.MethodType,
+                 weakref.ref)
+
+# Key of the counted objects of object arrays in `seen` (a sorted array of their ids)
+_OBJECT_IDS = 'object_ids'
+
+# Signed integer dtypes tried in order for downcasts (unsigned ones would wrap on subtraction)
+_INTEGER_DTYPES = (np.int8, np.int16, np.int32, np.int64)
+
+
+def rss_mb() -> Optional[float]:
+    """Get this process's resident memory in MB (Linux only)."""
+    try:
+        with open('/proc/self/statm', encoding='utf-8') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def format_bytes(size: float) -> str:
+    """Format a byte count with a binary unit (e.g. '1.5 MiB')."""
+    for unit in ('B', 'KiB', 'MiB', 'GiB'):
+        if abs(size) < 1024 or unit == 'GiB':
+            return f"{size:.0f} {unit}" if unit == 'B' else f"{size:.1f} {unit}"
+        size /= 1024
+
+
+def _array_bytes(array: np.ndarray, seen: Dict) -> int:
+    """Bytes of the buffer an array keeps alive, or 0 if another array already counted it."""
+    root = array
+    while isinstance(root.base, np.ndarray):
+        root = root.base
+    # Memory-mapped and Arrow-backed arrays end in a buffer object
+    owner = root.base if root.base is not None else root
+    key, size = (id(owner), None), root.nbytes
+    if root.ndim == 2 and array.ndim == 1 and root.shape[0] > 1 and min(root.strides) > 0:
+        # A column of a pandas block (one row of the 2D array per column): each
+        # column counts its own row, and views of the column count nothing more
+        offset = array.__array_interface__['data'][0] - root.__array_interface__['data'][0]
+        first, second = root.strides
+        row = offset // first if first > second else (offset % second) // first
+        key, size = (id(owner), row), root.nbytes // root.shape[0]
+    if key in seen:
+        return 0
+    seen[key] = owner
+    return size
+
+
+def _object_bytes(values: np.ndarray, seen: Dict) -> int:
+    """
+    Bytes of the objects referenced by an object array that were not counted yet.
+
+    read_csv stores one object per distinct text value, and filtered tables
+    share the objects of the tables they come from, so each object counts
+    once (pandas' deep memory usage counts it once per reference).
+    """
+    values = values.ravel()
+    if not len(values):
+        return 0
+    ids, first = np.unique(np.fromiter(map(id, values), dtype=np.int64, count=len(values)), return_index=True)
+    counted = seen.get(_OBJECT_IDS)
+    if counted is not None:
+        new = ~np.isin(ids, counted, assume_unique=True)
+        ids, first = ids[new], first[new]
+    # The arrays holding the objects are kept in `seen`, so these ids stay theirs
+    seen[_OBJECT_IDS] = ids if counted is None else np.union1d(counted, ids)
+    return sum(map(sys.getsizeof, values[first]))
+
+
+def _column_bytes(series: pd.Series, seen: Dict) -> int:
+    if isinstance(series.dtype, np.dtype):
+        values = series.to_numpy(copy=False)
+        size = _array_bytes(values, seen)
+        if series.dtype == object:
+            size += _object_bytes(values, seen)
+        return size
+    values = series.array
+    if id(values) in seen:
+        return 0
+    seen[id(values)] = values
+    return int(series.memory_usage(index=False, deep=True))
+
+
+def _frame_bytes(frame: Any, seen: Dict) -> int:
+    size = 0
+    if id(frame.index) not in seen:
+        seen[id(frame.index)] = frame.index
+        size += int(frame.index.memory_usage(deep=True))
+    columns = frame.items() if isinstance(frame, pd.DataFrame) else [(frame.name, frame)]
+    for _, series in columns:
+        size += _column_bytes(series, seen)
+    return size
+
+
+def deep_size(value: Any, seen: Optional[Dict] = None) -> int:
+    """
+    Measure the memory held by a value and everything it references.
+
+    Pandas and NumPy objects count their buffers (a view counts nothing if the
+    array it views was counted) and the distinct objects of object arrays
+    (shallow, e.g. strings), Plotly figures the size of their data and layout;
+    classes, modules and functions are not followed.
+
+    Args:
+        value: Object to measure
+        seen: Objects and buffers already counted, by id (updated), to count
+            memory shared by several values once; it holds them, so their ids
+            are not reused while it is in use
+
+    Returns:
+        Size in bytes
+    """
+    seen = {} if seen is None else seen
+    size = 0
+    pending = [value]
+    while pending:
+        item = pending.pop()
+        if id(item) in seen or isinstance(item, _OPAQUE_TYPES):
+            continue
+        seen[id(item)] = item
+        if isinstance(item, (pd.DataFrame, pd.Series)):
+            size += _frame_bytes(item, seen)
+        elif isinstance(item, pd.Index):
+            size += int(item.memory_usage(deep=True))
+        elif isinstance(item, np.ndarray):
+            size += _array_bytes(item, seen)
+            if item.dtype == object:
+                size += _object_bytes(item, seen)
+        elif isinstance(item, BaseFigure):
+            figure = item.to_dict()
+            size += sys.getsizeof(item)
+            pending.append(figure)
+        elif isinstance(item, (str, bytes, int, float, bool, type(None))):
+            size += sys.getsizeof(item)
+        elif isinstance(item, Mapping):
+            entries = dict(item)
+            size += sys.getsizeof(entries)
+            pending.extend(entries.keys())
+            pending.extend(entries.values())
+        elif isinstance(item, (list, tuple, set, frozenset, deque)):
+            size += sys.getsizeof(item)
+            pending.extend(item)
+        else:
+            size += sys.getsizeof(item)
+            if hasattr(item, '__dict__'):
+                pending.append(vars(item))
+            for cls in type(item).__mro__:
+                for name in getattr(cls, '__slots__', ()):
+                    if hasattr(item, name):
+                        pending.append(getattr(item, name))
+    return size
+
+
+def mark_seen(values: Iterable[Any], seen: Dict):
+    """
+    Exclude objects from later measurements without counting them (e.g. components shared by all sessions).
+
+    Args:
+        values: Objects to exclude
+        seen: Counted objects by id, to add them to
+    """
+    for value in values:
+        seen[id(value)] = value
+
+
+def _smallest_integer(low: float, high: float) -> np.dtype:
+    for dtype in _INTEGER_DTYPES:
+        info = np.iinfo(dtype)
+        if info.min <= low and high <= info.max:
+            return np.dtype(dtype)
+    return np.dtype(np.int64)
+
+
+def _arrow_string_bytes(series: pd.Series) -> Optional[int]:
+    try:
+        import pyarrow as pa
+    except ImportError:
+        return None
+    try:
+        return pa.array(series, from_pandas=True).nbytes
+    except pa.ArrowException:
+        return None
+
+
+def suggest_dtype(series: pd.Series, cardinality: int, size: int) -> Optional[Tuple[str, int]]:
+    """
+    Suggest a lossless dtype that would make a column smaller.
+
+    Text with few distinct values becomes 'category', other text
+    'string[pyarrow]' and ISO date strings 'datetime64[ns]'; integers are
+    downcast to the smallest dtype holding their range, whole floats become
+    integers (nullable ones if they have missing values) and floats that
+    survive the round trip become float32.
+
+    Args:
+        series: Column to examine
+        cardinality: Number of distinct non-missing values in the column
+        size: Bytes the column holds now
+
+    Returns:
+        Tuple of (dtype, estimated bytes), or None if no conversion saves memory
+    """
+    rows = len(series)
+    if rows == 0:
+        return None
+    dtype = series.dtype
+    nulls = int(series.isna().sum())
+    candidates = []
+    if dtype == object or isinstance(dtype, pd.StringDtype):
+        present = series.dropna()
+        if cardinality <= rows // 2:
+            # Codes plus one copy of each distinct value
+            categories = pd.Series(present.unique())
+            candidates.append(('category', rows * _smallest_integer(-1, cardinality).itemsize
+                               + int(categories.memory_usage(index=False, deep=True))))
+        sample = present.iloc[:DATE_SAMPLE]
+        if len(sample) and sample.map(type).eq(str).all() and sample.str.match(DATE_PATTERN).all():
+            candidates.append(('datetime64[ns]', rows * 8))
+        elif dtype == object and present.map(type).eq(str).all():
+            arrow_bytes = _arrow_string_bytes(series)
+            if arrow_bytes is not None:
+                candidates.append(('string[pyarrow]', arrow_bytes))
+    elif dtype.kind == 'i':
+        if not nulls:
+            smallest = _smallest_integer(series.min(), series.max())
+            candidates.append((smallest.name, rows * smallest.itemsize))
+    elif dtype.kind == 'f':
+        values = series.to_numpy()
+        present = values[~np.isnan(values)]
+        info = np.iinfo(np.int64)
+        if len(present) and np.array_equal(present, np.round(present)) \
+                and info.min <= present.min() and present.max() <= info.max:
+            smallest = _smallest_integer(present.min(), present.max())
+            if nulls:
+                # Nullable integers keep a one-byte mask
+                candidates.append((smallest.name.capitalize(), rows * (smallest.itemsize + 1)))
+            else:
+                candidates.append((smallest.name, rows * smallest.itemsize))
+        elif dtype.itemsize > 4 and np.array_equal(values.astype(np.float32).astype(dtype), values, equal_nan=True):
+            candidates.append(('float32', rows * 4))
+
+    if not candidates:
+        return None
+    suggestion = min(candidates, key=lambda candidate: candidate[1])
+    return suggestion if suggestion[1] < size else None
+
+
+def column_report(series: pd.Series, seen: Optional[Dict] = None) -> Dict[str, Any]:
+    """
+    Describe the memory of one column.
+
+    Args:
+        series: Column to describe
+        seen: Counted objects by id (updated), so buffers and strings shared
+            with columns described before are not counted again
+
+    Returns:
+        Dictionary with the column's name, dtype, missing values, cardinality,
+        deep bytes, suggested dtype and the bytes it would save
+    """
+    cardinality = int(series.nunique(dropna=True))
+    size = _column_bytes(series, {} if seen is None else seen)
+    suggestion = suggest_dtype(series, cardinality, size)
+    return {
+        'column': series.name,
+        'dtype': str(series.dtype),
+        'nulls': int(series.isna().sum()),
+        'cardinality': cardinality,
+        'bytes': size,
+        'suggested_dtype': suggestion[0] if suggestion else None,
+        'savings_bytes': size - suggestion[1] if suggestion else 0
+    }
+
+
+def table_report(data: Dict[str, pd.DataFrame], seen: Optional[Dict] = None) -> List[Dict[str, Any]]:
+    """
+    Describe the memory of the data tables, column by column.
+
+    Args:
+        data: Dictionary of data tables
+        seen: Counted objects by id (updated with the tables' buffers, so derived
+            structures viewing them are not charged for them)
+
+    Returns:
+        List with, per table, its rows, deep bytes, bytes shared with other
+        workers (memory-mapped) and private, possible savings and its columns
+    """
+    seen = {} if seen is None else seen
+    shared = {}
+    if any(table.attrs.get('shared_from') for table in data.values()):
+        from shared_tables import attached_memory
+        shared = attached_memory(data)
+    report = []
+    for table_name, table in data.items():
+        seen[id(table)] = table
+        seen[id(table.index)] = table.index
+        columns = [column_report(series, seen) for _, series in table.items()]
+        size = int(table.index.memory_usage(deep=True)) + sum(column['bytes'] for column in columns)
+        report.append({
+            'table': table_name,
+            'rows': len(table),
+            'bytes': size,
+            'shared_bytes': shared.get(table_name, {}).get('shared_bytes', 0),
+            'private_bytes': shared.get(table_name, {}).get('private_bytes', size),
+            'savings_bytes': sum(column['savings_bytes'] for column in columns),
+            'columns': columns
+        })
+    return report
+
+
+def component_structures(router: Any, response_handler: Any) -> Dict[str, Any]:
+    """
+    Get the derived structures held by the chatbot's components.
+
+    Args:
+        router: DataRouter in use
+        response_handler: ResponseHandler in use
+
+    Returns:
+        Dictionary of structure name to the memo or object holding it
+    """
+    return {
+        'query_contexts': router.context_memo,
+        'identifier_indexes': router.entity_extractor.index_memo,
+        'filtered_tables': router.entity_extractor.filter_memo,
+        'response_contexts': response_handler.context_memo,
+        'domain_verdicts': response_handler.domain_gate.memo,
+        'system_prompts': response_handler.prompt_builder.memo,
+        'keyword_matcher': router.matcher,
+        'routing_classifier': router.classifier
+    }
+
+
+def derived_report(structures: Dict[str, Any], seen: Optional[Dict] = None) -> List[Dict[str, Any]]:
+    """
+    Describe the memory of derived structures.
+
+    Args:
+        structures: Dictionary of structure name to a BoundedMemo or any object
+        seen: Counted objects by id (updated)
+
+    Returns:
+        List with, per structure, its entries and capacity (memos only) and deep bytes
+    """
+    seen = {} if seen is None else seen
+    report = []
+    for name, structure in structures.items():
+        if structure is None:
+            continue
+        if isinstance(structure, BoundedMemo):
+            items = structure.items()
+            entries, maxsize = len(items), structure.maxsize
+            size = sys.getsizeof(structure) + deep_size(items, seen)
+        else:
+            entries = maxsize = None
+            size = deep_size(structure, seen)
+        report.append({'structure': name, 'entries': entries, 'maxsize': maxsize, 'bytes': size})
+    return report
+
+
+def session_report(sessions: Dict[str, Mapping[str, Any]], seen: Optional[Dict] = None) -> List[Dict[str, Any]]:
+    """
+    Describe the memory of each session's state, largest first.
+
+    Args:
+        sessions: Dictionary of session id to its state (key to value)
+        seen: Counted objects by id (updated); shared components should be in it
+
+    Returns:
+        List with, per session, its deep bytes, the bytes of the charts in its
+        chat history and its three largest state entries
+    """
+    seen = {} if seen is None else seen
+    report = []
+    for session_id, state in sessions.items():
+        by_key = {}
+        figure_bytes = 0
+        for key, value in dict(state).items():
+            size = 0
+            if isinstance(value, ChatHistory):
+                size = deep_size([message['figure'] for message in value if message.get('figure') is not None], seen)
+                figure_bytes += size
+            by_key[key] = size + deep_size(value, seen)
+        largest = sorted(by_key.items(), key=lambda item: item[1], reverse=True)[:3]
+        report.append({
+            'session': session_id,
+            'bytes': sum(by_key.values()),
+            'figure_bytes': figure_bytes,
+            'largest': {key: size for key, size in largest}
+        })
+    return sorted(report, key=lambda entry: entry['bytes'], reverse=True)
+
+
+def memory_report(data: Dict[str, pd.DataFrame], structures: Optional[Dict[str, Any]] = None,
+                  sessions: Optional[Dict[str, Mapping[str, Any]]] = None,
+                  shared: Iterable[Any] = ()) -> Dict[str, Any]:
+    """
+    Measure the memory footprint of the process's tables, derived structures and sessions.
+
+    Args:
+        data: Dictionary of data tables
+        structures: Derived structures by name (see component_structures)
+        sessions: State of each session by session id
+        shared: Objects not charged to the sessions referencing them (the
+            components, the history store)
+
+    Returns:
+        Dictionary with the process RSS in MB, the 'tables', 'derived' and
+        'sessions' reports and their 'totals' in bytes
+    """
+    seen = {}
+    tables = table_report(data, seen)
+    derived = derived_report(structures or {}, seen)
+    mark_seen(shared, seen)
+    session_entries = session_report(sessions or {}, seen)
+    return {
+        'rss_mb': rss_mb(),
+        'tables': tables,
+        'derived': derived,
+        'sessions': session_entries,
+        'totals': {
+            'tables': sum(entry['bytes'] for entry in tables),
+            'derived': sum(entry['bytes'] for entry in derived),
+            'sessions': sum(entry['bytes'] for entry in session_entries),
+            'savings': sum(entry['savings_bytes'] for entry in tables)
+        }
+    }
+
+
+def _warm(router: Any, response_handler: Any, data: Dict[str, pd.DataFrame], questions: int):
+    """Fill the derived structures by routing corpus questions, as answering them would."""
+    from routing_classifier import CORPUS_PATH
+    with open(CORPUS_PATH, encoding='utf-8') as f:
+        queries = [json.loads(line)['query'] for line in f if line.strip()][:questions]
+    for query in queries:
+        query_context = router.get_query_context(query)
+        scoped_data = router.entity_extractor.apply_filters(data, query_context['filters'])
+        response_handler.prepare_response_context(query_context, scoped_data)
+        response_handler.get_domain_verdict(query, query_context)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Report the memory footprint of the chatbot's data and caches")
+    parser.add_argument('--data-dir', default=None, help="Directory of the exported CSV files (default: output)")
+    parser.add_argument('--questions', type=int, default=200,
+                        help="Routing corpus questions answered first, to fill the derived structures")
+    parser.add_argument('--output', help="Write the report as JSON to this file")
+    args = parser.parse_args(argv)
+
+    import data_loader
+    from data_router import DataRouter
+    from response_handler import ResponseHandler
+    from routing_classifier import get_default_classifier
+
+    data = data_loader.load_data(args.data_dir or data_loader.DATA_DIR)
+    router = DataRouter(classifier=get_default_classifier())
+    response_handler = ResponseHandler(router.matcher)
+    _warm(router, response_handler, data, args.questions)
+    report = memory_report(data, component_structures(router, response_handler))
+
+    totals = report['totals']
+    print(f"Process RSS {report['rss_mb']:.0f} MB; tables {format_bytes(totals['tables'])} "
+          f"(dtype changes would save {format_bytes(totals['savings'])}), "
+          f"derived structures {format_bytes(totals['derived'])}")
+    for table in report['tables']:
+        print(f"\n{table['table']}: {table['rows']:,} rows, {format_bytes(table['bytes'])} "
+              f"({format_bytes(table['shared_bytes'])} shared)")
+        print(f"  {'column':<24} {'dtype':<16} {'distinct':>10} {'size':>10}  suggestion")
+        for column in sorted(table['columns'], key=lambda entry: entry['bytes'], reverse=True):
+            suggestion = (f"{column['suggested_dtype']} (-{format_bytes(column['savings_bytes'])})"
+                          if column['suggested_dtype'] else '')
+            print(f"  {column['column']:<24} {column['dtype']:<16} {column['cardinality']:>10,} "
+                  f"{format_bytes(column['bytes']):>10}  {suggestion}")
+    print(f"\n{'structure':<20} {'entries':>10} {'size':>10}")
+    for entry in report['derived']:
+        entries = '' if entry['entries'] is None else f"{entry['entries']}/{entry['maxsize']}"
+        print(f"{entry['structure']:<20} {entries:>10} {format_bytes(entry['bytes']):>10}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
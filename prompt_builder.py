@@ -0,0 +1,249 @@
+"""
+Prefix-stable prompt assembly for the e-invoice chatbot.
+This module renders the prompt in blocks ordered from the most static content
+to the most dynamic, memoizes the rendered blocks, and records how much of
+each prompt the API served from its prompt cache.
+
+Providers cache prompts by exact prefix. Every request routed to the same
+language and tables therefore starts with byte-identical messages: the
+general instructions and table descriptions, then the samples of unfiltered
+tables. The conversation history follows, so a session's prefix grows from
+turn to turn; the domain constraints and the samples of tables filtered for
+the query change with each question and come last, before the question.
+"""
+
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional
+
+from memo import BoundedMemo, json_default
+
+
+class PromptBuilder:
+    """
+    Renders the blocks of the system prompt, each memoized on what it depends on.
+    """
+
+    def __init__(self, system_messages: Dict, table_descriptions: Dict, domain_constraints: Dict,
+                 cache_size: int = 256):
+        """
+        Initialize the builder.
+
+        Args:
+            system_messages: Message type to {language: text}; 'general' opens every prompt
+            table_descriptions: Table name to {language: description}
+            domain_constraints: Domain name to {language: [constraint, ...]}
+            cache_size: Number of rendered system prompts memoized
+        """
+        self.system_messages = system_messages
+        self.table_descriptions = table_descriptions
+        self.domain_constraints = domain_constraints
+        self.memo = BoundedMemo(cache_size)
+
+    def system_prompt(self, lang: str, tables: Iterable[str], domains: Iterable[str]) -> str:
+        """
+        Get the full system prompt for a language, tables and domains.
+
+        Args:
+            lang: Language code ('en' or 'ar')
+            tables: Relevant tables
+            domains: Relevant domains
+
+        Returns:
+            System prompt string (base prompt followed by the domain constraints)
+        """
+        tables, domains = tuple(tables), tuple(domains)
+        return self.memo.get_or_compute(
+            ('system', lang, tables, domains),
+            lambda: self.base_prompt(lang, tables) + self.domain_prompt(lang, domains)
+        )
+
+    def base_prompt(self, lang: str, tables: Iterable[str]) -> str:
+        """
+        Get the general instructions and table descriptions for a language and tables.
+
+        Tables are rendered in definition order, whatever order routing
+        returned them in, so the same selection always gives the same text.
+
+        Args:
+            lang: Language code ('en' or 'ar')
+            tables: Relevant tables
+
+        Returns:
+            Base prompt string
+        """
+        tables = tuple(tables)
+        return self.memo.get_or_compute(('base', lang, tables), lambda: self._render_base(lang, tables))
+
+    def domain_prompt(self, lang: str, domains: Iterable[str]) -> str:
+        """
+        Get the constraints of the relevant domains, one "- " line each, in definition order.
+
+        Args:
+            lang: Language code ('en' or 'ar')
+            domains: Relevant domains
+
+        Returns:
+            Domain constraints string (empty without domains)
+        """
+        domains = tuple(domains)
+        return self.memo.get_or_compute(('domains', lang, domains), lambda: self._render_domains(lang, domains))
+
+    def _render_base(self, lang: str, tables: tuple) -> str:
+        base_prompt = self.system_messages['general'][lang] + "\n\n"
+        for table in self.table_descriptions:
+            if table in tables:
+                base_prompt += self.table_descriptions[table][lang] + "\n"
+        return base_prompt
+
+    def _render_domains(self, lang: str, domains: tuple) -> str:
+        domain_prompt = ""
+        for domain in self.domain_constraints:
+            if domain in domains:
+                for constraint in self.domain_constraints[domain][lang]:
+                    domain_prompt += "- " + constraint + "\n"
+        return domain_prompt
+
+
+def render_data_samples(data_samples: Dict[str, List[Dict]],
+                        header: str = "Here are samples from the relevant data tables:") -> str:
+    """Render data samples as a system message."""
+    data_samples_str = header + "\n\n"
+    for table_name, samples in data_samples.items():
+        data_samples_str += f"{table_name.upper()} TABLE SAMPLE:\n"
+        data_samples_str += json.dumps(samples, indent=2, ensure_ascii=False, default=json_default)
+        data_samples_str += "\n\n"
+    return data_samples_str
+
+
+def assemble_messages(static_blocks: List[str], query: str, history: Optional[List[Dict]] = None,
+                      dynamic_blocks: Optional[List[str]] = None) -> List[Dict]:
+    """
+    Order chat messages from the most static to the most dynamic.
+
+    Args:
+        static_blocks: System messages that only depend on the language, routing and data
+        query: The user's query text
+        history: Earlier conversation messages; a session appends to them, so they
+            extend the cached prefix from turn to turn
+        dynamic_blocks: Per-query system messages (e.g. samples of filtered tables)
+
+    Returns:
+        List of chat messages in OpenAI format
+    """
+    return [
+        *({"role": "system", "content": block} for block in static_blocks),
+        *(history or []),
+        *({"role": "system", "content": block} for block in dynamic_blocks or []),
+        {"role": "user", "content": query}
+    ]
+
+
+def prefix_hash(messages: List[Dict], count: int = 1) -> str:
+    """
+    Hash the static prefix of a request.
+
+    Requests with the same hash can be served from the provider's prompt
+    cache; a hash that changes between identical routings means the prefix
+    is not stable.
+
+    Args:
+        messages: Chat messages
+        count: Number of leading messages that make up the static prefix
+
+    Returns:
+        Short hexadecimal digest
+    """
+    prefix = json.dumps(messages[:count], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(prefix.encode('utf-8')).hexdigest()[:16]
+
+
+def usage_metrics(usage: Any) -> Dict[str, int]:
+    """
+    Read token usage from an API response's usage (SDK object or dictionary).
+
+    Args:
+        usage: The 'usage' of a chat completion or final stream chunk
+
+    Returns:
+        Dictionary with prompt_tokens, cached_tokens and completion_tokens
+    """
+    def read(source, name):
+        if source is None:
+            return None
+        return source.get(name) if isinstance(source, dict) else getattr(source, name, None)
+
+    details = read(usage, 'prompt_tokens_details')
+    return {
+        'prompt_tokens': read(usage, 'prompt_tokens') or 0,
+        'cached_tokens': read(details, 'cached_tokens') or 0,
+        'completion_tokens': read(usage, 'completion_tokens') or 0
+    }
+
+
+class PromptCacheMetrics:
+    """
+    Thread-safe counters of prompt and cached tokens, overall and per prefix hash.
+    """
+
+    def __init__(self, max_prefixes: int = 256):
+        """
+        Initialize the counters.
+
+        Args:
+            max_prefixes: Number of most recently used prefix hashes tracked individually
+        """
+        self.max_prefixes = max_prefixes
+        self.totals = {'requests': 0, 'prompt_tokens': 0, 'cached_tokens': 0, 'completion_tokens': 0}
+        self.prefixes = OrderedDict()
+        self.lock = threading.Lock()
+
+    def record(self, prefix: str, usage: Dict[str, int]):
+        """
+        Record the usage of one request.
+
+        Args:
+            prefix: Prefix hash of the request
+            usage: Dictionary from usage_metrics
+        """
+        with self.lock:
+            entry = self.prefixes.pop(prefix, None) or {'requests': 0, 'prompt_tokens': 0, 'cached_tokens': 0}
+            self.prefixes[prefix] = entry
+            while len(self.prefixes) > self.max_prefixes:
+                self.prefixes.popitem(last=False)
+            for counters in (self.totals, entry):
+                counters['requests'] += 1
+                counters['prompt_tokens'] += usage['prompt_tokens']
+                counters['cached_tokens'] += usage['cached_tokens']
+            self.totals['completion_tokens'] += usage['completion_tokens']
+
+    def stats(self) -> Dict:
+        """
+        Get the counters.
+
+        Returns:
+            Dictionary with the totals, the cached share of prompt tokens
+            ('cache_hit_ratio') and the per-prefix counters
+        """
+        with self.lock:
+            totals = dict(self.totals)
+            prefixes = {prefix: dict(entry) for prefix, entry in self.prefixes.items()}
+        totals['cache_hit_ratio'] = totals['cached_tokens'] / totals['prompt_tokens'] if totals['prompt_tokens'] else 0.0
+        totals['distinct_prefixes'] = len(prefixes)
+        return {'totals': totals, 'prefixes': prefixes}
+
+    def reset(self):
+        """Clear all counters."""
+        with self.lock:
+            self.totals = dict.fromkeys(self.totals, 0)
+            self.prefixes.clear()
+
+
+_default_metrics = PromptCacheMetrics()
+
+
+def get_prompt_cache_metrics() -> PromptCacheMetrics:
+    """Get the process-wide prompt cache metrics."""
+    return _default_metrics
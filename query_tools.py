@@ -0,0 +1,428 @@
+"""
+Local data tools for function-calling query planning in the e-invoice chatbot.
+This module exposes aggregation tools to the model and executes them with pandas
+against the loaded tables, so only small result sets are sent back to the API.
+"""
+
+import json
+from typing import Dict, List, Optional, Any
+import numpy as np
+import pandas as pd
+
+# Maximum number of result rows returned to the model per tool call
+MAX_RESULT_ROWS = 50
+
+# Supported aggregation functions
+AGGREGATIONS = ['sum', 'mean', 'count', 'min', 'max', 'nunique']
+
+# Supported filter operators
+FILTER_OPERATORS = ['eq', 'ne', 'gt', 'gte', 'lt', 'lte', 'in', 'contains']
+
+_FILTERS_SCHEMA = {
+    "type": "array",
+    "description": "Optional row filters combined with AND.",
+    "items": {
+        "type": "object",
+        "properties": {
+            "column": {"type": "string"},
+            "op": {"type": "string", "enum": FILTER_OPERATORS},
+            "value": {"description": "Value to compare with (a list for 'in')."}
+        },
+        "required": ["column", "op", "value"]
+    }
+}
+
+
+def _mask(result: pd.Series) -> np.ndarray:
+    """Boolean row mask of a comparison; missing values (pd.NA in nullable columns) do not match."""
+    return result.to_numpy(dtype=bool, na_value=False)
+
+
+class QueryTools:
+    """
+    Executes model-requested aggregation tools against the loaded data tables.
+    """
+
+    def __init__(self, data_tables: Dict[str, pd.DataFrame]):
+        """
+        Initialize the tools.
+
+        Args:
+            data_tables: Dictionary of available data tables
+        """
+        self.data_tables = data_tables
+
+    def get_tool_definitions(self) -> List[Dict]:
+        """
+        Get the tool definitions in OpenAI function-calling format.
+
+        Returns:
+            List of tool definitions
+        """
+        table_enum = sorted(self.data_tables.keys())
+        return [
+            {
+                "type": "function",
+                "function": {
+                    "name": "aggregate",
+                    "description": "Aggregate a metric column of a table, optionally grouped by a column.",
+                    "parameters": {
+                        "type": "object",
+                        "properties": {
+                            "table": {"type": "string", "enum": table_enum},
+                            "group_by": {"type": "string", "description": "Column to group by (omit for a single total)."},
+                            "metric": {"type": "string", "description": "Column to aggregate, or 'count' to count rows."},
+                            "agg": {"type": "string", "enum": AGGREGATIONS},
+                            "filters": _FILTERS_SCHEMA
+                        },
+                        "required": ["table", "metric"]
+                    }
+                }
+            },
+            {
+                "type": "function",
+                "function": {
+                    "name": "top_k",
+                    "description": "Return the k groups (or rows) with the highest or lowest metric value.",
+                    "parameters": {
+                        "type": "object",
+                        "properties": {
+                            "table": {"type": "string", "enum": table_enum},
+                            "group_by": {"type": "string", "description": "Column to rank groups by (omit to rank rows)."},
+                            "metric": {"type": "string", "description": "Column to rank on, or 'count'."},
+                            "agg": {"type": "string", "enum": AGGREGATIONS},
+                            "k": {"type": "integer", "minimum": 1, "maximum": MAX_RESULT_ROWS},
+                            "ascending": {"type": "boolean"},
+                            "filters": _FILTERS_SCHEMA
+                        },
+                        "required": ["table", "metric"]
+                    }
+                }
+            },
+            {
+                "type": "function",
+                "function": {
+                    "name": "time_series",
+                    "description": "Aggregate a metric per time period (day, week, month, quarter or year).",
+                    "parameters": {
+                        "type": "object",
+                        "properties": {
+                            "table": {"type": "string", "enum": table_enum},
+                            "date_column": {"type": "string"},
+                            "metric": {"type": "string", "description": "Column to aggregate, or 'count'."},
+                            "agg": {"type": "string", "enum": AGGREGATIONS},
+                            "freq": {"type": "string", "enum": ["day", "week", "month", "quarter", "year"]},
+                            "filters": _FILTERS_SCHEMA
+                        },
+                        "required": ["table", "metric"]
+                    }
+                }
+            },
+            {
+                "type": "function",
+                "function": {
+                    "name": "lookup_invoice",
+                    "description": "Fetch one invoice with its line items and audit log entries.",
+                    "parameters": {
+                        "type": "object",
+                        "properties": {
+                            "invoice_number": {"type": "string"}
+                        },
+                        "required": ["invoice_number"]
+                    }
+                }
+            }
+        ]
+
+    def describe_schema(self, tables: Optional[List[str]] = None, max_values: int = 8) -> str:
+        """
+        Describe table columns compactly so the model can plan tool calls.
+
+        Args:
+            tables: Tables to describe (defaults to all loaded tables)
+            max_values: Maximum distinct values listed for categorical columns
+
+        Returns:
+            Schema description text
+        """
+        lines = []
+        for table_name in tables or sorted(self.data_tables.keys()):
+            df = self.data_tables.get(table_name)
+            if df is None:
+                continue
+            lines.append(f"{table_name} ({len(df)} rows):")
+            for column in df.columns:
+                series = df[column]
+                description = f"  - {column} [{series.dtype}]"
+                if pd.api.types.is_string_dtype(series) or pd.api.types.is_categorical_dtype(series):
+                    values = series.dropna().unique()
+                    if len(values) <= max_values:
+                        description += ": " + ", ".join(str(value) for value in values)
+                lines.append(description)
+        return "\n".join(lines)
+
+    def execute(self, name: str, arguments: Any) -> Dict:
+        """
+        Execute a tool call.
+
+        Args:
+            name: Tool name
+            arguments: Tool arguments as a dict or a JSON string
+
+        Returns:
+            Dictionary with the tool result, or an 'error' entry
+        """
+        if isinstance(arguments, str):
+            try:
+                arguments = json.loads(arguments or '{}')
+            except ValueError:
+                return {'error': 'Arguments are not valid JSON.'}
+
+        handlers = {
+            'aggregate': self.aggregate,
+            'top_k': self.top_k,
+            'time_series': self.time_series,
+            'lookup_invoice': self.lookup_invoice
+        }
+        if name not in handlers:
+            return {'error': f"Unknown tool '{name}'."}
+
+        try:
+            return handlers[name](**arguments)
+        except (KeyError, ValueError, TypeError) as e:
+            return {'error': str(e)}
+
+    def _get_table(self, table: str) -> pd.DataFrame:
+        if table not in self.data_tables:
+            raise KeyError(f"Unknown table '{table}'. Available tables: {sorted(self.data_tables.keys())}")
+        return self.data_tables[table]
+
+    def _check_column(self, df: pd.DataFrame, column: str):
+        if column not in df.columns:
+            raise KeyError(f"Unknown column '{column}'. Available columns: {list(df.columns)}")
+
+    def _apply_filters(self, df: pd.DataFrame, filters: Optional[List[Dict]]) -> pd.DataFrame:
+        """Apply AND-combined filters with one vectorized boolean mask."""
+        if not filters:
+            return df
+
+        mask = np.ones(len(df), dtype=bool)
+        for condition in filters:
+            column, op, value = condition['column'], condition['op'], condition.get('value')
+            self._check_column(df, column)
+            series = df[column]
+
+            if op == 'eq':
+                mask &= _mask(series == value)
+            elif op == 'ne':
+                mask &= ~_mask(series == value)
+            elif op == 'gt':
+                mask &= _mask(series > value)
+            elif op == 'gte':
+                mask &= _mask(series >= value)
+            elif op == 'lt':
+                mask &= _mask(series < value)
+            elif op == 'lte':
+                mask &= _mask(series <= value)
+            elif op == 'in':
+                mask &= _mask(series.isin(value if isinstance(value, list) else [value]))
+            elif op == 'contains':
+                mask &= _mask(series.astype(str).str.contains(str(value), case=False, regex=False))
+            else:
+                raise ValueError(f"Unsupported filter operator '{op}'.")
+
+        return df[mask]
+
+    def _aggregate_series(self, df: pd.DataFrame, group_by: Optional[str], metric: str, agg: str):
+        """Aggregate a metric column (or row counts) for the whole frame or per group."""
+        if agg not in AGGREGATIONS:
+            raise ValueError(f"Unsupported aggregation '{agg}'.")
+
+        if metric == 'count':
+            if group_by:
+                return df.groupby(group_by, observed=True).size()
+            return len(df)
+
+        self._check_column(df, metric)
+        if group_by:
+            return df.groupby(group_by, observed=True)[metric].agg(agg)
+        return df[metric].agg(agg)
+
+    def _to_records(self, series: pd.Series, key: str, value: str) -> List[Dict]:
+        frame = series.reset_index()
+        frame.columns = [key, value]
+        return json.loads(frame.head(MAX_RESULT_ROWS).to_json(orient='records', date_format='iso'))
+
+    def aggregate(self, table: str, metric: str, group_by: Optional[str] = None,
+                  agg: str = 'sum', filters: Optional[List[Dict]] = None) -> Dict:
+        """
+        Aggregate a metric, optionally per group.
+
+        Args:
+            table: Table name
+            metric: Column to aggregate, or 'count'
+            group_by: Optional column to group by
+            agg: Aggregation function
+            filters: Optional row filters
+
+        Returns:
+            Dictionary with the aggregated value or per-group rows
+        """
+        df = self._get_table(table)
+        if group_by:
+            self._check_column(df, group_by)
+        df = self._apply_filters(df, filters)
+        if metric == 'count':
+            agg = 'count'
+
+        result = self._aggregate_series(df, group_by, metric, agg)
+        output = {'tool': 'aggregate', 'table': table, 'metric': metric, 'agg': agg,
+                  'group_by': group_by, 'rows_matched': int(len(df))}
+        if group_by:
+            result = result.sort_values(ascending=False)
+            output['groups'] = int(len(result))
+            output['rows'] = self._to_records(result, group_by, metric)
+        else:
+            output['value'] = None if pd.isna(result) else float(result)
+        return output
+
+    def top_k(self, table: str, metric: str, group_by: Optional[str] = None, agg: str = 'sum',
+              k: int = 10, ascending: bool = False, filters: Optional[List[Dict]] = None) -> Dict:
+        """
+        Return the k highest (or lowest) groups or rows by a metric.
+
+        Args:
+            table: Table name
+            metric: Column to rank on, or 'count'
+            group_by: Optional column to rank groups by; rows are ranked otherwise
+            agg: Aggregation function for grouped ranking
+            k: Number of results
+            ascending: Return the lowest values instead of the highest
+            filters: Optional row filters
+
+        Returns:
+            Dictionary with the ranked rows
+        """
+        df = self._get_table(table)
+        df = self._apply_filters(df, filters)
+        k = max(1, min(int(k), MAX_RESULT_ROWS))
+        output = {'tool': 'top_k', 'table': table, 'metric': metric, 'group_by': group_by,
+                  'ascending': ascending, 'rows_matched': int(len(df))}
+
+        if group_by:
+            self._check_column(df, group_by)
+            if metric == 'count':
+                agg = 'count'
+            result = self._aggregate_series(df, group_by, metric, agg)
+            result = result.nsmallest(k) if ascending else result.nlargest(k)
+            output['agg'] = agg
+            output['rows'] = self._to_records(result, group_by, metric)
+        else:
+            self._check_column(df, metric)
+            rows = df.nsmallest(k, metric) if ascending else df.nlargest(k, metric)
+            output['rows'] = json.loads(rows.to_json(orient='records', date_format='iso'))
+        return output
+
+    def time_series(self, table: str, metric: str, date_column: Optional[str] = None, agg: str = 'sum',
+                    freq: str = 'month', filters: Optional[List[Dict]] = None) -> Dict:
+        """
+        Aggregate a metric per time period.
+
+        Args:
+            table: Table name
+            metric: Column to aggregate, or 'count'
+            date_column: Datetime column (defaults to the first datetime-like column)
+            agg: Aggregation function
+            freq: Period size ('day', 'week', 'month', 'quarter' or 'year')
+            filters: Optional row filters
+
+        Returns:
+            Dictionary with one row per period
+        """
+        period_codes = {'day': 'D', 'week': 'W', 'month': 'M', 'quarter': 'Q', 'year': 'Y'}
+        if freq not in period_codes:
+            raise ValueError(f"Unsupported frequency '{freq}'.")
+
+        df = self._get_table(table)
+        if date_column is None:
+            date_column = next(
+                (column for column in df.columns
+                 if pd.api.types.is_datetime64_any_dtype(df[column])
+                 or column.endswith(('_datetime', '_date')) or column == 'timestamp'),
+                None
+            )
+            if date_column is None:
+                raise ValueError(f"Table '{table}' has no date column.")
+        self._check_column(df, date_column)
+        df = self._apply_filters(df, filters)
+
+        dates = df[date_column]
+        if not pd.api.types.is_datetime64_any_dtype(dates):
+            dates = pd.to_datetime(dates, errors='coerce')
+        periods = dates.dt.to_period(period_codes[freq]).astype(str).rename('period')
+
+        if metric == 'count':
+            agg = 'count'
+            result = df.groupby(periods).size()
+        else:
+            self._check_column(df, metric)
+            if agg not in AGGREGATIONS:
+                raise ValueError(f"Unsupported aggregation '{agg}'.")
+            result = df[metric].groupby(periods).agg(agg)
+
+        result = result.sort_index().tail(MAX_RESULT_ROWS)
+        return {
+            'tool': 'time_series', 'table': table, 'metric': metric, 'agg': agg, 'freq': freq,
+            'date_column': date_column, 'rows_matched': int(len(df)),
+            'rows': self._to_records(result, 'period', metric)
+        }
+
+    def lookup_invoice(self, invoice_number: str) -> Dict:
+        """
+        Fetch an invoice with its line items and audit log entries.
+
+        Args:
+            invoice_number: Invoice number to look up
+
+        Returns:
+            Dictionary with the invoice, its items and audit logs
+        """
+        invoices = self._get_table('invoices')
+        invoice_rows = invoices[invoices['invoice_number'].astype(str) == str(invoice_number)]
+        if invoice_rows.empty:
+            return {'tool': 'lookup_invoice', 'invoice_number': invoice_number, 'found': False}
+
+        output = {
+            'tool': 'lookup_invoice',
+            'invoice_number': invoice_number,
+            'found': True,
+            'invoice': json.loads(invoice_rows.head(1).to_json(orient='records', date_format='iso'))[0]
+        }
+        for table_name in ('items', 'audit_logs'):
+            df = self.data_tables.get(table_name)
+            if df is not None and 'invoice_id' in df.columns:
+                related = df[df['invoice_id'].astype(str) == str(invoice_number)]
+                output[table_name] = json.loads(related.head(MAX_RESULT_ROWS).to_json(orient='records', date_format='iso'))
+        return output
+
+
+# Example usage
+if __name__ == "__main__":
+    mock_data = {
+        'invoices': pd.DataFrame({
+            'invoice_number': [f'INV{i:03d}' for i in range(1, 101)],
+            'invoice_datetime': pd.date_range(start='2025-01-01', periods=100),
+            'buyer_emirate': np.random.choice(['Dubai', 'Abu Dhabi', 'Sharjah'], 100),
+            'invoice_tax_amount': np.random.uniform(50, 500, 100),
+            'anomaly_type': np.random.choice([None, 'Duplicate', 'Round Amount'], 100, p=[0.8, 0.1, 0.1])
+        })
+    }
+
+    tools = QueryTools(mock_data)
+    print(tools.describe_schema())
+    print(tools.execute('aggregate', {'table': 'invoices', 'group_by': 'buyer_emirate', 'metric': 'invoice_tax_amount'}))
+    print(tools.execute('top_k', '{"table": "invoices", "group_by": "anomaly_type", "metric": "count", "k": 2}'))
+    print(tools.execute('time_series', {'table': 'invoices', 'metric': 'invoice_tax_amount', 'freq': 'month'}))
+    print(tools.execute('aggregate', {'table': 'invoices', 'metric': 'invoice_tax_amount',
+                                      'filters': [{'column': 'buyer_emirate', 'op': 'eq', 'value': 'Dubai'}]}))
+    print(tools.execute('lookup_invoice', {'invoice_number': 'INV007'}))
@@ -6,25 +6,48 @@ This module handles API calls and generates responses based on query context.
 import os
 import json
 import time
-from typing import Dict, List, Tuple, Optional, Any
+from typing import Dict, Iterator, List, Tuple, Optional, Any
 import pandas as pd
-import openai
+
+from llm_client import LLMClient, LLMError, classify_error, get_default_client
+from prompt_builder import (PromptCacheMetrics, assemble_messages, get_prompt_cache_metrics, prefix_hash,
+                            render_data_samples, usage_metrics)
+from query_tools import QueryTools
+from telemetry import get_telemetry
+
+# Maximum number of tool-calling rounds before the model must answer
+MAX_TOOL_ROUNDS = 4
+
+# User-facing messages for structured API error codes
+API_ERROR_MESSAGES = {
+    'invalid_api_key': 'Invalid API key. Please check your OpenAI API key and try again.',
+    'rate_limit': 'Rate limit exceeded. Please wait a moment and try again.',
+    'quota_exceeded': 'The OpenAI quota for this API key is exhausted. Please check your plan and billing details.',
+    'timeout': 'The OpenAI API did not respond in time. Please try again.',
+    'connection': 'Could not connect to the OpenAI API. Please check your network connection and try again.',
+    'server_error': 'The OpenAI API is temporarily unavailable. Please try again later.'
+}
 
 class ResponseGenerator:
     """
     Handles ChatGPT API integration and response generation.
     """
     
-    def __init__(self, api_key: Optional[str] = None):
+    def __init__(self, api_key: Optional[str] = None, client: Optional[LLMClient] = None,
+                 metrics: Optional[PromptCacheMetrics] = None):
         """
         Initialize the response generator.
         
         Args:
             api_key: Optional OpenAI API key
+            client: LLM client to send requests through (defaults to the shared,
+                rate-limited process-wide client)
+            metrics: Prompt cache metrics to record token usage in (defaults to
+                the process-wide metrics)
         """
         self.api_key = api_key
-        if api_key:
-            openai.api_key = api_key
+        self.client = client or get_default_client()
+        self.metrics = metrics or get_prompt_cache_metrics()
     
     def set_api_key(self, api_key: str) -> bool:
         """
@@ -40,7 +63,6 @@ class ResponseGenerator:
             return False
         
         self.api_key = api_key
-        openai.api_key = api_key
         return True
     
     def has_valid_api_key(self) -> bool:
@@ -52,7 +74,90 @@ class ResponseGenerator:
         """
         return bool(self.api_key) and isinstance(self.api_key, str) and len(self.api_key) >= 10
     
-    def generate_response(self, query: str, response_context: Dict, model: str = "gpt-3.5-turbo") -> Dict:
+    def build_messages(self, query: str, response_context: Dict,
+                       history: Optional[List[Dict]] = None) -> List[Dict]:
+        """
+        Build the chat messages for a query.
+        
+        Args:
+            query: The user's query text
+            response_context: Dictionary with response context
+            history: Earlier conversation messages (e.g. from ConversationMemory)
+            
+        Returns:
+            List of chat messages in OpenAI format
+        """
+        static_blocks, dynamic_blocks = self.prompt_blocks(response_context)
+        return assemble_messages(static_blocks, query, history, dynamic_blocks)
+    
+    def prompt_blocks(self, response_context: Dict, static_extra: Optional[List[str]] = None) -> Tuple[List[str], List[str]]:
+        """
+        Split the system content of a response context into static and per-query blocks.
+        
+        Most static first: the base prompt and the samples of unfiltered tables only
+        change with the language and routed tables, so together with the growing
+        history they stay a cacheable prefix; the domain constraints and samples
+        filtered for this query go after the history.
+        
+        Args:
+            response_context: Dictionary with response context
+            static_extra: Further static system messages placed after the static samples
+            
+        Returns:
+            Tuple of (static blocks, per-query blocks)
+        """
+        static_samples, query_samples = self.split_data_samples(response_context)
+        if 'base_prompt' in response_context:
+            static_blocks = [response_context['base_prompt']]
+            dynamic_blocks = [response_context['domain_prompt']] if response_context['domain_prompt'] else []
+        else:
+            static_blocks, dynamic_blocks = [response_context['system_prompt']], []
+        if static_samples:
+            static_blocks.append(render_data_samples(static_samples))
+        static_blocks += static_extra or []
+        if query_samples:
+            dynamic_blocks.append(render_data_samples(
+                query_samples, "Here are samples from the relevant data tables, filtered for this question:"))
+        return static_blocks, dynamic_blocks
+    
+    def split_data_samples(self, response_context: Dict) -> Tuple[Dict, Dict]:
+        """
+        Split the data samples of a response context into routing-level and query-level samples.
+        
+        Args:
+            response_context: Dictionary with response context
+            
+        Returns:
+            Tuple of (samples of unfiltered tables, samples of tables filtered for the query)
+        """
+        data_samples = response_context.get('data_samples') or {}
+        query_tables = set(response_context.get('query_samples') or ())
+        return (
+            {table: samples for table, samples in data_samples.items() if table not in query_tables},
+            {table: samples for table, samples in data_samples.items() if table in query_tables}
+        )
+    
+    def record_usage(self, messages: List[Dict], usage: Any, static_count: int = 1) -> Optional[Dict]:
+        """
+        Record the token usage of a request in the prompt cache metrics.
+        
+        Args:
+            messages: The request's chat messages
+            usage: The 'usage' reported by the API (None if it reported none)
+            static_count: Number of leading messages that make up the static prefix
+            
+        Returns:
+            Dictionary with the token counts and the 'prefix_hash', or None without usage
+        """
+        if usage is None:
+            return None
+        metrics = usage_metrics(usage)
+        metrics['prefix_hash'] = prefix_hash(messages, static_count)
+        self.metrics.record(metrics['prefix_hash'], metrics)
+        return metrics
+    
+    def generate_response(self, query: str, response_context: Dict, model: str = "gpt-3.5-turbo",
+                          history: Optional[List[Dict]] = None) -> Dict:
         """
         Generate a response using the ChatGPT API.
         
@@ -60,6 +165,7 @@ class ResponseGenerator:
             query: The user's query text
             response_context: Dictionary with response context
             model: The OpenAI model to use
+            history: Earlier conversation messages for follow-up questions
             
         Returns:
             Dictionary with response information
@@ -85,30 +191,20 @@ class ResponseGenerator:
             }
         
         try:
-            # Prepare messages for the API call
-            messages = [
-                {"role": "system", "content": response_context['system_prompt']},
-                {"role": "user", "content": query}
-            ]
+            # Prepare messages for the API call, most static first
+            static_blocks, dynamic_blocks = self.prompt_blocks(response_context)
+            messages = assemble_messages(static_blocks, query, history, dynamic_blocks)
             
-            # Add data samples to the system message if available
-            if 'data_samples' in response_context and response_context['data_samples']:
-                data_samples_str = "Here are samples from the relevant data tables:\n\n"
-                for table_name, samples in response_context['data_samples'].items():
-                    data_samples_str += f"{table_name.upper()} TABLE SAMPLE:\n"
-                    data_samples_str += json.dumps(samples, indent=2, ensure_ascii=False)
-                    data_samples_str += "\n\n"
-                
-                # Add data samples as a system message
-                messages.insert(1, {"role": "system", "content": data_samples_str})
-            
-            # Make the API call
-            response = openai.ChatCompletion.create(
-                model=model,
-                messages=messages,
-                temperature=0.7,
-                max_tokens=1000
-            )
+            # Make the API call (rate limited and retried by the client)
+            with get_telemetry().span('openai_request', stream=False, model=model) as span:
+                response = self.client.create_chat_completion(
+                    self.api_key,
+                    model=model,
+                    messages=messages,
+                    temperature=0.7,
+                    max_tokens=1000
+                )
+                span['outcome'] = 'ok'
             
             # Extract the response text
             response_text = response.choices[0].message.content
@@ -118,38 +214,235 @@ class ResponseGenerator:
                 'error': None,
                 'message': None,
                 'response_text': response_text,
-                'visualization_type': response_context.get('visualization_type')
+                'visualization_type': response_context.get('visualization_type'),
+                'usage': self.record_usage(messages, getattr(response, 'usage', None), len(static_blocks))
+            }
+            
+        except Exception as e:
+            # Handle API errors by their structured error code
+            error = classify_error(e)
+            message = API_ERROR_MESSAGES.get(error.code, f'API error: {error.message}')
+            
+            return {
+                'success': False,
+                'error': error.code if error.code in API_ERROR_MESSAGES else 'api_error',
+                'message': message,
+                'response_text': None,
+                'visualization_type': None
+            }
+    
+    def generate_response_stream(self, query: str, response_context: Dict,
+                                 model: str = "gpt-3.5-turbo",
+                                 history: Optional[List[Dict]] = None) -> Iterator[str]:
+        """
+        Stream a response from the ChatGPT API as text chunks.
+        
+        Identical concurrent requests share one upstream stream.
+        
+        Args:
+            query: The user's query text
+            response_context: Dictionary with response context
+            model: The OpenAI model to use
+            history: Earlier conversation messages for follow-up questions
+            
+        Returns:
+            Iterator over response text chunks
+            
+        Raises:
+            LLMError: If the API key is missing or the request fails
+        """
+        if not self.has_valid_api_key():
+            raise LLMError('missing_api_key', 'Please provide an OpenAI API key in the sidebar.')
+        
+        if response_context.get('is_out_of_domain', False):
+            return iter([response_context['out_of_domain_message']])
+        
+        static_blocks, dynamic_blocks = self.prompt_blocks(response_context)
+        messages = assemble_messages(static_blocks, query, history, dynamic_blocks)
+        started = time.perf_counter()
+        chunks = self.client.stream_chat_completion(
+            self.api_key,
+            model=model,
+            messages=messages,
+            temperature=0.7,
+            max_tokens=1000,
+            stream_options={'include_usage': True},
+            on_usage=lambda usage: self.record_usage(messages, usage, len(static_blocks))
+        )
+        return self._timed_stream(chunks, model, started)
+    
+    def _timed_stream(self, chunks: Iterator[str], model: str, started: float) -> Iterator[str]:
+        """Pass a stream through, recording its time to first token and total time."""
+        telemetry = get_telemetry()
+        attributes = {'stream': True, 'model': model, 'outcome': 'error'}
+        try:
+            for chunk in chunks:
+                if 'first_token_seconds' not in attributes:
+                    attributes['first_token_seconds'] = time.perf_counter() - started
+                    telemetry.observe('openai_first_token', attributes['first_token_seconds'], {'stream': True})
+                yield chunk
+            attributes['outcome'] = 'ok'
+        except GeneratorExit:
+            attributes['outcome'] = 'cancelled'
+            raise
+        finally:
+            telemetry.record('openai_request', time.perf_counter() - started, attributes)
+    
+    def generate_response_with_tools(self, query: str, response_context: Dict,
+                                     data_tables: Dict[str, pd.DataFrame],
+                                     model: str = "gpt-3.5-turbo",
+                                     history: Optional[List[Dict]] = None) -> Dict:
+        """
+        Generate a response by letting the model plan local aggregation tool calls.
+        
+        Instead of data samples, the model receives the table schemas and calls
+        aggregate/top_k/time_series/lookup_invoice tools that run locally with
+        pandas; only their small results are sent back to the API.
+        
+        Args:
+            query: The user's query text
+            response_context: Dictionary with response context
+            data_tables: Dictionary of available data tables
+            model: The OpenAI model to use
+            history: Earlier conversation messages for follow-up questions
+            
+        Returns:
+            Dictionary with response information, including the executed 'plan'
+        """
+        if not self.has_valid_api_key():
+            return {
+                'success': False,
+                'error': 'missing_api_key',
+                'message': 'Please provide an OpenAI API key in the sidebar.',
+                'response_text': None,
+                'visualization_type': None
+            }
+        
+        if response_context.get('is_out_of_domain', False):
+            return {
+                'success': True,
+                'error': None,
+                'message': None,
+                'response_text': response_context['out_of_domain_message'],
+                'visualization_type': None
+            }
+        
+        tools = QueryTools(data_tables)
+        tables = response_context['query_context']['relevant_tables']
+        # The schema only depends on the routed tables, so it is part of the static prefix
+        static_blocks, dynamic_blocks = self.prompt_blocks(
+            {**response_context, 'data_samples': None},
+            ["Answer using the provided tools to compute figures from the full data; "
+             "never guess numbers. Available tables and columns:\n" + tools.describe_schema(tables)]
+        )
+        messages = assemble_messages(static_blocks, query, history, dynamic_blocks)
+        plan = []
+        usage = []
+        
+        try:
+            for round_number in range(MAX_TOOL_ROUNDS):
+                with get_telemetry().span('openai_request', stream=False, model=model, tool_round=round_number) as span:
+                    response = self.client.create_chat_completion(
+                        self.api_key,
+                        model=model,
+                        messages=messages,
+                        temperature=0.2,
+                        max_tokens=1000,
+                        tools=tools.get_tool_definitions()
+                    )
+                    span['outcome'] = 'ok'
+                usage.append(self.record_usage(messages, getattr(response, 'usage', None), len(static_blocks)))
+                message = response.choices[0].message
+                tool_calls = getattr(message, 'tool_calls', None)
+                
+                if not tool_calls:
+                    return {
+                        'success': True,
+                        'error': None,
+                        'message': None,
+                        'response_text': message.content,
+                        'visualization_type': response_context.get('visualization_type'),
+                        'plan': plan,
+                        'usage': usage
+                    }
+                
+                messages.append({
+                    "role": "assistant",
+                    "content": message.content,
+                    "tool_calls": [
+                        {
+                            "id": call.id,
+                            "type": "function",
+                            "function": {"name": call.function.name, "arguments": call.function.arguments}
+                        }
+                        for call in tool_calls
+                    ]
+                })
+                
+                # Execute the requested tools locally and return only their results
+                for call in tool_calls:
+                    result = tools.execute(call.function.name, call.function.arguments)
+                    plan.append({'tool': call.function.name, 'arguments': call.function.arguments, 'result': result})
+                    messages.append({
+                        "role": "tool",
+                        "tool_call_id": call.id,
+                        "content": json.dumps(result, ensure_ascii=False, default=str)
+                    })
+            
+            return {
+                'success': False,
+                'error': 'api_error',
+                'message': 'The model did not produce an answer within the tool-call limit. Please rephrase your question.',
+                'response_text': None,
+                'visualization_type': None,
+                'plan': plan
             }
             
         except Exception as e:
-            # Handle API errors
-            error_message = str(e)
+            error = classify_error(e)
             
-            # Check for common error types
-            if "authentication" in error_message.lower():
-                return {
-                    'success': False,
-                    'error': 'invalid_api_key',
-                    'message': 'Invalid API key. Please check your OpenAI API key and try again.',
-                    'response_text': None,
-                    'visualization_type': None
-                }
-            elif "rate limit" in error_message.lower():
-                return {
-                    'success': False,
-                    'error': 'rate_limit',
-                    'message': 'Rate limit exceeded. Please wait a moment and try again.',
-                    'response_text': None,
-                    'visualization_type': None
-                }
-            else:
-                return {
-                    'success': False,
-                    'error': 'api_error',
-                    'message': f'API error: {error_message}',
-                    'response_text': None,
-                    'visualization_type': None
-                }
+            return {
+                'success': False,
+                'error': error.code if error.code in API_ERROR_MESSAGES else 'api_error',
+                'message': API_ERROR_MESSAGES.get(error.code, f'API error: {error.message}'),
+                'response_text': None,
+                'visualization_type': None
+            }
+    
+    def summarize_conversation(self, previous_summary: str, turns: List[Dict], max_tokens: int,
+                               model: str = "gpt-3.5-turbo") -> str:
+        """
+        Fold conversation turns into a rolling summary using the ChatGPT API.
+        
+        Used as the summarizer of a ConversationMemory; only called when older
+        turns leave the verbatim window, so each turn is summarized once.
+        
+        Args:
+            previous_summary: Summary of the turns folded earlier
+            turns: Turns to fold into the summary
+            max_tokens: Token budget of the resulting summary
+            model: The OpenAI model to use
+            
+        Returns:
+            The updated summary
+        """
+        transcript = "\n".join(f"{turn['role']}: {turn['content']}" for turn in turns)
+        messages = [
+            {"role": "system", "content": "Update the summary of an e-invoice data analysis conversation. "
+                                          "Keep the entities, filters, figures and open questions the user "
+                                          "may refer back to. Reply with the summary only, in the language "
+                                          "of the conversation."},
+            {"role": "user", "content": f"Current summary:\n{previous_summary or '(none)'}\n\n"
+                                        f"New turns:\n{transcript}"}
+        ]
+        response = self.client.create_chat_completion(
+            self.api_key,
+            model=model,
+            messages=messages,
+            temperature=0,
+            max_tokens=max_tokens
+        )
+        return response.choices[0].message.content or previous_summary
     
     def generate_mock_response(self, query: str, response_context: Dict) -> Dict:
         """
@@ -234,7 +527,7 @@ if __name__ == "__main__":
     from response_handler import ResponseHandler
     
     router = DataRouter()
-    handler = ResponseHandler()
+    handler = ResponseHandler(router.matcher)
     generator = ResponseGenerator()  # No API key for testing
     
     # Test with sample queries
@@ -8,12 +8,28 @@ import json
 from typing import Dict, List, Tuple, Optional, Any
 import pandas as pd
 
+from domain_gate import DomainGate
+from keyword_matcher import KeywordMatcher
+from memo import BoundedMemo, data_version, freeze
+from prompt_builder import PromptBuilder
+from telemetry import get_telemetry
+
 class ResponseHandler:
     """
     Handles multilingual and domain-aware responses for the e-invoice chatbot.
     """
     
-    def __init__(self):
+    def __init__(self, matcher: Optional[KeywordMatcher] = None, cache_size: int = 256):
+        """
+        Initialize the response handler.
+        
+        Args:
+            matcher: Keyword matcher shared with the data router (usually router.matcher),
+                so each query is scanned once; a private matcher is created if omitted
+            cache_size: Number of response contexts memoized (0 disables the memo)
+        """
+        self.context_memo = BoundedMemo(cache_size)
+        
         # Define domain constraints
         self.domain_constraints = {
             'tax_compliance': {
@@ -125,6 +141,13 @@ class ResponseHandler:
                 'ar': ['خريطة', 'موقع', 'إمارة', 'منطقة', 'جغرافي', 'مكاني', 'منطقة']
             }
         }
+        
+        # Register the visualization keywords; out-of-domain questions are detected by the domain gate
+        self.matcher = matcher or KeywordMatcher()
+        self.matcher.add_keywords('visualizations', self.visualization_suggestions)
+        
+        self.prompt_builder = PromptBuilder(self.system_messages, self.table_descriptions, self.domain_constraints)
+        self.domain_gate = DomainGate()
     
     def get_system_prompt(self, query_context: Dict) -> str:
         """
@@ -136,60 +159,57 @@ class ResponseHandler:
         Returns:
             System prompt string
         """
-        lang = query_context['language']
-        
-        # Start with general system message
-        system_prompt = self.system_messages['general'][lang] + "\n\n"
-        
-        # Add table descriptions for relevant tables
-        for table in query_context['relevant_tables']:
-            if table in self.table_descriptions:
-                system_prompt += self.table_descriptions[table][lang] + "\n"
+        # Rendered in a canonical order and memoized, so identical routings share a cacheable prefix
+        return self.prompt_builder.system_prompt(query_context['language'],
+                                                 query_context['relevant_tables'],
+                                                 query_context['relevant_domains'])
+    
+    def get_keyword_matches(self, query: str, query_context: Optional[Dict] = None) -> Dict:
+        """
+        Get the keyword matches of a query, reusing the router's scan when possible.
         
-        # Add domain constraints
-        for domain in query_context['relevant_domains']:
-            if domain in self.domain_constraints:
-                for constraint in self.domain_constraints[domain][lang]:
-                    system_prompt += "- " + constraint + "\n"
+        Args:
+            query: The user's query text
+            query_context: Dictionary with query context information
+            
+        Returns:
+            Keyword matches as returned by KeywordMatcher.match
+        """
+        keyword_matches = (query_context or {}).get('keyword_matches')
+        # The router's scan only covers our lists when it shares our matcher
+        if keyword_matches is None or 'visualizations' not in keyword_matches:
+            keyword_matches = self.matcher.match(query)
+        return keyword_matches
+    
+    def get_domain_verdict(self, query: str, query_context: Optional[Dict] = None) -> Dict:
+        """
+        Score whether a query is about e-invoice data, with the local domain gate.
         
-        return system_prompt
+        Args:
+            query: The user's query text
+            query_context: Dictionary with query context information (optional);
+                its keyword matches and filters count as in-domain evidence
+            
+        Returns:
+            Read-only verdict mapping as returned by DomainGate.check
+        """
+        return self.domain_gate.check(query, self.get_keyword_matches(query, query_context),
+                                      (query_context or {}).get('filters'))
     
-    def is_out_of_domain(self, query: str) -> bool:
+    def is_out_of_domain(self, query: str, query_context: Optional[Dict] = None) -> bool:
         """
         Check if a query is completely outside the e-invoice domain.
         
+        Only confident verdicts count: uncertain queries are left to the model.
+        
         Args:
             query: The user's query text
+            query_context: Dictionary with query context information (optional)
             
         Returns:
             Boolean indicating if query is out of domain
         """
-        # List of topics that are definitely out of domain
-        out_of_domain_topics_en = [
-            'weather', 'sports', 'entertainment', 'movies', 'music', 'recipes', 
-            'cooking', 'travel', 'vacation', 'hotel', 'flight', 'restaurant',
-            'politics', 'election', 'news', 'celebrity', 'game', 'gaming'
-        ]
-        
-        out_of_domain_topics_ar = [
-            'طقس', 'رياضة', 'ترفيه', 'أفلام', 'موسيقى', 'وصفات', 
-            'طبخ', 'سفر', 'عطلة', 'فندق', 'رحلة', 'مطعم',
-            'سياسة', 'انتخابات', 'أخبار', 'مشاهير', 'لعبة', 'ألعاب'
-        ]
-        
-        query_lower = query.lower()
-        
-        # Check English out-of-domain topics
-        for topic in out_of_domain_topics_en:
-            if topic in query_lower:
-                return True
-                
-        # Check Arabic out-of-domain topics
-        for topic in out_of_domain_topics_ar:
-            if topic in query_lower:
-                return True
-        
-        return False
+        return self.get_domain_verdict(query, query_context)['verdict'] == 'out_of_domain'
     
     def get_visualization_type(self, query: str, query_context: Dict) -> Optional[str]:
         """
@@ -202,13 +222,10 @@ class ResponseHandler:
         Returns:
             Visualization type or None if no visualization is appropriate
         """
-        lang = query_context['language']
-        query_lower = query.lower()
-        
-        # Check for visualization keywords
-        for viz_type, keywords in self.visualization_suggestions.items():
-            if any(keyword in query_lower for keyword in keywords[lang]):
-                return viz_type
+        # Check for visualization keywords (first type in definition order wins)
+        viz_types = self.get_keyword_matches(query, query_context)['visualizations']
+        if viz_types:
+            return viz_types[0]
         
         # Default visualizations based on domain
         domain_viz_mapping = {
@@ -245,38 +262,71 @@ class ResponseHandler:
         """
         Prepare comprehensive context for response generation.
         
+        Contexts are memoized per query, language, routed tables and domains and
+        data version, and returned read-only.
+        
         Args:
             query_context: Dictionary with query context information
             data_tables: Dictionary of available data tables
             
         Returns:
-            Dictionary with response context
+            Read-only mapping with response context
         """
-        # Check if query is out of domain
-        if self.is_out_of_domain(query_context['query']):
+        key = (
+            query_context['query'],
+            query_context['language'],
+            tuple(query_context['relevant_tables']),
+            tuple(query_context['relevant_domains']),
+            query_context['primary_domain'],
+            data_version(data_tables)
+        )
+        tables = [table for table in query_context['relevant_tables'] if table in data_tables]
+        with get_telemetry().span('prepare_response_context', tables=tables,
+                                  rows=sum(len(data_tables[table]) for table in tables)) as span:
+            response_context, hit = self.context_memo.lookup(
+                key, lambda: freeze(self._build_response_context(query_context, data_tables))
+            )
+            span['cache'] = 'hit' if hit else 'miss'
+        return response_context
+    
+    def _build_response_context(self, query_context: Dict, data_tables: Dict[str, pd.DataFrame]) -> Dict:
+        # Check if query is out of domain; these are answered without an API call
+        domain_verdict = self.get_domain_verdict(query_context['query'], query_context)
+        if domain_verdict['verdict'] == 'out_of_domain':
             return {
                 'is_out_of_domain': True,
-                'out_of_domain_message': self.system_messages['out_of_domain'][query_context['language']]
+                'out_of_domain_message': self.system_messages['out_of_domain'][query_context['language']],
+                'domain_verdict': domain_verdict
             }
         
-        # Get system prompt
+        # Get system prompt, and its blocks for prefix-stable message assembly
         system_prompt = self.get_system_prompt(query_context)
+        lang = query_context['language']
         
         # Determine visualization type
         viz_type = self.get_visualization_type(query_context['query'], query_context)
         
-        # Prepare data samples for relevant tables
+        # Prepare data samples for relevant tables, in the same canonical order as the system prompt
         data_samples = {}
-        for table_name in query_context['relevant_tables']:
-            if table_name in data_tables and not data_tables[table_name].empty:
+        query_samples = []
+        for table_name in self.table_descriptions:
+            if (table_name in query_context['relevant_tables'] and table_name in data_tables
+                    and not data_tables[table_name].empty):
                 # Get a sample of the data (first 5 rows)
                 data_samples[table_name] = data_tables[table_name].head(5).to_dict(orient='records')
+                # Samples of unfiltered tables only change with the routing; filtered ones with the query
+                if data_tables[table_name].attrs.get('filtered'):
+                    query_samples.append(table_name)
         
         return {
             'is_out_of_domain': False,
             'system_prompt': system_prompt,
+            'base_prompt': self.prompt_builder.base_prompt(lang, query_context['relevant_tables']),
+            'domain_prompt': self.prompt_builder.domain_prompt(lang, query_context['relevant_domains']),
             'visualization_type': viz_type,
             'data_samples': data_samples,
+            'query_samples': query_samples,
+            'domain_verdict': domain_verdict,
             'query_context': query_context
         }
 
@@ -286,7 +336,7 @@ if __name__ == "__main__":
     from data_router import DataRouter
     
     router = DataRouter()
-    handler = ResponseHandler()
+    handler = ResponseHandler(router.matcher)
     
     # Test with sample queries
     test_queries = [
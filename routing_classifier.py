@@ -0,0 +1,284 @@
+"""
+Trained table/domain classifier for routing e-invoice chatbot queries.
+This module predicts the relevant tables and domains of vague questions with
+hashed character n-grams and per-label logistic regression. It replaces the
+keyword router's defaults (the invoices table and all four domains) when no
+keyword matches, so vague questions get a smaller, better-targeted prompt.
+
+Train the shipped model with:
+    python routing_classifier.py --corpus corpus/routing_corpus.jsonl
+"""
+
+import argparse
+import json
+import os
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from arabic_normalizer import normalize_query
+
+MODEL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'models', 'routing_classifier.npz')
+CORPUS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'corpus', 'routing_corpus.jsonl')
+
+TABLE_LABELS = ['invoices', 'items', 'taxpayers', 'audit_logs']
+DOMAIN_LABELS = ['tax_compliance', 'fraud_detection', 'revenue_analysis', 'geographic_distribution']
+
+# Feature hashing settings; stored with the model so training and inference agree
+N_FEATURES = 2 ** 16
+NGRAM_RANGE = (2, 4)
+
+
+def build_vectorizer(n_features: int = N_FEATURES, ngram_range: Tuple[int, int] = NGRAM_RANGE):
+    """Stateless vectorizer: hashed character n-grams of the normalized query."""
+    from sklearn.feature_extraction.text import HashingVectorizer
+
+    return HashingVectorizer(preprocessor=normalize_query, analyzer='char_wb', ngram_range=ngram_range,
+                             n_features=n_features, alternate_sign=False, norm='l2')
+
+
+class RoutingClassifier:
+    """
+    Multi-label linear classifier for tables and domains, loaded lazily.
+
+    The model file holds only the weights of hashed features seen in
+    training (a compressed .npz, no pickles); scikit-learn is imported on
+    first use. When it or the model file is missing, predictions are None
+    and the caller keeps its keyword routing.
+    """
+
+    def __init__(self, path: str = MODEL_PATH, threshold: float = 0.4, min_confidence: float = 0.2):
+        """
+        Initialize the classifier without loading it.
+
+        Args:
+            path: Path of the serialized model
+            threshold: Probability above which a label is predicted
+            min_confidence: If no label passes the threshold, the most likely
+                label is still predicted when its probability reaches this value
+        """
+        self.path = path
+        self.threshold = threshold
+        self.min_confidence = min_confidence
+        self.available = None
+        self._lock = threading.Lock()
+
+    def _load(self) -> bool:
+        with self._lock:
+            if self.available is None:
+                try:
+                    from scipy.sparse import csr_matrix
+
+                    with np.load(self.path, allow_pickle=False) as model:
+                        n_features = int(model['n_features'])
+                        self.labels = {'tables': [str(label) for label in model['table_labels']],
+                                       'domains': [str(label) for label in model['domain_labels']]}
+                        self.vectorizer = build_vectorizer(n_features, tuple(int(n) for n in model['ngram_range']))
+                        self.weights, self.intercepts = {}, {}
+                        for kind in ['tables', 'domains']:
+                            columns, coef = model[f'{kind}_columns'], model[f'{kind}_coef']
+                            rows = np.repeat(columns, coef.shape[0])
+                            cols = np.tile(np.arange(coef.shape[0]), len(columns))
+                            self.weights[kind] = csr_matrix((coef.T.ravel(), (rows, cols)),
+                                                            shape=(n_features, coef.shape[0]))
+                            self.intercepts[kind] = model[f'{kind}_intercept']
+                    self.available = True
+                except (ImportError, OSError, KeyError, ValueError):
+                    self.available = False
+            return self.available
+
+    def predict_proba_many(self, queries: List[str]) -> Optional[Dict[str, np.ndarray]]:
+        """
+        Compute label probabilities for a batch of queries.
+
+        Args:
+            queries: Query texts
+
+        Returns:
+            {'tables': array (queries x tables), 'domains': array (queries x domains)},
+            or None if the model is unavailable
+        """
+        if not (self.available or self._load()):
+            return None
+        features = self.vectorizer.transform(queries)
+        probabilities = {}
+        for kind in ['tables', 'domains']:
+            scores = (features @ self.weights[kind]).toarray() + self.intercepts[kind]
+            probabilities[kind] = 1.0 / (1.0 + np.exp(-scores))
+        return probabilities
+
+    def predict_many(self, queries: List[str]) -> Optional[List[Dict[str, List[str]]]]:
+        """
+        Predict tables and domains for a batch of queries.
+
+        Args:
+            queries: Query texts
+
+        Returns:
+            One {'tables': [...], 'domains': [...]} per query, with empty lists
+            where the model is not confident, or None if the model is unavailable
+        """
+        probabilities = self.predict_proba_many(queries)
+        if probabilities is None:
+            return None
+
+        predictions = [{} for _ in queries]
+        for kind, matrix in probabilities.items():
+            labels = self.labels[kind]
+            selected = matrix >= self.threshold
+            best = matrix.argmax(axis=1)
+            for index, row in enumerate(selected):
+                chosen = [labels[j] for j in np.flatnonzero(row)]
+                if not chosen and matrix[index, best[index]] >= self.min_confidence:
+                    chosen = [labels[best[index]]]
+                predictions[index][kind] = chosen
+        return predictions
+
+
+def precision_recall(pairs: List[Tuple[List[str], List[str]]]) -> Dict[str, float]:
+    """Micro-averaged precision, recall and F1 over (predicted, expected) label lists."""
+    true_positives = sum(len(set(predicted) & set(expected)) for predicted, expected in pairs)
+    predicted_count = sum(len(set(predicted)) for predicted, _ in pairs)
+    expected_count = sum(len(set(expected)) for _, expected in pairs)
+    precision = true_positives / predicted_count if predicted_count else 0.0
+    recall = true_positives / expected_count if expected_count else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return {'precision': precision, 'recall': recall, 'f1': f1}
+
+
+def _label_matrix(corpus: List[Dict], kind: str, labels: List[str]) -> np.ndarray:
+    return np.array([[label in entry[kind] for label in labels] for entry in corpus], dtype=int)
+
+
+def _fit(features, targets: np.ndarray, regularization: float) -> Tuple[np.ndarray, np.ndarray]:
+    """Fit one logistic regression per label; returns (coef labels x features, intercepts)."""
+    from sklearn.linear_model import LogisticRegression
+
+    coef = np.zeros((targets.shape[1], features.shape[1]))
+    intercepts = np.full(targets.shape[1], -10.0)
+    for j in range(targets.shape[1]):
+        if targets[:, j].min() == targets[:, j].max():
+            # Label never (or always) present: constant prediction
+            intercepts[j] = 10.0 if targets[0, j] else -10.0
+            continue
+        model = LogisticRegression(C=regularization, solver='liblinear', max_iter=1000)
+        model.fit(features, targets[:, j])
+        coef[j], intercepts[j] = model.coef_[0], model.intercept_[0]
+    return coef, intercepts
+
+
+def train(corpus: List[Dict], output_path: str = MODEL_PATH, regularization: float = 30.0) -> str:
+    """
+    Train the classifier on a labeled corpus and save it.
+
+    Out-of-domain entries are kept as negatives for every label.
+
+    Args:
+        corpus: Entries with 'query', 'tables' and 'domains'
+        output_path: Where to write the .npz model
+        regularization: Inverse regularization strength (C) of the logistic regressions
+
+    Returns:
+        The output path
+    """
+    vectorizer = build_vectorizer()
+    features = vectorizer.transform([entry['query'] for entry in corpus])
+
+    arrays = {'n_features': np.array(N_FEATURES), 'ngram_range': np.array(NGRAM_RANGE),
+              'table_labels': np.array(TABLE_LABELS), 'domain_labels': np.array(DOMAIN_LABELS)}
+    for kind, labels in [('tables', TABLE_LABELS), ('domains', DOMAIN_LABELS)]:
+        coef, intercepts = _fit(features, _label_matrix(corpus, kind, labels), regularization)
+        # Keep only features seen in training; all other weights are zero
+        columns = np.flatnonzero(np.abs(coef).sum(axis=0))
+        arrays[f'{kind}_columns'] = columns.astype(np.int32)
+        arrays[f'{kind}_coef'] = coef[:, columns].astype(np.float32)
+        arrays[f'{kind}_intercept'] = intercepts.astype(np.float32)
+
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    np.savez_compressed(output_path, **arrays)
+    return output_path
+
+
+def cross_validate(corpus: List[Dict], folds: int = 5, regularization: float = 30.0) -> Dict[str, Dict]:
+    """
+    Compare keyword routing with and without the classifier on held-out folds.
+
+    Args:
+        corpus: Labeled entries
+        folds: Number of folds
+        regularization: Inverse regularization strength of the logistic regressions
+
+    Returns:
+        Configuration name to {'tables': {...}, 'domains': {...}} precision/recall/F1
+    """
+    import tempfile
+    from sklearn.model_selection import KFold
+    from data_router import DataRouter
+
+    pairs = {name: {'tables': [], 'domains': []} for name in ['keywords', 'keywords+classifier']}
+    with tempfile.TemporaryDirectory() as directory:
+        for fold, (train_index, test_index) in enumerate(
+                KFold(folds, shuffle=True, random_state=0).split(corpus)):
+            path = train([corpus[i] for i in train_index], os.path.join(directory, f'fold{fold}.npz'),
+                         regularization)
+            test = [corpus[i] for i in test_index if not corpus[i]['out_of_domain']]
+            queries = [entry['query'] for entry in test]
+            for name, router in [('keywords', DataRouter()),
+                                 ('keywords+classifier', DataRouter(classifier=RoutingClassifier(path)))]:
+                for entry, (tables, domains) in zip(test, router.route_many(queries)):
+                    pairs[name]['tables'].append((tables, entry['tables']))
+                    pairs[name]['domains'].append((domains, entry['domains']))
+    return {name: {kind: precision_recall(values) for kind, values in kinds.items()}
+            for name, kinds in pairs.items()}
+
+
+_default_classifier = None
+_default_lock = threading.Lock()
+
+
+def get_default_classifier() -> Optional[RoutingClassifier]:
+    """
+    Get the process-wide classifier for the shipped model.
+
+    Set ROUTING_CLASSIFIER=0 to disable it. The model (and scikit-learn)
+    is loaded by the first prediction, so creating the classifier never
+    delays startup. Loading is not started in a background thread: a daemon
+    thread still importing scikit-learn when a short-lived process exits
+    fails with "can't register atexit after shutdown".
+
+    Returns:
+        The shared classifier, or None if disabled or the model file is missing
+    """
+    global _default_classifier
+    if os.environ.get('ROUTING_CLASSIFIER', '1').lower() in ('0', 'false', 'no'):
+        return None
+    if not os.path.exists(MODEL_PATH):
+        return None
+    with _default_lock:
+        if _default_classifier is None:
+            _default_classifier = RoutingClassifier()
+        return _default_classifier
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Train the routing classifier on a labeled bilingual corpus")
+    parser.add_argument('--corpus', default=CORPUS_PATH, help="Labeled JSONL corpus")
+    parser.add_argument('--output', default=MODEL_PATH, help="Where to write the model")
+    parser.add_argument('--regularization', '-C', type=float, default=30.0)
+    parser.add_argument('--folds', type=int, default=5, help="Cross-validation folds (0 to skip)")
+    args = parser.parse_args(argv)
+
+    with open(args.corpus, encoding='utf-8') as f:
+        corpus = [json.loads(line) for line in f if line.strip()]
+
+    if args.folds:
+        for name, scores in cross_validate(corpus, args.folds, args.regularization).items():
+            print(f"{name:<20} held-out F1: tables {scores['tables']['f1']:.3f}, domains {scores['domains']['f1']:.3f}")
+
+    path = train(corpus, args.output, args.regularization)
+    print(f"Trained on {len(corpus)} queries -> {path} ({os.path.getsize(path) / 1024:.0f} KB)")
+
+
+if __name__ == "__main__":
+    main()
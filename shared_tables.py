@@ -0,0 +1,276 @@
+"""
+Shared data tables for the e-invoice chatbot.
+This module publishes the typed data tables once per node as Arrow IPC files
+(typically on a tmpfs such as /dev/shm) and attaches every worker process to
+them through read-only memory maps, so the workers of a node share one copy
+of the tables instead of each loading its own.
+
+Numeric, datetime and boolean columns are read-only NumPy views of the mapped
+files and text columns Arrow-backed string columns over them (dtype
+'string[pyarrow]' instead of object, with pd.NA for missing text), so they
+cost a worker no private memory. Only columns of mixed Python objects are
+copied into each worker; see attached_memory() for the split.
+"""
+
+import fcntl
+import json
+import os
+import shutil
+import time
+import uuid
+from hashlib import sha1
+from typing import Callable, Dict, Optional
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+# Name of the file describing the published snapshot, in the shared directory
+MANIFEST = 'manifest.json'
+
+# Schema metadata key holding the column encodings and table attrs
+METADATA_KEY = b'chatbot'
+
+# Bumped when the file layout changes; snapshots of another format are republished
+FORMAT_VERSION = 1
+
+
+def _encode(column: pd.Series):
+    """Convert a column to an Arrow array that maps back to the same pandas column."""
+    values = column.to_numpy()
+    if isinstance(column.dtype, np.dtype):
+        if column.dtype.kind == 'M':
+            # Stored as int64 so NaT stays a value and the column maps without a copy
+            return pa.array(values.astype('datetime64[ns]').view('int64')), {'kind': 'datetime'}
+        if column.dtype.kind == 'b':
+            # Arrow packs booleans into bits; bytes map without a copy
+            return pa.array(values.view('uint8')), {'kind': 'bool'}
+        if column.dtype.kind in 'iuf':
+            # Not from_pandas: NaN stays a float value, not a null
+            return pa.array(values), {'kind': 'numeric'}
+        if column.dtype.kind == 'O':
+            try:
+                return pa.array(values, type=pa.string(), from_pandas=True), {'kind': 'string'}
+            except (pa.ArrowInvalid, pa.ArrowTypeError):
+                # Mixed types: stored as Arrow infers them
+                return pa.array(values, from_pandas=True), {'kind': 'arrow'}
+    if isinstance(column.dtype, pd.StringDtype):
+        return pa.array(values, type=pa.string(), from_pandas=True), {'kind': 'string'}
+    return pa.Array.from_pandas(column), {'kind': 'arrow'}
+
+
+def _decode(column: pa.ChunkedArray, encoding: Dict):
+    """Map an Arrow column back to a pandas column, without copying it."""
+    kind = encoding['kind']
+    if kind == 'string':
+        return pd.arrays.ArrowStringArray(column)
+    if kind == 'arrow':
+        return column.to_pandas().array
+    # Fixed-width columns are one chunk unless a text column needed several
+    array = column.chunk(0) if column.num_chunks == 1 else column.combine_chunks()
+    if kind == 'datetime':
+        return array.to_numpy(zero_copy_only=True).view('datetime64[ns]')
+    if kind == 'bool':
+        return array.to_numpy(zero_copy_only=True).view(bool)
+    return array.to_numpy(zero_copy_only=True)
+
+
+def write_table(table: pd.DataFrame, path: str):
+    """
+    Write a table to an Arrow IPC file, keeping its dtypes and attrs.
+
+    Args:
+        table: The table (its index is not kept; the tables use a default index)
+        path: File to write
+    """
+    arrays, encodings = [], {}
+    for name in table.columns:
+        array, encoding = _encode(table[name])
+        arrays.append(array)
+        encodings[str(name)] = encoding
+    attrs = {key: value for key, value in table.attrs.items() if key != 'shared_from'}
+    metadata = {'format': FORMAT_VERSION, 'columns': encodings, 'attrs': attrs}
+    schema = pa.schema([pa.field(str(name), array.type) for name, array in zip(table.columns, arrays)],
+                       metadata={METADATA_KEY: json.dumps(metadata, default=str)})
+    # Text over 2 GB per column comes back as several chunks
+    arrow_table = pa.Table.from_arrays(arrays, schema=schema)
+    with pa.OSFile(path, 'wb') as sink:
+        with pa.ipc.new_file(sink, schema) as writer:
+            writer.write_table(arrow_table)
+
+
+def read_table(path: str) -> pd.DataFrame:
+    """
+    Attach to a table written by write_table through a read-only memory map.
+
+    Args:
+        path: The table's Arrow IPC file
+
+    Returns:
+        The table; its columns are read-only views of the file
+    """
+    with pa.memory_map(path, 'r') as source:
+        arrow_table = pa.ipc.open_file(source).read_all()
+    metadata = json.loads(arrow_table.schema.metadata[METADATA_KEY])
+    columns = {name: _decode(arrow_table.column(name), metadata['columns'][name])
+               for name in arrow_table.column_names}
+    # copy=False keeps one block per column, so the views are not consolidated into copies
+    table = pd.DataFrame(columns, copy=False)
+    table.attrs.update(metadata['attrs'])
+    table.attrs['shared_from'] = path
+    return table
+
+
+def _read_manifest(directory: str) -> Optional[Dict]:
+    try:
+        with open(os.path.join(directory, MANIFEST), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def publish_tables(data: Dict[str, pd.DataFrame], directory: str, source: str) -> Dict:
+    """
+    Publish tables as a new snapshot in a shared directory.
+
+    The snapshot is written to a directory of its own and the manifest is
+    replaced atomically, so workers never see a partly written snapshot;
+    earlier snapshots are removed (workers still attached keep their mapping).
+
+    Args:
+        data: Dictionary of data tables
+        directory: Shared directory, e.g. /dev/shm/chatbot
+        source: Key of the source data the tables were loaded from
+
+    Returns:
+        The new manifest
+    """
+    os.makedirs(directory, exist_ok=True)
+    snapshot = f"snapshot-{sha1(source.encode('utf-8')).hexdigest()[:12]}-{uuid.uuid4().hex[:8]}"
+    staging = os.path.join(directory, f".{snapshot}.tmp")
+    os.makedirs(staging)
+    files = {}
+    for table_name, table in data.items():
+        files[table_name] = f"{table_name}.arrow"
+        write_table(table, os.path.join(staging, files[table_name]))
+    os.rename(staging, os.path.join(directory, snapshot))
+
+    manifest = {'format': FORMAT_VERSION, 'source': source, 'snapshot': snapshot, 'tables': files,
+                'published': time.time(), 'publisher_pid': os.getpid()}
+    manifest_tmp = os.path.join(directory, f".{MANIFEST}.{uuid.uuid4().hex[:8]}")
+    with open(manifest_tmp, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(manifest_tmp, os.path.join(directory, MANIFEST))
+
+    for name in os.listdir(directory):
+        if name.startswith(('snapshot-', '.snapshot-')) and name != snapshot:
+            shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+    return manifest
+
+
+def attach_tables(directory: str, manifest: Optional[Dict] = None) -> Dict[str, pd.DataFrame]:
+    """
+    Attach to the snapshot currently published in a shared directory.
+
+    Args:
+        directory: Shared directory
+        manifest: The directory's manifest (read if omitted)
+
+    Returns:
+        Dictionary of data tables
+
+    Raises:
+        FileNotFoundError: If nothing is published there
+    """
+    manifest = manifest or _read_manifest(directory)
+    if manifest is None:
+        raise FileNotFoundError(f"No tables are published in {directory}")
+    snapshot = os.path.join(directory, manifest['snapshot'])
+    return {table_name: read_table(os.path.join(snapshot, file_name))
+            for table_name, file_name in manifest['tables'].items()}
+
+
+def load_shared(directory: str, source: str, loader: Callable[[], Dict[str, pd.DataFrame]]) -> Dict[str, pd.DataFrame]:
+    """
+    Attach to the tables published for a source, publishing them first if needed.
+
+    Only the first worker of the node (the one holding the directory's lock)
+    runs the loader; the others wait for it and attach to its snapshot. A
+    changed source (e.g. a re-exported CSV file) is republished by the next
+    worker that loads.
+
+    Args:
+        directory: Shared directory, e.g. /dev/shm/chatbot
+        source: Key of the current source data
+        loader: Loads the tables from the source
+
+    Returns:
+        Dictionary of data tables attached to the shared snapshot
+    """
+    manifest = _read_manifest(directory)
+    if manifest is None or manifest.get('source') != source or manifest.get('format') != FORMAT_VERSION:
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, '.lock'), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                # Another worker may have published while this one waited
+                manifest = _read_manifest(directory)
+                if manifest is None or manifest.get('source') != source or manifest.get('format') != FORMAT_VERSION:
+                    manifest = publish_tables(loader(), directory, source)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+    try:
+        return attach_tables(directory, manifest)
+    except FileNotFoundError:
+        # The snapshot was replaced (and removed) after the manifest was read
+        return attach_tables(directory)
+
+
+def attached_memory(data: Dict[str, pd.DataFrame]) -> Dict[str, Dict[str, int]]:
+    """
+    Split the memory of each table into bytes shared with other workers and private bytes.
+
+    Args:
+        data: Dictionary of data tables
+
+    Returns:
+        Dictionary of table name to {'shared_bytes', 'private_bytes'}
+    """
+    report = {}
+    for table_name, table in data.items():
+        shared = private = 0
+        usage = table.memory_usage(index=False, deep=True)
+        for name in table.columns:
+            values = table[name].array
+            if isinstance(values, pd.arrays.ArrowStringArray):
+                mapped = True
+            else:
+                # Views of a mapped file are read-only; columns built by the worker are not
+                values = table[name].to_numpy()
+                mapped = values.dtype != object and not values.flags.writeable
+            if mapped:
+                shared += int(usage[name])
+            else:
+                private += int(usage[name])
+        report[table_name] = {'shared_bytes': shared, 'private_bytes': private}
+    return report
+
+
+# Example usage
+if __name__ == "__main__":
+    import tempfile
+    from data_loader import generate_synthetic_data
+
+    directory = tempfile.mkdtemp(prefix='chatbot-shared-')
+    data = generate_synthetic_data()
+    data['invoices'].attrs['data_version'] = 'synthetic:example'
+    attached = load_shared(directory, 'synthetic', lambda: data)
+    for table_name, table in attached.items():
+        expected = data[table_name].astype({name: 'string[pyarrow]' for name, dtype in data[table_name].dtypes.items()
+                                            if dtype == object})
+        assert table.equals(expected), table_name
+    print(f"Published: {_read_manifest(directory)['tables']}")
+    print(f"Attrs kept: {attached['invoices'].attrs['data_version']}, sorted by {attached['invoices'].attrs['sorted_by']}")
+    print(f"Dtypes: {dict(attached['invoices'].dtypes.astype(str).value_counts())}")
+    print(f"Memory: {attached_memory(attached)}")
+    shutil.rmtree(directory)
@@ -0,0 +1,431 @@
+"""
+Slow-request profiling for the e-invoice chatbot.
+This module captures a profile of every request that takes longer than a
+threshold, so occasional slow answers can be analysed after the fact. It is
+opt-in: with CHATBOT_PROFILE_SLOW_MS unset, the hooks do nothing.
+
+While a hooked request runs, a background thread samples its thread's stack
+every CHATBOT_PROFILE_INTERVAL_MS milliseconds (wall-clock, so time spent
+waiting on the OpenAI API shows up too); the samples of requests faster than
+the threshold are dropped. A request crossing the threshold also starts
+tracemalloc (one request at a time) for about CHATBOT_PROFILE_TRACE_SECONDS,
+a bit longer when busy threads delay the sampler: tracing slows
+the traced code several times over (about 4x for chart building, even with a
+single frame per allocation), so the window is kept short and tracing can be
+turned off with CHATBOT_PROFILE_MEMORY=0. Each slow request is written to its
+own directory under CHATBOT_PROFILE_DIR, of which the newest
+CHATBOT_PROFILE_KEEP are kept:
+
+- profile.pstats: the samples as a pstats file (python -m pstats, snakeviz)
+- stacks.collapsed: the samples as collapsed stacks (flamegraph.pl, speedscope)
+- memory.tracemalloc: allocations made during the tracing window and still
+  alive at its end (tracemalloc.Snapshot.load), when the request was traced
+- request.json: the request's name, timings and context (query context,
+  question, chart type, table sizes), the process memory and its top
+  allocations
+"""
+
+import gc
+import json
+import marshal
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import uuid
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from memo import json_default
+from memory_report import rss_mb
+
+# Default capture location and sampling (overridable with environment variables)
+PROFILE_DIR = os.environ.get('CHATBOT_PROFILE_DIR') or os.path.join(tempfile.gettempdir(), 'chatbot_profiles')
+PROFILE_KEEP = int(os.environ.get('CHATBOT_PROFILE_KEEP', 20))
+PROFILE_INTERVAL = float(os.environ.get('CHATBOT_PROFILE_INTERVAL_MS', 5)) / 1000
+PROFILE_TRACE_SECONDS = float(os.environ.get('CHATBOT_PROFILE_TRACE_SECONDS', 1))
+
+# Samples kept per thread at most (about 8 minutes at the default interval)
+MAX_SAMPLES = 100000
+
+# Frames kept per allocation traceback while tracemalloc runs (each frame adds
+# to the slowdown: 25 frames made chart building about 70 times slower)
+TRACEMALLOC_FRAMES = 1
+
+
+class _Request:
+    """
+    A hooked request; records itself in its profiler when the block exits.
+    """
+
+    __slots__ = ('profiler', 'name', 'context', 'thread_id', 'thread_name', 'started', 'first_sample', 'snapshot',
+                 'traced_seconds')
+
+    def __init__(self, profiler: 'SlowRequestProfiler', name: str, context: Dict[str, Any]):
+        self.profiler = profiler
+        self.name = name
+        self.context = context
+        self.snapshot = None
+        self.traced_seconds = 0.0
+
+    def __enter__(self) -> Dict[str, Any]:
+        self.profiler._enter(self)
+        return self.context
+
+    def __exit__(self, exc_type, exc_value, traceback) -> bool:
+        if exc_type is not None:
+            self.context['error'] = f"{exc_type.__name__}: {exc_value}"
+        self.profiler._exit(self)
+        return False
+
+
+class _Disabled:
+    """Hook used while profiling is off: yields a context dictionary and does nothing else."""
+
+    def __enter__(self) -> Dict[str, Any]:
+        return {}
+
+    def __exit__(self, exc_type, exc_value, traceback) -> bool:
+        return False
+
+
+_DISABLED = _Disabled()
+
+
+def _frame_label(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def write_pstats(samples: List[Tuple], interval: float, path: str):
+    """
+    Write stack samples as a pstats file.
+
+    Each sample counts `interval` seconds for the function it ended in (its
+    own time) and for every function on its stack (their cumulative time);
+    call counts are sample counts.
+
+    Args:
+        samples: Stacks of code objects, innermost first
+        interval: Seconds per sample
+        path: File to write
+    """
+    counts = {}
+    for stack in samples:
+        counts[stack] = counts.get(stack, 0) + 1
+
+    stats = {}
+    for stack, count in counts.items():
+        seconds = count * interval
+        keys = [(code.co_filename, code.co_firstlineno, code.co_name) for code in reversed(stack)]
+        seen = set()
+        for depth, key in enumerate(keys):
+            entry = stats.setdefault(key, [0, 0, 0.0, 0.0, {}])
+            if key not in seen:
+                # Recursive functions count once per sample
+                seen.add(key)
+                entry[0] += count
+                entry[1] += count
+                entry[3] += seconds
+            if depth:
+                caller = keys[depth - 1]
+                own = seconds if depth == len(keys) - 1 else 0.0
+                previous = entry[4].get(caller, (0, 0, 0.0, 0.0))
+                entry[4][caller] = (previous[0] + count, previous[1] + count, previous[2] + own, previous[3] + seconds)
+        stats[keys[-1]][2] += seconds
+
+    with open(path, 'wb') as f:
+        marshal.dump({key: tuple(entry) for key, entry in stats.items()}, f)
+
+
+def write_collapsed(samples: List[Tuple], thread_name: str, path: str):
+    """
+    Write stack samples as collapsed stacks ('root;...;leaf count' per line).
+
+    Args:
+        samples: Stacks of code objects, innermost first
+        thread_name: Name of the sampled thread, used as the root frame
+        path: File to write
+    """
+    counts = {}
+    for stack in samples:
+        counts[stack] = counts.get(stack, 0) + 1
+    with open(path, 'w', encoding='utf-8') as f:
+        for stack, count in sorted(counts.items(), key=lambda item: -item[1]):
+            frames = [thread_name] + [_frame_label(code) for code in reversed(stack)]
+            f.write(f"{';'.join(frame.replace(';', ',') for frame in frames)} {count}\n")
+
+
+class SlowRequestProfiler:
+    """
+    Samples hooked requests and saves the profiles of those slower than a threshold.
+    """
+
+    def __init__(self, threshold: float, directory: str = PROFILE_DIR, keep: int = PROFILE_KEEP,
+                 interval: float = PROFILE_INTERVAL, trace_memory: bool = True,
+                 trace_seconds: float = PROFILE_TRACE_SECONDS):
+        """
+        Initialize the profiler.
+
+        Args:
+            threshold: Seconds above which a request is captured
+            directory: Directory receiving one sub-directory per capture
+            keep: Newest captures kept (older ones are deleted)
+            interval: Seconds between two stack samples
+            trace_memory: Whether to trace allocations once a request crosses the threshold
+            trace_seconds: Longest allocation tracing window
+        """
+        self.threshold = threshold
+        self.directory = directory
+        self.keep = keep
+        self.interval = interval
+        self.trace_memory = trace_memory
+        self.trace_seconds = trace_seconds
+        # Thread id to the requests running on it (nested hooks share the thread's samples)
+        self.active = {}
+        self.samples = {}
+        self.sampler = None
+        # Request being traced (one at a time) and when its tracing started
+        self.tracing = None
+        self.trace_started = 0.0
+        self.captures = 0
+        self.lock = threading.Lock()
+
+    def profile(self, name: str, **context: Any) -> _Request:
+        """
+        Hook a request.
+
+        The block may add entries to the context dictionary it receives (e.g.
+        the query context once it is known); they are saved with the capture.
+
+        Args:
+            name: Request name, e.g. 'handle_chat_input'
+            **context: Details saved with the capture
+
+        Returns:
+            Context manager yielding the context dictionary
+        """
+        return _Request(self, name, context)
+
+    def _enter(self, request: _Request):
+        request.thread_id = threading.get_ident()
+        request.thread_name = threading.current_thread().name
+        request.started = time.perf_counter()
+        with self.lock:
+            requests = self.active.setdefault(request.thread_id, [])
+            if not requests:
+                self.samples[request.thread_id] = []
+            request.first_sample = len(self.samples[request.thread_id])
+            requests.append(request)
+            if self.sampler is None:
+                self.sampler = threading.Thread(target=self._sample, name='slow-request-sampler', daemon=True)
+                self.sampler.start()
+
+    def _exit(self, request: _Request):
+        seconds = time.perf_counter() - request.started
+        with self.lock:
+            requests = self.active[request.thread_id]
+            requests.remove(request)
+            samples = self.samples[request.thread_id][request.first_sample:]
+            if not requests:
+                del self.active[request.thread_id]
+                del self.samples[request.thread_id]
+            if self.tracing is request:
+                self._stop_tracing()
+        if seconds < self.threshold:
+            return
+        try:
+            self._save(request, seconds, samples, request.snapshot)
+        except OSError:
+            # Profiling never fails the request it observes
+            pass
+
+    def _sample(self):
+        """Sample the stacks of the threads running requests until none are left."""
+        while True:
+            with self.lock:
+                if not self.active:
+                    self.sampler = None
+                    return
+                frames = sys._current_frames()
+                now = time.perf_counter()
+                for thread_id, requests in self.active.items():
+                    frame = frames.get(thread_id)
+                    samples = self.samples[thread_id]
+                    if frame is not None and len(samples) < MAX_SAMPLES:
+                        stack = []
+                        while frame is not None:
+                            stack.append(frame.f_code)
+                            frame = frame.f_back
+                        samples.append(tuple(stack))
+                    if self.trace_memory and self.tracing is None:
+                        for request in requests:
+                            if request.snapshot is None and now - request.started >= self.threshold:
+                                self._start_tracing(request, now)
+                                break
+                if self.tracing is not None and now - self.trace_started >= self.trace_seconds:
+                    self._stop_tracing()
+                del frames
+            time.sleep(self.interval)
+
+    def _start_tracing(self, request: _Request, now: float):
+        # Called with the lock held; tracing someone else started is left alone
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+            self.tracing = request
+            self.trace_started = now
+
+    def _stop_tracing(self):
+        # Called with the lock held, at the end of the window or of the traced request
+        # Without the profiler's own allocations (the stack samples)
+        self.tracing.snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, __file__),
+            tracemalloc.Filter(False, tracemalloc.__file__)
+        ])
+        self.tracing.traced_seconds = time.perf_counter() - self.trace_started
+        tracemalloc.stop()
+        self.tracing = None
+
+    def _save(self, request: _Request, seconds: float, samples: List[Tuple], snapshot):
+        """Write one capture directory, then drop the oldest captures beyond the limit."""
+        os.makedirs(self.directory, exist_ok=True)
+        # Sortable to the microsecond: rotation deletes by name
+        stamp = datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+        name = f"{stamp}-{request.name}-{seconds * 1000:.0f}ms-{uuid.uuid4().hex[:6]}"
+        staging = os.path.join(self.directory, f".{name}.tmp")
+        os.makedirs(staging)
+
+        if samples:
+            # A busy request holds the GIL and delays the sampler, so samples come
+            # further apart than the interval: spread the measured time over them
+            write_pstats(samples, seconds / len(samples), os.path.join(staging, 'profile.pstats'))
+            write_collapsed(samples, request.thread_name, os.path.join(staging, 'stacks.collapsed'))
+        top_allocations = []
+        if snapshot is not None:
+            snapshot.dump(os.path.join(staging, 'memory.tracemalloc'))
+            top_allocations = [
+                {'location': str(statistic.traceback), 'kib': round(statistic.size / 1024, 1),
+                 'count': statistic.count}
+                for statistic in snapshot.statistics('lineno')[:20]
+            ]
+        details = {
+            'name': request.name,
+            'seconds': seconds,
+            'threshold_seconds': self.threshold,
+            'ended': time.time(),
+            'thread': request.thread_name,
+            'samples': len(samples),
+            'sample_interval_seconds': self.interval,
+            'seconds_per_sample': seconds / len(samples) if samples else None,
+            'context': request.context,
+            'rss_mb': rss_mb(),
+            'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            'gc_collections': [generation['collections'] for generation in gc.get_stats()],
+            'traced_seconds': request.traced_seconds,
+            'top_allocations': top_allocations
+        }
+        with open(os.path.join(staging, 'request.json'), 'w', encoding='utf-8') as f:
+            json.dump(details, f, ensure_ascii=False, indent=2, default=json_default)
+        os.rename(staging, os.path.join(self.directory, name))
+
+        with self.lock:
+            self.captures += 1
+        captures = sorted(entry for entry in os.listdir(self.directory) if not entry.startswith('.'))
+        for old in captures[:-self.keep] if self.keep else captures:
+            shutil.rmtree(os.path.join(self.directory, old), ignore_errors=True)
+
+    def list_captures(self) -> List[str]:
+        """Get the capture directories, newest first."""
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted((os.path.join(self.directory, entry) for entry in os.listdir(self.directory)
+                       if not entry.startswith('.')), reverse=True)
+
+
+_default_profiler = None
+_default_profiler_lock = threading.Lock()
+_configured = False
+
+
+def get_profiler() -> Optional[SlowRequestProfiler]:
+    """
+    Get the process-wide profiler configured by CHATBOT_PROFILE_SLOW_MS.
+
+    Returns:
+        Shared SlowRequestProfiler instance, or None when profiling is off
+    """
+    global _default_profiler, _configured
+    if _configured:
+        return _default_profiler
+    with _default_profiler_lock:
+        if not _configured:
+            threshold_ms = os.environ.get('CHATBOT_PROFILE_SLOW_MS')
+            if threshold_ms:
+                _default_profiler = SlowRequestProfiler(
+                    float(threshold_ms) / 1000,
+                    trace_memory=os.environ.get('CHATBOT_PROFILE_MEMORY', '1') != '0'
+                )
+            _configured = True
+        return _default_profiler
+
+
+def profile_slow(name: str, **context: Any):
+    """
+    Hook a request into the process-wide profiler, if profiling is on.
+
+    Args:
+        name: Request name, e.g. 'generate_visualization'
+        **context: Details saved with a capture
+
+    Returns:
+        Context manager yielding a context dictionary the block may add to
+    """
+    profiler = get_profiler()
+    if profiler is None:
+        return _DISABLED
+    return profiler.profile(name, **context)
+
+
+# Example usage
+if __name__ == "__main__":
+    import pstats
+
+    import numpy as np
+
+    def slow_aggregate(rows: int) -> float:
+        values = np.random.uniform(0, 1, rows)
+        return sum(float(value) for value in values[:rows // 4]) + float(values.sum())
+
+    profiler = SlowRequestProfiler(threshold=0.1, directory=tempfile.mkdtemp(prefix='chatbot-profiles-'), keep=2)
+    with profiler.profile('fast_request', question="What is the total VAT collected in Dubai?"):
+        slow_aggregate(1000)
+    for _ in range(3):
+        with profiler.profile('slow_request', question="أظهر لي توزيع الفواتير حسب الإمارة") as context:
+            context['rows'] = 2000000
+            slow_aggregate(2000000)
+            time.sleep(0.05)
+
+    captures = profiler.list_captures()
+    print(f"Captures kept: {len(captures)} of {profiler.captures} ({[os.path.basename(path) for path in captures]})")
+    print(f"Files: {sorted(os.listdir(captures[0]))}")
+    with open(os.path.join(captures[0], 'request.json'), encoding='utf-8') as f:
+        details = json.load(f)
+    print(f"Request: {details['name']} {details['seconds']:.2f} s, {details['samples']} samples, "
+          f"context {details['context']}")
+    print(f"Memory: RSS {details['rss_mb']:.0f} MB, traced {details['traced_seconds']:.2f} s, "
+          f"top allocation {details['top_allocations'][:1]}")
+    stats = pstats.Stats(os.path.join(captures[0], 'profile.pstats'))
+    stats.sort_stats('tottime').print_stats(3)
+    with open(os.path.join(captures[0], 'stacks.collapsed'), encoding='utf-8') as f:
+        print(f"Top stack: {f.readline().strip()[-120:]}")
+
+    overhead_profiler = SlowRequestProfiler(threshold=10.0, directory=profiler.directory)
+    started = time.perf_counter()
+    for _ in range(20000):
+        with overhead_profiler.profile('tiny'):
+            pass
+    print(f"Hook cost below the threshold: {(time.perf_counter() - started) / 20000 * 1e6:.1f} us per request")
+    shutil.rmtree(profiler.directory)
@@ -0,0 +1,444 @@
+"""
+Per-stage instrumentation for the e-invoice chatbot.
+This module times the expensive steps of a request (routing, response
+context, the OpenAI call, chart drawing and data loading) as spans carrying
+attributes such as table sizes and cache hits, aggregates them into
+Prometheus histograms and keeps the most recent spans and request timings
+for the admin panel.
+
+Metrics are exported in the Prometheus text format on a local endpoint
+(CHATBOT_METRICS_PORT), to a file replaced atomically every
+CHATBOT_METRICS_INTERVAL seconds (CHATBOT_METRICS_FILE, e.g. for the node
+exporter's textfile collector) and through api_service.py's /metrics; spans
+can be appended to a size-rotated JSON-lines file (CHATBOT_SPANS_FILE).
+"""
+
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from memo import json_default
+
+# Upper bounds of the latency histogram buckets, in seconds
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Span attributes exported as Prometheus labels; all others (table sizes,
+# table names, models) stay on the recorded spans only, to bound the label
+# cardinality
+LABELS = ('cache', 'chart_type', 'stream', 'outcome', 'mode')
+
+# Prefix of all exported metric names
+PREFIX = 'chatbot'
+
+
+def _label_value(value: Any) -> str:
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    return str(value)
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _percentile(values: List[float], share: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(share * len(ordered)))]
+
+
+class Telemetry:
+    """
+    Thread-safe span recorder with Prometheus histograms and gauges.
+    """
+
+    def __init__(self, max_spans: int = 500, max_requests: int = 100, buckets: Tuple[float, ...] = BUCKETS):
+        """
+        Initialize an empty recorder.
+
+        Args:
+            max_spans: Most recent spans kept for the admin panel
+            max_requests: Most recent request timings kept for the admin panel
+            buckets: Upper bounds of the histogram buckets, in seconds
+        """
+        self.buckets = buckets
+        self.histograms = {}
+        self.gauges = {}
+        self.spans = deque(maxlen=max_spans)
+        self.requests = deque(maxlen=max_requests)
+        self.sinks = []
+        self.lock = threading.Lock()
+
+    def span(self, name: str, **attributes: Any) -> 'Span':
+        """
+        Time a block of code.
+
+        The block may add attributes to the dictionary the span yields (e.g.
+        a cache hit flag known only inside it); a block raising an exception
+        is recorded with outcome 'error'.
+
+        Args:
+            name: Span name, e.g. 'route_query'
+            **attributes: Attributes of the span
+
+        Returns:
+            Context manager yielding the span's attributes
+        """
+        return Span(self, name, attributes)
+
+    def record(self, name: str, seconds: float, attributes: Optional[Dict[str, Any]] = None):
+        """
+        Record a finished span.
+
+        Args:
+            name: Span name
+            seconds: Duration
+            attributes: Attributes of the span
+        """
+        attributes = attributes or {}
+        span = {'name': name, 'end': time.time(), 'seconds': seconds, 'attributes': attributes}
+        histogram = self._histogram_key(name, attributes)
+        with self.lock:
+            self._observe(histogram, seconds)
+            self.spans.append(span)
+            sinks = self.sinks
+        for sink in sinks:
+            sink(span)
+
+    def observe(self, name: str, seconds: float, attributes: Optional[Dict[str, Any]] = None):
+        """
+        Add a duration to the span's histogram without recording a span.
+
+        Args:
+            name: Histogram name (exported as chatbot_<name>_seconds)
+            seconds: Duration
+            attributes: Attributes; those listed in LABELS become labels
+        """
+        histogram = self._histogram_key(name, attributes)
+        with self.lock:
+            self._observe(histogram, seconds)
+
+    @staticmethod
+    def _histogram_key(name: str, attributes: Optional[Dict[str, Any]]) -> Tuple:
+        if not attributes:
+            return name, ()
+        return name, tuple((key, _label_value(attributes[key])) for key in LABELS
+                           if attributes.get(key) is not None)
+
+    def _observe(self, key: Tuple, seconds: float):
+        # Called with the lock held
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = {'counts': [0] * (len(self.buckets) + 1), 'count': 0, 'sum': 0.0}
+        # Index of the first bound >= seconds (len(buckets) for the +Inf bucket only)
+        histogram['counts'][bisect_left(self.buckets, seconds)] += 1
+        histogram['count'] += 1
+        histogram['sum'] += seconds
+
+    def set_gauge(self, name: str, value: float, **labels: Any):
+        """Set a gauge, exported as chatbot_<name>."""
+        key = (name, tuple((label, _label_value(labels[label])) for label in sorted(labels)))
+        with self.lock:
+            self.gauges[key] = value
+
+    def record_request(self, question: str, timings: Dict[str, float], **attributes: Any):
+        """
+        Keep the stage timings of one answered question for the admin panel.
+
+        Args:
+            question: The user's question
+            timings: Seconds per pipeline stage
+            **attributes: Further details (e.g. whether it succeeded)
+        """
+        with self.lock:
+            self.requests.append({'end': time.time(), 'question': question, 'timings': dict(timings), **attributes})
+
+    def recent_spans(self, limit: Optional[int] = None) -> List[Dict]:
+        """Get the most recent spans, newest first."""
+        with self.lock:
+            spans = list(self.spans)
+        spans.reverse()
+        return spans[:limit] if limit else spans
+
+    def recent_requests(self, limit: Optional[int] = None) -> List[Dict]:
+        """Get the timings of the most recent requests, newest first."""
+        with self.lock:
+            requests = list(self.requests)
+        requests.reverse()
+        return requests[:limit] if limit else requests
+
+    def summary(self) -> List[Dict]:
+        """
+        Summarize the recent spans per name and labels.
+
+        Returns:
+            List of {'span', 'labels', 'count', 'p50_ms', 'p95_ms', 'max_ms'},
+            slowest p95 first
+        """
+        groups = {}
+        for span in self.recent_spans():
+            labels = ', '.join(f"{key}={_label_value(span['attributes'][key])}" for key in LABELS
+                               if span['attributes'].get(key) is not None)
+            groups.setdefault((span['name'], labels), []).append(span['seconds'] * 1000)
+        summary = [{
+            'span': name,
+            'labels': labels,
+            'count': len(values),
+            'p50_ms': _percentile(values, 0.5),
+            'p95_ms': _percentile(values, 0.95),
+            'max_ms': max(values)
+        } for (name, labels), values in groups.items()]
+        return sorted(summary, key=lambda entry: entry['p95_ms'], reverse=True)
+
+    def render_prometheus(self) -> str:
+        """
+        Render all histograms and gauges in the Prometheus text exposition format.
+
+        Returns:
+            The metrics text
+        """
+        with self.lock:
+            histograms = {key: {'counts': list(value['counts']), 'count': value['count'], 'sum': value['sum']}
+                          for key, value in self.histograms.items()}
+            gauges = dict(self.gauges)
+
+        lines = []
+        for name in sorted({name for name, _ in histograms}):
+            metric = f"{PREFIX}_{name}_seconds"
+            lines.append(f"# HELP {metric} Duration of {name} in seconds")
+            lines.append(f"# TYPE {metric} histogram")
+            for (histogram_name, labels), histogram in sorted(histograms.items()):
+                if histogram_name != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(self.buckets, histogram['counts']):
+                    cumulative += count
+                    lines.append(f"{metric}_bucket{_format_labels(labels, ('le', repr(bound)))} {cumulative}")
+                lines.append(f"{metric}_bucket{_format_labels(labels, ('le', '+Inf'))} {histogram['count']}")
+                lines.append(f"{metric}_sum{_format_labels(labels)} {histogram['sum']:.6f}")
+                lines.append(f"{metric}_count{_format_labels(labels)} {histogram['count']}")
+        for name in sorted({name for name, _ in gauges}):
+            metric = f"{PREFIX}_{name}"
+            lines.append(f"# TYPE {metric} gauge")
+            for (gauge_name, labels), value in sorted(gauges.items()):
+                if gauge_name == name:
+                    lines.append(f"{metric}{_format_labels(labels)} {value}")
+        return '\n'.join(lines) + '\n'
+
+    def add_sink(self, sink):
+        """Call sink(span) with every span recorded from now on."""
+        with self.lock:
+            # Replaced rather than appended to, so record() can iterate it without the lock
+            self.sinks = self.sinks + [sink]
+
+    def reset(self):
+        """Drop all metrics, spans and request timings."""
+        with self.lock:
+            self.histograms.clear()
+            self.gauges.clear()
+            self.spans.clear()
+            self.requests.clear()
+
+
+class Span:
+    """
+    A running span; records itself in its Telemetry when the block exits.
+    """
+
+    __slots__ = ('telemetry', 'name', 'attributes', 'started')
+
+    def __init__(self, telemetry: Telemetry, name: str, attributes: Dict[str, Any]):
+        self.telemetry = telemetry
+        self.name = name
+        self.attributes = attributes
+        self.started = None
+
+    def __enter__(self) -> Dict[str, Any]:
+        self.started = time.perf_counter()
+        return self.attributes
+
+    def __exit__(self, exc_type, exc_value, traceback) -> bool:
+        seconds = time.perf_counter() - self.started
+        if exc_type is GeneratorExit:
+            self.attributes['outcome'] = 'cancelled'
+        elif exc_type is not None:
+            self.attributes['outcome'] = 'error'
+        self.telemetry.record(self.name, seconds, self.attributes)
+        return False
+
+
+class SpanLog:
+    """
+    Appends spans as JSON lines to a file rotated by size (file, file.1, ... file.N).
+    """
+
+    def __init__(self, path: str, max_bytes: int = 10 * 1024 * 1024, backups: int = 3):
+        """
+        Initialize the log.
+
+        Args:
+            path: Log file
+            max_bytes: Size at which the file is rotated
+            backups: Rotated files kept
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.lock = threading.Lock()
+
+    def __call__(self, span: Dict):
+        line = json.dumps(span, ensure_ascii=False, default=json_default) + '\n'
+        with self.lock:
+            if os.path.exists(self.path) and os.path.getsize(self.path) + len(line) > self.max_bytes:
+                self._rotate()
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line)
+
+    def _rotate(self):
+        for index in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{index}"):
+                os.replace(f"{self.path}.{index}", f"{self.path}.{index + 1}")
+        if self.backups:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+
+
+def write_metrics_file(telemetry: Telemetry, path: str):
+    """Replace a file with the current metrics, atomically."""
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, 'w', encoding='utf-8') as f:
+        f.write(telemetry.render_prometheus())
+    os.replace(temporary, path)
+
+
+def serve_metrics(telemetry: Telemetry, port: int, host: str = '127.0.0.1'):
+    """
+    Serve GET /metrics on a background thread.
+
+    Args:
+        telemetry: Recorder to export
+        port: Port to listen on (0 picks a free one)
+        host: Interface to listen on
+
+    Returns:
+        The running server (server.server_address holds the bound port)
+    """
+    # Imported here: only processes exporting on a port need it
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = telemetry.render_prometheus().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    return server
+
+
+_default_telemetry = Telemetry()
+_exporters_started = False
+_exporters_lock = threading.Lock()
+
+
+def get_telemetry() -> Telemetry:
+    """Get the process-wide recorder."""
+    return _default_telemetry
+
+
+def start_exporters() -> Dict[str, Any]:
+    """
+    Start the exporters configured by environment variables, once per process.
+
+    CHATBOT_METRICS_PORT serves /metrics; CHATBOT_METRICS_FILE is rewritten
+    every CHATBOT_METRICS_INTERVAL seconds (default 15); CHATBOT_SPANS_FILE
+    receives every span. With several processes per node, give each its own
+    port and files (a port already in use is skipped).
+
+    Returns:
+        Dictionary of the started exporters and any errors
+    """
+    global _exporters_started
+    started = {}
+    with _exporters_lock:
+        if _exporters_started:
+            return started
+        _exporters_started = True
+        telemetry = get_telemetry()
+
+        port = os.environ.get('CHATBOT_METRICS_PORT')
+        if port:
+            try:
+                started['server'] = serve_metrics(telemetry, int(port), os.environ.get('CHATBOT_METRICS_HOST', '127.0.0.1'))
+            except OSError as e:
+                started['server_error'] = str(e)
+
+        path = os.environ.get('CHATBOT_METRICS_FILE')
+        if path:
+            interval = float(os.environ.get('CHATBOT_METRICS_INTERVAL', 15))
+
+            def write_periodically():
+                while True:
+                    try:
+                        write_metrics_file(telemetry, path)
+                    except OSError:
+                        pass
+                    time.sleep(interval)
+
+            threading.Thread(target=write_periodically, name='metrics-file', daemon=True).start()
+            started['file'] = path
+
+        spans_path = os.environ.get('CHATBOT_SPANS_FILE')
+        if spans_path:
+            telemetry.add_sink(SpanLog(spans_path))
+            started['spans_file'] = spans_path
+    return started
+
+
+# Example usage
+if __name__ == "__main__":
+    import tempfile
+    import urllib.request
+
+    telemetry = Telemetry()
+    with telemetry.span('route_query', cache='miss', tables=['invoices']):
+        time.sleep(0.02)
+    with telemetry.span('route_query', cache='hit'):
+        pass
+    with telemetry.span('generate_visualization', chart_type='distribution', rows=100):
+        time.sleep(0.01)
+    telemetry.set_gauge('table_rows', 100, table='invoices')
+    telemetry.record_request("What is the total VAT collected in Dubai?", {'route': 0.02, 'llm': 0.8, 'total': 0.83})
+
+    server = serve_metrics(telemetry, 0)
+    url = f"http://127.0.0.1:{server.server_address[1]}/metrics"
+    text = urllib.request.urlopen(url).read().decode('utf-8')
+    print('\n'.join(line for line in text.splitlines() if '_count' in line or 'gauge' in line or 'table_rows{' in line))
+    server.shutdown()
+
+    log = SpanLog(os.path.join(tempfile.mkdtemp(), 'spans.jsonl'), max_bytes=300, backups=2)
+    for span in telemetry.recent_spans():
+        log(span)
+    print(f"Span log files: {sorted(os.listdir(os.path.dirname(log.path)))}")
+    print(f"Summary: {[(entry['span'], entry['labels'], entry['count']) for entry in telemetry.summary()]}")
@@ -5,12 +5,16 @@ This module creates appropriate visualizations based on query context and data.
 
 import pandas as pd
 import numpy as np
-import plotly.express as px
 import plotly.graph_objects as go
-from plotly.subplots import make_subplots
+from plotly.colors import qualitative, sequential
+# plotly.express is imported by the chart methods that use it: it is the slowest
+# part of plotly to import and is not needed until the first chart is drawn
 import json
 from typing import Dict, List, Tuple, Optional, Any
 
+from slow_profiler import profile_slow
+from telemetry import get_telemetry
+
 class VisualizationGenerator:
     """
     Generates interactive visualizations based on query context and data.
@@ -19,11 +23,11 @@ class VisualizationGenerator:
     def __init__(self):
         # Define color schemes
         self.color_schemes = {
-            'blues': px.colors.sequential.Blues,
-            'reds': px.colors.sequential.Reds,
-            'greens': px.colors.sequential.Greens,
-            'purples': px.colors.sequential.Purples,
-            'categorical': px.colors.qualitative.Safe
+            'blues': sequential.Blues,
+            'reds': sequential.Reds,
+            'greens': sequential.Greens,
+            'purples': sequential.Purples,
+            'categorical': qualitative.Safe
         }
         
         # Define emirate coordinates for maps
@@ -103,6 +107,7 @@ class VisualizationGenerator:
         Returns:
             Plotly figure object
         """
+        import plotly.express as px
         lang = query_context['language']
         
         # Check if we have the necessary columns
@@ -129,12 +134,13 @@ class VisualizationGenerator:
             
             return fig
         
-        # Convert datetime column if needed
-        if not pd.api.types.is_datetime64_any_dtype(data['invoice_datetime']):
-            data['invoice_datetime'] = pd.to_datetime(data['invoice_datetime'], errors='coerce')
+        # Convert datetime column if needed (without modifying the shared table)
+        invoice_datetime = data['invoice_datetime']
+        if not pd.api.types.is_datetime64_any_dtype(invoice_datetime):
+            invoice_datetime = pd.to_datetime(invoice_datetime, errors='coerce')
         
         # Group by month and calculate metrics
-        data['month'] = data['invoice_datetime'].dt.to_period('M')
+        month = invoice_datetime.dt.to_period('M').rename('month')
         
         # Determine what to plot based on available columns
         if 'invoice_tax_amount' in data.columns:
@@ -150,10 +156,10 @@ class VisualizationGenerator:
         
         # Aggregate data
         if y_column == 'count':
-            time_series_data = data.groupby('month').size().reset_index(name='count')
+            time_series_data = data.groupby(month).size().reset_index(name='count')
             time_series_data['month'] = time_series_data['month'].astype(str)
         else:
-            time_series_data = data.groupby('month')[y_column].sum().reset_index()
+            time_series_data = data.groupby(month)[y_column].sum().reset_index()
             time_series_data['month'] = time_series_data['month'].astype(str)
         
         # Create the figure
@@ -173,8 +179,8 @@ class VisualizationGenerator:
         
         # Add hover data
         fig.update_traces(
-            hovertemplate=f"{self.get_translated_label('month', lang)}: %{x}<br>" +
-                          f"{y_label}: %{y:,.2f}<extra></extra>"
+            hovertemplate=f"{self.get_translated_label('month', lang)}: %{{x}}<br>" +
+                          f"{y_label}: %{{y:,.2f}}<extra></extra>"
         )
         
         return fig
@@ -190,6 +196,7 @@ class VisualizationGenerator:
         Returns:
             Plotly figure object
         """
+        import plotly.express as px
         lang = query_context['language']
         
         # Determine what to compare based on available columns
@@ -272,8 +279,8 @@ class VisualizationGenerator:
         
         # Add hover data
         fig.update_traces(
-            hovertemplate=f"{category_label}: %{x}<br>" +
-                          f"{value_label}: %{y:,.2f}<extra></extra>"
+            hovertemplate=f"{category_label}: %{{x}}<br>" +
+                          f"{value_label}: %{{y:,.2f}}<extra></extra>"
         )
         
         return fig
@@ -289,6 +296,7 @@ class VisualizationGenerator:
         Returns:
             Plotly figure object
         """
+        import plotly.express as px
         lang = query_context['language']
         
         # Determine what to distribute based on available columns
@@ -344,9 +352,9 @@ class VisualizationGenerator:
         
         # Update hover template
         fig.update_traces(
-            hovertemplate=f"{category_label}: %{label}<br>" +
-                          f"{self.get_translated_label('count', lang)}: %{value}<br>" +
-                          f"{self.get_translated_label('percentage', lang)}: %{percent:.1f}%<extra></extra>"
+            hovertemplate=f"{category_label}: %{{label}}<br>" +
+                          f"{self.get_translated_label('count', lang)}: %{{value}}<br>" +
+                          f"{self.get_translated_label('percentage', lang)}: %{{percent:.1%}}<extra></extra>"
         )
         
         return fig
@@ -362,6 +370,7 @@ class VisualizationGenerator:
         Returns:
             Plotly figure object
         """
+        import plotly.express as px
         lang = query_context['language']
         
         # Check if we have emirate data
@@ -480,6 +489,83 @@ class VisualizationGenerator:
         
         return fig
     
+    def create_plan_chart(self, plan_step: Dict, query_context: Dict) -> Optional[go.Figure]:
+        """
+        Create a chart from the result of a query-planner tool call.
+        
+        Args:
+            plan_step: Executed plan step with 'tool' and 'result' entries
+            query_context: Dictionary with query context information
+            
+        Returns:
+            Plotly figure object or None if the result cannot be charted
+        """
+        import plotly.express as px
+        lang = query_context['language']
+        result = plan_step.get('result') or {}
+        rows = result.get('rows')
+        if not rows or result.get('error'):
+            return None
+        
+        chart_data = pd.DataFrame(rows)
+        metric = result['metric']
+        if metric not in chart_data.columns:
+            return None
+        
+        if plan_step['tool'] == 'time_series':
+            fig = px.line(
+                chart_data,
+                x='period',
+                y=metric,
+                title=f"{metric} ({result.get('agg', 'sum')})",
+                markers=True
+            )
+            fig.update_layout(
+                xaxis_title=self.get_translated_label(result.get('freq', 'month'), lang),
+                yaxis_title=metric,
+                template='plotly_white'
+            )
+            return fig
+        
+        group_by = result.get('group_by')
+        if not group_by or group_by not in chart_data.columns:
+            return None
+        
+        fig = px.bar(
+            chart_data,
+            x=group_by,
+            y=metric,
+            title=f"{metric} {self.get_translated_label('by', lang)} {group_by}",
+            color=metric,
+            color_continuous_scale=self.color_schemes['blues']
+        )
+        fig.update_layout(
+            xaxis_title=group_by,
+            yaxis_title=metric,
+            template='plotly_white'
+        )
+        return fig
+    
+    def generate_visualization_from_plan(self, plan: List[Dict], query_context: Dict) -> Optional[go.Figure]:
+        """
+        Generate a visualization from the last chartable step of a query plan.
+        
+        Args:
+            plan: Executed plan steps returned by the response generator
+            query_context: Dictionary with query context information
+            
+        Returns:
+            Plotly figure object or None if no step can be charted
+        """
+        with get_telemetry().span('generate_visualization', chart_type='plan', steps=len(plan or [])) as span:
+            for plan_step in reversed(plan or []):
+                fig = self.create_plan_chart(plan_step, query_context)
+                if fig is not None:
+                    span['drawn'] = True
+                    return fig
+            span['drawn'] = False
+        return None
+    
     def generate_visualization(self, viz_type: str, data: Dict[str, pd.DataFrame], query_context: Dict) -> Optional[go.Figure]:
         """
         Generate an appropriate visualization based on the type and data.
@@ -502,18 +588,24 @@ class VisualizationGenerator:
         # Get the data for the primary table
         table_data = data[primary_table]
         
-        # Generate the appropriate visualization based on type
-        if viz_type == 'time_series':
-            return self.create_time_series_chart(table_data, query_context)
-        elif viz_type == 'comparison':
-            return self.create_comparison_chart(table_data, query_context)
-        elif viz_type == 'distribution':
-            return self.create_distribution_chart(table_data, query_context)
-        elif viz_type == 'geographic':
-            return self.create_geographic_chart(table_data, query_context)
-        else:
-            # Default to comparison chart if type is not recognized
-            return self.create_comparison_chart(table_data, query_context)
+        # Unknown types (drawn as comparisons) share one label, so API callers cannot add metric series
+        chart_type = viz_type if viz_type in ('time_series', 'comparison', 'distribution', 'geographic') else 'other'
+        with get_telemetry().span('generate_visualization', chart_type=chart_type, table=primary_table,
+                                  rows=len(table_data)), \
+                profile_slow('generate_visualization', visualization_type=viz_type, table=primary_table,
+                             rows=len(table_data), query_context=query_context):
+            # Generate the appropriate visualization based on type
+            if viz_type == 'time_series':
+                return self.create_time_series_chart(table_data, query_context)
+            elif viz_type == 'comparison':
+                return self.create_comparison_chart(table_data, query_context)
+            elif viz_type == 'distribution':
+                return self.create_distribution_chart(table_data, query_context)
+            elif viz_type == 'geographic':
+                return self.create_geographic_chart(table_data, query_context)
+            else:
+                # Default to comparison chart if type is not recognized
+                return self.create_comparison_chart(table_data, query_context)
 
 
 # Example usage